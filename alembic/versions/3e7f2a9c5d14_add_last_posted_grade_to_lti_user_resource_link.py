@@ -0,0 +1,24 @@
+"""add last_posted_grade to lti_user_resource_link
+
+Revision ID: 3e7f2a9c5d14
+Revises: 9a3d7c61e0b2
+Create Date: 2020-07-14 09:18:52.730114
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e7f2a9c5d14'
+down_revision = '9a3d7c61e0b2'
+
+from alembic import op
+import sqlalchemy as sa
+
+from compair.models import convention
+
+def upgrade():
+    with op.batch_alter_table('lti_user_resource_link', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('last_posted_grade', sa.Float(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('lti_user_resource_link', naming_convention=convention) as batch_op:
+        batch_op.drop_column('last_posted_grade')
@@ -0,0 +1,26 @@
+"""add score_pending to comparison
+
+Revision ID: 5c2b8e4f1a7d
+Revises: fd7aab93104b
+Create Date: 2020-07-02 14:21:37.518402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2b8e4f1a7d'
+down_revision = 'fd7aab93104b'
+
+from alembic import op
+import sqlalchemy as sa
+
+from compair.models import convention
+
+def upgrade():
+    with op.batch_alter_table('comparison', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('score_pending', sa.Boolean(), default=False, server_default='0', nullable=False))
+    op.create_index(op.f('ix_comparison_score_pending'), 'comparison', ['score_pending'], unique=False)
+
+def downgrade():
+    with op.batch_alter_table('comparison', naming_convention=convention) as batch_op:
+        batch_op.drop_index('ix_comparison_score_pending')
+        batch_op.drop_column('score_pending')
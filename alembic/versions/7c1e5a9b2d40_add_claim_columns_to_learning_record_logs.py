@@ -0,0 +1,30 @@
+"""add claim columns to xapi_log and caliper_log
+
+Revision ID: 7c1e5a9b2d40
+Revises: 3e7f2a9c5d14
+Create Date: 2020-07-21 10:42:17.418305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5a9b2d40'
+down_revision = '3e7f2a9c5d14'
+
+from alembic import op
+import sqlalchemy as sa
+
+from compair.models import convention
+
+def upgrade():
+    for table_name in ['xapi_log', 'caliper_log']:
+        with op.batch_alter_table(table_name, naming_convention=convention) as batch_op:
+            batch_op.add_column(sa.Column('claim_id', sa.String(length=32), nullable=True))
+            batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+        op.create_index(op.f('ix_{}_claim_id'.format(table_name)), table_name, ['claim_id'], unique=False)
+
+def downgrade():
+    for table_name in ['xapi_log', 'caliper_log']:
+        op.drop_index(op.f('ix_{}_claim_id'.format(table_name)), table_name=table_name)
+        with op.batch_alter_table(table_name, naming_convention=convention) as batch_op:
+            batch_op.drop_column('claimed_at')
+            batch_op.drop_column('claim_id')
@@ -0,0 +1,127 @@
+"""store normalized scores
+
+Revision ID: 9a3d7c61e0b2
+Revises: 5c2b8e4f1a7d
+Create Date: 2020-07-08 10:42:19.204816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9a3d7c61e0b2'
+down_revision = '5c2b8e4f1a7d'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import and_
+
+from compair.models import convention
+
+def _normalized_score(score_column, score_min, score_max):
+    if score_min == None or score_max == None or score_min == score_max:
+        return None
+    return (score_column - score_min) / (score_max - score_min) * 100
+
+def upgrade():
+    with op.batch_alter_table('answer_score', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('normalized_score', sa.Float(), nullable=True))
+
+    with op.batch_alter_table('answer_criterion_score', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('normalized_score', sa.Float(), nullable=True))
+
+    with op.batch_alter_table('assignment', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('answer_score_min', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('answer_score_max', sa.Float(), nullable=True))
+
+    with op.batch_alter_table('assignment_criterion', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('answer_score_min', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('answer_score_max', sa.Float(), nullable=True))
+
+    answer_table = sa.table('answer',
+        sa.column('id', sa.Integer), sa.column('active', sa.Boolean)
+    )
+    assignment_table = sa.table('assignment',
+        sa.column('id', sa.Integer),
+        sa.column('answer_score_min', sa.Float), sa.column('answer_score_max', sa.Float)
+    )
+    assignment_criterion_table = sa.table('assignment_criterion',
+        sa.column('assignment_id', sa.Integer), sa.column('criterion_id', sa.Integer),
+        sa.column('answer_score_min', sa.Float), sa.column('answer_score_max', sa.Float)
+    )
+    answer_score_table = sa.table('answer_score',
+        sa.column('assignment_id', sa.Integer), sa.column('answer_id', sa.Integer),
+        sa.column('score', sa.Float), sa.column('normalized_score', sa.Float)
+    )
+    answer_criterion_score_table = sa.table('answer_criterion_score',
+        sa.column('assignment_id', sa.Integer), sa.column('criterion_id', sa.Integer),
+        sa.column('score', sa.Float), sa.column('normalized_score', sa.Float)
+    )
+
+    connection = op.get_bind()
+
+    # answer scores are normalized against active answers of the assignment
+    answer_score_min_max = connection.execute(
+        sa.select([
+            answer_score_table.c.assignment_id,
+            sa.func.min(answer_score_table.c.score),
+            sa.func.max(answer_score_table.c.score)
+        ])
+        .select_from(answer_score_table.join(answer_table, answer_score_table.c.answer_id == answer_table.c.id))
+        .where(answer_table.c.active == True)
+        .group_by(answer_score_table.c.assignment_id)
+    ).fetchall()
+
+    for (assignment_id, score_min, score_max) in answer_score_min_max:
+        connection.execute(
+            assignment_table.update()
+            .where(assignment_table.c.id == assignment_id)
+            .values(answer_score_min=score_min, answer_score_max=score_max)
+        )
+        connection.execute(
+            answer_score_table.update()
+            .where(answer_score_table.c.assignment_id == assignment_id)
+            .values(normalized_score=_normalized_score(answer_score_table.c.score, score_min, score_max))
+        )
+
+    # answer criterion scores are normalized against all scores of the assignment criterion
+    answer_criterion_score_min_max = connection.execute(
+        sa.select([
+            answer_criterion_score_table.c.assignment_id,
+            answer_criterion_score_table.c.criterion_id,
+            sa.func.min(answer_criterion_score_table.c.score),
+            sa.func.max(answer_criterion_score_table.c.score)
+        ])
+        .group_by(answer_criterion_score_table.c.assignment_id, answer_criterion_score_table.c.criterion_id)
+    ).fetchall()
+
+    for (assignment_id, criterion_id, score_min, score_max) in answer_criterion_score_min_max:
+        connection.execute(
+            assignment_criterion_table.update()
+            .where(and_(
+                assignment_criterion_table.c.assignment_id == assignment_id,
+                assignment_criterion_table.c.criterion_id == criterion_id
+            ))
+            .values(answer_score_min=score_min, answer_score_max=score_max)
+        )
+        connection.execute(
+            answer_criterion_score_table.update()
+            .where(and_(
+                answer_criterion_score_table.c.assignment_id == assignment_id,
+                answer_criterion_score_table.c.criterion_id == criterion_id
+            ))
+            .values(normalized_score=_normalized_score(answer_criterion_score_table.c.score, score_min, score_max))
+        )
+
+def downgrade():
+    with op.batch_alter_table('assignment_criterion', naming_convention=convention) as batch_op:
+        batch_op.drop_column('answer_score_max')
+        batch_op.drop_column('answer_score_min')
+
+    with op.batch_alter_table('assignment', naming_convention=convention) as batch_op:
+        batch_op.drop_column('answer_score_max')
+        batch_op.drop_column('answer_score_min')
+
+    with op.batch_alter_table('answer_criterion_score', naming_convention=convention) as batch_op:
+        batch_op.drop_column('normalized_score')
+
+    with op.batch_alter_table('answer_score', naming_convention=convention) as batch_op:
+        batch_op.drop_column('normalized_score')
@@ -0,0 +1,24 @@
+"""add ranking_version to assignment
+
+Revision ID: b41d6e0f3a87
+Revises: 7c1e5a9b2d40
+Create Date: 2020-07-23 14:06:51.730218
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b41d6e0f3a87'
+down_revision = '7c1e5a9b2d40'
+
+from alembic import op
+import sqlalchemy as sa
+
+from compair.models import convention
+
+def upgrade():
+    with op.batch_alter_table('assignment', naming_convention=convention) as batch_op:
+        batch_op.add_column(sa.Column('ranking_version', sa.Integer(), nullable=False, default=0, server_default='0'))
+
+def downgrade():
+    with op.batch_alter_table('assignment', naming_convention=convention) as batch_op:
+        batch_op.drop_column('ranking_version')
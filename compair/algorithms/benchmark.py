@@ -0,0 +1,272 @@
+"""
+    Headless pairing/scoring simulation benchmark
+
+    Simulates a cohort of students comparing answers with known (synthetic) grades by calling the
+    pairing and scoring algorithms directly (no database or application context needed).
+    Repetitions are fanned out over a process pool and every pairing/scoring combination is run
+    on the same cohorts, so timings and ranking quality can be compared between combinations.
+"""
+import multiprocessing
+import random
+import timeit
+from collections import namedtuple
+
+import numpy
+
+from compair.algorithms.comparison_winner import ComparisonWinner
+from compair.algorithms.scored_object import ScoredObject
+from compair.algorithms.exceptions import InsufficientObjectsForPairException, \
+    UserComparedAllObjectsException
+from compair.algorithms.pair import generate_pair
+from compair.algorithms.score import calculate_score, calculate_score_1vs1
+
+BenchmarkSettings = namedtuple('BenchmarkSettings', [
+    'number_of_answers', 'number_of_students', 'comparisons_per_student',
+    # probability that a student picks the better answer (after perceived value errors)
+    'correct_rate',
+    # standard deviation of the error added to the grades as perceived by students
+    'sigma'
+])
+
+SimulationResult = namedtuple('SimulationResult', [
+    'pairing_package_name', 'scoring_package_name', 'repetition',
+    'elapsed', 'pair_timings', 'score_1vs1_timings', 'score_timing',
+    'comparisons', 'spearman_1vs1', 'spearman'
+])
+
+BenchmarkReport = namedtuple('BenchmarkReport', [
+    'pairing_package_name', 'scoring_package_name', 'repetitions', 'comparisons',
+    'elapsed', 'pair_latency', 'score_1vs1_latency', 'score_latency',
+    'spearman_1vs1', 'spearman'
+])
+
+# percentiles reported for per call latencies
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+def run_benchmark(pairing_package_names, scoring_package_names, settings,
+        repetitions=10, processes=None, seed=None):
+    """
+    Runs every pairing/scoring combination for repetitions simulated cohorts.
+    Repetition i uses the same answer grades and student decisions seed for every combination.
+    processes: size of the process pool (defaults to the number of cpus, 1 runs in this process)
+    :return: (list of BenchmarkReport (one per combination), total wall time in seconds)
+    """
+    if seed is None:
+        seed = random.randint(0, 2**31 - 1)
+
+    job_args = []
+    for pairing_package_name in pairing_package_names:
+        for scoring_package_name in scoring_package_names:
+            for repetition in range(repetitions):
+                job_args.append((pairing_package_name, scoring_package_name, settings,
+                    repetition, seed + repetition))
+
+    start = timeit.default_timer()
+    if processes == 1:
+        results = [_simulate_helper(args) for args in job_args]
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            results = pool.map(_simulate_helper, job_args)
+        finally:
+            pool.close()
+            pool.join()
+    wall_time = timeit.default_timer() - start
+
+    results_by_combination = {}
+    for result in results:
+        combination = (result.pairing_package_name, result.scoring_package_name)
+        results_by_combination.setdefault(combination, []).append(result)
+
+    reports = []
+    for pairing_package_name in pairing_package_names:
+        for scoring_package_name in scoring_package_names:
+            combination_results = results_by_combination[(pairing_package_name, scoring_package_name)]
+            reports.append(_summarize(pairing_package_name, scoring_package_name, combination_results))
+
+    return reports, wall_time
+
+
+def simulate(pairing_package_name, scoring_package_name, settings, repetition=0, seed=None):
+    """
+    Simulates one cohort: students are picked at random until they completed their comparisons,
+    every comparison generates a pair then updates the two answer scores with calculate_score_1vs1.
+    The scores are recalculated from all comparisons with calculate_score at the end.
+    :return: SimulationResult
+    """
+    rng = random.Random(seed)
+    numpy_rng = numpy.random.RandomState(seed)
+    # pair generators pick from the global random generators
+    random.seed(seed)
+    numpy.random.seed(seed)
+
+    actual_grades = numpy_rng.normal(0.78, 0.1, settings.number_of_answers)
+    grade_by_answer_key = {key + 1: grade for key, grade in enumerate(actual_grades)}
+
+    scored_objects = {}
+    for key in grade_by_answer_key.keys():
+        scored_objects[key] = ScoredObject(
+            key=key, score=0, variable1=None, variable2=None,
+            rounds=0, opponents=0, wins=0, loses=0
+        )
+
+    # student comparisons_left and completed comparison pairs by student key
+    comparisons_left = {key: settings.comparisons_per_student for key in range(settings.number_of_students)}
+    student_comparison_pairs = {key: [] for key in range(settings.number_of_students)}
+    student_keys = sorted(comparisons_left.keys())
+
+    comparison_pairs = []
+    pair_timings = []
+    score_1vs1_timings = []
+
+    start = timeit.default_timer()
+    while len(student_keys) > 0:
+        student_key = rng.choice(student_keys)
+
+        pair_start = timeit.default_timer()
+        try:
+            comparison_pair = generate_pair(
+                package_name=pairing_package_name,
+                scored_objects=list(scored_objects.values()),
+                comparison_pairs=student_comparison_pairs[student_key]
+            )
+        except (InsufficientObjectsForPairException, UserComparedAllObjectsException):
+            student_keys.remove(student_key)
+            continue
+        pair_timings.append(timeit.default_timer() - pair_start)
+
+        winner = _decide_winner(rng, numpy_rng, settings,
+            grade_by_answer_key[comparison_pair.key1], grade_by_answer_key[comparison_pair.key2])
+        comparison_pair = comparison_pair._replace(winner=winner)
+
+        comparison_pairs.append(comparison_pair)
+        student_comparison_pairs[student_key].append(comparison_pair)
+        comparisons_left[student_key] -= 1
+        if comparisons_left[student_key] <= 0:
+            student_keys.remove(student_key)
+
+        score_start = timeit.default_timer()
+        result1, result2 = calculate_score_1vs1(
+            package_name=scoring_package_name,
+            key1_scored_object=scored_objects[comparison_pair.key1],
+            key2_scored_object=scored_objects[comparison_pair.key2],
+            winner=winner,
+            other_comparison_pairs=comparison_pairs
+        )
+        score_1vs1_timings.append(timeit.default_timer() - score_start)
+        scored_objects[result1.key] = result1
+        scored_objects[result2.key] = result2
+
+    score_start = timeit.default_timer()
+    results = calculate_score(
+        package_name=scoring_package_name,
+        comparison_pairs=comparison_pairs
+    ) if len(comparison_pairs) > 0 else {}
+    score_timing = timeit.default_timer() - score_start
+    elapsed = timeit.default_timer() - start
+
+    answer_keys = sorted(grade_by_answer_key.keys())
+    grades = [grade_by_answer_key[key] for key in answer_keys]
+    scores_1vs1 = [scored_objects[key].score for key in answer_keys]
+    # answers that were never compared keep the initial score
+    scores = [results[key].score if key in results else 0 for key in answer_keys]
+
+    return SimulationResult(
+        pairing_package_name=pairing_package_name,
+        scoring_package_name=scoring_package_name,
+        repetition=repetition,
+        elapsed=elapsed,
+        pair_timings=pair_timings,
+        score_1vs1_timings=score_1vs1_timings,
+        score_timing=score_timing,
+        comparisons=len(comparison_pairs),
+        spearman_1vs1=spearman_correlation(grades, scores_1vs1),
+        spearman=spearman_correlation(grades, scores)
+    )
+
+
+def spearman_correlation(values1, values2):
+    """
+    Spearman rank correlation (pearson correlation of the ranks, ties get their average rank)
+    :return: correlation or None if either list is constant
+    """
+    ranks1 = _rank(values1)
+    ranks2 = _rank(values2)
+    if numpy.std(ranks1) == 0 or numpy.std(ranks2) == 0:
+        return None
+    return float(numpy.corrcoef(ranks1, ranks2)[0, 1])
+
+
+def latency_percentiles(timings):
+    """
+    :return: dictionary of percentile -> seconds (LATENCY_PERCENTILES and 'max')
+    """
+    if len(timings) == 0:
+        return {}
+    percentiles = {
+        percentile: float(value)
+        for percentile, value in zip(LATENCY_PERCENTILES, numpy.percentile(timings, LATENCY_PERCENTILES))
+    }
+    percentiles['max'] = float(numpy.max(timings))
+    return percentiles
+
+
+def _simulate_helper(args):
+    return simulate(*args)
+
+
+def _rank(values):
+    values = numpy.asarray(values, dtype=float)
+    order = numpy.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+
+    ranks = numpy.empty(len(values), dtype=float)
+    start = 0
+    while start < len(values):
+        end = start
+        while end + 1 < len(values) and sorted_values[end + 1] == sorted_values[start]:
+            end += 1
+        ranks[order[start:end + 1]] = (start + end) / 2.0 + 1
+        start = end + 1
+    return ranks
+
+
+def _decide_winner(rng, numpy_rng, settings, key1_grade, key2_grade):
+    # make the actual values of answers fuzzy (represents perceived value errors)
+    if settings.sigma > 0:
+        key1_grade = numpy_rng.normal(key1_grade, settings.sigma)
+        key2_grade = numpy_rng.normal(key2_grade, settings.sigma)
+
+    if key1_grade == key2_grade:
+        return ComparisonWinner.key1 if rng.random() <= 0.5 else ComparisonWinner.key2
+
+    correct_answer = ComparisonWinner.key1 if key1_grade > key2_grade else ComparisonWinner.key2
+    incorrect_answer = ComparisonWinner.key2 if key1_grade > key2_grade else ComparisonWinner.key1
+    return correct_answer if rng.random() <= settings.correct_rate else incorrect_answer
+
+
+def _summarize(pairing_package_name, scoring_package_name, results):
+    pair_timings = []
+    score_1vs1_timings = []
+    for result in results:
+        pair_timings.extend(result.pair_timings)
+        score_1vs1_timings.extend(result.score_1vs1_timings)
+
+    return BenchmarkReport(
+        pairing_package_name=pairing_package_name,
+        scoring_package_name=scoring_package_name,
+        repetitions=len(results),
+        comparisons=sum(result.comparisons for result in results),
+        elapsed=sum(result.elapsed for result in results),
+        pair_latency=latency_percentiles(pair_timings),
+        score_1vs1_latency=latency_percentiles(score_1vs1_timings),
+        score_latency=latency_percentiles([result.score_timing for result in results]),
+        spearman_1vs1=_mean([result.spearman_1vs1 for result in results]),
+        spearman=_mean([result.spearman for result in results])
+    )
+
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return float(numpy.mean(values)) if len(values) > 0 else None
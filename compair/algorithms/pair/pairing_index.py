@@ -0,0 +1,335 @@
+import random
+import math
+from bisect import bisect_left, bisect_right
+
+from compair.algorithms.comparison_pair import ComparisonPair
+from compair.algorithms.exceptions import InsufficientObjectsForPairException, \
+    UserComparedAllObjectsException, UnknownPairGeneratorException
+
+# number of random picks tried in a round before falling back to a full scan
+RANDOM_PICK_ATTEMPTS = 8
+
+class RoundBucket(object):
+    """
+    Holds the keys of a single round sorted by score.
+    entries and scores are kept in the same order so that score lookups
+    can bisect on scores while exact removals bisect on entries
+    """
+    def __init__(self):
+        self.entries = []
+        self.scores = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, score):
+        entry = (score, key)
+        index = bisect_left(self.entries, entry)
+        self.entries.insert(index, entry)
+        self.scores.insert(index, score)
+
+    def remove(self, key, score):
+        entry = (score, key)
+        index = bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+            del self.scores[index]
+
+    def score_range(self, score):
+        """
+        Returns the (start, end) index range of entries with the given score
+        """
+        return (bisect_left(self.scores, score), bisect_right(self.scores, score))
+
+
+class PairingIndex(object):
+    """
+    Incrementally maintained index of scored objects used to generate pairs
+    without rebuilding rounds from the full list of scored objects on every call.
+
+    - scored objects are bucketed by round and kept sorted by score within a round
+    - completed comparison pairs are tracked per comparer (usually a user id)
+      as sets of used keys and opponents
+
+    Pairs follow the same rules as the random, adaptive and adaptive_min_delta
+    pair generators (see PairGenerator._setup_rounds and the _find_pair implementations)
+    """
+    def __init__(self):
+        self.log = None
+
+        # scored_objects[key] = ScoredObject
+        self.scored_objects = {}
+        # sorted list of rounds with at least one scored object
+        self.rounds = []
+        # round_buckets[round] = RoundBucket
+        self.round_buckets = {}
+
+        # used_keys[comparer] = set() of keys the comparer has already seen
+        self.used_keys = {}
+        # opponents[comparer][key] = set() of opponent keys
+        self.opponents = {}
+
+        # criterion_scores[key][criterion_key] = score
+        self.criterion_scores = {}
+        # criterion_weights[criterion_key] = weight
+        self.criterion_weights = {}
+
+    def _debug(self, message):
+        if self.log != None:
+            self.log.debug(message)
+
+    def __len__(self):
+        return len(self.scored_objects)
+
+    def __contains__(self, key):
+        return key in self.scored_objects
+
+    def add_scored_object(self, scored_object):
+        """
+        Adds or replaces a scored object in the index
+        """
+        # change None value scores to zero
+        if scored_object.score == None:
+            scored_object = scored_object._replace(score=0)
+        if scored_object.rounds == None:
+            scored_object = scored_object._replace(rounds=0)
+
+        self.remove_scored_object(scored_object.key)
+        self.scored_objects[scored_object.key] = scored_object
+
+        bucket = self.round_buckets.get(scored_object.rounds)
+        if bucket == None:
+            bucket = self.round_buckets[scored_object.rounds] = RoundBucket()
+            self.rounds.insert(bisect_left(self.rounds, scored_object.rounds), scored_object.rounds)
+        bucket.add(scored_object.key, scored_object.score)
+
+    def remove_scored_object(self, key):
+        scored_object = self.scored_objects.pop(key, None)
+        if scored_object == None:
+            return
+
+        bucket = self.round_buckets[scored_object.rounds]
+        bucket.remove(key, scored_object.score)
+        if len(bucket) == 0:
+            del self.round_buckets[scored_object.rounds]
+            del self.rounds[bisect_left(self.rounds, scored_object.rounds)]
+
+    def update_score(self, key, score):
+        scored_object = self.scored_objects.get(key)
+        if scored_object != None:
+            self.add_scored_object(scored_object._replace(score=score))
+
+    def update_rounds(self, key, rounds):
+        scored_object = self.scored_objects.get(key)
+        if scored_object != None:
+            self.add_scored_object(scored_object._replace(rounds=rounds))
+
+    def update_criterion_score(self, key, criterion_key, score):
+        self.criterion_scores.setdefault(key, {})[criterion_key] = score if score != None else 0
+
+    def add_comparison_pair(self, comparer, comparison_pair):
+        used_keys = self.used_keys.setdefault(comparer, set())
+        opponents = self.opponents.setdefault(comparer, {})
+
+        used_keys.add(comparison_pair.key1)
+        used_keys.add(comparison_pair.key2)
+        opponents.setdefault(comparison_pair.key1, set()).add(comparison_pair.key2)
+        opponents.setdefault(comparison_pair.key2, set()).add(comparison_pair.key1)
+
+    def set_comparison_pairs(self, comparer, comparison_pairs):
+        """
+        Replaces all of the comparer's completed comparison pairs
+        """
+        self.used_keys[comparer] = set()
+        self.opponents[comparer] = {}
+        for comparison_pair in comparison_pairs:
+            self.add_comparison_pair(comparer, comparison_pair)
+
+    def generate_pair(self, package_name, comparer, excluded_keys=None):
+        """
+        Returns a pair to be compared by the comparer.
+        If no valid pair can be found, an error is raised
+        param package_name: pairing algorithm (random, adaptive, or adaptive_min_delta)
+        param comparer: identifier used with add_comparison_pair/set_comparison_pairs
+        param excluded_keys: keys that the comparer cannot be given (ex: their own answers)
+        """
+        if package_name not in ['random', 'adaptive', 'adaptive_min_delta']:
+            raise UnknownPairGeneratorException
+
+        excluded_keys = excluded_keys if excluded_keys != None else set()
+        used_keys = self.used_keys.get(comparer, set())
+        opponents = self.opponents.get(comparer, {})
+
+        available_count = len(self.scored_objects) - \
+            len([key for key in excluded_keys if key in self.scored_objects])
+
+        # check valid
+        if available_count < 2:
+            raise InsufficientObjectsForPairException
+
+        # use only unused scored objects if possible (available for up to n/2 comparsions)
+        unused_count = available_count - \
+            len([key for key in used_keys if key in self.scored_objects and key not in excluded_keys])
+        only_unused = unused_count >= 2
+        pool_count = unused_count if only_unused else available_count
+
+        def in_pool(key):
+            return key not in excluded_keys and not (only_unused and key in used_keys)
+
+        def has_valid_opponent(key):
+            compared_count = len([opponent_key for opponent_key in opponents.get(key, set())
+                if opponent_key != key and opponent_key in self.scored_objects and in_pool(opponent_key)])
+            return pool_count - 1 - compared_count > 0
+
+        # step 1: select valid first element in pair (random within the lowest round possible)
+        scored_object_1 = None
+        for round in self.rounds:
+            key = self._random_key(self.round_buckets[round], 0, len(self.round_buckets[round]),
+                lambda key: in_pool(key) and has_valid_opponent(key))
+            if key != None:
+                scored_object_1 = self.scored_objects[key]
+                break
+
+        if scored_object_1 == None:
+            raise UserComparedAllObjectsException
+
+        # step 2: filter out invalid opponents
+        invalid_keys = opponents.get(scored_object_1.key, set())
+
+        def is_candidate(key):
+            return key != scored_object_1.key and key not in invalid_keys and in_pool(key)
+
+        # step 3: select valid second element in pair in the lowest round possible
+        scored_object_2 = None
+        for round in self.rounds:
+            bucket = self.round_buckets[round]
+            if package_name == 'adaptive':
+                key = self._closest_score_key(bucket, scored_object_1.score, is_candidate)
+            elif package_name == 'adaptive_min_delta':
+                key = self._min_delta_key(bucket, scored_object_1, is_candidate)
+            else:
+                key = self._random_key(bucket, 0, len(bucket), is_candidate)
+
+            if key != None:
+                scored_object_2 = self.scored_objects[key]
+                break
+
+        if scored_object_2 == None:
+            raise UnknownPairGeneratorException
+
+        self._debug("Paired " + str(scored_object_1.key) + " with " + str(scored_object_2.key))
+
+        return ComparisonPair(
+            key1=scored_object_1.key,
+            key2=scored_object_2.key,
+            winner=None
+        )
+
+    def _random_key(self, bucket, start, end, is_valid):
+        """
+        Returns a random valid key from bucket entries [start, end) or None.
+        Invalid keys are expected to be rare so a few random picks are tried
+        before falling back to scanning the range in random order
+        """
+        if end <= start:
+            return None
+
+        for _ in range(min(RANDOM_PICK_ATTEMPTS, end - start)):
+            key = bucket.entries[random.randrange(start, end)][1]
+            if is_valid(key):
+                return key
+
+        indexes = list(range(start, end))
+        random.shuffle(indexes)
+        for index in indexes:
+            key = bucket.entries[index][1]
+            if is_valid(key):
+                return key
+        return None
+
+    def _closest_score_key(self, bucket, score, is_valid):
+        """
+        Returns a valid key with the most similar score (randomly if tied) or None
+        """
+        position = bisect_left(bucket.scores, score)
+
+        # nearest valid entry at or above score
+        upper_score = None
+        for index in range(position, len(bucket)):
+            if is_valid(bucket.entries[index][1]):
+                upper_score = bucket.scores[index]
+                break
+
+        # nearest valid entry below score
+        lower_score = None
+        for index in range(position - 1, -1, -1):
+            if is_valid(bucket.entries[index][1]):
+                lower_score = bucket.scores[index]
+                break
+
+        if upper_score == None and lower_score == None:
+            return None
+
+        upper_delta = math.fabs(score - upper_score) if upper_score != None else None
+        lower_delta = math.fabs(score - lower_score) if lower_score != None else None
+
+        # collect the tied score ranges
+        ranges = []
+        if upper_delta != None and (lower_delta == None or upper_delta <= lower_delta):
+            ranges.append(bucket.score_range(upper_score))
+        if lower_delta != None and (upper_delta == None or lower_delta <= upper_delta):
+            ranges.append(bucket.score_range(lower_score))
+
+        if len(ranges) == 1:
+            return self._random_key(bucket, ranges[0][0], ranges[0][1], is_valid)
+
+        # try the range containing a random tied entry first so that tied keys are equally likely
+        lower_size = ranges[1][1] - ranges[1][0]
+        upper_size = ranges[0][1] - ranges[0][0]
+        if random.randrange(lower_size + upper_size) < lower_size:
+            ranges.reverse()
+        for (start, end) in ranges:
+            key = self._random_key(bucket, start, end, is_valid)
+            if key != None:
+                return key
+        return None
+
+    def _min_delta_key(self, bucket, scored_object_1, is_valid):
+        """
+        Returns the valid key with the minimum sum of weighted criterion score deltas
+        (if tied, select with closest score. if also tied, choose randomly) or None.
+        Criterion deltas are not ordered by score so the round is scanned.
+        """
+        score = scored_object_1.score
+        best_key = None
+        best_sort_key = None
+        for (other_score, key) in bucket.entries:
+            if not is_valid(key):
+                continue
+            sort_key = (
+                self._criterion_score_delta_sum(scored_object_1.key, key),
+                math.fabs(score - other_score),
+                random.random()
+            )
+            if best_sort_key == None or sort_key < best_sort_key:
+                best_key = key
+                best_sort_key = sort_key
+        return best_key
+
+    def _criterion_score_delta_sum(self, scored_object_key1, scored_object_key2):
+        """
+        Returns the sum of delta of criterion scores between the the scored obj
+        """
+        theSum = 0
+        criterion_scores_1 = self.criterion_scores.get(scored_object_key1, {})
+        criterion_scores_2 = self.criterion_scores.get(scored_object_key2, {})
+        criterion_key_list = set(criterion_scores_1.keys()) | set(criterion_scores_2.keys())
+
+        for criterion_key in criterion_key_list:
+            score1 = criterion_scores_1.get(criterion_key, 0)
+            score2 = criterion_scores_2.get(criterion_key, 0)
+            weight = self.criterion_weights.get(criterion_key, 0)
+
+            theSum += math.fabs(score1 - score2) * weight
+
+        return theSum
@@ -0,0 +1,132 @@
+"""
+    Comparison replay
+
+    Replays comparison pairs in order and keeps the score of every answer after each step.
+    Per answer state (rounds, wins, loses, opponent set and the comparison pairs it took part in)
+    is updated incrementally, so a step doesn't rebuild the previous comparisons of both answers
+    from the full comparison history.
+"""
+from collections import namedtuple
+
+from compair.algorithms.comparison_winner import ComparisonWinner
+from compair.algorithms.scored_object import ScoredObject
+from compair.algorithms.score import calculate_score_1vs1
+
+ReplayStep = namedtuple('ReplayStep', [
+    'comparison_pair', 'key1_before', 'key2_before', 'key1_after', 'key2_after'
+])
+
+# scoring algorithms whose 1vs1 update only depends on the ratings kept in the scored objects
+# (variable1/variable2). Their previous comparison pairs are only used for the
+# rounds/wins/loses/opponents counts, which the replay keeps itself
+RATING_SCORING_PACKAGES = ['elo_rating', 'true_skill_rating']
+
+
+class ComparisonReplay(object):
+    def __init__(self, package_name, keys=None, initial_score=0):
+        """
+        :param package_name: scoring algorithm package
+        :param keys: answer keys to start with (other keys are added when first compared)
+        :param initial_score: score of answers before their first comparison
+        """
+        self.package_name = package_name
+        self.initial_score = initial_score
+        self.incremental = package_name in RATING_SCORING_PACKAGES
+
+        # scored_objects[key] = ScoredObject
+        self.scored_objects = {}
+        # opponents[key] = set() of opponent keys
+        self.opponents = {}
+        # comparison_pairs[key] = comparison pairs the key took part in (only needed for
+        # scoring algorithms that recalculate scores from them)
+        self.comparison_pairs = {}
+
+        for key in keys or []:
+            self._add_key(key)
+
+    def score(self, key):
+        """
+        :return: current ScoredObject of key
+        """
+        if key not in self.scored_objects:
+            self._add_key(key)
+        return self.scored_objects[key]
+
+    def add(self, comparison_pair):
+        """
+        Updates the scores of the two answers of comparison_pair
+        :return: ReplayStep
+        """
+        key1 = comparison_pair.key1
+        key2 = comparison_pair.key2
+        key1_before = self.score(key1)
+        key2_before = self.score(key2)
+
+        if self.incremental:
+            other_comparison_pairs = []
+        else:
+            # previous comparison pairs of either key (pairs of both keys only once)
+            other_comparison_pairs = self.comparison_pairs[key1] + [
+                pair for pair in self.comparison_pairs[key2] if key1 not in [pair.key1, pair.key2]
+            ]
+
+        key1_after, key2_after = calculate_score_1vs1(
+            package_name=self.package_name,
+            key1_scored_object=key1_before,
+            key2_scored_object=key2_before,
+            winner=comparison_pair.winner,
+            other_comparison_pairs=other_comparison_pairs
+        )
+
+        if self.incremental:
+            key1_after = self._update_result_stats(key1_before, key1_after, key2,
+                comparison_pair.winner, ComparisonWinner.key1)
+            key2_after = self._update_result_stats(key2_before, key2_after, key1,
+                comparison_pair.winner, ComparisonWinner.key2)
+        else:
+            self.comparison_pairs[key1].append(comparison_pair)
+            self.comparison_pairs[key2].append(comparison_pair)
+
+        self.scored_objects[key1] = key1_after
+        self.scored_objects[key2] = key2_after
+
+        return ReplayStep(
+            comparison_pair=comparison_pair,
+            key1_before=key1_before,
+            key2_before=key2_before,
+            key1_after=key1_after,
+            key2_after=key2_after
+        )
+
+    def replay(self, comparison_pairs):
+        """
+        Generates a ReplayStep for every comparison pair in order
+        """
+        for comparison_pair in comparison_pairs:
+            yield self.add(comparison_pair)
+
+    def _add_key(self, key):
+        self.scored_objects[key] = ScoredObject(
+            key=key, score=self.initial_score, variable1=None, variable2=None,
+            rounds=0, opponents=0, wins=0, loses=0
+        )
+        self.opponents[key] = set()
+        self.comparison_pairs[key] = []
+
+    def _update_result_stats(self, before, after, opponent_key, winner, key_winner):
+        # winner == None only counts the round
+        if winner is None:
+            return after._replace(
+                rounds=before.rounds+1, opponents=before.opponents,
+                wins=before.wins, loses=before.loses
+            )
+
+        self.opponents[before.key].add(opponent_key)
+        did_win = winner == key_winner
+        did_lose = winner not in [key_winner, ComparisonWinner.draw]
+        return after._replace(
+            rounds=before.rounds+1,
+            opponents=len(self.opponents[before.key]),
+            wins=before.wins+1 if did_win else before.wins,
+            loses=before.loses+1 if did_lose else before.loses
+        )
@@ -0,0 +1,137 @@
+import numpy
+
+from compair.algorithms.score.score_algorithm_base import ScoreAlgorithmBase
+from compair.algorithms.comparison_winner import ComparisonWinner
+from compair.algorithms.scored_object import ScoredObject
+
+from compair.algorithms.exceptions import InvalidWinnerException
+
+# comparison results stored in the results array
+RESULT_NONE = -1
+RESULT_KEY1 = 0
+RESULT_KEY2 = 1
+RESULT_DRAW = 2
+
+WINNER_RESULTS = {
+    None: RESULT_NONE,
+    ComparisonWinner.key1: RESULT_KEY1,
+    ComparisonWinner.key2: RESULT_KEY2,
+    ComparisonWinner.draw: RESULT_DRAW
+}
+
+class ArrayScoreAlgorithmBase(ScoreAlgorithmBase):
+    """
+    Base for array backed score algorithms used by calculate_score(backend="array").
+
+    Keys are mapped to integer indexes and comparison pairs are converted into
+    NumPy arrays once so that rounds, wins, loses, and opponent counts are computed
+    with vectorized operations instead of rebuilding a ScoredObject for every match.
+
+    Results match the default score algorithms within floating point rounding:
+    - comparative_judgement: absolute difference < 1e-9 (summation order differs)
+    - elo_rating: identical (same sequential rating updates)
+    - true_skill_rating: absolute difference < 1e-6 (closed form 1vs1 update
+      instead of the factor graph used by trueskill.rate_1vs1)
+    """
+    def __init__(self):
+        ScoreAlgorithmBase.__init__(self)
+
+        # keys[index] = key
+        self.keys = []
+        # key_indexes[key] = index
+        self.key_indexes = {}
+
+    # default score algorithm of the package (set by subclasses)
+    score_algorithm_class = None
+
+    def calculate_score_1vs1(self, key1_scored_object, key2_scored_object, winner, other_comparison_pairs):
+        """
+        1vs1 updates only involve two keys, so they are delegated to the default score algorithm
+        """
+        score_algorithm = self.score_algorithm_class()
+        score_algorithm.log = self.log
+        return score_algorithm.calculate_score_1vs1(key1_scored_object, key2_scored_object,
+            winner, other_comparison_pairs)
+
+    def _index_comparison_pairs(self, comparison_pairs):
+        """
+        Converts comparison pairs into integer indexed arrays
+        :param comparison_pairs: array of comparison_pairs
+        :return: tuple of numpy arrays (key1 indexes, key2 indexes, results)
+        """
+        self.keys = []
+        self.key_indexes = {}
+
+        count = len(comparison_pairs)
+        indexes1 = numpy.empty(count, dtype=numpy.int64)
+        indexes2 = numpy.empty(count, dtype=numpy.int64)
+        results = numpy.empty(count, dtype=numpy.int8)
+
+        for position, comparison_pair in enumerate(comparison_pairs):
+            if comparison_pair.winner not in WINNER_RESULTS:
+                raise InvalidWinnerException
+
+            indexes1[position] = self._key_index(comparison_pair.key1)
+            indexes2[position] = self._key_index(comparison_pair.key2)
+            results[position] = WINNER_RESULTS[comparison_pair.winner]
+
+        return (indexes1, indexes2, results)
+
+    def _key_index(self, key):
+        index = self.key_indexes.get(key)
+        if index == None:
+            index = self.key_indexes[key] = len(self.keys)
+            self.keys.append(key)
+        return index
+
+    def _count_results(self, indexes1, indexes2, results):
+        """
+        Calculates rounds, wins, loses, and opponents for every key
+        :return: tuple of numpy arrays (rounds, wins, loses, opponents)
+        """
+        size = len(self.keys)
+
+        rounds = numpy.bincount(indexes1, minlength=size) + \
+            numpy.bincount(indexes2, minlength=size)
+
+        key1_won = results == RESULT_KEY1
+        key2_won = results == RESULT_KEY2
+        wins = numpy.bincount(indexes1[key1_won], minlength=size) + \
+            numpy.bincount(indexes2[key2_won], minlength=size)
+        loses = numpy.bincount(indexes1[key2_won], minlength=size) + \
+            numpy.bincount(indexes2[key1_won], minlength=size)
+
+        # opponents are distinct keys faced in comparisons with a result
+        completed = results != RESULT_NONE
+        matchups = numpy.unique(self._matchup_codes(indexes1[completed], indexes2[completed]))
+        opponents = numpy.bincount(matchups // max(size, 1), minlength=size)
+
+        return (rounds, wins, loses, opponents)
+
+    def _matchup_codes(self, indexes1, indexes2):
+        """
+        Encodes both directions of every (key, opponent) matchup as key_index * size + opponent_index
+        """
+        size = len(self.keys)
+        return numpy.concatenate([
+            indexes1 * size + indexes2,
+            indexes2 * size + indexes1
+        ])
+
+    def _build_results(self, scores, variable1s, variable2s, rounds, wins, loses, opponents):
+        """
+        Converts result arrays into a dictionary key -> ScoredObject
+        """
+        comparison_results = {}
+        for index, key in enumerate(self.keys):
+            comparison_results[key] = ScoredObject(
+                key=key,
+                score=float(scores[index]),
+                variable1=float(variable1s[index]) if variable1s is not None else None,
+                variable2=float(variable2s[index]) if variable2s is not None else None,
+                rounds=int(rounds[index]),
+                opponents=int(opponents[index]),
+                wins=int(wins[index]),
+                loses=int(loses[index])
+            )
+        return comparison_results
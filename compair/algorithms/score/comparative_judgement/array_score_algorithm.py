@@ -0,0 +1,50 @@
+import numpy
+
+from compair.algorithms.score.array_score_algorithm_base import ArrayScoreAlgorithmBase, \
+    RESULT_NONE, RESULT_KEY1, RESULT_KEY2
+from compair.algorithms.score.comparative_judgement.score_algorithm import ComparativeJudgementScoreAlgorithm
+
+class ComparativeJudgementArrayScoreAlgorithm(ArrayScoreAlgorithmBase):
+    score_algorithm_class = ComparativeJudgementScoreAlgorithm
+
+    def __init__(self):
+        ArrayScoreAlgorithmBase.__init__(self)
+
+    def calculate_score(self, comparison_pairs):
+        """
+        Calculate scores for a set of comparison_pairs
+        :param comparison_pairs: array of comparison_pairs
+        :return: dictionary key -> ScoredObject
+        """
+        indexes1, indexes2, results = self._index_comparison_pairs(comparison_pairs)
+        rounds, wins, loses, opponents = self._count_results(indexes1, indexes2, results)
+        size = len(self.keys)
+
+        # win/lose counts for every (key, opponent) matchup with a result
+        completed = results != RESULT_NONE
+        key1_won = (results[completed] == RESULT_KEY1).astype(numpy.float64)
+        key2_won = (results[completed] == RESULT_KEY2).astype(numpy.float64)
+
+        codes = self._matchup_codes(indexes1[completed], indexes2[completed])
+        matchups, matchup_indexes = numpy.unique(codes, return_inverse=True)
+        matchup_wins = numpy.bincount(matchup_indexes,
+            weights=numpy.concatenate([key1_won, key2_won]), minlength=len(matchups))
+        matchup_loses = numpy.bincount(matchup_indexes,
+            weights=numpy.concatenate([key2_won, key1_won]), minlength=len(matchups))
+
+        # see ACJ paper equation 3 for what we're doing here
+        # http://www.tandfonline.com/doi/full/10.1080/0969594X.2012.665354
+        matchup_keys = matchups // max(size, 1)
+        matchup_opponents = matchups % max(size, 1)
+        differences = numpy.exp(matchup_wins - matchup_loses)
+        prob_answer_wins = differences / (1 + differences)
+        # skip comparing to self
+        prob_answer_wins[matchup_keys == matchup_opponents] = 0.0
+
+        expected_scores = numpy.bincount(matchup_keys, weights=prob_answer_wins, minlength=size)
+
+        # an estimate of actual value can be gotten from excepted score / number of opponents
+        scores = expected_scores / numpy.maximum(opponents, 1)
+
+        return self._build_results(scores, expected_scores, None,
+            rounds, wins, loses, opponents)
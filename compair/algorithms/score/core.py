@@ -1,7 +1,9 @@
 from importlib import import_module
 
-def calculate_score(package_name="elo_rating", **kargs):
+def calculate_score(package_name="elo_rating", backend=None, **kargs):
     package = import_module("compair.algorithms.score."+package_name)
+    if backend == "array":
+        return package.calculate_score_array(**kargs)
     return package.calculate_score(**kargs)
 
 def calculate_score_1vs1(package_name="elo_rating", **kargs):
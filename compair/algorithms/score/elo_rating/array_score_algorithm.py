@@ -0,0 +1,51 @@
+import elo
+import numpy
+
+from compair.algorithms.score.array_score_algorithm_base import ArrayScoreAlgorithmBase, \
+    RESULT_NONE, RESULT_KEY1, RESULT_KEY2
+from compair.algorithms.score.elo_rating.score_algorithm import EloAlgorithmWrapper
+
+class EloArrayScoreAlgorithm(ArrayScoreAlgorithmBase):
+    score_algorithm_class = EloAlgorithmWrapper
+
+    def __init__(self):
+        ArrayScoreAlgorithmBase.__init__(self)
+
+    def calculate_score(self, comparison_pairs):
+        """
+        Calculate scores for a set of comparison_pairs
+        :param comparison_pairs: array of comparison_pairs
+        :return: dictionary key -> ScoredObject
+        """
+        env = elo.setup()
+
+        indexes1, indexes2, results = self._index_comparison_pairs(comparison_pairs)
+        rounds, wins, loses, opponents = self._count_results(indexes1, indexes2, results)
+
+        # elo ratings depend on the order of the matches so they are updated sequentially.
+        # plain floats are used instead of elo.Rating objects (same formula as elo.rate_1vs1)
+        ratings = [float(env.initial)] * len(self.keys)
+        k_factor = env.k_factor
+        f_factor = 2 * env.beta
+
+        for index1, index2, result in zip(indexes1.tolist(), indexes2.tolist(), results.tolist()):
+            # skip incomplete comparisosns
+            if result == RESULT_NONE:
+                continue
+
+            if result == RESULT_KEY1:
+                score1, score2 = (elo.WIN, elo.LOSS)
+            elif result == RESULT_KEY2:
+                score1, score2 = (elo.LOSS, elo.WIN)
+            else:
+                score1, score2 = (elo.DRAW, elo.DRAW)
+
+            r1 = ratings[index1]
+            r2 = ratings[index2]
+            ratings[index1] = r1 + k_factor * (score1 - 1. / (1 + 10 ** ((r2 - r1) / f_factor)))
+            ratings[index2] = r2 + k_factor * (score2 - 1. / (1 + 10 ** ((r1 - r2) / f_factor)))
+
+        scores = numpy.array(ratings, dtype=numpy.float64)
+
+        return self._build_results(scores, scores, None,
+            rounds, wins, loses, opponents)
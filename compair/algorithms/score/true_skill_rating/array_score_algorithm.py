@@ -0,0 +1,68 @@
+import math
+import trueskill
+import numpy
+
+from compair.algorithms.score.array_score_algorithm_base import ArrayScoreAlgorithmBase, \
+    RESULT_NONE, RESULT_KEY1, RESULT_KEY2
+from compair.algorithms.score.true_skill_rating.score_algorithm import TrueSkillAlgorithmWrapper
+
+class TrueSkillArrayScoreAlgorithm(ArrayScoreAlgorithmBase):
+    score_algorithm_class = TrueSkillAlgorithmWrapper
+
+    def __init__(self):
+        ArrayScoreAlgorithmBase.__init__(self)
+
+    def calculate_score(self, comparison_pairs):
+        """
+        Calculate scores for a set of comparison_pairs
+        :param comparison_pairs: array of comparison_pairs
+        :return: dictionary key -> ScoredObject
+        """
+        env = trueskill.setup()
+
+        indexes1, indexes2, results = self._index_comparison_pairs(comparison_pairs)
+        rounds, wins, loses, opponents = self._count_results(indexes1, indexes2, results)
+
+        # true skill ratings depend on the order of the matches so they are updated sequentially.
+        # uses the closed form of the 1vs1 factor graph solved by trueskill.rate_1vs1
+        mus = [float(env.mu)] * len(self.keys)
+        sigma_squares = [float(env.sigma) ** 2] * len(self.keys)
+        tau_square = env.tau ** 2
+        beta_square = env.beta ** 2
+        draw_margin = trueskill.calc_draw_margin(env.draw_probability, 2, env=env)
+
+        for index1, index2, result in zip(indexes1.tolist(), indexes2.tolist(), results.tolist()):
+            # skip incomplete comparisosns
+            if result == RESULT_NONE:
+                continue
+
+            # rate_1vs1 is always called with the winner first
+            if result == RESULT_KEY2:
+                winner_index, loser_index = (index2, index1)
+            else:
+                winner_index, loser_index = (index1, index2)
+
+            winner_sigma_square = sigma_squares[winner_index] + tau_square
+            loser_sigma_square = sigma_squares[loser_index] + tau_square
+            c = math.sqrt(2 * beta_square + winner_sigma_square + loser_sigma_square)
+            diff = (mus[winner_index] - mus[loser_index]) / c
+
+            if result == RESULT_KEY1 or result == RESULT_KEY2:
+                v = env.v_win(diff, draw_margin / c)
+                w = env.w_win(diff, draw_margin / c)
+            else:
+                v = env.v_draw(diff, draw_margin / c)
+                w = env.w_draw(diff, draw_margin / c)
+
+            mus[winner_index] += winner_sigma_square / c * v
+            mus[loser_index] -= loser_sigma_square / c * v
+            sigma_squares[winner_index] = winner_sigma_square * (1 - winner_sigma_square / c ** 2 * w)
+            sigma_squares[loser_index] = loser_sigma_square * (1 - loser_sigma_square / c ** 2 * w)
+
+        mus = numpy.array(mus, dtype=numpy.float64)
+        sigmas = numpy.sqrt(numpy.array(sigma_squares, dtype=numpy.float64))
+        # same as trueskill.expose
+        scores = mus - (env.mu / env.sigma) * sigmas
+
+        return self._build_results(scores, mus, sigmas,
+            rounds, wins, loses, opponents)
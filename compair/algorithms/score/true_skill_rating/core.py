@@ -1,4 +1,5 @@
 from .score_algorithm import TrueSkillAlgorithmWrapper
+from .array_score_algorithm import TrueSkillArrayScoreAlgorithm
 
 def calculate_score(comparison_pairs=[], log=None):
     score_algorithm = TrueSkillAlgorithmWrapper()
@@ -8,4 +9,9 @@ def calculate_score(comparison_pairs=[], log=None):
 def calculate_score_1vs1(key1_scored_object, key2_scored_object, winner, other_comparison_pairs=[], log=None):
     score_algorithm = TrueSkillAlgorithmWrapper()
     score_algorithm.log = log
-    return score_algorithm.calculate_score_1vs1(key1_scored_object, key2_scored_object, winner, other_comparison_pairs)
\ No newline at end of file
+    return score_algorithm.calculate_score_1vs1(key1_scored_object, key2_scored_object, winner, other_comparison_pairs)
+
+def calculate_score_array(comparison_pairs=[], log=None):
+    score_algorithm = TrueSkillArrayScoreAlgorithm()
+    score_algorithm.log = log
+    return score_algorithm.calculate_score(comparison_pairs)
\ No newline at end of file
@@ -316,6 +316,7 @@ class AnswerRootAPI(Resource):
 
         db.session.add(answer)
         db.session.commit()
+        Comparison.update_pairing_index_answer(answer)
 
         on_answer_create.send(
             self,
@@ -506,6 +507,7 @@ class AnswerIdAPI(Resource):
         model_changes = get_model_changes(answer)
         db.session.add(answer)
         db.session.commit()
+        Comparison.update_pairing_index_answer(answer)
 
         on_answer_modified.send(
             self,
@@ -561,6 +563,11 @@ class AnswerIdAPI(Resource):
 
         answer.active = False
         db.session.commit()
+        Comparison.update_pairing_index_answer(answer)
+
+        # removing an answer can change the min/max score of the assignment
+        AnswerScore.update_normalized_scores(assignment.id)
+        db.session.commit()
 
         # update course & assignment grade for user if answer was fully submitted
         if not answer.draft:
@@ -4,6 +4,7 @@ from flask_login import login_required, current_user
 from flask_restful import Resource, marshal
 from flask_restful.reqparse import RequestParser
 from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 
 from . import dataformat
 from compair.core import db, event, abort
@@ -162,13 +163,21 @@ class AnswerCommentListAPI(Resource):
                 .join(User, AnswerComment.user_id == User.id) \
                 .filter(User.uuid.in_(user_ids))
 
-        answer_comments = query.order_by(AnswerComment.created.desc()).all()
+        answer_comments = query \
+            .options(joinedload('answer')) \
+            .options(joinedload('user')) \
+            .order_by(AnswerComment.created.desc()) \
+            .all()
 
-        # checking the permission
+        # checking the permission (once per answer, comments on the same answer share the result)
+        checked_answer_ids = set()
         for answer_comment in answer_comments:
+            if answer_comment.answer_id in checked_answer_ids:
+                continue
             require(READ, answer_comment.answer,
                 title="Feedback Unavailable",
                 message="Sorry, your role in this course does not allow you to view feedback for this answer.")
+            checked_answer_ids.add(answer_comment.answer_id)
 
         on_answer_comment_list_get.send(
             self,
@@ -1,5 +1,7 @@
 import datetime
 import dateutil.parser
+import threading
+import time
 
 from bouncer.constants import READ, EDIT, CREATE, DELETE, MANAGE
 from flask import Blueprint
@@ -7,7 +9,8 @@ from flask_login import login_required, current_user, current_app
 from flask_restful import Resource, marshal
 from flask_restful.reqparse import RequestParser
 from sqlalchemy import desc, or_, func, and_
-from sqlalchemy.orm import joinedload, undefer_group, load_only
+from sqlalchemy.orm import joinedload, undefer_group, load_only, contains_eager
+from sqlalchemy.sql.expression import join
 from six import text_type
 
 from . import dataformat
@@ -17,10 +20,21 @@ from compair.models import Assignment, Course, Criterion, AssignmentCriterion, A
     AnswerComment, AnswerCommentType, PairingAlgorithm, Criterion, File, User, UserCourse, \
     CourseRole, Group
 from .util import new_restful_api, get_model_changes, pagination_parser
+from .answer import on_answer_create, on_answer_modified, on_answer_delete
+from .answer_comment import on_answer_comment_create, on_answer_comment_modified, on_answer_comment_delete
+from .comparison import on_comparison_create, on_comparison_update
 
 assignment_api = Blueprint('assignment_api', __name__)
 api = new_restful_api(assignment_api)
 
+# process level assignment statuses used by AssignmentRootStatusAPI ('assignments')
+# and UserCourseStatusListAPI ('course')
+# _assignment_statuses[(user_id, course_id, status_type)] = (built timestamp, statuses)
+_assignment_statuses = {}
+# incremented whenever a course's statuses change so that statuses built from older reads are not stored
+_assignment_status_versions = {}
+_assignment_status_lock = threading.RLock()
+
 def non_blank_text(value):
     if value is None:
         return None
@@ -641,169 +655,321 @@ class AssignmentRootStatusAPI(Resource):
             title="Assignment Status Unavailable",
             message="Assignment status can be seen only by those enrolled in the course. Please double-check your enrollment in this course.")
 
-        group = current_user.get_course_group(course.id)
-        group_id = group.id if group else None
+        statuses = get_cached_assignment_statuses(current_user.id, course.id)
+        if statuses == None:
+            version = get_assignment_status_version(course.id)
+            statuses = _get_assignment_statuses(course)
+            set_cached_assignment_statuses(current_user.id, course.id, version, statuses)
 
-        assignments = course.assignments \
-            .filter_by(active=True) \
-            .all()
-        assignment_ids = [assignment.id for assignment in assignments]
+        on_assignment_list_get_status.send(
+            self,
+            event_name=on_assignment_list_get_status.name,
+            user=current_user,
+            course_id=course.id,
+            data=statuses)
 
-        answer_counts = Answer.query \
-            .with_entities(
-                Answer.assignment_id,
-                func.count(Answer.assignment_id).label('answer_count')
-            ) \
-            .filter_by(
-                comparable=True,
-                active=True,
-                practice=False,
-                draft=False
-            ) \
-            .filter(or_(
-                Answer.user_id == current_user.id,
-                and_(Answer.group_id == group_id, Answer.group_answer == True)
-            )) \
-            .filter(Answer.assignment_id.in_(assignment_ids)) \
-            .group_by(Answer.assignment_id) \
-            .all()
+        return {"statuses": statuses}
 
+api.add_resource(AssignmentRootStatusAPI, '/status')
 
-        feedback_counts = AnswerComment.query \
-            .join("answer") \
-            .with_entities(
-                Answer.assignment_id,
-                func.count(Answer.assignment_id).label('feedback_count')
-            ) \
-            .filter(and_(
-                AnswerComment.active == True,
-                AnswerComment.draft == False,
-                Answer.active == True,
-                Answer.practice == False,
-                Answer.draft == False,
-                Answer.assignment_id.in_(assignment_ids)
-            )) \
-            .filter(or_(
-                Answer.user_id == current_user.id,
-                and_(Answer.group_id == group_id, Answer.group_id != None)
-            )) \
-            .group_by(Answer.assignment_id) \
-            .all()
 
-        # get self evaluation status for assignments with self evaluations enabled
+def _get_assignment_statuses(course):
+    """
+    Builds the statuses of the current user for every active assignment in the course.
+    Every count is read with one query grouped by assignment_id
+    """
+    group = current_user.get_course_group(course.id)
+    group_id = group.id if group else None
+
+    assignments = course.assignments \
+        .filter_by(active=True) \
+        .all()
+    assignment_ids = [assignment.id for assignment in assignments]
+
+    if len(assignment_ids) == 0:
+        return {}
+
+    answer_counts = dict(Answer.query \
+        .with_entities(
+            Answer.assignment_id,
+            func.count(Answer.assignment_id)
+        ) \
+        .filter_by(
+            comparable=True,
+            active=True,
+            practice=False,
+            draft=False
+        ) \
+        .filter(or_(
+            Answer.user_id == current_user.id,
+            and_(Answer.group_id == group_id, Answer.group_answer == True)
+        )) \
+        .filter(Answer.assignment_id.in_(assignment_ids)) \
+        .group_by(Answer.assignment_id) \
+        .all())
+
+    # same conditions as Assignment.comparable_answer_count
+    comparable_answer_counts = dict(db.session.query(
+            Answer.assignment_id,
+            func.count(Answer.id)
+        ) \
+        .select_from(
+            join(Answer, UserCourse, UserCourse.user_id == Answer.user_id, isouter=True).
+            join(Group, Group.id == Answer.group_id, isouter=True)
+        ) \
+        .filter(and_(
+            Answer.assignment_id.in_(assignment_ids),
+            Answer.active == True,
+            Answer.draft == False,
+            Answer.practice == False,
+            Answer.comparable == True,
+            or_(
+                and_(
+                    UserCourse.course_id == course.id,
+                    UserCourse.course_role != CourseRole.dropped,
+                    UserCourse.id != None
+                ),
+                and_(
+                    Group.course_id == course.id,
+                    Group.active == True,
+                    Group.id != None
+                )
+            )
+        )) \
+        .group_by(Answer.assignment_id) \
+        .all())
+
+    comparison_counts = dict(Comparison.query \
+        .with_entities(
+            Comparison.assignment_id,
+            func.count(Comparison.assignment_id)
+        ) \
+        .filter_by(
+            user_id=current_user.id,
+            completed=True
+        ) \
+        .filter(Comparison.assignment_id.in_(assignment_ids)) \
+        .group_by(Comparison.assignment_id) \
+        .all())
+
+    comparison_draft_counts = dict(Comparison.query \
+        .with_entities(
+            Comparison.assignment_id,
+            func.count(Comparison.assignment_id)
+        ) \
+        .filter_by(
+            user_id=current_user.id,
+            draft=True
+        ) \
+        .filter(Comparison.assignment_id.in_(assignment_ids)) \
+        .group_by(Comparison.assignment_id) \
+        .all())
+
+    feedback_counts = dict(AnswerComment.query \
+        .join("answer") \
+        .with_entities(
+            Answer.assignment_id,
+            func.count(Answer.assignment_id)
+        ) \
+        .filter(and_(
+            AnswerComment.active == True,
+            AnswerComment.draft == False,
+            Answer.active == True,
+            Answer.practice == False,
+            Answer.draft == False,
+            Answer.assignment_id.in_(assignment_ids)
+        )) \
+        .filter(or_(
+            Answer.user_id == current_user.id,
+            and_(Answer.group_id == group_id, Answer.group_id != None)
+        )) \
+        .group_by(Answer.assignment_id) \
+        .all())
+
+    # get self evaluation status for assignments with self evaluations enabled
+    self_evaluation_counts = {}
+    self_evaluation_draft_counts = {}
+    self_evaluation_assignment_ids = [assignment.id for assignment in assignments if assignment.enable_self_evaluation]
+    if len(self_evaluation_assignment_ids) > 0:
         self_evaluations = AnswerComment.query \
             .join("answer") \
             .with_entities(
                 Answer.assignment_id,
-                func.count(Answer.assignment_id).label('self_evaluation_count')
+                AnswerComment.draft,
+                func.count(Answer.assignment_id)
             ) \
             .filter(and_(
                 AnswerComment.user_id == current_user.id,
                 AnswerComment.active == True,
                 AnswerComment.comment_type == AnswerCommentType.self_evaluation,
-                AnswerComment.draft == False,
                 Answer.active == True,
                 Answer.practice == False,
                 Answer.draft == False,
-                Answer.assignment_id.in_(assignment_ids)
+                Answer.assignment_id.in_(self_evaluation_assignment_ids)
             )) \
-            .group_by(Answer.assignment_id) \
-            .all()
-
-        self_evaluation_drafts = AnswerComment.query \
-            .join("answer") \
-            .with_entities(
-                Answer.assignment_id,
-                func.count(Answer.assignment_id).label('self_evaluation_count')
-            ) \
-            .filter(and_(
-                AnswerComment.user_id == current_user.id,
-                AnswerComment.active == True,
-                AnswerComment.comment_type == AnswerCommentType.self_evaluation,
-                AnswerComment.draft == True,
-                Answer.active == True,
-                Answer.practice == False,
-                Answer.draft == False,
-                Answer.assignment_id.in_(assignment_ids)
-            )) \
-            .group_by(Answer.assignment_id) \
+            .group_by(Answer.assignment_id, AnswerComment.draft) \
             .all()
+        for (assignment_id, draft, count) in self_evaluations:
+            if draft:
+                self_evaluation_draft_counts[assignment_id] = count
+            else:
+                self_evaluation_counts[assignment_id] = count
+
+    drafts = Answer.query \
+        .with_entities(Answer.assignment_id, Answer.uuid) \
+        .filter_by(
+            active=True,
+            practice=False,
+            draft=True
+        ) \
+        .filter(or_(
+            and_(Answer.group_id == group_id, Answer.group_id != None),
+            Answer.user_id == current_user.id
+        )) \
+        .filter(Answer.assignment_id.in_(assignment_ids)) \
+        .all()
+    draft_ids = {}
+    for (assignment_id, uuid) in drafts:
+        draft_ids.setdefault(assignment_id, []).append(uuid)
+
+    # assignment permissions are granted per course
+    can_edit = allow(EDIT, Assignment(course_id=course.id))
+
+    statuses = {}
+    for assignment in assignments:
+        answer_count = answer_counts.get(assignment.id, 0)
+        feedback_count = feedback_counts.get(assignment.id, 0)
+        assignment_draft_ids = draft_ids.get(assignment.id, [])
+        comparison_count = comparison_counts.get(assignment.id, 0)
+        comparison_draft_count = comparison_draft_counts.get(assignment.id, 0)
+        other_comparable_answers = comparable_answer_counts.get(assignment.id, 0) - answer_count
+
+        # students can only begin comparing when there there are enough answers submitted that they can do
+        # comparisons without seeing the same answer more than once
+        comparison_available = other_comparable_answers >= assignment.number_of_comparisons * 2
+        # instructors and tas can compare as long as there are new possible comparisons
+        if can_edit:
+            comparison_available = comparison_count < other_comparable_answers * (other_comparable_answers - 1) / 2
 
-        query = Answer.query \
-            .options(load_only('id', 'assignment_id', 'uuid')) \
-            .filter_by(
-                active=True,
-                practice=False,
-                draft=True
-            ) \
-            .filter(or_(
-                and_(Answer.group_id == group_id, Answer.group_id != None),
-                Answer.user_id == current_user.id
-            )) \
-            .filter(Answer.assignment_id.in_(assignment_ids))
-        drafts = query.all()
-
-        statuses = {}
-        for assignment in assignments:
-            answer_count = next(
-                (result.answer_count for result in answer_counts if result.assignment_id == assignment.id),
-                0
-            )
-            feedback_count = next(
-                (result.feedback_count for result in feedback_counts if result.assignment_id == assignment.id),
-                0
-            )
-            assignment_drafts = [draft for draft in drafts if draft.assignment_id == assignment.id]
-            comparison_count = assignment.completed_comparison_count_for_user(current_user.id)
-            comparison_draft_count = assignment.draft_comparison_count_for_user(current_user.id)
-            other_comparable_answers = assignment.comparable_answer_count - answer_count
-
-            # students can only begin comparing when there there are enough answers submitted that they can do
-            # comparisons without seeing the same answer more than once
-            comparison_available = other_comparable_answers >= assignment.number_of_comparisons * 2
-            # instructors and tas can compare as long as there are new possible comparisons
-            if allow(EDIT, assignment):
-                comparison_available = comparison_count < other_comparable_answers * (other_comparable_answers - 1) / 2
-
-            statuses[assignment.uuid] = {
-                'answers': {
-                    'answered': answer_count > 0,
-                    'feedback': feedback_count,
-                    'count': answer_count,
-                    'has_draft': len(assignment_drafts) > 0,
-                    'draft_ids': [draft.uuid for draft in assignment_drafts]
-                },
-                'comparisons': {
-                    'available': comparison_available,
-                    'count': comparison_count,
-                    'left': max(0, assignment.total_comparisons_required - comparison_count),
-                    'has_draft': comparison_draft_count > 0
-                }
+        statuses[assignment.uuid] = {
+            'answers': {
+                'answered': answer_count > 0,
+                'feedback': feedback_count,
+                'count': answer_count,
+                'has_draft': len(assignment_draft_ids) > 0,
+                'draft_ids': assignment_draft_ids
+            },
+            'comparisons': {
+                'available': comparison_available,
+                'count': comparison_count,
+                'left': max(0, assignment.total_comparisons_required - comparison_count),
+                'has_draft': comparison_draft_count > 0
             }
+        }
 
-            if assignment.enable_self_evaluation:
-                self_evaluation_count = next(
-                    (result.self_evaluation_count for result in self_evaluations if result.assignment_id == assignment.id),
-                    0
-                )
-                self_evaluation_draft_count = next(
-                    (result.self_evaluation_count for result in self_evaluation_drafts if result.assignment_id == assignment.id),
-                    0
-                )
-                statuses[assignment.uuid]['comparisons']['self_evaluation_completed'] = self_evaluation_count > 0
-                statuses[assignment.uuid]['comparisons']['self_evaluation_draft'] = self_evaluation_draft_count > 0
-
-        on_assignment_list_get_status.send(
-            self,
-            event_name=on_assignment_list_get_status.name,
-            user=current_user,
-            course_id=course.id,
-            data=statuses)
-
-        return {"statuses": statuses}
-
-api.add_resource(AssignmentRootStatusAPI, '/status')
-
+        if assignment.enable_self_evaluation:
+            statuses[assignment.uuid]['comparisons']['self_evaluation_completed'] = \
+                self_evaluation_counts.get(assignment.id, 0) > 0
+            statuses[assignment.uuid]['comparisons']['self_evaluation_draft'] = \
+                self_evaluation_draft_counts.get(assignment.id, 0) > 0
+
+    return statuses
+
+def get_assignment_status_version(course_id):
+    """
+    Returns the version of the course's statuses to pass to set_cached_assignment_statuses
+    """
+    with _assignment_status_lock:
+        return _assignment_status_versions.get(course_id, 0)
+
+def get_cached_assignment_statuses(user_id, course_id, status_type='assignments'):
+    """
+    Returns the cached assignment statuses of the user in the course or None.
+    Statuses are cached per process for ASSIGNMENT_STATUS_CACHE_TTL seconds
+    or until an answer, comment, comparison or assignment of the course changes
+    """
+    ttl = current_app.config.get('ASSIGNMENT_STATUS_CACHE_TTL', 0)
+    if ttl <= 0:
+        return None
+    with _assignment_status_lock:
+        cached = _assignment_statuses.get((user_id, course_id, status_type))
+        if cached and time.time() - cached[0] < ttl:
+            return cached[1]
+    return None
+
+def set_cached_assignment_statuses(user_id, course_id, version, statuses, status_type='assignments'):
+    """
+    Caches statuses unless the course's statuses changed since version was read
+    """
+    if current_app.config.get('ASSIGNMENT_STATUS_CACHE_TTL', 0) <= 0:
+        return
+    with _assignment_status_lock:
+        if _assignment_status_versions.get(course_id, 0) == version:
+            _assignment_statuses[(user_id, course_id, status_type)] = (time.time(), statuses)
+
+def clear_assignment_statuses(course_id=None, user_id=None):
+    """
+    Removes the cached statuses of the course (only those of user_id if given)
+    or of every course if course_id is None
+    """
+    with _assignment_status_lock:
+        if course_id == None:
+            _assignment_statuses.clear()
+            return
+        for key in list(_assignment_statuses.keys()):
+            if key[1] == course_id and (user_id == None or key[0] == user_id):
+                del _assignment_statuses[key]
+        _assignment_status_versions[course_id] = _assignment_status_versions.get(course_id, 0) + 1
+
+def _clear_course_assignment_statuses(sender, course_id=None, **extra):
+    clear_assignment_statuses(course_id)
+
+def _clear_user_assignment_statuses(sender, user=None, course_id=None, **extra):
+    clear_assignment_statuses(course_id, user.id)
+
+# answers, comments and assignments change the statuses of everyone in the course
+for signal in [on_answer_create, on_answer_modified, on_answer_delete, on_answer_comment_create,
+        on_answer_comment_modified, on_answer_comment_delete, on_assignment_create,
+        on_assignment_modified, on_assignment_delete]:
+    signal.connect(_clear_course_assignment_statuses)
+# comparisons only change the statuses of the user comparing
+on_comparison_create.connect(_clear_user_assignment_statuses)
+on_comparison_update.connect(_clear_user_assignment_statuses)
+
+
+def _comparison_loader_options():
+    """
+    Eager loads what the comparison set format shows of the comparison criteria and compared answers
+    (file, author, score and comment counts) with the comparisons instead of one answer at a time
+    """
+    options = [joinedload('comparison_criteria').joinedload('criterion')]
+    for answer_relationship in ['answer1', 'answer2']:
+        for relationship in ['file', 'user', 'group', 'score']:
+            options.append(joinedload(answer_relationship).joinedload(relationship))
+        options.append(joinedload(answer_relationship).undefer_group('counts'))
+    return options
+
+def _group_comparison_feedback(comparisons, answer_comments):
+    """
+    Adds the evaluation comments the comparison author left on each compared answer to the comparisons
+    (answer1_feedback and answer2_feedback)
+    :return: (comparisons by user id, self-evaluation comments by user id)
+    """
+    evaluations = {}
+    self_evaluations = {}
+    for comment in answer_comments:
+        if comment.comment_type == AnswerCommentType.evaluation:
+            evaluations.setdefault((comment.user_id, comment.answer_id), []).append(comment)
+        elif comment.comment_type == AnswerCommentType.self_evaluation:
+            self_evaluations.setdefault(comment.user_id, []).append(comment)
+
+    comparisons_by_user = {}
+    for comparison in comparisons:
+        comparison.answer1_feedback = evaluations.get((comparison.user_id, comparison.answer1_id), [])
+        comparison.answer2_feedback = evaluations.get((comparison.user_id, comparison.answer2_id), [])
+        comparisons_by_user.setdefault(comparison.user_id, []).append(comparison)
+
+    return comparisons_by_user, self_evaluations
 
 # /user/comparisons
 class AssignmentUserComparisonsAPI(Resource):
@@ -819,6 +985,7 @@ class AssignmentUserComparisonsAPI(Resource):
 
         # get comparisons for current user
         comparisons = Comparison.query \
+            .options(*_comparison_loader_options()) \
             .filter(and_(
                 Comparison.completed == True,
                 Comparison.assignment_id == assignment.id,
@@ -829,6 +996,8 @@ class AssignmentUserComparisonsAPI(Resource):
         # get all self-evaluations and evaluation comments for current user
         answer_comments = AnswerComment.query \
             .join("answer") \
+            .options(contains_eager('answer')) \
+            .options(joinedload('user')) \
             .filter(and_(
                 AnswerComment.active == True,
                 AnswerComment.comment_type.in_([AnswerCommentType.self_evaluation, AnswerCommentType.evaluation]),
@@ -841,18 +1010,7 @@ class AssignmentUserComparisonsAPI(Resource):
             .all()
 
         # add comparison answer evaluation comments to comparison object
-        for comparison in comparisons:
-            comparison.answer1_feedback = [comment for comment in answer_comments if
-                comment.user_id == comparison.user_id and
-                comment.answer_id == comparison.answer1_id and
-                comment.comment_type == AnswerCommentType.evaluation
-            ]
-
-            comparison.answer2_feedback = [comment for comment in answer_comments if
-                comment.user_id == comparison.user_id and
-                comment.answer_id == comparison.answer2_id and
-                comment.comment_type == AnswerCommentType.evaluation
-            ]
+        comparisons_by_user, self_evaluations_by_user = _group_comparison_feedback(comparisons, answer_comments)
 
         on_assignment_user_comparisons_get.send(
             self,
@@ -863,13 +1021,8 @@ class AssignmentUserComparisonsAPI(Resource):
         )
 
         comparison_set = {
-            'comparisons': [comparison for comparison in comparisons if
-                comparison.user_id == current_user.id
-            ],
-            'self_evaluations': [comment for comment in answer_comments if
-                comment.user_id == current_user.id and
-                comment.comment_type == AnswerCommentType.self_evaluation
-            ]
+            'comparisons': comparisons_by_user.get(current_user.id, []),
+            'self_evaluations': self_evaluations_by_user.get(current_user.id, [])
         }
 
         return marshal(comparison_set, dataformat.get_comparison_set(restrict_user, with_user=False))
@@ -965,6 +1118,7 @@ class AssignmentUsersComparisonsAPI(Resource):
 
             # get all comparisons that group of users created
             comparisons = Comparison.query \
+                .options(*_comparison_loader_options()) \
                 .filter(and_(
                     Comparison.completed == True,
                     Comparison.assignment_id == assignment.id,
@@ -994,34 +1148,20 @@ class AssignmentUsersComparisonsAPI(Resource):
                 ))
 
             answer_comments = AnswerComment.query \
+                .options(joinedload('answer')) \
+                .options(joinedload('user')) \
                 .filter(or_(*conditions)) \
                 .filter_by(draft=False) \
                 .all()
 
             # add comparison answer evaluation comments to comparison object
-            for comparison in comparisons:
-                comparison.answer1_feedback = [comment for comment in answer_comments if
-                    comment.user_id == comparison.user_id and
-                    comment.answer_id == comparison.answer1_id and
-                    comment.comment_type == AnswerCommentType.evaluation
-                ]
-
-                comparison.answer2_feedback = [comment for comment in answer_comments if
-                    comment.user_id == comparison.user_id and
-                    comment.answer_id == comparison.answer2_id and
-                    comment.comment_type == AnswerCommentType.evaluation
-                ]
+            comparisons_by_user, self_evaluations_by_user = _group_comparison_feedback(comparisons, answer_comments)
 
             for user in page.items:
                 comparison_sets.append({
                     'user': user,
-                    'comparisons': [comparison for comparison in comparisons if
-                        comparison.user_id == user.id
-                    ],
-                    'self_evaluations': [comment for comment in answer_comments if
-                        comment.user_id == user.id and
-                        comment.comment_type == AnswerCommentType.self_evaluation
-                    ]
+                    'comparisons': comparisons_by_user.get(user.id, []),
+                    'self_evaluations': self_evaluations_by_user.get(user.id, [])
                 })
 
 
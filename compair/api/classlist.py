@@ -1,24 +1,26 @@
+import datetime
 import os
 import uuid
 import unicodecsv as csv
+from collections import OrderedDict
 
 from bouncer.constants import EDIT, READ, MANAGE
 from flask import Blueprint, request, current_app, make_response
 from flask_login import login_required, current_user
 from flask_restful import Resource, marshal
 from six import BytesIO
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, bindparam
 from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 from flask_restful.reqparse import RequestParser
 
 from . import dataformat
 from compair.core import db, event, abort, allowed_file, display_name_generator
-from compair.authorization import allow, require, USER_IDENTITY
+from compair.authorization import allow, require, invalidate_permissions, USER_IDENTITY
 from compair.models import UserCourse, Course, User, SystemRole, CourseRole, \
     ThirdPartyType, ThirdPartyUser, Group
-from compair.tasks import set_passwords
-from .util import new_restful_api
+from compair.tasks import set_passwords, import_classlist
+from .util import new_restful_api, new_uuid, load_job, save_job
 
 classlist_api = Blueprint('classlist_api', __name__)
 api = new_restful_api(classlist_api)
@@ -56,6 +58,10 @@ CAS_OR_SAML_IMPORT = {
     'group_name': 6
 }
 
+# number of rows validated and inserted at a time
+IMPORT_BATCH_SIZE = 1000
+
+
 # events
 on_classlist_get = event.signal('CLASSLIST_GET')
 on_classlist_upload = event.signal('CLASSLIST_UPLOAD')
@@ -91,217 +97,341 @@ def _parse_user_row(import_type, row):
     return user
 
 
-def _get_existing_users_by_identifier(import_type, users):
-    username_index = COMPAIR_IMPORT['username']
-    if import_type == ThirdPartyType.cas.value or import_type == ThirdPartyType.saml.value:
-        username_index = CAS_OR_SAML_IMPORT['username']
-    usernames = [u[username_index] for u in users if len(u) > username_index]
+def _get_existing_users_by_identifier(import_type, usernames):
+    """
+    :return: dictionary of username -> (user id, last online) for users in the system
+    """
     if len(usernames) == 0:
         return {}
 
     if import_type == ThirdPartyType.cas.value or import_type == ThirdPartyType.saml.value:
         # CAS/SAML login
         third_party_users = ThirdPartyUser.query \
-            .options(joinedload('user')) \
+            .join("user") \
+            .with_entities(ThirdPartyUser.unique_identifier, User.id, User.last_online) \
             .filter(and_(
                 ThirdPartyUser.unique_identifier.in_(usernames),
                 ThirdPartyUser.third_party_type == ThirdPartyType(import_type)
             )) \
             .all()
         return {
-            third_party_user.unique_identifier: third_party_user.user for third_party_user in third_party_users
+            unique_identifier: (user_id, last_online) for (unique_identifier, user_id, last_online) in third_party_users
         }
     else:
         # ComPAIR login
         users = User.query \
+            .with_entities(User.username, User.id, User.last_online) \
             .filter(User.username.in_(usernames)) \
             .all()
         return {
-            u.username: u for u in users
+            username: (user_id, last_online) for (username, user_id, last_online) in users
         }
 
-def _get_existing_users_by_student_number(import_type, users):
-    student_number_index = COMPAIR_IMPORT['student_number']
-    if import_type == ThirdPartyType.cas.value or import_type == ThirdPartyType.saml.value:
-        student_number_index = CAS_OR_SAML_IMPORT['student_number']
-    student_number = [u[student_number_index] for u in users if len(u) > student_number_index]
-    if len(student_number) == 0:
-        return {}
+def _get_existing_student_numbers(student_numbers):
+    if len(student_numbers) == 0:
+        return set()
 
     users = User.query \
-        .filter(User.student_number.in_(student_number)) \
+        .with_entities(User.student_number) \
+        .filter(User.student_number.in_(student_numbers)) \
         .all()
-    return {
-        u.student_number: u for u in users
-    }
+    return set(student_number for (student_number,) in users)
 
-def import_users(import_type, course, users):
-    invalids = []  # invalid entries - eg. invalid # of columns
-    count = 0  # store number of successful enrolments
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        # skip empty rows
+        if len(row) < 1:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def import_users(import_type, course, rows, user_id=None, on_progress=None):
+    """
+    Imports users from rows (an iterable of csv rows) into the course.
+    Rows are validated and new users are inserted in batches of IMPORT_BATCH_SIZE, then enrolments are
+    written with bulk statements and students missing from the file are dropped.
+    user_id: the user importing the file (recorded as creator/modifier)
+    on_progress: called with the number of rows processed after every batch
+    """
+    third_party_import = import_type == ThirdPartyType.cas.value or import_type == ThirdPartyType.saml.value
 
-    imported_users = []
-    set_user_passwords = []
+    invalids = []  # invalid entries - eg. invalid # of columns
+    processed = 0
 
-    # store unique user identifiers - eg. student number - throws error if duplicate in file
-    import_usernames = []
-    import_student_numbers = []
+    # user id -> group name of valid users in file
+    imported_users = OrderedDict()
+    set_user_passwords = {}
 
     # store unique user identifiers - eg. student number - throws error if duplicate in file
-    existing_system_usernames = _get_existing_users_by_identifier(import_type, users)
-    existing_system_student_numbers = _get_existing_users_by_student_number(import_type, users)
+    import_usernames = set()
+    import_student_numbers = set()
 
-    groups = course.groups.all()
-    groups_by_name = {}
-    for group in groups:
-        groups_by_name[group.name] = group
+    now = datetime.datetime.utcnow()
 
     # create / update users in file
-    for user_row in users:
-        if len(user_row) < 1:
-            continue  # skip empty row
-        user = _parse_user_row(import_type, user_row)
+    for batch in _batches(rows, IMPORT_BATCH_SIZE):
+        parsed_users = [_parse_user_row(import_type, user_row) for user_row in batch]
+
+        existing_system_usernames = _get_existing_users_by_identifier(import_type,
+            list(set(user['username'] for user in parsed_users if user['username'])))
+        existing_system_student_numbers = _get_existing_student_numbers(
+            list(set(user['student_number'] for user in parsed_users if user['student_number'])))
+
+        new_users = []  # (uuid, password, group name)
+        new_user_rows = []
+        new_third_party_user_rows = []
+
+        for user in parsed_users:
+            # validate unique identifier
+            username = user.get('username')
+            password = user.get('password') #always None for CAS/SAML import, can be None for existing users on ComPAIR import
+            student_number = user.get('student_number')
+
+            if not username:
+                invalids.append({'user': User(username=username), 'message': 'The username is required.'})
+                continue
+            elif username in import_usernames:
+                invalids.append({'user': User(username=username), 'message': 'This username already exists in the file.'})
+                continue
 
-        # validate unique identifier
-        username = user.get('username')
-        password = user.get('password') #always None for CAS/SAML import, can be None for existing users on ComPAIR import
-        student_number = user.get('student_number')
+            existing_user = existing_system_usernames.get(username, None)
+            if existing_user:
+                (existing_user_id, last_online) = existing_user
+                # overwrite password if user has not logged in yet
+                if last_online == None and not password in [None, '*']:
+                    set_user_passwords[existing_user_id] = password
+                imported_users[existing_user_id] = user.get('group')
+            else:
+                invalid_user = User(
+                    username=username,
+                    student_number=student_number,
+                    firstname=user.get('firstname'),
+                    lastname=user.get('lastname'),
+                    email=user.get('email')
+                )
+                if not third_party_import:
+                    # ComPAIR login
+                    if password in [None, '*']:
+                        invalids.append({'user': invalid_user, 'message': 'The password is required.'})
+                        continue
+                    elif len(password) < 4:
+                        invalids.append({'user': invalid_user, 'message': 'The password must be at least 4 characters long.'})
+                        continue
+
+                # validate student number (if not None)
+                if student_number:
+                    # invalid if already showed up in file
+                    if student_number in import_student_numbers:
+                        invalids.append({'user': invalid_user, 'message': 'This student number already exists in the file.'})
+                        continue
+                    # invalid if student number already exists in the system
+                    elif student_number in existing_system_student_numbers:
+                        invalids.append({'user': invalid_user, 'message': 'This student number already exists in the system.'})
+                        continue
+
+                user_uuid = new_uuid()
+                new_user_rows.append({
+                    'uuid': user_uuid,
+                    'username': None if third_party_import else username,
+                    '_password': None,
+                    'system_role': SystemRole.student,
+                    'displayname': user.get('displayname') if user.get('displayname') else display_name_generator(),
+                    'email': user.get('email'),
+                    'firstname': user.get('firstname'),
+                    'lastname': user.get('lastname'),
+                    'student_number': student_number,
+                    'created': now,
+                    'created_user_id': user_id,
+                    'modified': now,
+                    'modified_user_id': user_id
+                })
+                if third_party_import:
+                    # CAS/SAML login
+                    new_third_party_user_rows.append({
+                        'uuid': new_uuid(),
+                        'third_party_type': ThirdPartyType(import_type),
+                        'unique_identifier': username,
+                        'user_uuid': user_uuid
+                    })
+                new_users.append((user_uuid, password, user.get('group')))
+
+            import_usernames.add(username)
+            if student_number:
+                import_student_numbers.add(student_number)
+
+        if len(new_user_rows) > 0:
+            db.session.execute(User.__table__.insert(), new_user_rows)
+            new_user_ids = dict(User.query \
+                .with_entities(User.uuid, User.id) \
+                .filter(User.uuid.in_([new_user_row['uuid'] for new_user_row in new_user_rows])) \
+                .all())
+
+            if len(new_third_party_user_rows) > 0:
+                for third_party_user_row in new_third_party_user_rows:
+                    third_party_user_row.update({
+                        'user_id': new_user_ids[third_party_user_row.pop('user_uuid')],
+                        'created': now,
+                        'created_user_id': user_id,
+                        'modified': now,
+                        'modified_user_id': user_id
+                    })
+                db.session.execute(ThirdPartyUser.__table__.insert(), new_third_party_user_rows)
+
+            for (user_uuid, password, group_name) in new_users:
+                if not third_party_import:
+                    set_user_passwords[new_user_ids[user_uuid]] = password
+                imported_users[new_user_ids[user_uuid]] = group_name
+        db.session.commit()
 
-        u = existing_system_usernames.get(username, None)
+        processed += len(batch)
+        if on_progress:
+            on_progress(processed)
 
-        if not username:
-            invalids.append({'user': User(username=username), 'message': 'The username is required.'})
-            continue
-        elif username in import_usernames:
-            invalids.append({'user': User(username=username), 'message': 'This username already exists in the file.'})
-            continue
+    count = _enrol_imported_users(course, imported_users, user_id)
 
-        if u:
-            # overwrite password if user has not logged in yet
-            if u.last_online == None and not password in [None, '*']:
-                set_user_passwords.append((u, password))
-        else:
-            u = User(
-                username=None,
-                password=None,
-                student_number=user.get('student_number'),
-                firstname=user.get('firstname'),
-                lastname=user.get('lastname'),
-                email=user.get('email')
-            )
-            if import_type == ThirdPartyType.cas.value or import_type == ThirdPartyType.saml.value:
-                # CAS/SAML login
-                u.third_party_auths.append(ThirdPartyUser(
-                    unique_identifier=username,
-                    third_party_type=ThirdPartyType(import_type)
-                ))
-            else:
-                # ComPAIR login
-                u.username = username
-                if password in [None, '*']:
-                    invalids.append({'user': u, 'message': 'The password is required.'})
-                    continue
-                elif len(password) < 4:
-                    invalids.append({'user': u, 'message': 'The password must be at least 4 characters long.'})
-                    continue
-                else:
-                    set_user_passwords.append((u, password))
-
-            # validate student number (if not None)
-            if student_number:
-                # invalid if already showed up in file
-                if student_number in import_student_numbers:
-                    u.username = username
-                    invalids.append({'user': u, 'message': 'This student number already exists in the file.'})
-                    continue
-                # invalid if student number already exists in the system
-                elif student_number in existing_system_student_numbers:
-                    u.username = username
-                    invalids.append({'user': u, 'message': 'This student number already exists in the system.'})
-                    continue
-
-            u.system_role = SystemRole.student
-            u.displayname = user.get('displayname') if user.get('displayname') else display_name_generator()
-            db.session.add(u)
-
-        import_usernames.append(username)
-        if student_number:
-            import_student_numbers.append(student_number)
-        imported_users.append( (u, user.get('group')) )
-    db.session.commit()
+    # wait until user ids are generated before starting background jobs
+    # perform password update in chunks of 1000 (each chunk is hashed across PASSWORD_HASH_PROCESSES processes)
+    chunk_size = 1000
+    password_user_ids = list(set_user_passwords.keys())
+    for index in range(0, len(password_user_ids), chunk_size):
+        set_passwords.delay({
+            password_user_id: set_user_passwords[password_user_id]
+            for password_user_id in password_user_ids[index:index + chunk_size]
+        })
 
-    enroled = UserCourse.query \
-        .filter_by(course_id=course.id) \
-        .all()
+    return {
+        'success': count,
+        'invalids': marshal(invalids, dataformat.get_import_users_results(False))
+    }
 
-    enroled = {e.user_id: e for e in enroled}
+def _enrol_imported_users(course, imported_users, user_id=None):
+    """
+    Enrols imported users (dictionary of user id -> group name) as students with bulk statements.
+    Instructor and teaching assistant roles are kept and students missing from the file are dropped
+    :return: number of students enrolled
+    """
+    count = 0
+    now = datetime.datetime.utcnow()
 
-    students = UserCourse.query \
-        .filter_by(
-            course_id=course.id,
-            course_role=CourseRole.student
-        ) \
-        .all()
-    students = {s.user_id: s for s in students}
+    groups_by_name = {}
+    for group in course.groups.all():
+        groups_by_name[group.name] = group
 
+    # add new groups if needed
+    for group_name in set(imported_users.values()):
+        if group_name and group_name not in groups_by_name:
+            group = Group(
+                course=course,
+                name=group_name
+            )
+            groups_by_name[group_name] = group
+            db.session.add(group)
+    db.session.flush()
+
+    enroled = {}
+    for (user_course_id, enroled_user_id, course_role, group_id) in UserCourse.query \
+            .with_entities(UserCourse.id, UserCourse.user_id, UserCourse.course_role, UserCourse.group_id) \
+            .filter_by(course_id=course.id) \
+            .all():
+        enroled[enroled_user_id] = (user_course_id, course_role, group_id)
+
+    insert_rows = []
+    update_rows = []
     # enrol valid users in file
-    for user, group_name in imported_users:
-        enrol = enroled.get(user.id, UserCourse(course_id=course.id, user_id=user.id))
-        enrol.group = None
-        if group_name:
-            group = groups_by_name.get(group_name)
-            # add new groups if needed
-            if not group:
-                group = Group(
-                    course=course,
-                    name=group_name
-                )
-                groups_by_name[group_name] = group
-                db.session.add(group)
-            enrol.group = group
+    for (imported_user_id, group_name) in imported_users.items():
+        group_id = groups_by_name[group_name].id if group_name else None
+        enrolment = enroled.pop(imported_user_id, None)
+
+        if enrolment == None:
+            insert_rows.append({
+                'course_id': course.id,
+                'user_id': imported_user_id,
+                'course_role': CourseRole.student,
+                'group_id': group_id,
+                'created': now,
+                'created_user_id': user_id,
+                'modified': now,
+                'modified_user_id': user_id
+            })
+            count += 1
+            continue
 
+        (user_course_id, course_role, current_group_id) = enrolment
         # do not overwrite instructor or teaching assistant roles
-        if enrol.course_role not in [CourseRole.instructor, CourseRole.teaching_assistant]:
-            enrol.course_role = CourseRole.student
-            if user.id in students:
-                del students[user.id]
+        if course_role not in [CourseRole.instructor, CourseRole.teaching_assistant]:
+            course_role = CourseRole.student
             count += 1
-        db.session.add(enrol)
-
+        if course_role != enrolment[1] or group_id != current_group_id:
+            update_rows.append({
+                'user_course_id': user_course_id,
+                'course_role': course_role,
+                'group_id': group_id,
+                'modified': now,
+                'modified_user_id': user_id
+            })
+
+    # unenrol users not in file anymore (skip users that are already dropped)
+    dropped_ids = [user_course_id for (user_course_id, course_role, group_id) in enroled.values()
+        if course_role == CourseRole.student]
+
+    table = UserCourse.__table__
+    if len(insert_rows) > 0:
+        db.session.execute(table.insert(), insert_rows)
+    if len(update_rows) > 0:
+        db.session.execute(table.update().where(table.c.id == bindparam('user_course_id')), update_rows)
+    if len(dropped_ids) > 0:
+        db.session.execute(table.update()
+            .where(table.c.id.in_(dropped_ids))
+            .values(course_role=CourseRole.dropped, group_id=None, modified=now, modified_user_id=user_id))
     db.session.commit()
 
-    # unenrol users not in file anymore
-    for user_id in students:
-        enrolment = students.get(user_id)
-        # skip users that are already dropped
-        if enrolment.course_role == CourseRole.dropped:
-            continue
-        enrolment.course_role = CourseRole.dropped
-        enrolment.group_id = None
-        db.session.add(enrolment)
-    db.session.commit()
+    # core statements do not refresh enrolments already loaded in the session
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, UserCourse):
+            db.session.expire(instance)
+        elif isinstance(instance, User):
+            db.session.expire(instance, ['user_courses'])
+    invalidate_permissions()
 
-    # wait until user ids are generated before starting background jobs
-    # perform password update in chunks of 100
-    chunk_size = 100
-    chunks = [set_user_passwords[index:index + chunk_size] for index in range(0, len(set_user_passwords), chunk_size)]
-    for chunk in chunks:
-        set_passwords.delay({
-            user.id: password for (user, password) in chunk
-        })
+    return count
 
-    on_classlist_upload.send(
-        current_app._get_current_object(),
-        event_name=on_classlist_upload.name,
-        user=current_user,
-        course_id=course.id
-    )
 
+def import_job_response(job_id, job):
     return {
-        'success': count,
-        'invalids': marshal(invalids, dataformat.get_import_users_results(False))
+        'id': job_id,
+        'status': job.get('status'),
+        'processed': job.get('processed', 0),
+        'total': job.get('total'),
+        'success': job.get('success', 0),
+        'invalids': job.get('invalids', [])
     }
 
 
+def import_job_path(job_id):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'import_' + job_id + '.json')
+
+
+def load_import_job(job_id):
+    """
+    Load the status of a class list import job. Returns None for unknown or invalid job ids
+    """
+    return load_job(job_id, import_job_path)
+
+
+def save_import_job(job_id, **values):
+    """
+    Create (job_id is None) or update the status of a class list import job.
+    Job statuses are kept next to the uploaded files
+    :return: the job id
+    """
+    return save_job(job_id, import_job_path, **values)
+
+
 @api.representation('text/csv')
 def output_csv(data, code, headers=None):
     fieldnames = ['username', 'student_number', 'firstname', 'lastname', 'displayname', 'group_name']
@@ -428,7 +558,6 @@ class ClasslistRootAPI(Resource):
             abort(400, title="Class List Not Imported", message="Please select another way for students to log in and try importing again. Students are not able to use the ComPAIR logins based on the current settings.")
 
         uploaded_file = request.files['file']
-        results = {'success': 0, 'invalids': []}
 
         if not uploaded_file:
             abort(400, title="Class List Not Imported", message="No file was found to upload. Please try uploading again.")
@@ -440,29 +569,42 @@ class ClasslistRootAPI(Resource):
         tmp_name = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         uploaded_file.save(tmp_name)
         current_app.logger.debug("Importing for course " + str(course.id) + " with " + filename)
-        with open(tmp_name, 'rb') as csvfile:
-            spamreader = csv.reader(csvfile)
-            users = []
-            for row in spamreader:
-                if row:
-                    users.append(row)
-
-            if len(users) > 0:
-                results = import_users(import_type, course, users)
-
-            on_classlist_upload.send(
-                self,
-                event_name=on_classlist_upload.name,
-                user=current_user,
-                course_id=course.id)
-        os.remove(tmp_name)
-        current_app.logger.debug("Class Import for course " + str(course.id) + " is successful. Removed file.")
-        return results
+
+        # the file is imported in the background, poll the job for progress and results
+        job_id = save_import_job(None, course_id=course.id, status='pending', processed=0)
+        import_classlist.delay(job_id, course.id, import_type, tmp_name, current_user.id)
+
+        on_classlist_upload.send(
+            self,
+            event_name=on_classlist_upload.name,
+            user=current_user,
+            course_id=course.id)
+
+        return import_job_response(job_id, load_import_job(job_id))
 
 
 api.add_resource(ClasslistRootAPI, '')
 
 
+# /import/job_id
+class ClasslistImportJobAPI(Resource):
+    @login_required
+    def get(self, course_uuid, job_id):
+        course = Course.get_active_by_uuid_or_404(course_uuid)
+        require(EDIT, UserCourse(course_id=course.id),
+            title="Class List Import Unavailable",
+            message="Sorry, your role in this course does not allow you to import or otherwise change the class list.")
+
+        job = load_import_job(job_id)
+        if not job or job.get('course_id') != course.id:
+            abort(404, title="Class List Import Unavailable",
+                message="Sorry, this class list import was not found. Please try importing the file again.")
+
+        return import_job_response(job_id, job)
+
+api.add_resource(ClasslistImportJobAPI, '/import/<job_id>')
+
+
 # /user_uuid
 class EnrolAPI(Resource):
     @login_required
@@ -17,6 +17,7 @@ from compair.authorization import require, allow
 from compair.models import Answer, Comparison, Course, WinningAnswer, \
     Assignment, UserCourse, CourseRole, AssignmentCriterion, \
     AnswerComment, AnswerCommentType
+from compair.tasks import update_assignment_scores
 from .util import new_restful_api
 
 from compair.algorithms import InsufficientObjectsForPairException, \
@@ -250,18 +251,26 @@ class CompareRootAPI(Resource):
             params.get('attempt_ended', None)
         )
 
-        db.session.commit()
+        async_score_updates = completed and current_app.config.get('ASYNC_SCORE_UPDATES_ENABLED')
+        if async_score_updates:
+            comparison.score_pending = True
 
-        # update answer scores
-        if completed and not is_comparison_example:
-            current_app.logger.debug("Doing scoring")
-            Comparison.update_scores_1vs1(comparison)
-            #Comparison.calculate_scores(assignment.id)
+        db.session.commit()
 
-        # update course & assignment grade for user if comparison is completed
-        if completed:
-            assignment.calculate_grade(current_user)
-            course.calculate_grade(current_user)
+        if async_score_updates:
+            # scores & grades are updated by the worker
+            update_assignment_scores.delay(assignment.id)
+        else:
+            # update answer scores
+            if completed and not is_comparison_example:
+                current_app.logger.debug("Doing scoring")
+                Comparison.update_scores_1vs1(comparison)
+                #Comparison.calculate_scores(assignment.id)
+
+            # update course & assignment grade for user if comparison is completed
+            if completed:
+                assignment.calculate_grade(current_user)
+                course.calculate_grade(current_user)
 
         on_comparison_update.send(
             self,
@@ -1,11 +1,12 @@
 import datetime
+import os
 
 import dateutil.parser
 from bouncer.constants import MANAGE, READ, CREATE, EDIT, DELETE
 from flask import Blueprint, current_app
 from flask_restful import Resource, marshal_with, marshal, reqparse
 from flask_login import login_required, current_user
-from sqlalchemy import exc, func
+from sqlalchemy import exc, func, and_
 from six import text_type
 
 from . import dataformat
@@ -13,7 +14,8 @@ from compair.authorization import require
 from compair.core import db, event, abort
 from compair.models import Course, CourseRole, UserCourse, Answer, \
     Assignment, AssignmentCriterion, File, ComparisonExample
-from .util import pagination, new_restful_api, get_model_changes
+from .util import pagination, new_restful_api, get_model_changes, new_uuid, load_job, save_job
+from compair.tasks import duplicate_course_assignments
 
 course_api = Blueprint('course_api', __name__)
 api = new_restful_api(course_api)
@@ -40,6 +42,9 @@ duplicate_course_parser.add_argument('end_date', default=None)
 # has to add location parameter, otherwise MultiDict will screw up the list
 duplicate_course_parser.add_argument('assignments', type=list, default=[], location='json') #only ids and dates
 
+# number of assignments copied per set of bulk insert statements
+DUPLICATE_BATCH_SIZE = 50
+
 # events
 on_course_modified = event.signal('COURSE_MODIFIED')
 on_course_get = event.signal('COURSE_GET')
@@ -234,39 +239,20 @@ class CourseDuplicateAPI(Resource):
         elif start_date and end_date and start_date > end_date:
             abort(400, title="Course Not Saved", message="Course end time must be after course start time.")
 
-        assignments = [assignment for assignment in course.assignments if assignment.active]
+        assignments = Assignment.query \
+            .with_entities(Assignment.uuid, Assignment.name) \
+            .filter_by(
+                course_id=course.id,
+                active=True
+            ) \
+            .all()
         assignments_copy_data = params.get("assignments")
 
         if len(assignments) != len(assignments_copy_data):
             abort(400, title="Course Not Saved", message="The course is missing assignments. Please reload the page and try duplicating again.")
 
         for assignment_copy_data in assignments_copy_data:
-            if assignment_copy_data.get('answer_start'):
-                assignment_copy_data['answer_start'] = datetime.datetime.strptime(
-                    assignment_copy_data.get('answer_start'), '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            if assignment_copy_data.get('answer_end'):
-                assignment_copy_data['answer_end'] = datetime.datetime.strptime(
-                    assignment_copy_data.get('answer_end'), '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            if assignment_copy_data.get('compare_start'):
-                assignment_copy_data['compare_start'] = datetime.datetime.strptime(
-                    assignment_copy_data.get('compare_start'), '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            if assignment_copy_data.get('compare_end'):
-                assignment_copy_data['compare_end'] = datetime.datetime.strptime(
-                    assignment_copy_data.get('compare_end'), '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            if 'enable_self_evaluation' not in assignment_copy_data:
-                assignment_copy_data['enable_self_evaluation'] = False
-
-            if assignment_copy_data.get('self_eval_start'):
-                assignment_copy_data['self_eval_start'] = datetime.datetime.strptime(
-                    assignment_copy_data.get('self_eval_start'), '%Y-%m-%dT%H:%M:%S.%fZ')
-
-            if assignment_copy_data.get('self_eval_end'):
-                assignment_copy_data['self_eval_end'] = datetime.datetime.strptime(
-                    assignment_copy_data.get('self_eval_end'), '%Y-%m-%dT%H:%M:%S.%fZ')
+            assignment_copy_data = parse_assignment_copy_data(assignment_copy_data)
 
             valid, error_message = Assignment.validate_periods(start_date, end_date,
                 assignment_copy_data.get('answer_start'), assignment_copy_data.get('answer_end'),
@@ -276,6 +262,12 @@ class CourseDuplicateAPI(Resource):
                 error_message = error_message.replace(".", "") + " for assignment "+text_type(assignment_copy_data.get('name', ''))+"."
                 abort(400, title="Course Not Saved", message=error_message)
 
+        # this should never be missing due to the length check
+        assignment_copy_data_ids = set(assignment_copy_data.get('id') for assignment_copy_data in assignments_copy_data)
+        for (assignment_uuid, assignment_name) in assignments:
+            if assignment_uuid not in assignment_copy_data_ids:
+                abort(400, title="Course Not Saved", message="Missing information for assignment "+assignment_name+". Please try duplicating again.")
+
         # duplicate course
         duplicate_course = Course(
             name=params.get("name"),
@@ -295,98 +287,18 @@ class CourseDuplicateAPI(Resource):
         )
         db.session.add(new_user_course)
 
-        # duplicate assignments
-        for assignment in assignments:
-            # this should never be null due
-            assignment_copy_data = next((assignment_copy_data
-                for assignment_copy_data in assignments_copy_data
-                if assignment_copy_data.get('id') == assignment.uuid),
-                None
-            )
-
-            if not assignment_copy_data:
-                abort(400, title="Course Not Saved", message="Missing information for assignment "+assignment.name+". Please try duplicating again.")
-
-            duplicate_assignment = Assignment(
-                course=duplicate_course,
-                user_id=current_user.id,
-                file=assignment.file,
-                name=assignment.name,
-                description=assignment.description,
-
-                answer_start=assignment_copy_data.get('answer_start'),
-                answer_end=assignment_copy_data.get('answer_end'),
-                compare_start=assignment_copy_data.get('compare_start'),
-                compare_end=assignment_copy_data.get('compare_end'),
-
-                self_eval_start=assignment_copy_data.get('self_eval_start') if assignment_copy_data.get('enable_self_evaluation', False) else None,
-                self_eval_end=assignment_copy_data.get('self_eval_end') if assignment_copy_data.get('enable_self_evaluation', False) else None,
-                self_eval_instructions=assignment.self_eval_instructions if assignment_copy_data.get('enable_self_evaluation', False) else None,
-
-                answer_grade_weight=assignment.answer_grade_weight,
-                comparison_grade_weight=assignment.comparison_grade_weight,
-                self_evaluation_grade_weight=assignment.self_evaluation_grade_weight,
-
-                number_of_comparisons=assignment.number_of_comparisons,
-                students_can_reply=assignment.students_can_reply,
-                enable_self_evaluation=assignment_copy_data.get('enable_self_evaluation', False),
-                enable_group_answers=assignment.enable_group_answers,
-                pairing_algorithm=assignment.pairing_algorithm,
-                scoring_algorithm=assignment.scoring_algorithm,
-                peer_feedback_prompt=assignment.peer_feedback_prompt,
-                educators_can_compare=assignment.educators_can_compare,
-                rank_display_limit=assignment.rank_display_limit,
-            )
-            db.session.add(duplicate_assignment)
-
-            # duplicate assignment criteria
-            for assignment_criterion in assignment.assignment_criteria:
-                if not assignment_criterion.active:
-                    continue
-
-                duplicate_assignment_criterion = AssignmentCriterion(
-                    assignment=duplicate_assignment,
-                    criterion_id=assignment_criterion.criterion_id
-                )
-                db.session.add(duplicate_assignment_criterion)
-
-            # duplicate assignment comparisons examples
-            for comparison_example in assignment.comparison_examples:
-                answer1 = comparison_example.answer1
-                answer2 = comparison_example.answer2
-
-                # duplicate assignment comparisons example answers
-                duplicate_answer1 = Answer(
-                    assignment=duplicate_assignment,
-                    user_id=current_user.id,
-                    file=answer1.file,
-                    content=answer1.content,
-                    practice=answer1.practice,
-                    active=answer1.active,
-                    draft=answer1.draft
-                )
-                db.session.add(duplicate_answer1)
-
-                # duplicate assignment comparisons example answers
-                duplicate_answer2 = Answer(
-                    assignment=duplicate_assignment,
-                    user_id=current_user.id,
-                    file=answer2.file,
-                    content=answer2.content,
-                    practice=answer2.practice,
-                    active=answer2.active,
-                    draft=answer2.draft
-                )
-                db.session.add(duplicate_answer2)
-
-                duplicate_comparison_example = ComparisonExample(
-                    assignment=duplicate_assignment,
-                    answer1=duplicate_answer1,
-                    answer2=duplicate_answer2
-                )
-                db.session.add(duplicate_comparison_example)
-
-        db.session.commit()
+        background_threshold = current_app.config.get('COURSE_DUPLICATE_BACKGROUND_THRESHOLD', 0)
+        job_id = None
+        if background_threshold > 0 and len(assignments) >= background_threshold:
+            # large courses are copied in the background, poll the job for progress
+            db.session.commit()
+            job_id = save_duplicate_job(None, course_id=duplicate_course.id, status='pending',
+                processed=0, total=len(assignments))
+            duplicate_course_assignments.delay(job_id, course.id, duplicate_course.id,
+                assignments_copy_data, current_user.id)
+        else:
+            duplicate_assignments(course, duplicate_course, assignments_copy_data, current_user.id)
+            db.session.commit()
 
         on_course_duplicate.send(
             self,
@@ -395,6 +307,251 @@ class CourseDuplicateAPI(Resource):
             course=duplicate_course,
             data=marshal(course, dataformat.get_course()))
 
-        return marshal(duplicate_course, dataformat.get_course())
+        course_data = marshal(duplicate_course, dataformat.get_course())
+        if job_id:
+            course_data['duplicate_job'] = duplicate_job_response(job_id, load_duplicate_job(job_id))
+        return course_data
+
+api.add_resource(CourseDuplicateAPI, '/<course_uuid>/duplicate')
 
-api.add_resource(CourseDuplicateAPI, '/<course_uuid>/duplicate')
\ No newline at end of file
+# /course/:course_uuid/duplicate/:job_id
+class CourseDuplicateJobAPI(Resource):
+    @login_required
+    def get(self, course_uuid, job_id):
+        """
+        Progress of a course duplicated in the background (course_uuid is the duplicate course)
+        """
+        course = Course.get_active_by_uuid_or_404(course_uuid)
+        require(EDIT, course,
+            title="Course Duplication Unavailable",
+            message="Sorry, your role in this course does not allow you to see its duplication progress.")
+
+        job = load_duplicate_job(job_id)
+        if not job or job.get('course_id') != course.id:
+            abort(404, title="Course Duplication Unavailable",
+                message="Sorry, this course duplication was not found. Please reload the page.")
+
+        return duplicate_job_response(job_id, job)
+
+api.add_resource(CourseDuplicateJobAPI, '/<course_uuid>/duplicate/<job_id>')
+
+
+def parse_assignment_copy_data(assignment_copy_data):
+    """
+    Returns a copy of the assignment data sent to duplicate a course with its dates parsed
+    """
+    assignment_copy_data = dict(assignment_copy_data)
+
+    for date_field in ['answer_start', 'answer_end', 'compare_start', 'compare_end',
+            'self_eval_start', 'self_eval_end']:
+        if assignment_copy_data.get(date_field):
+            assignment_copy_data[date_field] = datetime.datetime.strptime(
+                assignment_copy_data.get(date_field), '%Y-%m-%dT%H:%M:%S.%fZ')
+
+    if 'enable_self_evaluation' not in assignment_copy_data:
+        assignment_copy_data['enable_self_evaluation'] = False
+
+    return assignment_copy_data
+
+
+def duplicate_assignments(course, duplicate_course, assignments_copy_data, user_id, on_progress=None):
+    """
+    Copies the active assignments of course with their active criteria and comparison examples
+    (including the example answers) into duplicate_course.
+    Source rows are read with one query per table and batch, and the copies are written with bulk
+    inserts in dependency order, DUPLICATE_BATCH_SIZE assignments at a time. Does not commit.
+    assignments_copy_data: list of the new names/dates sent by the client (see parse_assignment_copy_data)
+    on_progress(processed): called after every batch with the number of assignments copied
+    """
+    copy_data_by_uuid = {
+        assignment_copy_data.get('id'): parse_assignment_copy_data(assignment_copy_data)
+        for assignment_copy_data in assignments_copy_data
+    }
+
+    assignments = Assignment.query \
+        .filter(and_(
+            Assignment.course_id == course.id,
+            Assignment.active == True,
+            Assignment.uuid.in_(list(copy_data_by_uuid.keys()))
+        )) \
+        .order_by(Assignment.id) \
+        .all()
+
+    for index in range(0, len(assignments), DUPLICATE_BATCH_SIZE):
+        _duplicate_assignment_batch(assignments[index:index+DUPLICATE_BATCH_SIZE],
+            duplicate_course, copy_data_by_uuid, user_id)
+        if on_progress:
+            on_progress(min(index + DUPLICATE_BATCH_SIZE, len(assignments)))
+
+    # core statements are not seen by relationships already loaded in the session
+    db.session.expire(duplicate_course)
+
+
+def _duplicate_assignment_batch(assignments, duplicate_course, copy_data_by_uuid, user_id):
+    assignment_ids = [assignment.id for assignment in assignments]
+    now = datetime.datetime.utcnow()
+    tracking = {
+        'created': now,
+        'created_user_id': user_id,
+        'modified': now,
+        'modified_user_id': user_id
+    }
+
+    assignment_criteria = AssignmentCriterion.query \
+        .with_entities(AssignmentCriterion.assignment_id, AssignmentCriterion.criterion_id) \
+        .filter(and_(
+            AssignmentCriterion.assignment_id.in_(assignment_ids),
+            AssignmentCriterion.active == True
+        )) \
+        .order_by(AssignmentCriterion.assignment_id, AssignmentCriterion.position) \
+        .all()
+
+    comparison_examples = ComparisonExample.query \
+        .with_entities(ComparisonExample.assignment_id, ComparisonExample.answer1_id, ComparisonExample.answer2_id) \
+        .filter(ComparisonExample.assignment_id.in_(assignment_ids)) \
+        .order_by(ComparisonExample.id) \
+        .all()
+
+    example_answer_ids = set()
+    for (_, answer1_id, answer2_id) in comparison_examples:
+        example_answer_ids.update([answer1_id, answer2_id])
+    example_answers = {
+        answer.id: answer
+        for answer in Answer.query \
+            .with_entities(Answer.id, Answer.file_id, Answer.content, Answer.practice, Answer.active, Answer.draft) \
+            .filter(Answer.id.in_(list(example_answer_ids))) \
+            .all()
+    } if len(example_answer_ids) > 0 else {}
+
+    # assignments
+    duplicate_assignment_uuids = {}
+    assignment_rows = []
+    for assignment in assignments:
+        assignment_copy_data = copy_data_by_uuid[assignment.uuid]
+        enable_self_evaluation = assignment_copy_data.get('enable_self_evaluation', False)
+        duplicate_assignment_uuids[assignment.id] = new_uuid()
+
+        assignment_rows.append(dict(tracking,
+            uuid=duplicate_assignment_uuids[assignment.id],
+            course_id=duplicate_course.id,
+            user_id=user_id,
+            file_id=assignment.file_id,
+            name=assignment.name,
+            description=assignment.description,
+
+            answer_start=assignment_copy_data.get('answer_start'),
+            answer_end=assignment_copy_data.get('answer_end'),
+            compare_start=assignment_copy_data.get('compare_start'),
+            compare_end=assignment_copy_data.get('compare_end'),
+
+            self_eval_start=assignment_copy_data.get('self_eval_start') if enable_self_evaluation else None,
+            self_eval_end=assignment_copy_data.get('self_eval_end') if enable_self_evaluation else None,
+            self_eval_instructions=assignment.self_eval_instructions if enable_self_evaluation else None,
+
+            answer_grade_weight=assignment.answer_grade_weight,
+            comparison_grade_weight=assignment.comparison_grade_weight,
+            self_evaluation_grade_weight=assignment.self_evaluation_grade_weight,
+
+            number_of_comparisons=assignment.number_of_comparisons,
+            students_can_reply=assignment.students_can_reply,
+            enable_self_evaluation=enable_self_evaluation,
+            enable_group_answers=assignment.enable_group_answers,
+            pairing_algorithm=assignment.pairing_algorithm,
+            scoring_algorithm=assignment.scoring_algorithm,
+            peer_feedback_prompt=assignment.peer_feedback_prompt,
+            educators_can_compare=assignment.educators_can_compare,
+            rank_display_limit=assignment.rank_display_limit
+        ))
+    db.session.execute(Assignment.__table__.insert(), assignment_rows)
+
+    new_assignment_ids = dict(Assignment.query \
+        .with_entities(Assignment.uuid, Assignment.id) \
+        .filter(Assignment.uuid.in_(list(duplicate_assignment_uuids.values()))) \
+        .all())
+    duplicate_assignment_ids = {
+        assignment_id: new_assignment_ids[duplicate_uuid]
+        for assignment_id, duplicate_uuid in duplicate_assignment_uuids.items()
+    }
+
+    # assignment criteria (positions start from 0 again without the inactive criteria)
+    criterion_rows = []
+    positions = {}
+    for (assignment_id, criterion_id) in assignment_criteria:
+        position = positions.get(assignment_id, 0)
+        positions[assignment_id] = position + 1
+        criterion_rows.append(dict(tracking,
+            assignment_id=duplicate_assignment_ids[assignment_id],
+            criterion_id=criterion_id,
+            position=position
+        ))
+    if len(criterion_rows) > 0:
+        db.session.execute(AssignmentCriterion.__table__.insert(), criterion_rows)
+
+    if len(comparison_examples) == 0:
+        return
+
+    # comparison example answers (every example gets its own copy of both answers)
+    example_answer_uuids = []
+    answer_rows = []
+    for (assignment_id, answer1_id, answer2_id) in comparison_examples:
+        answer_uuids = []
+        for answer_id in [answer1_id, answer2_id]:
+            answer = example_answers[answer_id]
+            answer_uuid = new_uuid()
+            answer_uuids.append(answer_uuid)
+            answer_rows.append(dict(tracking,
+                uuid=answer_uuid,
+                assignment_id=duplicate_assignment_ids[assignment_id],
+                user_id=user_id,
+                file_id=answer.file_id,
+                content=answer.content,
+                practice=answer.practice,
+                active=answer.active,
+                draft=answer.draft
+            ))
+        example_answer_uuids.append(answer_uuids)
+    db.session.execute(Answer.__table__.insert(), answer_rows)
+
+    duplicate_answer_ids = dict(Answer.query \
+        .with_entities(Answer.uuid, Answer.id) \
+        .filter(Answer.uuid.in_([answer_row['uuid'] for answer_row in answer_rows])) \
+        .all())
+
+    example_rows = []
+    for (assignment_id, _, _), (answer1_uuid, answer2_uuid) in zip(comparison_examples, example_answer_uuids):
+        example_rows.append(dict(tracking,
+            uuid=new_uuid(),
+            assignment_id=duplicate_assignment_ids[assignment_id],
+            answer1_id=duplicate_answer_ids[answer1_uuid],
+            answer2_id=duplicate_answer_ids[answer2_uuid]
+        ))
+    db.session.execute(ComparisonExample.__table__.insert(), example_rows)
+
+
+def duplicate_job_response(job_id, job):
+    return {
+        'id': job_id,
+        'status': job.get('status'),
+        'processed': job.get('processed', 0),
+        'total': job.get('total')
+    }
+
+
+def duplicate_job_path(job_id):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'duplicate_' + job_id + '.json')
+
+
+def load_duplicate_job(job_id):
+    """
+    Load the status of a course duplication job. Returns None for unknown or invalid job ids
+    """
+    return load_job(job_id, duplicate_job_path)
+
+
+def save_duplicate_job(job_id, **values):
+    """
+    Create (job_id is None) or update the status of a course duplication job.
+    Job statuses are kept in the upload folder
+    :return: the job id
+    """
+    return save_job(job_id, duplicate_job_path, **values)
@@ -10,20 +10,21 @@ except ImportError:
 
 from bouncer.constants import MANAGE
 from flask import Blueprint, current_app, request
-from flask import url_for
 from flask_login import login_required, current_user
 
 from flask_restful import Resource, reqparse
 
 from sqlalchemy import func, and_, or_
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, contains_eager
 
 from compair.authorization import require
 from compair.core import event, abort
 from compair.models import User, CourseRole, Assignment, UserCourse, Course, Answer, \
-    AnswerComment, AssignmentCriterion, Comparison, AnswerCommentType, Group, File, KalturaMedia
+    AnswerComment, AssignmentCriterion, Comparison, AnswerCommentType, Group, File, KalturaMedia, \
+    AnswerScore, AssignmentGrade
 from compair.kaltura import KalturaAPI
-from .util import new_restful_api
+from compair.tasks import generate_report
+from .util import new_restful_api, load_job, save_job
 
 report_api = Blueprint('report_api', __name__)
 api = new_restful_api(report_api)
@@ -34,6 +35,8 @@ report_parser.add_argument('group_id')
 report_parser.add_argument('type', required=True, nullable=False)
 report_parser.add_argument('assignment')
 
+REPORT_TYPES = ["participation_stat", "participation", "peer_feedback"]
+
 # events
 on_export_report = event.signal('EXPORT_REPORT')
 # should we have a different event for each type of report?
@@ -78,72 +81,16 @@ class ReportRootAPI(Resource):
                 ) \
                 .all()
 
-        if report_type == "participation_stat":
-            data = participation_stat_report(course, assignments, group, assignment_uuid is None)
-
-            title = [
-                'Assignment', 'Last Name', 'First Name','Student Number', 'User UUID',
-                'Answer', 'Answer ID', 'Answer Deleted', 'Answer Submission Date', 'Answer Last Modified',
-                'Answer Score (Normalized)', 'Overall Rank',
-                'Comparisons Submitted', 'Comparisons Required', 'Comparison Requirements Met',
-                'Self-Evaluation Submitted', 'Feedback Submitted (During Comparisons)', 'Feedback Submitted (Outside Comparisons)']
-            titles = [title]
-
-        elif report_type == "participation":
-            user_titles = ['Last Name', 'First Name', 'Student Number']
-            data = participation_report(course, assignments, group)
-
-            title_row1 = [""] * len(user_titles)
-            title_row2 = user_titles
-
-            for assignment in assignments:
-                title_row1 += [assignment.name]
-                title_row2.append('Participation Grade')
-                title_row1 += [""]
-                title_row2.append('Answer')
-                title_row1 += [""]
-                title_row2.append('Attachment')
-                title_row1 += [""]
-                title_row2.append('Answer Score (Normalized)')
-                title_row1 += [""]
-                title_row2.append("Comparisons Submitted (" + str(assignment.total_comparisons_required) + ' required)')
-                if assignment.enable_self_evaluation:
-                    title_row1 += [""]
-                    title_row2.append("Self-Evaluation Submitted")
-                title_row1 += [""]
-                title_row2.append("Feedback Submitted (During Comparisons)")
-                title_row1 += [""]
-                title_row2.append("Feedback Submitted (Outside Comparisons)")
-            titles = [title_row1, title_row2]
-
-        elif report_type == "peer_feedback":
-            titles1 = [
-                "",
-                "Feedback Author", "", "",
-                "Answer Author", "", "",
-                "", ""
-            ]
-            titles2 = [
-                "Assignment",
-                "Last Name", "First Name", "Student Number",
-                "Last Name", "First Name", "Student Number",
-                "Feedback Type", "Feedback", "Feedback Character Count"
-            ]
-            data = peer_feedback_report(course, assignments, group)
-            titles = [titles1, titles2]
-
-        else:
+        if report_type not in REPORT_TYPES:
             abort(400, title="Report Not Run", message="Please try again with a report type from the list of report types provided.")
 
         name = name_generator(course, report_type, group)
-        tmp_name = os.path.join(current_app.config['REPORT_FOLDER'], name)
+        job_id = save_report_job(None, course_id=course.id, file=name, status='pending')
 
-        with open(tmp_name, 'wb') as report:
-            out = csv.writer(report)
-            for t in titles:
-                out.writerow(t)
-            for s in data:
-                out.writerow(s)
+        # reports are written by a celery job. the client polls ReportJobAPI until it is complete
+        generate_report.delay(job_id, course.id, report_type,
+            [assignment.id for assignment in assignments], group.id if group else None,
+            assignment_uuid is None, request.url_root)
 
         on_export_report.send(
             self,
@@ -152,17 +99,141 @@ class ReportRootAPI(Resource):
             course_id=course.id,
             data={'type': report_type, 'filename': name})
 
-        return {'file': 'report/' + name}
+        return report_job_response(job_id, load_report_job(job_id))
 
 
 api.add_resource(ReportRootAPI, '')
 
 
-def participation_stat_report(course, assignments, group, overall):
-    report = []
+class ReportJobAPI(Resource):
+    @login_required
+    def get(self, course_uuid, job_id):
+        course = Course.get_active_by_uuid_or_404(course_uuid)
+        assignment = Assignment(course_id=course.id)
+        require(MANAGE, assignment,
+            title="Report Unavailable",
+            message="Sorry, your system role does not allow you to view reports.")
+
+        job = load_report_job(job_id)
+        if not job or job.get('course_id') != course.id:
+            abort(404, title="Report Unavailable",
+                message="Sorry, this report was not found. Please try running the report again.")
+
+        return report_job_response(job_id, job)
+
+
+api.add_resource(ReportJobAPI, '/<job_id>')
+
+
+def report_job_response(job_id, job):
+    return {
+        'id': job_id,
+        'status': job.get('status'),
+        'file': 'report/' + job.get('file') if job.get('status') == 'complete' else None
+    }
+
+
+def report_job_path(job_id):
+    return os.path.join(current_app.config['REPORT_FOLDER'], job_id + '.json')
+
+
+def load_report_job(job_id):
+    """
+    Load the status of a report job. Returns None for unknown or invalid job ids
+    """
+    return load_job(job_id, report_job_path)
+
+
+def save_report_job(job_id, **values):
+    """
+    Create (job_id is None) or update the status of a report job.
+    Job statuses are kept next to the reports
+    :return: the job id
+    """
+    return save_job(job_id, report_job_path, **values)
+
+
+def report_titles(report_type, assignments):
+    if report_type == "participation_stat":
+        title = [
+            'Assignment', 'Last Name', 'First Name','Student Number', 'User UUID',
+            'Answer', 'Answer ID', 'Answer Deleted', 'Answer Submission Date', 'Answer Last Modified',
+            'Answer Score (Normalized)', 'Overall Rank',
+            'Comparisons Submitted', 'Comparisons Required', 'Comparison Requirements Met',
+            'Self-Evaluation Submitted', 'Feedback Submitted (During Comparisons)', 'Feedback Submitted (Outside Comparisons)']
+        return [title]
+
+    elif report_type == "participation":
+        user_titles = ['Last Name', 'First Name', 'Student Number']
+
+        title_row1 = [""] * len(user_titles)
+        title_row2 = user_titles
+
+        for assignment in assignments:
+            title_row1 += [assignment.name]
+            title_row2.append('Participation Grade')
+            title_row1 += [""]
+            title_row2.append('Answer')
+            title_row1 += [""]
+            title_row2.append('Attachment')
+            title_row1 += [""]
+            title_row2.append('Answer Score (Normalized)')
+            title_row1 += [""]
+            title_row2.append("Comparisons Submitted (" + str(assignment.total_comparisons_required) + ' required)')
+            if assignment.enable_self_evaluation:
+                title_row1 += [""]
+                title_row2.append("Self-Evaluation Submitted")
+            title_row1 += [""]
+            title_row2.append("Feedback Submitted (During Comparisons)")
+            title_row1 += [""]
+            title_row2.append("Feedback Submitted (Outside Comparisons)")
+        return [title_row1, title_row2]
+
+    elif report_type == "peer_feedback":
+        titles1 = [
+            "",
+            "Feedback Author", "", "",
+            "Answer Author", "", "",
+            "", ""
+        ]
+        titles2 = [
+            "Assignment",
+            "Last Name", "First Name", "Student Number",
+            "Last Name", "First Name", "Student Number",
+            "Feedback Type", "Feedback", "Feedback Character Count"
+        ]
+        return [titles1, titles2]
+
+
+def report_rows(report_type, course, assignments, group, overall, base_url):
+    if report_type == "participation_stat":
+        return participation_stat_report(course, assignments, group, overall)
+    elif report_type == "participation":
+        return participation_report(course, assignments, group, base_url)
+    elif report_type == "peer_feedback":
+        return peer_feedback_report(course, assignments, group)
+
+
+def write_report(name, report_type, course, assignments, group, overall, base_url):
+    """
+    Stream the report into REPORT_FOLDER. Rows are written as they are generated and the
+    file only appears under its name once complete
+    """
+    file_path = os.path.join(current_app.config['REPORT_FOLDER'], name)
+
+    with open(file_path + '.part', 'wb') as report:
+        out = csv.writer(report)
+        for title in report_titles(report_type, assignments):
+            out.writerow(title)
+        for row in report_rows(report_type, course, assignments, group, overall, base_url):
+            out.writerow(row)
+    os.rename(file_path + '.part', file_path)
+
 
+def participation_stat_report(course, assignments, group, overall):
     query = UserCourse.query \
         .join(User, User.id == UserCourse.user_id) \
+        .options(contains_eager(UserCourse.user)) \
         .filter(and_(
             UserCourse.course_id == course.id,
             UserCourse.course_role != CourseRole.dropped
@@ -172,7 +243,7 @@ def participation_stat_report(course, assignments, group, overall):
     classlist = query.order_by(User.lastname, User.firstname, User.id).all()
 
     assignment_ids = [assignment.id for assignment in assignments]
-    class_ids = [u.user.id for u in classlist]
+    class_ids = [u.user_id for u in classlist]
 
     group_ids = [g.id for g in course.groups.all() if g.active]
     group_users = {}
@@ -180,57 +251,74 @@ def participation_stat_report(course, assignments, group, overall):
         if user_course.group_id:
             group_users.setdefault(user_course.group_id, []).append(user_course.user_id)
 
+    # ANSWERS: instructors / TAs could submit multiple answers. normally 1 answer per student
+    answers = Answer.query \
+        .outerjoin(AnswerScore, AnswerScore.answer_id == Answer.id) \
+        .with_entities(
+            Answer.assignment_id, Answer.user_id, Answer.group_id, Answer.uuid, Answer.active,
+            Answer.content, Answer.submission_date, Answer.modified,
+            AnswerScore.score, AnswerScore.normalized_score
+        ) \
+        .filter(and_(
+            Answer.assignment_id.in_(assignment_ids),
+            Answer.comparable == True,
+            Answer.draft == False,
+            Answer.practice == False,
+            or_(
+                Answer.user_id.in_(class_ids),
+                Answer.group_id.in_(group_ids)
+            )
+        )) \
+        .order_by(Answer.submission_date) \
+        .all()
+
+    user_answers = {}   # structure - assignment_id/user_id/[answer list]
+    for answer in answers:
+        user_ids = group_users.get(answer.group_id, []) if answer.group_id != None else [answer.user_id]
+        for user_id in user_ids:
+            user_answers.setdefault(answer.assignment_id, {}).setdefault(user_id, []).append(answer)
+
+    # RANKS: scores of active answers for every assignment
+    rankings = AnswerScore.get_assignment_rankings(assignment_ids)
+
+    def answer_rank_and_score(answer):
+        if answer.score == None:
+            return ('Not Evaluated', 'Not Evaluated')
+        return (
+            AnswerScore.get_rank_for_score(rankings.get(answer.assignment_id, []), answer.score),
+            # all answers have the same score
+            round_score(answer.normalized_score) if answer.normalized_score != None else 'Not Evaluated'
+        )
+
+    # EVALUATIONS
+    evaluations = Comparison.query \
+        .with_entities(Comparison.assignment_id, Comparison.user_id, func.count(Comparison.id)) \
+        .filter(and_(
+            Comparison.assignment_id.in_(assignment_ids),
+            Comparison.completed == True
+        )) \
+        .group_by(Comparison.assignment_id, Comparison.user_id) \
+        .all()
+    evaluation_submitted = {(assignment_id, user_id): int(count) for (assignment_id, user_id, count) in evaluations}
+
+    # COMMENTS
+    comments = AnswerComment.query \
+        .join(Answer) \
+        .filter(Answer.assignment_id.in_(assignment_ids)) \
+        .filter(AnswerComment.draft == False) \
+        .filter(AnswerComment.active == True) \
+        .with_entities(Answer.assignment_id, AnswerComment.user_id, AnswerComment.comment_type, func.count(AnswerComment.id)) \
+        .group_by(Answer.assignment_id, AnswerComment.user_id, AnswerComment.comment_type) \
+        .all()
+    comment_counts = {} # structure - (assignment_id, user_id)/comment_type/count
+    for (assignment_id, user_id, comment_type, count) in comments:
+        comment_counts.setdefault((assignment_id, user_id), {})[comment_type] = count
+
     total_req = 0
     total = {}
 
     for assignment in assignments:
-        # ANSWERS: instructors / TAs could submit multiple answers. normally 1 answer per student
-        answers = Answer.query \
-            .options(joinedload('score')) \
-            .filter(and_(
-                Answer.assignment_id == assignment.id,
-                Answer.comparable == True,
-                Answer.draft == False,
-                Answer.practice == False,
-                or_(
-                    Answer.user_id.in_(class_ids),
-                    Answer.group_id.in_(group_ids)
-                )
-            )) \
-            .order_by(Answer.submission_date) \
-            .all()
-
-        user_answers = {}   # structure - user_id/[answer list]
-        for answer in answers:
-            user_ids = group_users.get(answer.group_id, []) if answer.group_answer else [answer.user_id]
-            for user_id in user_ids:
-                user_answers.setdefault(user_id, []).append(answer)
-
-        # EVALUATIONS
-        evaluations = Comparison.query \
-            .with_entities(Comparison.user_id, func.count(Comparison.id)) \
-            .filter_by(
-                assignment_id=assignment.id,
-                completed=True
-            ) \
-            .group_by(Comparison.user_id) \
-            .all()
-        evaluation_submitted = {user_id: int(count) for (user_id, count) in evaluations}
-
-        # COMMENTS
-        comments = AnswerComment.query \
-            .join(Answer) \
-            .filter(Answer.assignment_id == assignment.id) \
-            .filter(AnswerComment.draft == False) \
-            .filter(AnswerComment.active == True) \
-            .with_entities(AnswerComment.user_id, AnswerComment.comment_type, func.count(AnswerComment.id)) \
-            .group_by(AnswerComment.user_id, AnswerComment.comment_type) \
-            .all()
-        comments_self_eval = {user_id: count for (user_id, comment_type, count) in comments if comment_type == AnswerCommentType.self_evaluation}
-        comments_during_comparison = {user_id: count for (user_id, comment_type, count) in comments if comment_type == AnswerCommentType.evaluation}
-        comments_private = {user_id: count for (user_id, comment_type, count) in comments if comment_type == AnswerCommentType.private}
-        comments_public = {user_id: count for (user_id, comment_type, count) in comments if comment_type == AnswerCommentType.public}
-
+        assignment_answers = user_answers.get(assignment.id, {})
         total_req += assignment.total_comparisons_required  # for overall required
 
         for user_course in classlist:
@@ -247,8 +335,8 @@ def participation_stat_report(course, assignments, group, overall):
             })
 
             # each user has at least 1 line per assignment, regardless whether there is an answer
-            active_answer_list = [ans for ans in user_answers.get(user.id, []) if ans.active]
-            deleted_answer_list = [ans for ans in user_answers.get(user.id, []) if not ans.active]
+            active_answer_list = [ans for ans in assignment_answers.get(user.id, []) if ans.active]
+            deleted_answer_list = [ans for ans in assignment_answers.get(user.id, []) if not ans.active]
             submitted = len(active_answer_list)
             deleted_count = len(deleted_answer_list)
             the_answer = active_answer_list[0] if submitted else None
@@ -257,59 +345,40 @@ def participation_stat_report(course, assignments, group, overall):
             answer_submission_date = datetime_to_string(the_answer.submission_date) if submitted else 'N/A'
             answer_last_modified = datetime_to_string(the_answer.modified) if submitted else 'N/A'
             answer_text = snippet(the_answer.content) if submitted else 'N/A'
-            answer_rank = the_answer.score.rank if submitted and the_answer.score else 'Not Evaluated'
-            answer_score = round_score(the_answer.score.normalized_score) if submitted and the_answer.score else 'Not Evaluated'
+            (answer_rank, answer_score) = answer_rank_and_score(the_answer) if submitted else ('Not Evaluated', 'Not Evaluated')
             total[user.id]['total_answers'] += submitted
             temp.extend([answer_text, answer_uuid, is_deleted, answer_submission_date, answer_last_modified, answer_score, answer_rank])
 
-            evaluations = evaluation_submitted.get(user.id, 0)
+            evaluations = evaluation_submitted.get((assignment.id, user.id), 0)
             evaluation_req_met = 'Yes' if evaluations >= assignment.total_comparisons_required else 'No'
             total[user.id]['total_evaluations'] += evaluations
             temp.extend([evaluations, assignment.total_comparisons_required, evaluation_req_met])
 
-            comment_self_eval_count = comments_self_eval.get(user.id, 0)
-            comment_during_comparison_count = comments_during_comparison.get(user.id, 0)
-            comment_outside_comparison_count = comments_private.get(user.id, 0) + comments_public.get(user.id, 0)
+            user_comment_counts = comment_counts.get((assignment.id, user.id), {})
+            comment_self_eval_count = user_comment_counts.get(AnswerCommentType.self_evaluation, 0)
+            comment_during_comparison_count = user_comment_counts.get(AnswerCommentType.evaluation, 0)
+            comment_outside_comparison_count = user_comment_counts.get(AnswerCommentType.private, 0) + \
+                user_comment_counts.get(AnswerCommentType.public, 0)
             total[user.id]['total_comments_self_eval'] += comment_self_eval_count
             total[user.id]['total_comments_during_comparison'] += comment_during_comparison_count
             total[user.id]['total_comments_outside_comparison'] += comment_outside_comparison_count
             temp.extend([comment_self_eval_count, comment_during_comparison_count, comment_outside_comparison_count])
 
-            report.append(temp)
+            yield temp
 
             # handle multiple answers from the user (normally only apply for instructors / TAs)
-            if submitted > 1:
-                for answer in active_answer_list[1:]:
-                    answer_uuid = answer.uuid
-                    answer_submission_date = datetime_to_string(answer.submission_date)
-                    answer_last_modified = datetime_to_string(answer.modified)
-                    answer_text = snippet(answer.content)
-                    answer_rank = answer.score.rank if submitted and answer.score else 'Not Evaluated'
-                    answer_score = round_score(answer.score.normalized_score) if submitted and answer.score else 'Not Evaluated'
-                    temp = [assignment.name, user.lastname, user.firstname, user.student_number, user.uuid,
-                        answer_text, answer_uuid, 'N', answer_submission_date, answer_last_modified,
-                        answer_score, answer_rank,
-                        evaluations, assignment.total_comparisons_required,
-                        evaluation_req_met, comment_self_eval_count, comment_during_comparison_count, comment_outside_comparison_count]
-
-                    report.append(temp)
-
-            # add deleted answers, if any
-            if deleted_count > 0:
-                for answer in deleted_answer_list:
-                    answer_uuid = answer.uuid
-                    answer_submission_date = datetime_to_string(answer.submission_date)
-                    answer_last_modified = datetime_to_string(answer.modified)
-                    answer_text = snippet(answer.content)
-                    answer_rank = answer.score.rank if answer.score else 'Not Evaluated'
-                    answer_score = round_score(answer.score.normalized_score) if answer.score else 'Not Evaluated'
-                    temp = [assignment.name, user.lastname, user.firstname, user.student_number, user.uuid,
-                        answer_text, answer_uuid, 'Y', answer_submission_date, answer_last_modified,
-                        answer_score, answer_rank,
-                        evaluations, assignment.total_comparisons_required,
-                        evaluation_req_met, comment_self_eval_count, comment_during_comparison_count, comment_outside_comparison_count]
-
-                    report.append(temp)
+            # and add deleted answers, if any
+            for (answer, is_deleted) in [(ans, 'N') for ans in active_answer_list[1:]] + \
+                    [(ans, 'Y') for ans in deleted_answer_list]:
+                (answer_rank, answer_score) = answer_rank_and_score(answer)
+                temp = [assignment.name, user.lastname, user.firstname, user.student_number, user.uuid,
+                    snippet(answer.content), answer.uuid, is_deleted,
+                    datetime_to_string(answer.submission_date), datetime_to_string(answer.modified),
+                    answer_score, answer_rank,
+                    evaluations, assignment.total_comparisons_required,
+                    evaluation_req_met, comment_self_eval_count, comment_during_comparison_count, comment_outside_comparison_count]
+
+                yield temp
 
     if overall:
         for user_course_student in classlist:
@@ -328,15 +397,13 @@ def participation_stat_report(course, assignments, group, overall):
                 sum_submission['total_answers'], '', '', '', '', '', '',
                 sum_submission['total_evaluations'], total_req, req_met, sum_submission['total_comments_self_eval'],
                 sum_submission['total_comments_during_comparison'], sum_submission['total_comments_outside_comparison']]
-            report.append(temp)
-    return report
-
+            yield temp
 
-def participation_report(course, assignments, group):
-    report = []
 
+def participation_report(course, assignments, group, base_url):
     query = UserCourse.query \
         .join(User, User.id == UserCourse.user_id) \
+        .options(contains_eager(UserCourse.user)) \
         .filter(and_(
             UserCourse.course_id == course.id,
             UserCourse.course_role == CourseRole.student
@@ -357,7 +424,6 @@ def participation_report(course, assignments, group):
     answers = Answer.query \
         .options(joinedload('file')) \
         .options(joinedload('score')) \
-        .options(joinedload('criteria_scores')) \
         .filter(and_(
             Answer.assignment_id.in_(assignment_ids),
             Answer.draft == False,
@@ -371,7 +437,6 @@ def participation_report(course, assignments, group):
         .all()
 
     scores = {} # structure - user_id/assignment_id/normalized_score
-    criteria_scores = {} # structure - user_id/assignment_id/criterion_id/normalized_score
     answer_count = {} # structure - user_id/assignment_id/[answers]
     answer_attachment = {} # structure - user_id/assignment_id/[File]
     for answer in answers:
@@ -381,12 +446,6 @@ def participation_report(course, assignments, group):
             user_object = scores.setdefault(user_id, {})
             user_object.setdefault(answer.assignment_id, answer.score.normalized_score if answer.score else None)
 
-            # set criteria_scores
-            user_object = criteria_scores.setdefault(user_id, {})
-            assignment_object = user_object.setdefault(answer.assignment_id, {})
-            for s in answer.criteria_scores:
-                assignment_object[s.criterion_id] = s.normalized_score
-
             # set answer_count
             user_object = answer_count.setdefault(user_id, {})
             assignment_list = user_object.setdefault(answer.assignment_id, [])
@@ -412,41 +471,38 @@ def participation_report(course, assignments, group):
     for (assignment_id, user_id, count) in comparisons_counts:
         comparisons.setdefault(user_id, {}).setdefault(assignment_id, count)
 
-    # CRITERIA
-    assignment_criteria = AssignmentCriterion.query \
-        .filter(AssignmentCriterion.assignment_id.in_(assignment_ids)) \
-        .filter_by(active=True) \
-        .order_by(AssignmentCriterion.position) \
+    # COMMENTS
+    comments = AnswerComment.query \
+        .join(Answer) \
+        .filter(Answer.assignment_id.in_(assignment_ids)) \
+        .filter(AnswerComment.user_id.in_(class_ids)) \
+        .filter(AnswerComment.draft == False) \
+        .filter(AnswerComment.active == True) \
+        .with_entities(Answer.assignment_id, AnswerComment.user_id, AnswerComment.comment_type, func.count(AnswerComment.id)) \
+        .group_by(Answer.assignment_id, AnswerComment.user_id, AnswerComment.comment_type) \
         .all()
 
-    criteria = {}  # structure - assignment_id/criterion_id
-    for assignment_criterion in assignment_criteria:
-        criteria.setdefault(assignment_criterion.assignment_id, [])
-        criteria[assignment_criterion.assignment_id] \
-            .append(assignment_criterion.criterion_id)
+    comment_counts = {} # structure - user_id/assignment_id/comment_type/count
+    for (assignment_id, user_id, comment_type, count) in comments:
+        comment_counts.setdefault(user_id, {}).setdefault(assignment_id, {})[comment_type] = count
+
+    # GRADES
+    grades = AssignmentGrade.query \
+        .with_entities(AssignmentGrade.assignment_id, AssignmentGrade.user_id, AssignmentGrade.grade) \
+        .filter(AssignmentGrade.assignment_id.in_(assignment_ids)) \
+        .all()
 
     user_grades = {} # structure - user_id/assignment_id/grade
-    for assignment in assignments:
-        for grade in assignment.grades:
-            user_object = user_grades.setdefault(grade.user_id, {})
-            user_object[grade.assignment_id] = round_grade(grade.grade * 100)
+    for (assignment_id, user_id, grade) in grades:
+        user_object = user_grades.setdefault(user_id, {})
+        user_object[assignment_id] = round_grade(grade * 100)
 
     for user_courses in classlist:
         user = user_courses.user
         temp = [user.lastname, user.firstname, user.student_number]
 
         for assignment in assignments:
-            # COMMENTS
-            comments = AnswerComment.query \
-                .join(Answer) \
-                .filter(Answer.assignment_id == assignment.id) \
-                .filter(AnswerComment.user_id == user.id) \
-                .filter(AnswerComment.draft == False) \
-                .filter(AnswerComment.active == True) \
-                .with_entities(AnswerComment.comment_type, func.count(AnswerComment.id)) \
-                .group_by(AnswerComment.comment_type) \
-                .all()
-            comments_counts = {comment_type: count for (comment_type, count) in comments}
+            comments_counts = comment_counts.get(user.id, {}).get(assignment.id, {})
             comments_self_eval = comments_counts.get(AnswerCommentType.self_evaluation, 0)
             comments_during_comparison = comments_counts.get(AnswerCommentType.evaluation, 0)
             comments_outside_comparison = comments_counts.get(AnswerCommentType.public, 0) + comments_counts.get(AnswerCommentType.private, 0)
@@ -454,7 +510,7 @@ def participation_report(course, assignments, group):
             temp.append(user_grades.get(user.id, {}).get(assignment.id, ""))
             temp.append('\n\n'.join(answer_count.get(user.id, {}).get(assignment.id, [])))
             temp.append('\n\n'.join( \
-                [generate_hyperlink_for_excel(attachment_url(f)) for f in answer_attachment.get(user.id, {}).get(assignment.id, [])] \
+                [generate_hyperlink_for_excel(attachment_url(f, base_url)) for f in answer_attachment.get(user.id, {}).get(assignment.id, [])] \
                 ))
             if user.id not in scores or assignment.id not in scores[user.id]:
                 score = 'No Answer'
@@ -476,12 +532,9 @@ def participation_report(course, assignments, group):
             temp.append(comments_during_comparison)
             temp.append(comments_outside_comparison)
 
-        report.append(temp)
-
-    return report
+        yield temp
 
 def peer_feedback_report(course, assignments, group):
-    report = []
 
     senders = User.query \
         .join("user_courses") \
@@ -521,10 +574,14 @@ def peer_feedback_report(course, assignments, group):
         .order_by(AnswerComment.created) \
         .all()
 
+    # group feedback by assignment and sender in one pass (keeps created order within each group)
+    sent_feedback = {} # structure - (assignment_id, sender_user_id)/[feedback]
+    for answer_comment in answer_comments:
+        sent_feedback.setdefault((answer_comment.assignment_id, answer_comment.sender_user_id), []).append(answer_comment)
+
     for assignment in assignments:
         for user in senders:
-            user_sent_feedback = [ac for ac in answer_comments  \
-                if ac.sender_user_id == user.id and ac.assignment_id == assignment.id]
+            user_sent_feedback = sent_feedback.get((assignment.id, user.id), [])
 
             if len(user_sent_feedback) > 0:
                 for feedback in user_sent_feedback:
@@ -552,7 +609,7 @@ def peer_feedback_report(course, assignments, group):
                         escape_leading_symbols_for_excel(plain_feedback_content), \
                         len(plain_feedback_content)]
 
-                    report.append(temp)
+                    yield temp
 
             else:
                 # enter blank row
@@ -562,9 +619,7 @@ def peer_feedback_report(course, assignments, group):
                     "---", "---", "---",
                     "", ""
                 ]
-                report.append(temp)
-
-    return report
+                yield temp
 
 
 def strip_html(text):
@@ -626,13 +681,14 @@ def round_grade(grade, ndigits=0):
     """
     return round(grade, ndigits)
 
-def attachment_url(file):
+def attachment_url(file, base_url):
     """
-    Generate url from attachment File
+    Generate url from attachment File. Reports are generated outside of requests so
+    base_url (the url root of the request that ran the report) is used instead of url_for
     """
     if not file:
         return ''
-    return url_for('file_retrieve', file_type='attachment', file_name=file.name, _external=True)
+    return base_url.rstrip('/') + '/app/attachment/' + file.name
 
 def datetime_to_string(datetime):
     if not datetime:
@@ -7,7 +7,7 @@ from bouncer.constants import MANAGE, EDIT, CREATE, READ
 from flask_restful import Resource, marshal
 from flask_restful.reqparse import RequestParser
 from flask_login import login_required, current_user
-from sqlalchemy.orm import load_only, joinedload
+from sqlalchemy.orm import load_only, joinedload, undefer
 from sqlalchemy import exc, asc, or_, and_, func, desc, asc
 from six import text_type
 
@@ -19,6 +19,8 @@ from compair.models import User, SystemRole, Course, UserCourse, CourseRole, Ass
     LTIConsumer, LTIUser, LTIUserResourceLink, LTIContext, ThirdPartyUser, ThirdPartyType, \
     Answer, Comparison, AnswerComment, AnswerCommentType, EmailNotificationMethod
 from compair.api.login import authenticate
+from .assignment import get_assignment_status_version, get_cached_assignment_statuses, \
+    set_cached_assignment_statuses
 from distutils.util import strtobool
 
 user_api = Blueprint('user_api', __name__)
@@ -535,81 +537,30 @@ class UserCourseStatusListAPI(Resource):
                 message="Sorry, you are not enrolled in one or more of the selected users' courses yet. Course status is not available until your are enrolled in the course.")
 
         statuses = {}
+        student_course_groups = {}
 
         for course, course_role, group_id in results:
-            incomplete_assignment_ids = set()
+            statuses[course.uuid] = {
+                'incomplete_assignments': 0
+            }
             if not allow(MANAGE, Course) and course_role == CourseRole.student:
-                answer_period_assignments = [assignment for assignment in course.assignments if assignment.active and assignment.answer_period]
-                compare_period_assignments = [assignment for assignment in course.assignments if assignment.active and assignment.compare_period]
-
-                if len(answer_period_assignments) > 0:
-                    answer_period_assignment_ids = [assignment.id for assignment in answer_period_assignments]
-                    answers = Answer.query \
-                        .filter(and_(
-                            or_(
-                                and_(Answer.group_id == group_id, Answer.group_id != None),
-                                Answer.user_id == current_user.id,
-                            ),
-                            Answer.assignment_id.in_(answer_period_assignment_ids),
-                            Answer.active == True,
-                            Answer.practice == False,
-                            Answer.draft == False
-                        ))
-                    for assignment in answer_period_assignments:
-                        answer = next(
-                            (answer for answer in answers if answer.assignment_id == assignment.id),
-                            None
-                        )
-                        if answer is None:
-                            incomplete_assignment_ids.add(assignment.id)
-
-                if len(compare_period_assignments) > 0:
-                    compare_period_assignment_ids = [assignment.id for assignment in compare_period_assignments]
-                    comparisons = Comparison.query \
-                        .filter(and_(
-                            Comparison.user_id == current_user.id,
-                            Comparison.assignment_id.in_(compare_period_assignment_ids),
-                            Comparison.completed == True
-                        ))
-
-                    self_evaluations = AnswerComment.query \
-                        .join("answer") \
-                        .with_entities(
-                            Answer.assignment_id,
-                            func.count(Answer.assignment_id).label('self_evaluation_count')
-                        ) \
-                        .filter(and_(
-                            or_(
-                                and_(Answer.group_id == group_id, Answer.group_id != None),
-                                Answer.user_id == current_user.id,
-                            ),
-                            AnswerComment.active == True,
-                            AnswerComment.comment_type == AnswerCommentType.self_evaluation,
-                            AnswerComment.draft == False,
-                            Answer.active == True,
-                            Answer.practice == False,
-                            Answer.draft == False,
-                            Answer.assignment_id.in_(compare_period_assignment_ids)
-                        )) \
-                        .group_by(Answer.assignment_id) \
-                        .all()
-
-                    for assignment in compare_period_assignments:
-                        assignment_comparisons = [comparison for comparison in comparisons if comparison.assignment_id == assignment.id]
-                        if len(assignment_comparisons) < assignment.total_comparisons_required:
-                            incomplete_assignment_ids.add(assignment.id)
+                cached = get_cached_assignment_statuses(current_user.id, course.id, 'course')
+                if cached != None:
+                    statuses[course.uuid] = cached
+                else:
+                    student_course_groups[course.id] = group_id
 
-                        if assignment.enable_self_evaluation:
-                            self_evaluation_count = next(
-                                (result.self_evaluation_count for result in self_evaluations if result.assignment_id == assignment.id),
-                                0
-                            )
-                            if self_evaluation_count == 0:
-                                incomplete_assignment_ids.add(assignment.id)
+        if len(student_course_groups) > 0:
+            course_uuids_by_id = { course.id: course.uuid for course, _, _ in results }
+            versions = { course_id: get_assignment_status_version(course_id) for course_id in student_course_groups.keys() }
+            incomplete_assignment_counts = _get_incomplete_assignment_counts(student_course_groups)
 
-            statuses[course.uuid] = {
-                'incomplete_assignments': len(incomplete_assignment_ids)
-            }
+            for course_id in student_course_groups.keys():
+                course_status = {
+                    'incomplete_assignments': incomplete_assignment_counts.get(course_id, 0)
+                }
+                statuses[course_uuids_by_id[course_id]] = course_status
+                set_cached_assignment_statuses(current_user.id, course_id, versions[course_id], course_status, 'course')
 
         on_user_course_status_get.send(
             self,
@@ -619,6 +570,99 @@ class UserCourseStatusListAPI(Resource):
 
         return {"statuses": statuses}
 
+def _get_incomplete_assignment_counts(course_groups):
+    """
+    Counts the assignments of the current student that still need an answer, comparisons or a
+    self-evaluation in every course with one query per step (grouped by assignment_id).
+    course_groups: dictionary course_id -> group_id of the current user (or None)
+    :return: dictionary course_id -> number of incomplete assignments
+    """
+    course_ids = list(course_groups.keys())
+    group_ids = [group_id for group_id in course_groups.values() if group_id != None]
+
+    # answers of the user or of the user's groups
+    answer_owner_filter = Answer.user_id == current_user.id
+    if len(group_ids) > 0:
+        answer_owner_filter = or_(answer_owner_filter, Answer.group_id.in_(group_ids))
+
+    assignments = Assignment.query \
+        .options(undefer('comparison_example_count')) \
+        .filter(and_(
+            Assignment.course_id.in_(course_ids),
+            Assignment.active == True
+        )) \
+        .all()
+
+    answer_period_assignment_ids = [assignment.id for assignment in assignments if assignment.answer_period]
+    compare_period_assignments = [assignment for assignment in assignments if assignment.compare_period]
+    compare_period_assignment_ids = [assignment.id for assignment in compare_period_assignments]
+    self_evaluation_assignment_ids = [assignment.id for assignment in compare_period_assignments
+        if assignment.enable_self_evaluation]
+
+    answered_assignment_ids = set()
+    if len(answer_period_assignment_ids) > 0:
+        answered_assignment_ids = set(assignment_id for (assignment_id, ) in Answer.query \
+            .with_entities(Answer.assignment_id) \
+            .filter(and_(
+                answer_owner_filter,
+                Answer.assignment_id.in_(answer_period_assignment_ids),
+                Answer.active == True,
+                Answer.practice == False,
+                Answer.draft == False
+            )) \
+            .distinct() \
+            .all())
+
+    comparison_counts = {}
+    if len(compare_period_assignment_ids) > 0:
+        comparison_counts = dict(Comparison.query \
+            .with_entities(
+                Comparison.assignment_id,
+                func.count(Comparison.assignment_id)
+            ) \
+            .filter(and_(
+                Comparison.user_id == current_user.id,
+                Comparison.assignment_id.in_(compare_period_assignment_ids),
+                Comparison.completed == True
+            )) \
+            .group_by(Comparison.assignment_id) \
+            .all())
+
+    self_evaluated_assignment_ids = set()
+    if len(self_evaluation_assignment_ids) > 0:
+        self_evaluated_assignment_ids = set(assignment_id for (assignment_id, ) in AnswerComment.query \
+            .join("answer") \
+            .with_entities(Answer.assignment_id) \
+            .filter(and_(
+                answer_owner_filter,
+                AnswerComment.active == True,
+                AnswerComment.comment_type == AnswerCommentType.self_evaluation,
+                AnswerComment.draft == False,
+                Answer.active == True,
+                Answer.practice == False,
+                Answer.draft == False,
+                Answer.assignment_id.in_(self_evaluation_assignment_ids)
+            )) \
+            .distinct() \
+            .all())
+
+    incomplete_assignment_counts = {}
+    for assignment in assignments:
+        incomplete = False
+        if assignment.answer_period and assignment.id not in answered_assignment_ids:
+            incomplete = True
+        if assignment.compare_period:
+            if comparison_counts.get(assignment.id, 0) < assignment.total_comparisons_required:
+                incomplete = True
+            if assignment.enable_self_evaluation and assignment.id not in self_evaluated_assignment_ids:
+                incomplete = True
+
+        if incomplete:
+            incomplete_assignment_counts[assignment.course_id] = \
+                incomplete_assignment_counts.get(assignment.course_id, 0) + 1
+
+    return incomplete_assignment_counts
+
 # /id/lti/users
 class UserLTIListAPI(Resource):
     @login_required
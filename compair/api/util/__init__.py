@@ -1,7 +1,12 @@
+import base64
 import cProfile
 import contextlib
 from functools import wraps
+import json
+import os
 import pstats
+import re
+import uuid
 from enum import Enum
 from flask_restful.reqparse import RequestParser
 
@@ -121,6 +126,50 @@ def get_model_changes(model):
 
     return changes
 
+JOB_ID_REGEX = re.compile(r'^[A-Za-z0-9_-]{22}$')
+
+
+def new_uuid():
+    return base64.urlsafe_b64encode(uuid.uuid4().bytes).decode('ascii').replace('=', '')
+
+
+def load_job(job_id, job_path):
+    """
+    Load the status of a background job from the json file at job_path(job_id).
+    Returns None for unknown or invalid job ids
+    """
+    if not job_id or not JOB_ID_REGEX.match(job_id):
+        return None
+
+    path = job_path(job_id)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, 'r') as job_file:
+        return json.load(job_file)
+
+
+def save_job(job_id, job_path, **values):
+    """
+    Create (job_id is None) or update the status of a background job in the json file at job_path(job_id).
+    Job statuses are kept on disk so web and worker processes share them
+    :return: the job id
+    """
+    job = {}
+    if job_id == None:
+        job_id = new_uuid()
+    else:
+        job = load_job(job_id, job_path) or {}
+    job.update(values)
+
+    # replace the status file at once so polling never reads a partial file
+    path = job_path(job_id)
+    with open(path + '.tmp', 'w') as job_file:
+        json.dump(job, job_file)
+    os.rename(path + '.tmp', path)
+
+    return job_id
+
 pagination_parser = RequestParser()
 pagination_parser.add_argument('page', type=int, required=False, default=1)
 pagination_parser.add_argument('perPage', type=int, required=False, default=20)
@@ -1,8 +1,12 @@
+import threading
+
 from bouncer.constants import ALL, MANAGE, EDIT, READ, CREATE, DELETE
+from bouncer.models import RuleList
+from flask import g, has_app_context
 from flask_bouncer import ensure
 from flask_login import current_user
 from werkzeug.exceptions import Unauthorized
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, event
 
 from .core import abort, impersonation
 
@@ -12,6 +16,12 @@ from .models import Course, User, UserCourse, CourseRole, SystemRole, \
 
 USER_IDENTITY = 'permission_user_identity'
 
+# process level compiled rules used by define_authorization
+# _permission_rules[(user id, system role, enrolments, impersonation original user)] = rules
+_permission_rules = {}
+_permission_rules_lock = threading.Lock()
+PERMISSION_RULES_CACHE_SIZE = 10000
+
 
 def define_authorization(user, they, impersonation_original_user=None):
     """
@@ -20,45 +30,138 @@ def define_authorization(user, they, impersonation_original_user=None):
     if not user.is_authenticated:
         return  # user isn't logged in
 
-    original_user_courses_dict = {} if not impersonation_original_user else \
-        {c.course_id: c for c in impersonation_original_user.user_courses \
-            if c.course_role != CourseRole.dropped}
+    they.extend(_get_permission_rules(user, impersonation_original_user))
 
-    def if_my_student(student):
-        course_subquery = Course.query \
-            .with_entities(Course.id) \
-            .join(UserCourse) \
+
+def invalidate_permissions():
+    """
+    Recompile the permissions of the current request on the next permission check.
+    Call after changing enrolments with bulk statements (ORM changes are detected)
+    """
+    if has_app_context():
+        g.pop('permission_rules', None)
+        g.pop('permission_student_ids', None)
+
+
+def _get_permission_rules(user, impersonation_original_user=None):
+    """
+    Returns the compiled rules of user. Rules are compiled once per request and cached per process
+    by the enrolments they are compiled from, so enrolment changes always compile new rules
+    """
+    request_rules = g.setdefault('permission_rules', {})
+    request_key = (user.id, impersonation_original_user.id if impersonation_original_user else None)
+    rules = request_rules.get(request_key)
+    if rules != None:
+        return rules
+
+    enrolments = tuple(UserCourse.query \
+        .with_entities(UserCourse.course_id, UserCourse.course_role, UserCourse.group_id) \
+        .filter(and_(
+            UserCourse.user_id == user.id,
+            UserCourse.course_role != CourseRole.dropped
+        )) \
+        .order_by(UserCourse.course_id) \
+        .all())
+
+    # if impersonating, only keep courses the original user has access to
+    original_user_key = None
+    if impersonation_original_user:
+        original_course_ids = None
+        if impersonation_original_user.system_role != SystemRole.sys_admin:
+            original_course_ids = frozenset(course_id for (course_id,) in UserCourse.query \
+                .with_entities(UserCourse.course_id) \
+                .filter(and_(
+                    UserCourse.user_id == impersonation_original_user.id,
+                    UserCourse.course_role != CourseRole.dropped
+                )) \
+                .all())
+            enrolments = tuple(enrolment for enrolment in enrolments if enrolment[0] in original_course_ids)
+        original_user_key = (impersonation_original_user.id, original_course_ids)
+
+    key = (user.id, user.system_role, enrolments, original_user_key)
+    with _permission_rules_lock:
+        rules = _permission_rules.get(key)
+    if rules == None:
+        rules = _compile_rules(user.id, user.system_role, enrolments)
+        with _permission_rules_lock:
+            # rules of previous enrolments are never reused, drop them once there are too many
+            if len(_permission_rules) >= PERMISSION_RULES_CACHE_SIZE:
+                _permission_rules.clear()
+            _permission_rules[key] = rules
+
+    request_rules[request_key] = rules
+    return rules
+
+
+def _get_my_student_ids(user_id):
+    """
+    Returns the ids of students in courses taught by the instructor (loaded once per request)
+    """
+    student_ids = g.setdefault('permission_student_ids', {})
+    if user_id not in student_ids:
+        course_subquery = UserCourse.query \
+            .with_entities(UserCourse.course_id) \
             .filter(and_(
-                UserCourse.user_id == user.id,
+                UserCourse.user_id == user_id,
                 UserCourse.course_role == CourseRole.instructor
             )) \
             .subquery()
-        exists = Course.query. \
-            join(UserCourse) \
+        student_ids[user_id] = frozenset(student_id for (student_id,) in UserCourse.query \
+            .with_entities(UserCourse.user_id) \
             .filter(and_(
-                UserCourse.user_id == student.id,
+                UserCourse.course_id.in_(course_subquery),
                 UserCourse.course_role == CourseRole.student
             )) \
-            .filter(Course.id.in_(course_subquery)) \
-            .count()
-        return bool(exists)
+            .all())
+    return student_ids[user_id]
 
-    def if_can_delete_attachment_reference(file):
-        for assignment in file.assignments.all():
-            if allow(DELETE, assignment):
-                return True
 
-        for answer in file.answers.all():
-            if allow(DELETE, answer):
-                return True
+def _compile_rules(user_id, system_role, enrolments):
+    """
+    Builds the rules of a user from their enrolments (tuples of course_id, course_role, group_id).
+    Course rules check set membership so the number of rules does not grow with the number of courses.
+    Rules only reference ids so they can be shared between requests
+    """
+    they = RuleList()
 
-        return False
+    course_ids = frozenset(course_id for (course_id, course_role, group_id) in enrolments)
+    group_ids = frozenset(group_id for (course_id, course_role, group_id) in enrolments if group_id)
+    instructor_course_ids = frozenset(course_id for (course_id, course_role, group_id) in enrolments
+        if course_role == CourseRole.instructor)
+    manage_course_ids = frozenset(course_id for (course_id, course_role, group_id) in enrolments
+        if course_role in [CourseRole.instructor, CourseRole.teaching_assistant])
+
+    def if_my_student(student):
+        return student.id in _get_my_student_ids(user_id)
+
+    def if_can_delete_attachment_reference(file):
+        # same as checking DELETE on the assignments and answers referencing the file
+        if len(manage_course_ids) > 0 and file.assignments \
+                .filter(Assignment.course_id.in_(manage_course_ids)) \
+                .count() > 0:
+            return True
+
+        answer_conditions = [Answer.user_id == user_id]
+        if len(group_ids) > 0:
+            answer_conditions.append(Answer.group_id.in_(group_ids))
+        if len(manage_course_ids) > 0:
+            answer_conditions.append(Assignment.course_id.in_(manage_course_ids))
+        return file.answers \
+            .join(Assignment, Assignment.id == Answer.assignment_id) \
+            .filter(or_(*answer_conditions)) \
+            .count() > 0
+
+    def in_courses(course_ids, **conditions):
+        def condition(target):
+            return target.course_id in course_ids and \
+                all(getattr(target, key) == value for key, value in conditions.items())
+        return condition
 
     # Assign permissions based on system roles
-    if user.system_role == SystemRole.sys_admin:
+    if system_role == SystemRole.sys_admin:
         # sysadmin can do anything
         they.can(MANAGE, ALL)
-    elif user.system_role == SystemRole.instructor:
+    elif system_role == SystemRole.instructor:
         # instructors can create courses
         they.can(CREATE, Course)
         # instructors can read the default criterion
@@ -70,60 +173,62 @@ def define_authorization(user, they, impersonation_original_user=None):
         they.can(impersonation.IMPERSONATE, User, if_my_student) # TODO also check if it is a current course??
 
     # users can edit and read their own user account
-    they.can((READ, EDIT), User, id=user.id)
+    they.can((READ, EDIT), User, id=user_id)
     # they can also look at their own course enrolments
-    they.can(READ, UserCourse, user_id=user.id)
+    they.can(READ, UserCourse, user_id=user_id)
     # they can read and edit their own criteria
-    they.can((READ, EDIT), Criterion, user_id=user.id)
+    they.can((READ, EDIT), Criterion, user_id=user_id)
 
     # they can delete their own attachments
-    they.can(DELETE, File, user_id=user.id)
+    they.can(DELETE, File, user_id=user_id)
 
     # Assign permissions based on course roles
     # give access to courses the user is enroled in
-    for entry in user.user_courses:
-        if entry.course_role == CourseRole.dropped:
-            continue
-        # if impersonating and the original user has no access to the course, skip it
-        if impersonation_original_user \
-            and not original_user_courses_dict.get(entry.course_id, None) \
-            and not impersonation_original_user.system_role == SystemRole.sys_admin:
-            continue
-        they.can(READ, Course, id=entry.course_id)
-        they.can(READ, Assignment, course_id=entry.course_id)
+    if len(course_ids) > 0:
+        they.can(READ, Course, lambda course: course.id in course_ids)
+        they.can(READ, Assignment, in_courses(course_ids))
         # only owner/Instructors/TAs can read answer drafts
-        they.can(READ, Answer, course_id=entry.course_id, draft=False)
-        they.can(CREATE, Answer, course_id=entry.course_id)
-        they.can((EDIT, DELETE, READ), Answer, user_id=user.id)
-        if entry.group_id:
-            they.can((EDIT, DELETE, READ), Answer, group_id=entry.group_id)
+        they.can(READ, Answer, in_courses(course_ids, draft=False))
+        they.can(CREATE, Answer, in_courses(course_ids))
+        they.can((EDIT, DELETE, READ), Answer, user_id=user_id)
+        if len(group_ids) > 0:
+            they.can((EDIT, DELETE, READ), Answer, lambda answer: answer.group_id in group_ids)
         they.can(DELETE, File, if_can_delete_attachment_reference)
         # only owner/Instructors/TAs can read answer comment drafts
-        they.can(READ, AnswerComment, course_id=entry.course_id, draft=False)
-        they.can(CREATE, AnswerComment, course_id=entry.course_id)
+        they.can(READ, AnswerComment, in_courses(course_ids, draft=False))
+        they.can(CREATE, AnswerComment, in_courses(course_ids))
         # owner of the answer comment
-        they.can((EDIT, DELETE, READ), AnswerComment, user_id=user.id)
+        they.can((EDIT, DELETE, READ), AnswerComment, user_id=user_id)
         # students, instructor and ta can submit comparisons
-        they.can((CREATE, EDIT), Comparison, course_id=entry.course_id)
-        # instructors can modify the course, enrolment, and groups
-        if entry.course_role == CourseRole.instructor:
-            they.can((EDIT, DELETE), Course, id=entry.course_id)
-            they.can(EDIT, UserCourse, course_id=entry.course_id)
-            they.can((EDIT, DELETE, CREATE), Group, course_id=entry.course_id)
-        # instructors and ta can do anything they want to assignments
-        if entry.course_role == CourseRole.instructor or \
-                entry.course_role == CourseRole.teaching_assistant:
-            they.can(MANAGE, Assignment, course_id=entry.course_id)
-            they.can(MANAGE, Answer, course_id=entry.course_id)
-            they.can(MANAGE, AnswerComment, course_id=entry.course_id)
-            they.can(MANAGE, ComparisonExample, course_id=entry.course_id)
-            they.can(READ, Comparison, course_id=entry.course_id)
-            they.can(READ, UserCourse, course_id=entry.course_id)
-            they.can(READ, Group, course_id=entry.course_id)
-            they.can((CREATE, DELETE), AssignmentCriterion, course_id=entry.course_id)
-            they.can(READ, USER_IDENTITY)
-            # TA can create criteria
-            they.can(CREATE, Criterion)
+        they.can((CREATE, EDIT), Comparison, in_courses(course_ids))
+    # instructors can modify the course, enrolment, and groups
+    if len(instructor_course_ids) > 0:
+        they.can((EDIT, DELETE), Course, lambda course: course.id in instructor_course_ids)
+        they.can(EDIT, UserCourse, in_courses(instructor_course_ids))
+        they.can((EDIT, DELETE, CREATE), Group, in_courses(instructor_course_ids))
+    # instructors and ta can do anything they want to assignments
+    if len(manage_course_ids) > 0:
+        they.can(MANAGE, Assignment, in_courses(manage_course_ids))
+        they.can(MANAGE, Answer, in_courses(manage_course_ids))
+        they.can(MANAGE, AnswerComment, in_courses(manage_course_ids))
+        they.can(MANAGE, ComparisonExample, in_courses(manage_course_ids))
+        they.can(READ, Comparison, in_courses(manage_course_ids))
+        they.can(READ, UserCourse, in_courses(manage_course_ids))
+        they.can(READ, Group, in_courses(manage_course_ids))
+        they.can((CREATE, DELETE), AssignmentCriterion, in_courses(manage_course_ids))
+        they.can(READ, USER_IDENTITY)
+        # TA can create criteria
+        they.can(CREATE, Criterion)
+
+    return list(they)
+
+
+# enrolment changes in the session are visible to permission checks later in the same request
+@event.listens_for(UserCourse, 'after_insert')
+@event.listens_for(UserCourse, 'after_update')
+@event.listens_for(UserCourse, 'after_delete')
+def receive_after_user_course_write(mapper, connection, target):
+    invalidate_permissions()
 
 
 # Tell the client side about a user's permissions.
@@ -92,7 +92,7 @@ env_overridables = [
     'KALTURA_SECRET', 'KALTURA_PLAYER_ID',
     'MAIL_SERVER', 'MAIL_DEBUG', 'MAIL_USERNAME', 'MAIL_PASSWORD',
     'MAIL_DEFAULT_SENDER', 'MAIL_SUPPRESS_SEND',
-    'GA_TRACKING_ID'
+    'GA_TRACKING_ID', 'SCORING_BACKEND'
 ]
 
 env_bool_overridables = [
@@ -105,12 +105,16 @@ env_bool_overridables = [
     'ALLOW_STUDENT_CHANGE_NAME', 'ALLOW_STUDENT_CHANGE_DISPLAY_NAME',
     'ALLOW_STUDENT_CHANGE_STUDENT_NUMBER', 'ALLOW_STUDENT_CHANGE_EMAIL',
     'MAIL_NOTIFICATION_ENABLED', 'MAIL_USE_TLS', 'MAIL_USE_SSL', 'MAIL_ASCII_ATTACHMENTS',
-    'ENFORCE_SSL', 'IMPERSONATION_ENABLED'
+    'ENFORCE_SSL', 'IMPERSONATION_ENABLED', 'PAIRING_INDEX_ENABLED',
+    'ASYNC_SCORE_UPDATES_ENABLED', 'ASYNC_LEARNING_RECORDS_ENABLED'
 ]
 
 env_int_overridables = [
     'ATTACHMENT_UPLOAD_LIMIT', 'LRS_USER_INPUT_FIELD_SIZE_LIMIT',
-    'MAIL_PORT', 'MAIL_MAX_EMAILS'
+    'MAIL_PORT', 'MAIL_MAX_EMAILS', 'PAIRING_INDEX_TTL', 'RANK_CACHE_TTL',
+    'ASSIGNMENT_STATUS_CACHE_TTL', 'PASSWORD_HASH_PROCESSES', 'LTI_OUTCOME_POST_CONCURRENCY',
+    'LRS_TRANSMIT_BATCH_SIZE', 'LRS_TRANSMIT_TIMEOUT', 'LRS_TRANSMIT_DELAY',
+    'COURSE_DUPLICATE_BACKGROUND_THRESHOLD'
 ]
 
 env_set_overridables = [
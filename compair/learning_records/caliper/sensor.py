@@ -8,7 +8,7 @@ import json
 import caliper
 from caliper import condensor
 
-from compair.tasks import emit_lrs_caliper_event
+from compair.tasks import emit_lrs_caliper_events
 
 from caliper.constants import CALIPER_VERSION
 
@@ -20,6 +20,8 @@ from compair.learning_records.learning_record import LearningRecord
 from compair.learning_records.resource_iri import ResourceIRI
 from six import text_type, string_types
 
+CALIPER_DATA_VERSION = 'http://purl.imsglobal.org/ctx/caliper/v1p1'
+
 class CaliperSensor(LearningRecord):
     _version = CALIPER_VERSION
 
@@ -59,7 +61,7 @@ class CaliperSensor(LearningRecord):
         db.session.commit()
 
         if not cls.storing_locally():
-            emit_lrs_caliper_event.delay(caliper_log.id)
+            cls._queue_transmission(emit_lrs_caliper_events)
 
     @classmethod
     def _emit_to_lrs(cls, event_json):
@@ -73,3 +75,28 @@ class CaliperSensor(LearningRecord):
         sensor.send(event)
 
         # TODO find way to log bad requests
+
+    @classmethod
+    def _emit_batch_to_lrs(cls, event_jsons):
+        """
+        Sends events (json strings) to the LRS in one Caliper envelope
+        :return: the LRS response status code
+        """
+        # should only be called by delayed task emit_lrs_caliper_events
+        headers = {
+            'Authorization': 'Bearer ' + text_type(current_app.config.get('LRS_CALIPER_API_KEY')),
+            'Content-Type': 'application/json'
+        }
+
+        # events are stored as json so the envelope can be built without parsing them
+        body = '{{"sensor": {}, "sendTime": {}, "dataVersion": {}, "data": [{}]}}'.format(
+            json.dumps(ResourceIRI.compair()), json.dumps(cls.generate_timestamp()),
+            json.dumps(CALIPER_DATA_VERSION), ",".join(event_jsons))
+
+        response = cls._get_session().post(text_type(current_app.config.get('LRS_CALIPER_HOST')),
+            data=body.encode('utf-8'), headers=headers, timeout=current_app.config.get('LRS_TRANSMIT_TIMEOUT', 30))
+
+        if not (200 <= response.status_code < 300):
+            current_app.logger.error("Caliper Failed with: " + response.text)
+
+        return response.status_code
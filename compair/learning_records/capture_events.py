@@ -4,8 +4,14 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 from future.standard_library import install_aliases
 install_aliases()
 
+import json
 import mimetypes
 import caliper
+from functools import wraps
+from six import text_type
+
+from flask import current_app, request, session as sess, g, has_request_context, _request_ctx_stack
+from flask_login import current_user
 
 from .resource_iri import ResourceIRI
 from .learning_record import LearningRecord
@@ -15,7 +21,10 @@ from .xapi import XAPIActivity, XAPIActor, XAPIContext, \
 from .caliper import CaliperSensor, CaliperEntities, CaliperEvent, \
     CaliperActor
 
-from compair.models import AnswerCommentType, File
+import compair.models
+from compair.models import AnswerCommentType, File, User
+from compair.core import db
+from compair.tasks import build_learning_records
 
 from compair.api import on_get_file
 from compair.api.file import  on_attach_file, on_detach_file
@@ -69,8 +78,118 @@ def capture_events():
     on_criterion_create.connect(learning_record_on_criterion_create)
     on_criterion_update.connect(learning_record_on_criterion_update)
 
+# learning record handlers by name, used to build the records of captured events
+_learning_record_handlers = {}
+
+# session values read while building learning records
+_SESSION_KEYS = ['session_id', 'start_at', 'end_at', 'login_method',
+    'impersonation_original_user_id', 'impersonation_act_as_user_id']
+
+def learning_record_builder(capture=None):
+    """
+    Decorates a learning record signal handler. When ASYNC_LEARNING_RECORDS_ENABLED is set, the request
+    only captures the facts of the event (model ids, values, session and browser details, timestamp)
+    and the records are built and emitted by the build_learning_records celery task.
+    capture(user, **extra) returns facts that need to be read when the event happens
+    """
+    def decorator(handler):
+        _learning_record_handlers[handler.__name__] = handler
+
+        @wraps(handler)
+        def receiver(sender, user, **extra):
+            if not current_app.config.get('ASYNC_LEARNING_RECORDS_ENABLED') or \
+                    not (XAPI.enabled() or CaliperSensor.enabled()):
+                return handler(sender, user, **extra)
+
+            model_ids = {}
+            facts = capture(user, **extra) if capture else {}
+            for key, value in extra.items():
+                if isinstance(value, db.Model):
+                    model_ids[key] = [value.__class__.__name__, value.id]
+                else:
+                    # api data can hold dates and enums
+                    facts[key] = json.loads(json.dumps(value, default=text_type))
+
+            build_learning_records.delay(handler.__name__, user.id, model_ids, facts, _capture_request_facts())
+        return receiver
+    return decorator
+
+def _capture_request_facts():
+    request_facts = {
+        'timestamp': LearningRecord.generate_timestamp()
+    }
+    if has_request_context():
+        request_facts['base_url'] = request.url_root
+        request_facts['user_agent'] = request.environ.get('HTTP_USER_AGENT')
+        request_facts['referer'] = request.environ.get('HTTP_REFERER')
+        request_facts['session'] = { key: sess.get(key) for key in _SESSION_KEYS if sess.get(key) != None }
+        request_facts['current_user_id'] = current_user.id if current_user and current_user.is_authenticated else None
+    return request_facts
+
+def build_captured_learning_records(handler_name, user_id, model_ids, facts, request_facts):
+    """
+    Builds and emits the learning records of an event captured by learning_record_builder.
+    Records describe the models as they are when they are built, handlers choose verbs and
+    completion from the state captured with the event (ex: draft, completed)
+    """
+    handler = _learning_record_handlers[handler_name]
+    user = User.query.get(user_id)
+
+    extra = dict(facts)
+    for key, (model_name, model_id) in model_ids.items():
+        extra[key] = getattr(compair.models, model_name).query.get(model_id)
+
+    # records use the time of the event instead of the time they are built
+    g.learning_record_timestamp = request_facts['timestamp']
+    try:
+        if request_facts.get('base_url') == None:
+            handler(None, user, **extra)
+            return
+
+        headers = {}
+        if request_facts.get('user_agent'):
+            headers['User-Agent'] = request_facts.get('user_agent')
+        if request_facts.get('referer'):
+            headers['Referer'] = request_facts.get('referer')
+
+        with current_app.test_request_context(base_url=request_facts['base_url'], headers=headers):
+            for key, value in request_facts['session'].items():
+                sess[key] = value
+            # set the user directly, logging in would send login signals
+            current_user_id = request_facts.get('current_user_id')
+            _request_ctx_stack.top.user = User.query.get(current_user_id) if current_user_id \
+                else current_app.login_manager.anonymous_user()
+
+            handler(None, user, **extra)
+    finally:
+        g.pop('learning_record_timestamp', None)
+
+def _get_current_comparison(user, assignment, comparison):
+    comparison_count = assignment.completed_comparison_count_for_user(user.id)
+    return comparison_count if comparison.completed else comparison_count + 1
+
+def _capture_comparison_facts(user, **extra):
+    # later comparisons change the count and the comparison can be completed before the records are built
+    return {
+        'current_comparison': _get_current_comparison(user, extra.get('assignment'), extra.get('comparison')),
+        'completed': extra.get('comparison').completed
+    }
+
+def _capture_answer_facts(user, **extra):
+    # the answer can be submitted before the records are built
+    return {
+        'draft': extra.get('answer').draft
+    }
+
+def _capture_answer_comment_facts(user, **extra):
+    # the answer comment can be submitted before the records are built
+    return {
+        'draft': extra.get('answer_comment').draft
+    }
+
 # on_login_with_method
 # logged in to compair
+@learning_record_builder()
 def learning_record_on_login_with_method(sender, user, **extra):
     if XAPI.enabled():
         XAPI.emit(XAPIStatement.generate(
@@ -89,6 +208,7 @@ def learning_record_on_login_with_method(sender, user, **extra):
 
 # on_logout
 # logged in to compair
+@learning_record_builder()
 def learning_record_on_logout(sender, user, **extra):
     if XAPI.enabled():
         XAPI.emit(XAPIStatement.generate(
@@ -108,6 +228,7 @@ def learning_record_on_logout(sender, user, **extra):
 # download report (report)
 # download assignment_attachment (attachment with assignment)
 # download answer_attachment (attachment with answer)
+@learning_record_builder()
 def learning_record_on_get_file(sender, user, **extra):
     file_type = extra.get('file_type')
     file_name = extra.get('file_name')
@@ -171,6 +292,7 @@ def learning_record_on_get_file(sender, user, **extra):
 # on_attach_file
 # attach assignment_attachment (attachment with assignment)
 # attach answer_attachment (attachment with answer)
+@learning_record_builder()
 def learning_record_on_attach_file(sender, user, **extra):
     file_record = extra.get('file')
     mimetype, encoding = mimetypes.guess_type(file_record.name)
@@ -214,6 +336,7 @@ def learning_record_on_attach_file(sender, user, **extra):
 # on_detach_file
 # attach assignment_attachment (attachment with assignment)
 # attach answer_attachment (attachment with answer)
+@learning_record_builder()
 def learning_record_on_detach_file(sender, user, **extra):
     file_record = extra.get('file')
     mimetype, encoding = mimetypes.guess_type(file_record.name)
@@ -255,6 +378,7 @@ def learning_record_on_detach_file(sender, user, **extra):
 
 # on_user_modified
 # updated user_profile
+@learning_record_builder()
 def learning_record_on_user_modified(sender, user, **extra):
     changes = extra.get('data', {}).get('changes')
 
@@ -278,14 +402,16 @@ def learning_record_on_user_modified(sender, user, **extra):
 
 # on_answer_comment_create
 # commented answer_comment (public & private)
+@learning_record_builder(capture=_capture_answer_comment_facts)
 def learning_record_on_answer_comment_create(sender, user, **extra):
     answer_comment = extra.get('answer_comment')
+    draft = extra.get('draft', answer_comment.draft)
 
     if answer_comment.comment_type == AnswerCommentType.evaluation:
         evaluation_number = extra.get('evaluation_number')
 
         if XAPI.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 XAPI.emit(XAPIStatement.generate(
                     user=user,
                     verb=XAPIVerb.generate('commented'),
@@ -299,12 +425,12 @@ def learning_record_on_answer_comment_create(sender, user, **extra):
                 verb=XAPIVerb.generate('completed'),
                 object=XAPIObject.evaluation_response(answer_comment),
                 context=XAPIContext.evaluation_response(answer_comment, evaluation_number, registration=answer_comment.attempt_uuid),
-                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not answer_comment.draft)
+                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not draft)
             ))
 
 
         if CaliperSensor.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 CaliperSensor.emit(caliper.events.Event(
                     action=caliper.constants.BASIC_EVENT_ACTIONS["COMMENTED"],
                     object=CaliperEntities.answer(answer_comment.answer),
@@ -321,7 +447,7 @@ def learning_record_on_answer_comment_create(sender, user, **extra):
 
     elif answer_comment.comment_type == AnswerCommentType.self_evaluation:
         if XAPI.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 XAPI.emit(XAPIStatement.generate(
                     user=user,
                     verb=XAPIVerb.generate('commented'),
@@ -335,7 +461,7 @@ def learning_record_on_answer_comment_create(sender, user, **extra):
                 verb=XAPIVerb.generate('completed'),
                 object=XAPIObject.self_evaluation_response(answer_comment),
                 context=XAPIContext.self_evaluation_response(answer_comment, registration=answer_comment.attempt_uuid),
-                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not answer_comment.draft)
+                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not draft)
             ))
 
             XAPI.emit(XAPIStatement.generate(
@@ -343,11 +469,11 @@ def learning_record_on_answer_comment_create(sender, user, **extra):
                 verb=XAPIVerb.generate('submitted'),
                 object=XAPIObject.assignment_attempt(answer_comment.answer.assignment, answer_comment),
                 context=XAPIContext.assignment_attempt(answer_comment.answer.assignment, registration=answer_comment.attempt_uuid),
-                result=XAPIResult.basic(success=True, completion=not answer_comment.draft)
+                result=XAPIResult.basic(success=True, completion=not draft)
             ))
 
         if CaliperSensor.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 CaliperSensor.emit(caliper.events.Event(
                     action=caliper.constants.BASIC_EVENT_ACTIONS["COMMENTED"],
                     object=CaliperEntities.answer(answer_comment.answer),
@@ -396,15 +522,17 @@ def learning_record_on_answer_comment_create(sender, user, **extra):
 # drafted self_evaluation + suspended self_evaluation_question (self_evaluation draft)
 # submitted self_evaluation + completed self_evaluation_question (self_evaluation not draft)
 # updated answer_comment (public & private)
+@learning_record_builder(capture=_capture_answer_comment_facts)
 def learning_record_on_answer_comment_modified(sender, user, **extra):
     answer_comment = extra.get('answer_comment')
+    draft = extra.get('draft', answer_comment.draft)
     was_draft = extra.get('was_draft')
 
     if answer_comment.comment_type == AnswerCommentType.evaluation:
         evaluation_number = extra.get('evaluation_number')
 
         if XAPI.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 XAPI.emit(XAPIStatement.generate(
                     user=user,
                     verb=XAPIVerb.generate('commented' if was_draft else 'updated'),
@@ -418,12 +546,12 @@ def learning_record_on_answer_comment_modified(sender, user, **extra):
                 verb=XAPIVerb.generate('completed'),
                 object=XAPIObject.evaluation_response(answer_comment),
                 context=XAPIContext.evaluation_response(answer_comment, evaluation_number, registration=answer_comment.attempt_uuid),
-                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not answer_comment.draft)
+                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not draft)
             ))
 
 
         if CaliperSensor.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 CaliperSensor.emit(caliper.events.Event(
                     action=caliper.constants.BASIC_EVENT_ACTIONS["COMMENTED" if was_draft else "MODIFIED"],
                     object=CaliperEntities.answer(answer_comment.answer),
@@ -440,7 +568,7 @@ def learning_record_on_answer_comment_modified(sender, user, **extra):
 
     elif answer_comment.comment_type == AnswerCommentType.self_evaluation:
         if XAPI.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 XAPI.emit(XAPIStatement.generate(
                     user=user,
                     verb=XAPIVerb.generate('commented' if was_draft else 'updated'),
@@ -454,7 +582,7 @@ def learning_record_on_answer_comment_modified(sender, user, **extra):
                 verb=XAPIVerb.generate('completed'),
                 object=XAPIObject.self_evaluation_response(answer_comment),
                 context=XAPIContext.self_evaluation_response(answer_comment, registration=answer_comment.attempt_uuid),
-                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not answer_comment.draft)
+                result=XAPIResult.basic_attempt(answer_comment, answer_comment.content, success=True, completion=not draft)
             ))
 
             XAPI.emit(XAPIStatement.generate(
@@ -462,11 +590,11 @@ def learning_record_on_answer_comment_modified(sender, user, **extra):
                 verb=XAPIVerb.generate('submitted'),
                 object=XAPIObject.assignment_attempt(answer_comment.answer.assignment, answer_comment),
                 context=XAPIContext.assignment_attempt(answer_comment.answer.assignment, registration=answer_comment.attempt_uuid),
-                result=XAPIResult.basic(success=True, completion=not answer_comment.draft)
+                result=XAPIResult.basic(success=True, completion=not draft)
             ))
 
         if CaliperSensor.enabled():
-            if not answer_comment.draft:
+            if not draft:
                 CaliperSensor.emit(caliper.events.Event(
                     action=caliper.constants.BASIC_EVENT_ACTIONS["COMMENTED" if was_draft else "MODIFIED"],
                     object=CaliperEntities.answer(answer_comment.answer),
@@ -513,6 +641,7 @@ def learning_record_on_answer_comment_modified(sender, user, **extra):
 # deleted evaluation_response (evaluation)
 # deleted self_evaluation (self_evaluation)
 # deleted answer_comment (public & private)
+@learning_record_builder()
 def learning_record_on_answer_comment_delete(sender, user, **extra):
     answer_comment = extra.get('answer_comment')
 
@@ -535,8 +664,10 @@ def learning_record_on_answer_comment_delete(sender, user, **extra):
 # on_answer_create
 # drafted answer_solution + suspended assignment_question (draft)
 # submitted answer_solution + completed assignment_question (not draft)
+@learning_record_builder(capture=_capture_answer_facts)
 def learning_record_on_answer_create(sender, user, **extra):
     answer = extra.get('answer')
+    draft = extra.get('draft', answer.draft)
 
     if XAPI.enabled():
         XAPI.emit(XAPIStatement.generate(
@@ -544,7 +675,7 @@ def learning_record_on_answer_create(sender, user, **extra):
             verb=XAPIVerb.generate('completed'),
             object=XAPIObject.answer(answer),
             context=XAPIContext.answer(answer, registration=answer.attempt_uuid),
-            result=XAPIResult.basic_attempt(answer, answer.content, success=True, completion=not answer.draft)
+            result=XAPIResult.basic_attempt(answer, answer.content, success=True, completion=not draft)
         ))
 
         XAPI.emit(XAPIStatement.generate(
@@ -552,7 +683,7 @@ def learning_record_on_answer_create(sender, user, **extra):
             verb=XAPIVerb.generate('submitted'),
             object=XAPIObject.assignment_attempt(answer.assignment, answer),
             context=XAPIContext.assignment_attempt(answer.assignment, registration=answer.attempt_uuid),
-            result=XAPIResult.basic(success=True, completion=not answer.draft)
+            result=XAPIResult.basic(success=True, completion=not draft)
         ))
 
     if CaliperSensor.enabled():
@@ -573,8 +704,10 @@ def learning_record_on_answer_create(sender, user, **extra):
 # on_answer_modified
 # drafted answer_solution + suspended assignment_question (draft)
 # submitted answer_solution + completed assignment_question (not draft)
+@learning_record_builder(capture=_capture_answer_facts)
 def learning_record_on_answer_modified(sender, user, **extra):
     answer = extra.get('answer')
+    draft = extra.get('draft', answer.draft)
 
     if XAPI.enabled():
         XAPI.emit(XAPIStatement.generate(
@@ -582,7 +715,7 @@ def learning_record_on_answer_modified(sender, user, **extra):
             verb=XAPIVerb.generate('completed'),
             object=XAPIObject.answer(answer),
             context=XAPIContext.answer(answer, registration=answer.attempt_uuid),
-            result=XAPIResult.basic_attempt(answer, answer.content, success=True, completion=not answer.draft)
+            result=XAPIResult.basic_attempt(answer, answer.content, success=True, completion=not draft)
         ))
 
         XAPI.emit(XAPIStatement.generate(
@@ -590,7 +723,7 @@ def learning_record_on_answer_modified(sender, user, **extra):
             verb=XAPIVerb.generate('submitted'),
             object=XAPIObject.assignment_attempt(answer.assignment, answer),
             context=XAPIContext.assignment_attempt(answer.assignment, registration=answer.attempt_uuid),
-            result=XAPIResult.basic(success=True, completion=not answer.draft)
+            result=XAPIResult.basic(success=True, completion=not draft)
         ))
 
     if CaliperSensor.enabled():
@@ -611,6 +744,7 @@ def learning_record_on_answer_modified(sender, user, **extra):
 
 # on_answer_delete
 # deleted answer_solution
+@learning_record_builder()
 def learning_record_on_answer_delete(sender, user, **extra):
     answer = extra.get('answer')
 
@@ -632,6 +766,7 @@ def learning_record_on_answer_delete(sender, user, **extra):
 
 # on_assignment_create
 # authored assignment_assessment
+@learning_record_builder()
 def learning_record_on_assignment_create(sender, user, **extra):
     assignment = extra.get('assignment')
 
@@ -653,6 +788,7 @@ def learning_record_on_assignment_create(sender, user, **extra):
 
 # on_assignment_modified
 # updated assignment_assessment
+@learning_record_builder()
 def learning_record_on_assignment_modified(sender, user, **extra):
     assignment = extra.get('assignment')
 
@@ -674,6 +810,7 @@ def learning_record_on_assignment_modified(sender, user, **extra):
 
 # on_assignment_delete
 # deleted assignment_assessment
+@learning_record_builder()
 def learning_record_on_assignment_delete(sender, user, **extra):
     assignment = extra.get('assignment')
 
@@ -697,13 +834,16 @@ def learning_record_on_assignment_delete(sender, user, **extra):
 # drafted comparison_solution(s) + suspended comparison_question (not completed)
 # submitted comparison_solution(s) + completed comparison_question (completed)
 # evaluated answer_evaluation(s) (completed and was not comparison example)
+@learning_record_builder(capture=_capture_comparison_facts)
 def learning_record_on_comparison_update(sender, user, **extra):
     assignment = extra.get('assignment')
     comparison = extra.get('comparison')
     is_comparison_example = extra.get('is_comparison_example')
 
-    comparison_count = assignment.completed_comparison_count_for_user(user.id)
-    current_comparison = comparison_count if comparison.completed else comparison_count + 1
+    current_comparison = extra.get('current_comparison')
+    if current_comparison == None:
+        current_comparison = _get_current_comparison(user, assignment, comparison)
+    completed = extra.get('completed', comparison.completed)
 
     if XAPI.enabled():
         XAPI.emit(XAPIStatement.generate(
@@ -711,7 +851,7 @@ def learning_record_on_comparison_update(sender, user, **extra):
             verb=XAPIVerb.generate('completed'),
             object=XAPIObject.comparison(comparison),
             context=XAPIContext.comparison(comparison, current_comparison, registration=comparison.attempt_uuid),
-            result=XAPIResult.comparison(comparison, success=True, completion=comparison.completed)
+            result=XAPIResult.comparison(comparison, success=True, completion=completed)
         ))
 
         XAPI.emit(XAPIStatement.generate(
@@ -719,7 +859,7 @@ def learning_record_on_comparison_update(sender, user, **extra):
             verb=XAPIVerb.generate('submitted'),
             object=XAPIObject.assignment_attempt(comparison.assignment, comparison),
             context=XAPIContext.assignment_attempt(comparison.assignment, registration=comparison.attempt_uuid),
-            result=XAPIResult.basic(success=True, completion=comparison.completed)
+            result=XAPIResult.basic(success=True, completion=completed)
         ))
 
     if CaliperSensor.enabled():
@@ -738,7 +878,7 @@ def learning_record_on_comparison_update(sender, user, **extra):
         ))
 
 
-    if not is_comparison_example and comparison.completed:
+    if not is_comparison_example and completed:
         if XAPI.enabled():
             XAPI.emit(XAPIStatement.generate(
                 user=user,
@@ -772,6 +912,7 @@ def learning_record_on_comparison_update(sender, user, **extra):
 
 # on_course_create
 # authored course
+@learning_record_builder()
 def learning_record_on_course_create(sender, user, **extra):
     course = extra.get('course')
 
@@ -791,6 +932,7 @@ def learning_record_on_course_create(sender, user, **extra):
 
 # on_course_modified
 # updated course
+@learning_record_builder()
 def learning_record_on_course_modified(sender, user, **extra):
     course = extra.get('course')
 
@@ -811,6 +953,7 @@ def learning_record_on_course_modified(sender, user, **extra):
 
 # on_course_delete
 # updated course
+@learning_record_builder()
 def learning_record_on_course_delete(sender, user, **extra):
     course = extra.get('course')
 
@@ -831,6 +974,7 @@ def learning_record_on_course_delete(sender, user, **extra):
 
 # on_criterion_create
 # authored criterion_question
+@learning_record_builder()
 def learning_record_on_criterion_create(sender, user, **extra):
     criterion = extra.get('criterion')
 
@@ -851,6 +995,7 @@ def learning_record_on_criterion_create(sender, user, **extra):
 
 # on_criterion_update
 # updated criterion_question
+@learning_record_builder()
 def learning_record_on_criterion_update(sender, user, **extra):
     criterion = extra.get('criterion')
 
@@ -1,8 +1,16 @@
-from flask import current_app, request
+from flask import current_app, request, g, has_app_context
 from six import text_type
 import datetime
 import pytz
 import re
+import requests
+import threading
+import time
+
+_lrs_session = None
+_lrs_session_lock = threading.Lock()
+_transmissions_queued_at = {}
+_transmissions_lock = threading.Lock()
 
 class LearningRecord(object):
     _version = None
@@ -34,6 +42,9 @@ class LearningRecord(object):
 
     @classmethod
     def generate_timestamp(cls):
+        # set while building the records of an event outside of its request
+        if has_app_context() and g.get('learning_record_timestamp'):
+            return g.learning_record_timestamp
         return datetime.datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
 
     @classmethod
@@ -82,3 +93,35 @@ class LearningRecord(object):
     @classmethod
     def _emit_to_lrs(cls, record_json):
         return
+
+    @classmethod
+    def _emit_batch_to_lrs(cls, record_jsons):
+        return 200
+
+    @classmethod
+    def _queue_transmission(cls, task):
+        """
+        Queues task to send the waiting records in LRS_TRANSMIT_DELAY seconds, unless this process
+        already queued it within that delay (the queued task sends every record waiting when it runs)
+        """
+        delay = current_app.config.get('LRS_TRANSMIT_DELAY', 5)
+        now = time.time()
+        with _transmissions_lock:
+            queued_at = _transmissions_queued_at.get(task.name)
+            if queued_at != None and now - queued_at < delay:
+                return
+            _transmissions_queued_at[task.name] = now
+
+        task.apply_async(countdown=delay)
+
+    @classmethod
+    def _get_session(cls):
+        """
+        Returns the requests session shared by LRS transmissions so batches reuse
+        pooled connections instead of opening one per record
+        """
+        global _lrs_session
+        with _lrs_session_lock:
+            if _lrs_session == None:
+                _lrs_session = requests.Session()
+        return _lrs_session
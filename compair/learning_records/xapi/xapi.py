@@ -1,10 +1,12 @@
+import base64
+
 from flask import current_app, request
 from tincan import RemoteLRS
 from compair.models import XAPILog
 from compair.core import db
 from six import text_type
 
-from compair.tasks import emit_lrs_xapi_statement
+from compair.tasks import emit_lrs_xapi_statements
 
 from tincan import Statement
 from compair.learning_records.learning_record import LearningRecord
@@ -33,7 +35,7 @@ class XAPI(LearningRecord):
         db.session.commit()
 
         if not cls.storing_locally():
-            emit_lrs_xapi_statement.delay(xapi_log.id)
+            cls._queue_transmission(emit_lrs_xapi_statements)
 
     @classmethod
     def _emit_to_lrs(cls, statement_json):
@@ -58,4 +60,35 @@ class XAPI(LearningRecord):
 
         if not lrs_response.success:
             current_app.logger.error("xAPI Failed with: " + str(lrs_response.data))
-            current_app.logger.error("xAPI Request Body: " + lrs_response.request.content)
\ No newline at end of file
+            current_app.logger.error("xAPI Request Body: " + lrs_response.request.content)
+
+    @classmethod
+    def _emit_batch_to_lrs(cls, statement_jsons):
+        """
+        Sends statements (json strings) to the LRS with one multi-statement POST
+        :return: the LRS response status code
+        """
+        # should only be called by delayed task emit_lrs_xapi_statements
+        headers = {
+            'X-Experience-API-Version': cls._version,
+            'Content-Type': 'application/json'
+        }
+
+        if current_app.config.get('LRS_XAPI_AUTH'):
+            headers['Authorization'] = current_app.config.get('LRS_XAPI_AUTH')
+        else:
+            credentials = "{}:{}".format(current_app.config.get('LRS_XAPI_USERNAME'),
+                current_app.config.get('LRS_XAPI_PASSWORD')).encode('utf-8')
+            headers['Authorization'] = "Basic " + base64.b64encode(credentials).decode('utf-8')
+
+        endpoint = current_app.config.get('LRS_XAPI_STATEMENT_ENDPOINT').rstrip('/') + '/statements'
+        # statements are stored as json so the request body can be built without parsing them
+        body = "[" + ",".join(statement_jsons) + "]"
+
+        response = cls._get_session().post(endpoint, data=body.encode('utf-8'), headers=headers,
+            timeout=current_app.config.get('LRS_TRANSMIT_TIMEOUT', 30))
+
+        if not (200 <= response.status_code < 300):
+            current_app.logger.error("xAPI Failed with: " + response.text)
+
+        return response.status_code
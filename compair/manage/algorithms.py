@@ -0,0 +1,81 @@
+"""
+    Pairing and Scoring Algorithm Commands
+"""
+from flask_script import Manager
+
+from compair.algorithms.benchmark import BenchmarkSettings, LATENCY_PERCENTILES, run_benchmark
+from compair.models import PairingAlgorithm, ScoringAlgorithm
+
+manager = Manager(usage="Pairing and Scoring Algorithm Commands")
+
+
+@manager.option('-p', '--pairing', dest='pairing', default=None,
+    help='Comma separated pairing algorithms (default: all)')
+@manager.option('-s', '--scoring', dest='scoring', default=None,
+    help='Comma separated scoring algorithms (default: all)')
+@manager.option('-a', '--answers', dest='answers', default=100, help='Number of answers')
+@manager.option('-u', '--students', dest='students', default=100, help='Number of students')
+@manager.option('-c', '--comparisons', dest='comparisons', default=10,
+    help='Number of comparisons per student')
+@manager.option('-r', '--repetitions', dest='repetitions', default=10,
+    help='Number of simulated cohorts per pairing/scoring combination')
+@manager.option('--correct-rate', dest='correct_rate', default=1.0,
+    help='Probability that a student picks the better answer')
+@manager.option('--sigma', dest='sigma', default=0.0,
+    help='Standard deviation of the error in answer grades as perceived by students')
+@manager.option('-j', '--processes', dest='processes', default=None,
+    help='Number of worker processes (default: number of cpus)')
+@manager.option('--seed', dest='seed', default=None, help='Random seed for reproducible cohorts')
+def benchmark(pairing, scoring, answers, students, comparisons, repetitions, correct_rate,
+        sigma, processes, seed):
+    """
+    Simulate comparisons with synthetic cohorts and report the speed and ranking quality
+    of every pairing/scoring algorithm combination
+    """
+    pairing_package_names = pairing.split(',') if pairing else [algorithm.value for algorithm in PairingAlgorithm]
+    scoring_package_names = scoring.split(',') if scoring else [algorithm.value for algorithm in ScoringAlgorithm]
+
+    for package_name in pairing_package_names:
+        if package_name not in [algorithm.value for algorithm in PairingAlgorithm]:
+            raise RuntimeError("Unknown pairing algorithm {}".format(package_name))
+    for package_name in scoring_package_names:
+        if package_name not in [algorithm.value for algorithm in ScoringAlgorithm]:
+            raise RuntimeError("Unknown scoring algorithm {}".format(package_name))
+
+    settings = BenchmarkSettings(
+        number_of_answers=int(answers),
+        number_of_students=int(students),
+        comparisons_per_student=int(comparisons),
+        correct_rate=float(correct_rate),
+        sigma=float(sigma)
+    )
+
+    reports, wall_time = run_benchmark(pairing_package_names, scoring_package_names, settings,
+        repetitions=int(repetitions),
+        processes=int(processes) if processes else None,
+        seed=int(seed) if seed is not None else None)
+
+    latency_header = " ".join(["p{}".format(percentile) for percentile in LATENCY_PERCENTILES] + ["max"])
+    print("{:<20} {:<22} {:>6} {:>9} | pair ms ({}) | 1vs1 ms ({}) | full ms ({}) | {:>10} {:>10}".format(
+        "pairing", "scoring", "reps", "time (s)", latency_header, latency_header, latency_header,
+        "rho (1vs1)", "rho (full)"))
+
+    for report in reports:
+        print("{:<20} {:<22} {:>6} {:>9.2f} | {} | {} | {} | {:>10} {:>10}".format(
+            report.pairing_package_name, report.scoring_package_name,
+            report.repetitions, report.elapsed,
+            _format_latency(report.pair_latency), _format_latency(report.score_1vs1_latency),
+            _format_latency(report.score_latency),
+            _format_correlation(report.spearman_1vs1), _format_correlation(report.spearman)))
+
+    print("Ran {} simulations in {:.2f}s".format(
+        sum(report.repetitions for report in reports), wall_time))
+
+
+def _format_latency(latency):
+    keys = LATENCY_PERCENTILES + ['max']
+    return " ".join(["{:.3f}".format(latency[key] * 1000) if key in latency else "-" for key in keys])
+
+
+def _format_correlation(correlation):
+    return "{:.4f}".format(correlation) if correlation is not None else "-"
@@ -0,0 +1,146 @@
+"""
+    Learning Record Store Commands
+"""
+import datetime
+import json
+import time
+import uuid
+
+from flask_script import Manager
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+
+from compair.core import db
+from compair.models import XAPILog, CaliperLog
+from compair.learning_records import XAPI, CaliperSensor
+from compair.learning_records.caliper.sensor import CALIPER_DATA_VERSION
+from compair.tasks.emit_learning_record import _emit_pending_logs
+
+manager = Manager(usage="Learning Record Store Commands")
+
+
+class StubLRSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubLRSRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accepts xAPI statement posts (single statement or list) and Caliper envelopes on any path.
+    Authentication is not checked
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, don't delay the body on kept alive connections
+    disable_nagle_algorithm = True
+    latency = 0.0
+    received = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        records = json.loads(self.rfile.read(length).decode('utf-8'))
+
+        if isinstance(records, dict) and 'data' in records:
+            # caliper envelope
+            StubLRSRequestHandler.received += len(records['data'])
+            self._send(200, "")
+        else:
+            # xapi statements, respond with the ids of the stored statements
+            records = records if isinstance(records, list) else [records]
+            StubLRSRequestHandler.received += len(records)
+            self._send(200, json.dumps([str(uuid.uuid4()) for _ in records]))
+
+    def _send(self, status, body):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@manager.command
+def stub_lrs(host='localhost', port=8091, latency=0.0):
+    """
+    Run a local LRS that accepts and discards learning records for offline transmission benchmarks.
+    Set LRS_XAPI_STATEMENT_ENDPOINT or LRS_CALIPER_HOST to http://host:port/ and run `manage.py lrs transmit`
+
+    :param latency: seconds added to every response to simulate a remote LRS
+    :return: None
+    """
+    StubLRSRequestHandler.latency = float(latency)
+
+    server = StubLRSServer((host, int(port)), StubLRSRequestHandler)
+    print("Accepting learning records on http://{}:{}/".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Received {} learning records".format(StubLRSRequestHandler.received))
+
+
+@manager.option('-r', '--records', dest='records', default=0,
+    help='Number of generated learning records to add before sending')
+@manager.option('-t', '--type', dest='record_type', default='xapi',
+    help='Type of learning records to send (xapi or caliper)')
+def transmit(records, record_type):
+    """
+    Send the learning records waiting in the log tables to the LRS and report the throughput
+    """
+    if record_type == 'caliper':
+        log_model, record_column, learning_record = CaliperLog, 'event', CaliperSensor
+    else:
+        log_model, record_column, learning_record = XAPILog, 'statement', XAPI
+
+    if learning_record.storing_locally():
+        print("The LRS is set to 'local', set the LRS url to send learning records")
+        return
+
+    records = int(records)
+    if records > 0:
+        now = datetime.datetime.utcnow()
+        record = json.dumps(_generate_record(record_type))
+        db.session.execute(log_model.__table__.insert(), [{
+            record_column: record,
+            'transmitted': False,
+            'created': now,
+            'modified': now
+        } for _ in range(records)])
+        db.session.commit()
+
+    start = time.time()
+    sent_count = _emit_pending_logs(log_model, record_column, learning_record)
+    elapsed = time.time() - start
+
+    print("Sent {} learning records in {:.2f}s ({:.0f} records/s)".format(
+        sent_count, elapsed, sent_count / elapsed if elapsed > 0 else 0))
+
+
+def _generate_record(record_type):
+    timestamp = XAPI.generate_timestamp()
+    if record_type == 'caliper':
+        return {
+            '@context': CALIPER_DATA_VERSION,
+            'id': 'urn:uuid:' + str(uuid.uuid4()),
+            'type': 'Event',
+            'action': 'Viewed',
+            'actor': {'id': 'https://example.com/user/benchmark', 'type': 'Person'},
+            'object': {'id': 'https://example.com/app/', 'type': 'SoftwareApplication'},
+            'eventTime': timestamp
+        }
+
+    return {
+        'actor': {
+            'account': {'homePage': 'https://example.com/', 'name': 'benchmark'},
+            'objectType': 'Agent'
+        },
+        'verb': {'id': 'http://id.tincanapi.com/verb/viewed', 'display': {'en-US': 'viewed'}},
+        'object': {'id': 'https://example.com/app/', 'objectType': 'Activity'},
+        'timestamp': timestamp,
+        'version': XAPI._version
+    }
@@ -0,0 +1,188 @@
+"""
+    LTI Commands
+"""
+import json
+import time
+
+from flask_script import Manager
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+from compair.models import Course, LTIMembership
+from compair.models.lti_models import MembershipNoValidContextsException
+
+manager = Manager(usage="LTI Commands")
+
+
+class StubConsumerServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubConsumerRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves a generated roster with the membership service (GET, paginated json) and
+    the memberships extension (POST, xml). OAuth signatures are not checked
+    """
+    members = 1000
+    per_page = 100
+    latency = 0.0
+
+    def _member(self, index):
+        user_id = "stub_user_{}".format(index)
+        return {
+            'user_id': user_id,
+            # first member teaches the course
+            'role': "urn:lti:role:ims/lis/Instructor" if index == 0 else "urn:lti:role:ims/lis/Learner",
+            'given_name': "Stub",
+            'family_name': "User {}".format(index),
+            'email': "{}@example.com".format(user_id),
+            'lis_result_sourcedid': "stub_sourcedid_{}".format(index)
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', [str(self.per_page)])[0])
+        rlid = query.get('rlid', [None])[0]
+
+        start = (page - 1) * per_page
+        end = min(start + per_page, self.members)
+
+        membership = []
+        for index in range(start, end):
+            # only learners have a result for the resource link
+            if rlid and index == 0:
+                continue
+            member = self._member(index)
+            record = {
+                'status': 'Active',
+                'role': [member['role']],
+                'member': {
+                    'userId': member['user_id'],
+                    'sourcedId': member['user_id'],
+                    'email': member['email'],
+                    'givenName': member['given_name'],
+                    'familyName': member['family_name'],
+                    'name': member['given_name'] + " " + member['family_name']
+                }
+            }
+            if rlid:
+                record['message'] = [{
+                    'message_type': 'basic-lti-launch-request',
+                    'lis_result_sourcedid': member['lis_result_sourcedid']
+                }]
+            membership.append(record)
+
+        next_page = None
+        if end < self.members:
+            query['page'] = [str(page + 1)]
+            query['per_page'] = [str(per_page)]
+            next_page = "http://{}:{}{}?{}".format(self.server.server_name, self.server.server_port, url.path,
+                "&".join("{}={}".format(key, values[0]) for key, values in query.items()))
+
+        self._send(200, 'application/vnd.ims.lis.v2.membershipcontainer+json', json.dumps({
+            '@id': None,
+            '@type': 'Page',
+            'nextPage': next_page,
+            'pageOf': {
+                'membershipPredicate': 'http://www.w3.org/ns/org#membership',
+                'membershipSubject': {
+                    '@type': 'Context',
+                    'membership': membership
+                }
+            }
+        }))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+
+        records = []
+        for index in range(self.members):
+            member = self._member(index)
+            records.append(
+                "<member>"
+                "<user_id>{}</user_id>"
+                "<roles>{}</roles>"
+                "<person_name_given>{}</person_name_given>"
+                "<person_name_family>{}</person_name_family>"
+                "<person_contact_email_primary>{}</person_contact_email_primary>"
+                "<lis_result_sourcedid>{}</lis_result_sourcedid>"
+                "</member>".format(
+                    escape(member['user_id']), "Instructor" if index == 0 else "Learner",
+                    escape(member['given_name']), escape(member['family_name']),
+                    escape(member['email']), escape(member['lis_result_sourcedid'])
+                )
+            )
+
+        self._send(200, 'application/xml',
+            "<message_response>"
+            "<lti_message_type>basic-lis-readmembershipsforcontext</lti_message_type>"
+            "<statusinfo><codemajor>Success</codemajor><severity>Status</severity></statusinfo>"
+            "<memberships>" + "".join(records) + "</memberships>"
+            "</message_response>")
+
+    def _send(self, status, content_type, body):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@manager.command
+def stub_consumer(host='localhost', port=8090, members=1000, per_page=100, latency=0.0):
+    """
+    Run a local LTI consumer that serves a generated roster for offline membership benchmarks.
+    Point a context's custom_context_memberships_url (or ext_ims_lis_memberships_url) at
+    http://host:port/membership and run `manage.py lti sync_membership`
+
+    :param latency: seconds added to every response to simulate a remote consumer
+    :return: None
+    """
+    StubConsumerRequestHandler.members = int(members)
+    StubConsumerRequestHandler.per_page = int(per_page)
+    StubConsumerRequestHandler.latency = float(latency)
+
+    server = StubConsumerServer((host, int(port)), StubConsumerRequestHandler)
+    print("Serving {} members ({} per page) on http://{}:{}/membership".format(
+        members, per_page, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@manager.command
+def sync_membership(course_id):
+    """
+    Sync the LTI membership of a course and report how long it took
+
+    :return: None
+    """
+    course = Course.query.get(course_id)
+    if not course:
+        print("No course found with that ID")
+        return
+
+    start = time.time()
+    try:
+        LTIMembership.update_membership_for_course(course)
+    except MembershipNoValidContextsException:
+        print("No valid lti contexts are linked to the course")
+        return
+    elapsed = time.time() - start
+
+    print("Synced membership of course {} ({} users) in {:.2f}s".format(
+        course.name, len(course.user_courses), elapsed))
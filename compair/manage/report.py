@@ -3,9 +3,10 @@
 """
 import unicodecsv as csv
 import elo
-from compair.algorithms import ScoredObject
-from compair.algorithms.score import calculate_score_1vs1
+from compair.algorithms import ComparisonPair
+from compair.algorithms.replay import ComparisonReplay
 import numbers
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
 
 from flask_script import Manager
@@ -146,15 +147,11 @@ def create(assignment_id):
     )
 
     # replay comparisons for real scores at every step
-    comparisons_output = []
-    scores = {
-        criterion.id: {} for criterion in criteria
+    replays = {
+        criterion.id: ComparisonReplay(ScoringAlgorithm.elo.value, initial_score=elo.INITIAL)
+        for criterion in criteria
     }
-    scores['overall'] = {}
-    past_comparisons = {
-        criterion.id: [] for criterion in criteria
-    }
-    past_comparisons['overall'] = []
+    replays['overall'] = ComparisonReplay(ScoringAlgorithm.elo.value, initial_score=elo.INITIAL)
 
     comparisons = Comparison.query \
         .options(joinedload('comparison_criteria')) \
@@ -167,180 +164,84 @@ def create(assignment_id):
 
     round_length = float(len(answers)) / 2
     round_number = 0
-    for index, comparison in enumerate(comparisons):
-        answer1_id = comparison.answer1_id
-        answer2_id = comparison.answer2_id
-
-        # overall
-        answer1_score_before = scores['overall'].get(answer1_id, ScoredObject(
-            key=answer1_id,
-            score=elo.INITIAL,
-            variable1=elo.INITIAL,
-            variable2=None,
-            rounds=0,
-            wins=0,
-            loses=0,
-            opponents=0
-        ))
-        answer2_score_before = scores['overall'].get(answer2_id, ScoredObject(
-            key=answer2_id,
-            score=elo.INITIAL,
-            variable1=elo.INITIAL,
-            variable2=None,
-            rounds=0,
-            wins=0,
-            loses=0,
-            opponents=0
-        ))
-
-        other_comparisons = []
-        for pc in past_comparisons['overall']:
-            if pc.key1 in [answer1_id, answer2_id] or pc.key2 in [answer1_id, answer2_id]:
-                other_comparisons.append(pc)
-
-        result_1, result_2 = calculate_score_1vs1(
-            package_name=ScoringAlgorithm.elo.value,
-            key1_scored_object=answer1_score_before,
-            key2_scored_object=answer2_score_before,
-            winner=comparison.comparison_pair_winner(),
-            other_comparison_pairs=[c for c in other_comparisons]
-        )
-        scores['overall'][result_1.key] = result_1
-        scores['overall'][result_2.key] = result_2
-
-        answer1_score_after = scores['overall'][answer1_id]
-        answer2_score_after = scores['overall'][answer2_id]
-
-        past_comparisons['overall'].append(comparison.convert_to_comparison_pair())
-
-        winner_id = None
-        if comparison.winner == WinningAnswer.answer1:
-            winner_id = answer1_id
-        elif comparison.winner == WinningAnswer.answer2:
-            winner_id = answer2_id
-        elif comparison.winner == WinningAnswer.draw:
-            winner_id = "draw"
-
-        comparisons_output.append([
-            comparison.user_id, None, 'Overall',
-            answer1_id, answer1_score_before.score, answer1_score_after.score,
-            answer2_id, answer2_score_before.score, answer2_score_after.score,
-            winner_id, comparison.modified
-        ])
-
-        # each criterion
-        comparison_criteria = comparison.comparison_criteria
-        comparison_criteria.sort(key=lambda x: x.criterion_id)
-        for comparison_criterion in comparison_criteria:
-            criterion = next(criterion for criterion in criteria if criterion.id == comparison_criterion.criterion_id)
-
-            answer1_score_before = scores[criterion.id].get(answer1_id, ScoredObject(
-                key=answer1_id,
-                score=elo.INITIAL,
-                variable1=elo.INITIAL,
-                variable2=None,
-                rounds=0,
-                wins=0,
-                loses=0,
-                opponents=0
-            ))
-            answer2_score_before = scores[criterion.id].get(answer2_id, ScoredObject(
-                key=answer2_id,
-                score=elo.INITIAL,
-                variable1=elo.INITIAL,
-                variable2=None,
-                rounds=0,
-                wins=0,
-                loses=0,
-                opponents=0
-            ))
-
-            other_comparisons = []
-            for pc in past_comparisons[criterion.id]:
-                if pc.key1 in [answer1_id, answer2_id] or pc.key2 in [answer1_id, answer2_id]:
-                    other_comparisons.append(pc)
-
-            result_1, result_2 = calculate_score_1vs1(
-                package_name=ScoringAlgorithm.elo.value,
-                key1_scored_object=answer1_score_before,
-                key2_scored_object=answer2_score_before,
-                winner=comparison_criterion.comparison_pair_winner(),
-                other_comparison_pairs=[c for c in other_comparisons]
-            )
-            scores[criterion.id][result_1.key] = result_1
-            scores[criterion.id][result_2.key] = result_2
-
-            answer1_score_after = scores[criterion.id][answer1_id]
-            answer2_score_after = scores[criterion.id][answer2_id]
-
-            past_comparisons[criterion.id].append(comparison.convert_to_comparison_pair())
+    with csv_writer(file_name + 'comparisons.csv',
+            ['User Id', 'Criterion Id', 'Criterion',
+             'Answer 1', 'Score 1 Before', 'Score 1 After',
+             'Answer 2', 'Score 2 Before', 'Score 2 After',
+             'Winner', 'Timestamp']) as comparisons_writer:
+        for index, comparison in enumerate(comparisons):
+            answer1_id = comparison.answer1_id
+            answer2_id = comparison.answer2_id
+
+            # overall
+            step = replays['overall'].add(comparison.convert_to_comparison_pair())
 
             winner_id = None
-            if comparison_criterion.winner == WinningAnswer.answer1:
+            if comparison.winner == WinningAnswer.answer1:
                 winner_id = answer1_id
-            elif comparison_criterion.winner == WinningAnswer.answer2:
+            elif comparison.winner == WinningAnswer.answer2:
                 winner_id = answer2_id
-
-            comparisons_output.append([
-                comparison.user_id, criterion.id, criterion.name,
-                answer1_id, answer1_score_before.score, answer1_score_after.score,
-                answer2_id, answer2_score_before.score, answer2_score_after.score,
-                winner_id, comparison_criterion.modified
+            elif comparison.winner == WinningAnswer.draw:
+                winner_id = "draw"
+
+            comparisons_writer.writerow([
+                comparison.user_id, None, 'Overall',
+                answer1_id, step.key1_before.score, step.key1_after.score,
+                answer2_id, step.key2_before.score, step.key2_after.score,
+                winner_id, comparison.modified
             ])
 
-        if (index+1) % round_length < 1:
-            round_number += 1
-
-            round_scores = []
-            for answer in answers:
-                score = scores['overall'].get(answer.id, ScoredObject(
-                    key=answer2_id,
-                    score=elo.INITIAL,
-                    variable1=elo.INITIAL,
-                    variable2=None,
-                    rounds=0,
-                    wins=0,
-                    loses=0,
-                    opponents=0
+            # each criterion
+            comparison_criteria = comparison.comparison_criteria
+            comparison_criteria.sort(key=lambda x: x.criterion_id)
+            for comparison_criterion in comparison_criteria:
+                criterion = next(criterion for criterion in criteria if criterion.id == comparison_criterion.criterion_id)
+
+                step = replays[criterion.id].add(ComparisonPair(
+                    key1=answer1_id,
+                    key2=answer2_id,
+                    winner=comparison_criterion.comparison_pair_winner()
                 ))
 
-                round_scores.append([answer.user_id, answer.id, None, 'Overall',
-                    score.score, score.rounds, score.wins,
-                    score.loses, score.opponents])
-
-                comparison_criteria = comparison.comparison_criteria
-                comparison_criteria.sort(key=lambda x: x.criterion_id)
-                for comparison_criterion in comparison_criteria:
-                    criterion = next(criterion for criterion in criteria if criterion.id == comparison_criterion.criterion_id)
-                    criterion_score = scores[criterion.id].get(answer.id, ScoredObject(
-                        key=answer2_id,
-                        score=elo.INITIAL,
-                        variable1=elo.INITIAL,
-                        variable2=None,
-                        rounds=0,
-                        wins=0,
-                        loses=0,
-                        opponents=0
-                    ))
-
-                    round_scores.append([answer.user_id, answer.id, criterion.id, criterion.name,
-                        criterion_score.score, criterion_score.rounds, criterion_score.wins,
-                        criterion_score.loses, criterion_score.opponents])
-
-            write_csv(
-                file_name + 'scores_round_' + str(round_number) + '.csv',
-                ['User Id', 'Answer Id', 'Criterion Id', 'Criterion', 'Score', 'Rounds', 'Wins', 'Loses', 'Opponents'],
-                round_scores
-            )
+                winner_id = None
+                if comparison_criterion.winner == WinningAnswer.answer1:
+                    winner_id = answer1_id
+                elif comparison_criterion.winner == WinningAnswer.answer2:
+                    winner_id = answer2_id
 
-    write_csv(
-        file_name + 'comparisons.csv',
-        ['User Id', 'Criterion Id', 'Criterion',
-         'Answer 1', 'Score 1 Before', 'Score 1 After',
-         'Answer 2', 'Score 2 Before', 'Score 2 After',
-         'Winner', 'Timestamp'],
-        comparisons_output
-    )
+                comparisons_writer.writerow([
+                    comparison.user_id, criterion.id, criterion.name,
+                    answer1_id, step.key1_before.score, step.key1_after.score,
+                    answer2_id, step.key2_before.score, step.key2_after.score,
+                    winner_id, comparison_criterion.modified
+                ])
+
+            if (index+1) % round_length < 1:
+                round_number += 1
+
+                round_scores = []
+                for answer in answers:
+                    score = replays['overall'].score(answer.id)
+
+                    round_scores.append([answer.user_id, answer.id, None, 'Overall',
+                        score.score, score.rounds, score.wins,
+                        score.loses, score.opponents])
+
+                    comparison_criteria = comparison.comparison_criteria
+                    comparison_criteria.sort(key=lambda x: x.criterion_id)
+                    for comparison_criterion in comparison_criteria:
+                        criterion = next(criterion for criterion in criteria if criterion.id == comparison_criterion.criterion_id)
+                        criterion_score = replays[criterion.id].score(answer.id)
+
+                        round_scores.append([answer.user_id, answer.id, criterion.id, criterion.name,
+                            criterion_score.score, criterion_score.rounds, criterion_score.wins,
+                            criterion_score.loses, criterion_score.opponents])
+
+                write_csv(
+                    file_name + 'scores_round_' + str(round_number) + '.csv',
+                    ['User Id', 'Answer Id', 'Criterion Id', 'Criterion', 'Score', 'Rounds', 'Wins', 'Loses', 'Opponents'],
+                    round_scores
+                )
 
 
     query = User.query \
@@ -361,14 +262,23 @@ def create(assignment_id):
 
 
 def write_csv(filename, headers, data):
-    with open(secure_filename(filename), 'wt') as csvfile:
-        report_writer = csv.writer(
-            csvfile, delimiter=',',
-            quotechar='"', quoting=csv.QUOTE_MINIMAL
-        )
-        report_writer.writerow(headers)
+    with csv_writer(filename, headers) as report_writer:
         for d in data:
             output = []
             for o in d:
                 output.append(o)
             report_writer.writerow(output)
+
+
+@contextmanager
+def csv_writer(filename, headers):
+    """
+    Opens filename and yields a csv writer, rows are written as they are produced
+    """
+    with open(secure_filename(filename), 'wb') as csvfile:
+        report_writer = csv.writer(
+            csvfile, delimiter=',',
+            quotechar='"', quoting=csv.QUOTE_MINIMAL
+        )
+        report_writer.writerow(headers)
+        yield report_writer
@@ -48,6 +48,9 @@ class AnswerCriterionScore(DefaultTableMixin, WriteTrackingMixin):
     wins = db.Column(db.Integer, default=0, nullable=False)
     loses = db.Column(db.Integer, default=0, nullable=False)
     opponents = db.Column(db.Integer, default=0, nullable=False)
+    # (score - min score) / (max score - min score) * 100 of the criterion in the assignment.
+    # maintained by update_normalized_scores (see calculated_normalized_score)
+    normalized_score = db.Column(db.Float, nullable=True)
 
     # relationships
     # assignment via Assignment Model
@@ -69,19 +72,83 @@ class AnswerCriterionScore(DefaultTableMixin, WriteTrackingMixin):
             opponents=self.opponents
         )
 
+    @classmethod
+    def update_normalized_scores(cls, assignment_id, answer_ids=None):
+        """
+        Updates stored normalized scores and the min/max score of every criterion in the assignment.
+        Only the scores of answer_ids are updated unless the criterion's min/max changed (or answer_ids is None)
+        """
+        from . import AssignmentCriterion
+        from .answer_score import normalized_score_expression
+
+        criteria_min_max = AnswerCriterionScore.query \
+            .with_entities(AnswerCriterionScore.criterion_id,
+                func.min(AnswerCriterionScore.score), func.max(AnswerCriterionScore.score)) \
+            .filter(AnswerCriterionScore.assignment_id == assignment_id) \
+            .group_by(AnswerCriterionScore.criterion_id) \
+            .all()
+
+        stored_criteria_min_max = {}
+        for (criterion_id, score_min, score_max) in AssignmentCriterion.query \
+                .with_entities(AssignmentCriterion.criterion_id,
+                    AssignmentCriterion.answer_score_min, AssignmentCriterion.answer_score_max) \
+                .filter(AssignmentCriterion.assignment_id == assignment_id) \
+                .all():
+            stored_criteria_min_max[criterion_id] = (score_min, score_max)
+
+        table = AnswerCriterionScore.__table__
+        assignment_criterion_table = AssignmentCriterion.__table__
+        for (criterion_id, score_min, score_max) in criteria_min_max:
+            min_max_changed = stored_criteria_min_max.get(criterion_id) != (score_min, score_max)
+
+            statement = table.update() \
+                .where(and_(
+                    table.c.assignment_id == assignment_id,
+                    table.c.criterion_id == criterion_id
+                )) \
+                .values(
+                    normalized_score=normalized_score_expression(table.c.score, score_min, score_max),
+                    modified=table.c.modified
+                )
+            if answer_ids != None and not min_max_changed:
+                statement = statement.where(table.c.answer_id.in_(answer_ids))
+            db.session.execute(statement)
+
+            if min_max_changed:
+                db.session.execute(assignment_criterion_table.update()
+                    .where(and_(
+                        assignment_criterion_table.c.assignment_id == assignment_id,
+                        assignment_criterion_table.c.criterion_id == criterion_id
+                    ))
+                    .values(
+                        answer_score_min=score_min,
+                        answer_score_max=score_max,
+                        modified=assignment_criterion_table.c.modified
+                    )
+                )
+
+        # core statements do not refresh objects already loaded in the session
+        for instance in list(db.session.identity_map.values()):
+            if isinstance(instance, AnswerCriterionScore):
+                db.session.expire(instance, ['normalized_score'])
+            elif isinstance(instance, AssignmentCriterion):
+                db.session.expire(instance, ['answer_score_min', 'answer_score_max'])
+
     @classmethod
     def __declare_last__(cls):
         super(cls, cls).__declare_last__()
 
+        # calculated on every load, only used to verify the stored normalized_score
         s_alias = cls.__table__.alias()
-        cls.normalized_score = column_property(
+        cls.calculated_normalized_score = column_property(
             select([
                 (cls.score - func.min(s_alias.c.score)) / (func.max(s_alias.c.score) - func.min(s_alias.c.score)) * 100
             ]).
             where(and_(
                 s_alias.c.criterion_id == cls.criterion_id,
                 s_alias.c.assignment_id == cls.assignment_id,
-            ))
+            )),
+            deferred=True
         )
 
     __table_args__ = (
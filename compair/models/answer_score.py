@@ -1,9 +1,14 @@
+import time
+import threading
+from bisect import bisect_left, bisect_right
+
 # sqlalchemy
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import column_property
-from sqlalchemy import func, select, and_, or_, join
+from sqlalchemy.orm import column_property, Session
+from sqlalchemy import func, select, and_, or_, join, event, inspect
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy_enum34 import EnumType
+from flask import current_app
 
 from compair.algorithms import ScoredObject
 
@@ -11,6 +16,11 @@ from . import *
 
 from compair.core import db
 
+# process level score rankings used by AnswerScore.rank and AnswerScore.get_score_for_rank
+# _score_rankings[assignment_id] = (built timestamp, assignment ranking_version, ascending list of active answer scores)
+_score_rankings = {}
+_score_ranking_lock = threading.RLock()
+
 class AnswerScore(DefaultTableMixin, WriteTrackingMixin):
     __tablename__ = 'answer_score'
 
@@ -46,6 +56,9 @@ class AnswerScore(DefaultTableMixin, WriteTrackingMixin):
     wins = db.Column(db.Integer, default=0, nullable=False)
     loses = db.Column(db.Integer, default=0, nullable=False)
     opponents = db.Column(db.Integer, default=0, nullable=False)
+    # (score - min score) / (max score - min score) * 100 of active answers in the assignment.
+    # maintained by update_normalized_scores (see calculated_normalized_score)
+    normalized_score = db.Column(db.Float, nullable=True)
 
     # relationships
     # assignment via Assignment Model
@@ -66,13 +79,8 @@ class AnswerScore(DefaultTableMixin, WriteTrackingMixin):
 
     @hybrid_property
     def rank(self):
-        scores = AnswerScore.get_assignment_scores(self.assignment_id)
-        for index, score in enumerate(scores):
-            if score.score == self.score:
-                return index + 1
-        return None
+        return AnswerScore.get_rank_for_score(AnswerScore.get_assignment_ranking(self.assignment_id), self.score)
 
-    # TODO: this should be cached
     @classmethod
     def get_assignment_scores(cls, assignment_id):
         return AnswerScore.query \
@@ -85,20 +93,188 @@ class AnswerScore(DefaultTableMixin, WriteTrackingMixin):
             .order_by(AnswerScore.score.desc()) \
             .all()
 
+    @classmethod
+    def get_assignment_ranking(cls, assignment_id):
+        """
+        Returns the scores of active answers in the assignment sorted in ascending order.
+        Rankings are cached per process for up to RANK_CACHE_TTL seconds and are only reused
+        while the assignment's ranking_version (incremented by every process changing its scores) is unchanged
+        """
+        return AnswerScore.get_assignment_rankings([assignment_id])[assignment_id]
+
+    @classmethod
+    def get_assignment_rankings(cls, assignment_ids):
+        """
+        Returns a dictionary of assignment_id -> ascending scores of active answers.
+        Cached rankings are reused and the others are read with a single query
+        """
+        from . import Assignment
+
+        ttl = current_app.config.get('RANK_CACHE_TTL', 0)
+        rankings = {}
+        versions = {}
+        if ttl > 0:
+            # read before the scores so that a ranking is never stored with a newer version than its scores
+            versions = dict(Assignment.query \
+                .with_entities(Assignment.id, Assignment.ranking_version) \
+                .filter(Assignment.id.in_(assignment_ids)) \
+                .all())
+            with _score_ranking_lock:
+                for assignment_id in assignment_ids:
+                    cached = _score_rankings.get(assignment_id)
+                    if cached and time.time() - cached[0] < ttl and cached[1] == versions.get(assignment_id):
+                        rankings[assignment_id] = cached[2]
+
+        missing_assignment_ids = [assignment_id for assignment_id in assignment_ids if assignment_id not in rankings]
+        if len(missing_assignment_ids) == 0:
+            return rankings
+
+        built_at = time.time()
+        for assignment_id in missing_assignment_ids:
+            rankings[assignment_id] = []
+        scores = AnswerScore.query \
+            .with_entities(AnswerScore.assignment_id, AnswerScore.score) \
+            .join("answer") \
+            .filter(and_(
+                Answer.active == True,
+                AnswerScore.assignment_id.in_(missing_assignment_ids)
+            )) \
+            .order_by(AnswerScore.score) \
+            .all()
+        for (assignment_id, score) in scores:
+            rankings[assignment_id].append(score)
+
+        if ttl > 0:
+            with _score_ranking_lock:
+                for assignment_id in missing_assignment_ids:
+                    _score_rankings[assignment_id] = (built_at, versions.get(assignment_id), rankings[assignment_id])
+        return rankings
+
+    @classmethod
+    def get_rank_for_score(cls, ranking, score):
+        """
+        Returns the rank of score in ranking (see get_assignment_ranking) or None if it is not ranked
+        """
+        index = bisect_left(ranking, score)
+        if index < len(ranking) and ranking[index] == score:
+            # tied scores share the highest rank
+            return len(ranking) - bisect_right(ranking, score) + 1
+        return None
+
+    @classmethod
+    def clear_assignment_ranking(cls, assignment_id=None):
+        """
+        Removes the cached ranking of the assignment (or of every assignment if assignment_id is None)
+        """
+        with _score_ranking_lock:
+            if assignment_id == None:
+                _score_rankings.clear()
+            else:
+                _score_rankings.pop(assignment_id, None)
+
+    @classmethod
+    def invalidate_assignment_ranking(cls, assignment_id, session=None, connection=None):
+        """
+        Clears the cached ranking now and again once the session commits
+        (rankings built before the commit would not include the changes).
+        The assignment's ranking_version is incremented once per transaction so that
+        other processes stop using their cached rankings once the changes are committed
+        """
+        from . import Assignment
+
+        session = session if session != None else db.session
+        AnswerScore.clear_assignment_ranking(assignment_id)
+        changed_assignment_ids = session.info.setdefault('changed_ranking_assignment_ids', set())
+        if assignment_id not in changed_assignment_ids:
+            table = Assignment.__table__
+            # flush events must use the connection of the flush
+            (connection if connection != None else session).execute(table.update()
+                .where(table.c.id == assignment_id)
+                .values(
+                    ranking_version=table.c.ranking_version + 1,
+                    modified=table.c.modified
+                )
+            )
+            changed_assignment_ids.add(assignment_id)
+
+    @classmethod
+    def update_normalized_scores(cls, assignment_id, answer_ids=None):
+        """
+        Updates stored normalized scores and the assignment's min/max answer score.
+        Only the scores of answer_ids are updated unless the min/max changed (or answer_ids is None)
+        """
+        from . import Assignment
+
+        (score_min, score_max) = AnswerScore.query \
+            .with_entities(func.min(AnswerScore.score), func.max(AnswerScore.score)) \
+            .join("answer") \
+            .filter(and_(
+                Answer.active == True,
+                AnswerScore.assignment_id == assignment_id
+            )) \
+            .one()
+
+        stored_min_max = Assignment.query \
+            .with_entities(Assignment.answer_score_min, Assignment.answer_score_max) \
+            .filter(Assignment.id == assignment_id) \
+            .one()
+        min_max_changed = tuple(stored_min_max) != (score_min, score_max)
+
+        table = AnswerScore.__table__
+        statement = table.update() \
+            .where(table.c.assignment_id == assignment_id) \
+            .values(
+                normalized_score=normalized_score_expression(table.c.score, score_min, score_max),
+                modified=table.c.modified
+            )
+        if answer_ids != None and not min_max_changed:
+            statement = statement.where(table.c.answer_id.in_(answer_ids))
+        db.session.execute(statement)
+
+        if min_max_changed:
+            db.session.execute(Assignment.__table__.update()
+                .where(Assignment.__table__.c.id == assignment_id)
+                .values(
+                    answer_score_min=score_min,
+                    answer_score_max=score_max,
+                    modified=Assignment.__table__.c.modified
+                )
+            )
+
+        # core statements do not refresh objects already loaded in the session
+        for instance in list(db.session.identity_map.values()):
+            if isinstance(instance, AnswerScore):
+                db.session.expire(instance, ['normalized_score'])
+            elif isinstance(instance, Assignment) and min_max_changed:
+                db.session.expire(instance, ['answer_score_min', 'answer_score_max'])
+
     @classmethod
     def get_score_for_rank(cls, assignment_id, rank):
-        scores = AnswerScore.get_assignment_scores(assignment_id)
+        scores = AnswerScore.get_assignment_ranking(assignment_id)
         if len(scores) < rank:
             return None
         else:
-            return scores[rank-1].score
+            return scores[len(scores) - rank]
 
     @classmethod
     def __declare_last__(cls):
         super(cls, cls).__declare_last__()
 
+        @event.listens_for(cls, 'after_insert')
+        @event.listens_for(cls, 'after_update')
+        @event.listens_for(cls, 'after_delete')
+        def receive_after_score_write(mapper, connection, target):
+            AnswerScore.invalidate_assignment_ranking(target.assignment_id, inspect(target).session, connection)
+
+        # rankings only include active answers
+        @event.listens_for(Answer, 'after_update')
+        def receive_after_answer_update(mapper, connection, target):
+            if inspect(target).attrs.active.history.has_changes():
+                AnswerScore.invalidate_assignment_ranking(target.assignment_id, inspect(target).session, connection)
+
+        # calculated on every load, only used to verify the stored normalized_score
         s_alias = cls.__table__.alias()
-        cls.normalized_score = column_property(
+        cls.calculated_normalized_score = column_property(
             select([
                 (cls.score - func.min(s_alias.c.score)) / (func.max(s_alias.c.score) - func.min(s_alias.c.score)) * 100
             ]).
@@ -106,9 +282,28 @@ class AnswerScore(DefaultTableMixin, WriteTrackingMixin):
             where(and_(
                 Answer.active == True,
                 s_alias.c.assignment_id == cls.assignment_id,
-            ))
+            )),
+            deferred=True
         )
 
     __table_args__ = (
         DefaultTableMixin.default_table_args
-    )
\ No newline at end of file
+    )
+
+@event.listens_for(Session, 'after_commit')
+def receive_after_commit(session):
+    for assignment_id in session.info.pop('changed_ranking_assignment_ids', set()):
+        AnswerScore.clear_assignment_ranking(assignment_id)
+
+# the ranking_version increments were rolled back, the next transaction changing scores increments them again
+@event.listens_for(Session, 'after_rollback')
+def receive_after_rollback(session):
+    session.info.pop('changed_ranking_assignment_ids', None)
+
+def normalized_score_expression(score_column, score_min, score_max):
+    """
+    (score - min) / (max - min) * 100 or NULL when all scores are the same (or there are none)
+    """
+    if score_min == None or score_max == None or score_max == score_min:
+        return None
+    return (score_column - score_min) / (score_max - score_min) * 100
@@ -42,6 +42,11 @@ class Assignment(DefaultTableMixin, UUIDMixin, ActiveMixin, WriteTrackingMixin):
     comparison_grade_weight = db.Column(db.Integer, default=1, nullable=False)
     self_evaluation_grade_weight = db.Column(db.Integer, default=1, nullable=False)
     peer_feedback_prompt = db.Column(db.Text)
+    # min/max score of active answers used for AnswerScore.normalized_score
+    answer_score_min = db.Column(db.Float, nullable=True)
+    answer_score_max = db.Column(db.Float, nullable=True)
+    # incremented whenever answer scores change so processes can tell their cached rankings are stale
+    ranking_version = db.Column(db.Integer, default=0, nullable=False)
 
     # relationships
     # user via User Model
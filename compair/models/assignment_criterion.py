@@ -17,6 +17,9 @@ class AssignmentCriterion(DefaultTableMixin, ActiveMixin, WriteTrackingMixin):
         nullable=False)
     position = db.Column(db.Integer)
     weight = db.Column(db.Integer, default=1, nullable=False)
+    # min/max answer criterion score used for AnswerCriterionScore.normalized_score
+    answer_score_min = db.Column(db.Float, nullable=True)
+    answer_score_max = db.Column(db.Float, nullable=True)
 
     # relationships
     # assignment many-to-many criterion with association assignment_criteria
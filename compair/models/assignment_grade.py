@@ -5,8 +5,9 @@ import pytz
 # sqlalchemy
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import column_property
-from sqlalchemy import func, select, and_, or_
+from sqlalchemy import func, select, and_, or_, bindparam
 from sqlalchemy.ext.hybrid import hybrid_property
+from flask_login import current_user
 
 from . import *
 
@@ -55,88 +56,29 @@ class AssignmentGrade(DefaultTableMixin, WriteTrackingMixin):
 
     @classmethod
     def calculate_grade(cls, assignment, user):
-        from . import Answer, Comparison, CourseRole, \
-            AnswerComment, AnswerCommentType, LTIOutcome
+        from . import CourseRole, LTIOutcome
 
         user_is_student = False
-        group_id = None
+        user_groups = {}
 
         for course_user in assignment.course.user_courses:
             if course_user.user_id != user.id:
                 continue
             user_is_student = course_user.course_role == CourseRole.student
-            group_id = course_user.group_id
+            if course_user.group_id:
+                user_groups[user.id] = course_user.group_id
             break
 
         if not user_is_student:
             return
 
-        user_answer_count = Answer.query \
-            .filter_by(
-                assignment_id=assignment.id,
-                user_id=user.id,
-                active=True,
-                practice=False,
-                draft=False
-            ) \
-            .count()
+        _update_assignment_grades(assignment, [user.id], user_groups)
 
-        group_answer_counts = 0
-        if group_id:
-            group_answer_counts = Answer.query \
-                .filter_by(
-                    assignment_id=assignment.id,
-                    active=True,
-                    practice=False,
-                    draft=False,
-                    group_id=group_id
-                ) \
-                .count()
-
-        comparison_count = Comparison.query \
-            .filter_by(
-                user_id=user.id,
-                assignment_id=assignment.id,
-                completed=True
-            ) \
-            .count()
-
-        self_evaluation_count = AnswerComment.query \
-            .join("answer") \
-            .filter(and_(
-                AnswerComment.user_id == user.id,
-                AnswerComment.active == True,
-                AnswerComment.comment_type == AnswerCommentType.self_evaluation,
-                AnswerComment.draft == False,
-                Answer.assignment_id == assignment.id,
-                Answer.active == True,
-                Answer.practice == False,
-                Answer.draft == False
-            )) \
-            .count()
-
-        answer_count = user_answer_count + group_answer_counts
-
-        grade = _calculate_assignment_grade(assignment,
-            answer_count, comparison_count, self_evaluation_count)
-
-        assignment_grade = AssignmentGrade.get_user_assignment_grade(assignment, user)
-        if assignment_grade == None:
-            assignment_grade = AssignmentGrade(
-                user_id=user.id,
-                assignment_id=assignment.id
-            )
-
-        assignment_grade.grade = grade
-        db.session.add(assignment_grade)
-        db.session.commit()
-
-        LTIOutcome.update_assignment_user_grade(assignment, user.id)
+        LTIOutcome.update_assignment_users_grades(assignment, [user.id])
 
     @classmethod
     def calculate_group_grade(cls, assignment, group):
-        from . import Answer, Comparison, CourseRole, \
-            AnswerComment, AnswerCommentType, LTIOutcome
+        from . import CourseRole, LTIOutcome
 
         student_ids = [course_user.user_id
             for course_user in assignment.course.user_courses
@@ -147,130 +89,22 @@ class AssignmentGrade(DefaultTableMixin, WriteTrackingMixin):
         if len(student_ids) == 0:
             return
 
-        user_answer_counts = Answer.query \
-            .with_entities(
-                Answer.user_id,
-                func.count(Answer.user_id).label('answer_count')
-            ) \
-            .filter_by(
-                assignment_id=assignment.id,
-                active=True,
-                practice=False,
-                draft=False
-            ) \
-            .filter(
-                Answer.user_id.in_(student_ids)
-            ) \
-            .group_by(Answer.user_id) \
-            .all()
-
-        group_answer_counts = Answer.query \
-            .with_entities(
-                Answer.group_id,
-                func.count(Answer.group_id).label('answer_count')
-            ) \
-            .filter_by(
-                assignment_id=assignment.id,
-                active=True,
-                practice=False,
-                draft=False,
-                group_id=group.id
-            ) \
-            .group_by(Answer.group_id) \
-            .all()
-
-        comparison_counts = Comparison.query \
-            .with_entities(
-                Comparison.user_id,
-                func.count(Comparison.user_id).label('comparison_count')
-            ) \
-            .filter_by(
-                assignment_id=assignment.id,
-                completed=True
-            ) \
-            .filter(
-                Comparison.user_id.in_(student_ids)
-            ) \
-            .group_by(Comparison.user_id) \
-            .all()
-
-        self_evaluation_counts = AnswerComment.query \
-            .with_entities(
-                AnswerComment.user_id,
-                func.count(AnswerComment.user_id).label('self_evaluation_count')
-            ) \
-            .join("answer") \
-            .filter(and_(
-                AnswerComment.active == True,
-                AnswerComment.comment_type == AnswerCommentType.self_evaluation,
-                AnswerComment.draft == False,
-                Answer.assignment_id == assignment.id,
-                Answer.active == True,
-                Answer.practice == False,
-                Answer.draft == False,
-                AnswerComment.user_id.in_(student_ids)
-            )) \
-            .group_by(AnswerComment.user_id) \
-            .all()
-
-        assignment_grades = AssignmentGrade.get_assignment_grades(assignment)
-        new_assignment_grades = []
-        for student_id in student_ids:
-            user_answer_count = next((result.answer_count for result in user_answer_counts
-                if result.user_id == student_id
-            ), 0)
-
-            group_answer_count = next((result.answer_count for result in group_answer_counts
-                if result.group_id == group.id
-            ), 0)
-
-            answer_count = user_answer_count + group_answer_count
-
-            comparison_count = next((result.comparison_count for result in comparison_counts
-                if result.user_id == student_id
-            ), 0)
-
-            self_evaluation_count = next((result.self_evaluation_count for result in self_evaluation_counts
-                if result.user_id == student_id
-            ), 0)
-
-            grade = _calculate_assignment_grade(assignment,
-                answer_count, comparison_count, self_evaluation_count)
-
-            assignment_grade = next((assignment_grade for assignment_grade in assignment_grades
-                if assignment_grade.user_id == student_id
-            ), None)
-
-            if assignment_grade == None:
-                assignment_grade = AssignmentGrade(
-                    user_id=student_id,
-                    assignment_id=assignment.id
-                )
-                new_assignment_grades.append(assignment_grade)
-
-            assignment_grade.grade = grade
-
-        db.session.add_all(assignment_grades + new_assignment_grades)
-        db.session.commit()
+        user_groups = { student_id: group.id for student_id in student_ids }
+        _update_assignment_grades(assignment, student_ids, user_groups)
 
         LTIOutcome.update_assignment_users_grades(assignment, student_ids)
 
     @classmethod
     def calculate_grades(cls, assignment):
-        from . import Answer, CourseRole, Comparison, \
-            AnswerComment, AnswerCommentType, LTIOutcome
+        from . import CourseRole, LTIOutcome
 
         student_ids = []
-        group_ids = set()
-
         user_groups = {}
         for course_user in assignment.course.user_courses:
             if course_user.course_role == CourseRole.student:
                 student_ids.append(course_user.user_id)
                 if course_user.group_id:
-                    group_ids.add(course_user.group_id)
                     user_groups[course_user.user_id] = course_user.group_id
-        group_ids = list(group_ids)
 
         # skip if there aren't any students
         if len(student_ids) == 0:
@@ -280,10 +114,46 @@ class AssignmentGrade(DefaultTableMixin, WriteTrackingMixin):
             LTIOutcome.update_assignment_grades(assignment)
             return
 
-        user_answer_counts = Answer.query \
+        _update_assignment_grades(assignment, student_ids, user_groups)
+
+        # don't update until passed the answer start date
+        if assignment.available:
+            LTIOutcome.update_assignment_users_grades(assignment, student_ids)
+
+def _update_assignment_grades(assignment, student_ids, user_groups):
+    """
+    Calculates and stores the assignment grades of student_ids using one grouped query
+    per count (answers, group answers, comparisons, self-evaluations).
+    user_groups: dictionary student_id -> group_id for students in a group
+    :return: list of user ids with a new or changed grade
+    """
+    from . import Answer, Comparison, AnswerComment, AnswerCommentType
+
+    group_ids = list(set(user_groups.values()))
+
+    user_answer_counts = dict(Answer.query \
+        .with_entities(
+            Answer.user_id,
+            func.count(Answer.user_id)
+        ) \
+        .filter_by(
+            assignment_id=assignment.id,
+            active=True,
+            practice=False,
+            draft=False
+        ) \
+        .filter(
+            Answer.user_id.in_(student_ids)
+        ) \
+        .group_by(Answer.user_id) \
+        .all())
+
+    group_answer_counts = {}
+    if len(group_ids) > 0:
+        group_answer_counts = dict(Answer.query \
             .with_entities(
-                Answer.user_id,
-                func.count(Answer.user_id).label('answer_count')
+                Answer.group_id,
+                func.count(Answer.group_id)
             ) \
             .filter_by(
                 assignment_id=assignment.id,
@@ -292,108 +162,125 @@ class AssignmentGrade(DefaultTableMixin, WriteTrackingMixin):
                 draft=False
             ) \
             .filter(
-                Answer.user_id.in_(student_ids)
-            ) \
-            .group_by(Answer.user_id) \
-            .all()
-
-        group_answer_counts = []
-        if len(group_ids) > 0:
-            group_answer_counts = Answer.query \
-                .with_entities(
-                    Answer.group_id,
-                    func.count(Answer.group_id).label('answer_count')
-                ) \
-                .filter_by(
-                    assignment_id=assignment.id,
-                    active=True,
-                    practice=False,
-                    draft=False
-                ) \
-                .filter(
-                    Answer.group_id.in_(group_ids)
-                ) \
-                .group_by(Answer.group_id) \
-                .all()
-
-        comparison_counts = Comparison.query \
-            .with_entities(
-                Comparison.user_id,
-                func.count(Comparison.user_id).label('comparison_count')
-            ) \
-            .filter_by(
-                assignment_id=assignment.id,
-                completed=True
-            ) \
-            .filter(
-                Comparison.user_id.in_(student_ids)
-            ) \
-            .group_by(Comparison.user_id) \
-            .all()
-
-        self_evaluation_counts = AnswerComment.query \
-            .with_entities(
-                AnswerComment.user_id,
-                func.count(AnswerComment.user_id).label('self_evaluation_count')
+                Answer.group_id.in_(group_ids)
             ) \
-            .join("answer") \
-            .filter(and_(
-                AnswerComment.active == True,
-                AnswerComment.comment_type == AnswerCommentType.self_evaluation,
-                AnswerComment.draft == False,
-                Answer.assignment_id == assignment.id,
-                Answer.active == True,
-                Answer.practice == False,
-                Answer.draft == False,
-                AnswerComment.user_id.in_(student_ids)
-            )) \
-            .group_by(AnswerComment.user_id) \
-            .all()
-
-        assignment_grades = AssignmentGrade.get_assignment_grades(assignment)
-        new_assignment_grades = []
-        for student_id in student_ids:
-            user_answer_count = next((result.answer_count for result in user_answer_counts
-                if result.user_id == student_id
-            ), 0)
-
-            group_id = user_groups.get(student_id)
-            group_answer_count = 0
-            if group_id:
-                group_answer_count = next((result.answer_count for result in group_answer_counts
-                    if result.group_id == group_id
-                ), 0)
-
-            answer_count = user_answer_count + group_answer_count
-
-            comparison_count = next((result.comparison_count for result in comparison_counts
-                if result.user_id == student_id
-            ), 0)
-
-            self_evaluation_count = next((result.self_evaluation_count for result in self_evaluation_counts
-                if result.user_id == student_id
-            ), 0)
-
-            grade = _calculate_assignment_grade(assignment,
-                answer_count, comparison_count, self_evaluation_count)
-
-            assignment_grade = next((assignment_grade for assignment_grade in assignment_grades
-                if assignment_grade.user_id == student_id
-            ), None)
-
-            if assignment_grade == None:
-                assignment_grade = AssignmentGrade(
-                    user_id=student_id,
-                    assignment_id=assignment.id
-                )
-                new_assignment_grades.append(assignment_grade)
-
-            assignment_grade.grade = grade
-
-        db.session.add_all(assignment_grades + new_assignment_grades)
-        db.session.commit()
-
-        LTIOutcome.update_assignment_grades(assignment)
+            .group_by(Answer.group_id) \
+            .all())
+
+    comparison_counts = dict(Comparison.query \
+        .with_entities(
+            Comparison.user_id,
+            func.count(Comparison.user_id)
+        ) \
+        .filter_by(
+            assignment_id=assignment.id,
+            completed=True
+        ) \
+        .filter(
+            Comparison.user_id.in_(student_ids)
+        ) \
+        .group_by(Comparison.user_id) \
+        .all())
+
+    self_evaluation_counts = dict(AnswerComment.query \
+        .with_entities(
+            AnswerComment.user_id,
+            func.count(AnswerComment.user_id)
+        ) \
+        .join("answer") \
+        .filter(and_(
+            AnswerComment.active == True,
+            AnswerComment.comment_type == AnswerCommentType.self_evaluation,
+            AnswerComment.draft == False,
+            Answer.assignment_id == assignment.id,
+            Answer.active == True,
+            Answer.practice == False,
+            Answer.draft == False,
+            AnswerComment.user_id.in_(student_ids)
+        )) \
+        .group_by(AnswerComment.user_id) \
+        .all())
+
+    user_grades = {}
+    for student_id in student_ids:
+        answer_count = user_answer_counts.get(student_id, 0)
+        group_id = user_groups.get(student_id)
+        if group_id:
+            answer_count += group_answer_counts.get(group_id, 0)
+
+        user_grades[student_id] = _calculate_assignment_grade(assignment, answer_count,
+            comparison_counts.get(student_id, 0), self_evaluation_counts.get(student_id, 0))
+
+    changed_user_ids = bulk_upsert_grades(AssignmentGrade, 'assignment_id', assignment.id, user_grades)
+    db.session.commit()
+
+    return changed_user_ids
+
+def bulk_upsert_grades(model, parent_column_name, parent_id, user_grades):
+    """
+    Inserts or updates the grades of model (AssignmentGrade or CourseGrade) for parent_id
+    with one insert and one update executemany. Unchanged grades are not written.
+    user_grades: dictionary user_id -> grade
+    :return: list of user ids with a new or changed grade
+    """
+    if len(user_grades) == 0:
+        return []
+
+    table = model.__table__
+
+    existing_grades = {}
+    existing_rows = db.session.execute(
+        select([table.c.id, table.c.user_id, table.c.grade])
+        .where(and_(
+            table.c[parent_column_name] == parent_id,
+            table.c.user_id.in_(list(user_grades.keys()))
+        ))
+    )
+    for existing_row in existing_rows:
+        existing_grades[existing_row['user_id']] = (existing_row['id'], existing_row['grade'])
+
+    now = datetime.datetime.utcnow()
+    modified_user_id = current_user.id if current_user and current_user.is_authenticated else None
+
+    changed_user_ids = []
+    insert_rows = []
+    update_rows = []
+    for user_id, grade in user_grades.items():
+        existing_grade = existing_grades.get(user_id)
+        if existing_grade == None:
+            insert_rows.append({
+                parent_column_name: parent_id,
+                'user_id': user_id,
+                'grade': grade,
+                'created': now,
+                'created_user_id': modified_user_id,
+                'modified': now,
+                'modified_user_id': modified_user_id
+            })
+        # grades may be stored with single precision floats
+        elif abs(existing_grade[1] - grade) > 0.000001:
+            update_rows.append({
+                'grade_id': existing_grade[0],
+                'grade': grade,
+                'modified': now,
+                'modified_user_id': modified_user_id
+            })
+        else:
+            continue
+        changed_user_ids.append(user_id)
+
+    if len(insert_rows) > 0:
+        db.session.execute(table.insert(), insert_rows)
+    if len(update_rows) > 0:
+        db.session.execute(table.update().where(table.c.id == bindparam('grade_id')), update_rows)
+
+    # grade objects already loaded in the session are not refreshed by core statements
+    if len(changed_user_ids) > 0:
+        for instance in list(db.session.identity_map.values()):
+            if isinstance(instance, model):
+                db.session.expire(instance)
+
+    return changed_user_ids
 
 def _calculate_assignment_grade(assignment, answer_count, comparison_count, self_evaulation_count):
     grade = 0.0
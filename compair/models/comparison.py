@@ -1,9 +1,15 @@
+import time
+import threading
+from datetime import datetime
+
 # sqlalchemy
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import load_only
-from sqlalchemy import func, select, and_, or_
+from sqlalchemy import func, select, and_, or_, bindparam
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.hybrid import hybrid_property
 from flask import current_app
+from flask_login import current_user
 from sqlalchemy_enum34 import EnumType
 
 from . import *
@@ -11,9 +17,14 @@ from importlib import import_module
 
 from compair.core import db
 from compair.algorithms import ScoredObject, ComparisonPair, ComparisonWinner
-from compair.algorithms.pair import generate_pair
+from compair.algorithms.pair import generate_pair, PairingIndex
 from compair.algorithms.score import calculate_score, calculate_score_1vs1
 
+# process level pairing indexes used when PAIRING_INDEX_ENABLED is set
+# _pairing_indexes[assignment_id] = (pairing_algorithm, built timestamp, PairingIndex)
+_pairing_indexes = {}
+_pairing_index_lock = threading.RLock()
+
 
 class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin):
     __tablename__ = 'comparison'
@@ -32,6 +43,8 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
         nullable=True)
     round_compared = db.Column(db.Integer, default=0, nullable=False)
     completed = db.Column(db.Boolean(), default=False, nullable=False, index=True)
+    # completed comparison waiting on asynchronous score and grade updates (ASYNC_SCORE_UPDATES_ENABLED)
+    score_pending = db.Column(db.Boolean(), default=False, nullable=False, index=True)
     pairing_algorithm = db.Column(EnumType(PairingAlgorithm), nullable=True, default=PairingAlgorithm.random)
 
     # relationships
@@ -123,6 +136,10 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
         ineligible_user_ids = [ineligible.user_id for ineligible in ineligibles]
         ineligible_user_ids.append(user_id)
 
+        if current_app.config.get('PAIRING_INDEX_ENABLED', False):
+            return Comparison._get_new_comparison_pair_from_index(assignment_id, user_id,
+                group_id, pairing_algorithm, comparisons, ineligible_user_ids)
+
         query = Answer.query \
             .with_entities(Answer, AnswerScore.score) \
             .outerjoin(AnswerScore, AnswerScore.answer_id == Answer.id) \
@@ -207,6 +224,165 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
 
         return comparison_pair
 
+    @classmethod
+    def _get_new_comparison_pair_from_index(cls, assignment_id, user_id, group_id,
+                                pairing_algorithm, comparisons, ineligible_user_ids):
+        from . import Answer
+
+        # answers by the current user, dropped users, and the user's group cannot be compared
+        excluded_filters = [Answer.user_id.in_(ineligible_user_ids)]
+        if group_id:
+            excluded_filters.append(Answer.group_id == group_id)
+
+        excluded_answers = Answer.query \
+            .with_entities(Answer.id) \
+            .filter(and_(
+                Answer.assignment_id == assignment_id,
+                or_(*excluded_filters)
+            )) \
+            .all()
+        excluded_keys = set([excluded_answer.id for excluded_answer in excluded_answers])
+
+        with _pairing_index_lock:
+            pairing_index = Comparison._get_pairing_index(assignment_id, pairing_algorithm)
+            pairing_index.set_comparison_pairs(user_id,
+                [comparison.convert_to_comparison_pair() for comparison in comparisons])
+
+            while True:
+                comparison_pair = pairing_index.generate_pair(
+                    package_name=pairing_algorithm.value,
+                    comparer=user_id,
+                    excluded_keys=excluded_keys
+                )
+
+                # the index might be stale if answers were modified by another process
+                valid_answers = Answer.query \
+                    .with_entities(Answer.id) \
+                    .filter(and_(
+                        Answer.id.in_([comparison_pair.key1, comparison_pair.key2]),
+                        Answer.active == True,
+                        Answer.practice == False,
+                        Answer.draft == False,
+                        Answer.comparable == True
+                    )) \
+                    .all()
+                valid_answer_ids = set([valid_answer.id for valid_answer in valid_answers])
+
+                if len(valid_answer_ids) == 2:
+                    return comparison_pair
+
+                for key in [comparison_pair.key1, comparison_pair.key2]:
+                    if key not in valid_answer_ids:
+                        pairing_index.remove_scored_object(key)
+
+    @classmethod
+    def _get_pairing_index(cls, assignment_id, pairing_algorithm):
+        """
+        Returns the assignment's pairing index, (re)building it if it is missing or expired
+        """
+        with _pairing_index_lock:
+            cached = _pairing_indexes.get(assignment_id)
+            ttl = current_app.config.get('PAIRING_INDEX_TTL', 60)
+            if cached == None or cached[0] != pairing_algorithm or time.time() - cached[1] > ttl:
+                cached = (pairing_algorithm, time.time(),
+                    Comparison._build_pairing_index(assignment_id, pairing_algorithm))
+                _pairing_indexes[assignment_id] = cached
+            return cached[2]
+
+    @classmethod
+    def _build_pairing_index(cls, assignment_id, pairing_algorithm):
+        from . import Answer, AnswerScore, PairingAlgorithm, \
+            AnswerCriterionScore, AssignmentCriterion
+
+        answers_with_score = Answer.query \
+            .with_entities(Answer.id, Answer.round, AnswerScore.score) \
+            .outerjoin(AnswerScore, AnswerScore.answer_id == Answer.id) \
+            .filter(and_(
+                Answer.assignment_id == assignment_id,
+                Answer.active == True,
+                Answer.practice == False,
+                Answer.draft == False,
+                Answer.comparable == True
+            )) \
+            .all()
+
+        pairing_index = PairingIndex()
+        pairing_index.log = current_app.logger
+        for answer_with_score in answers_with_score:
+            pairing_index.add_scored_object(ScoredObject(
+                key=answer_with_score.id,
+                score=answer_with_score.score,
+                rounds=answer_with_score.round,
+                variable1=None, variable2=None,
+                wins=None, loses=None, opponents=None
+            ))
+
+        # adaptive min delta algo requires extra criterion specific parameters
+        if pairing_algorithm == PairingAlgorithm.adaptive_min_delta:
+            answer_criterion_scores = AnswerCriterionScore.query \
+                .with_entities(AnswerCriterionScore.answer_id,
+                    AnswerCriterionScore.criterion_id, AnswerCriterionScore.score) \
+                .join(Answer) \
+                .filter(and_(
+                    Answer.assignment_id == assignment_id,
+                    Answer.active == True,
+                    Answer.practice == False,
+                    Answer.draft == False
+                )) \
+                .all()
+
+            assignment_criterion_weights = AssignmentCriterion.query \
+                .with_entities(AssignmentCriterion.criterion_id, AssignmentCriterion.weight) \
+                .filter(and_(
+                    AssignmentCriterion.assignment_id == assignment_id,
+                    AssignmentCriterion.active == True
+                )) \
+                .all()
+
+            for criterion_score in answer_criterion_scores:
+                pairing_index.update_criterion_score(criterion_score.answer_id,
+                    criterion_score.criterion_id, criterion_score.score)
+
+            for the_weight in assignment_criterion_weights:
+                pairing_index.criterion_weights[the_weight.criterion_id] = \
+                    the_weight.weight
+
+        return pairing_index
+
+    @classmethod
+    def _get_loaded_pairing_index(cls, assignment_id):
+        """
+        Returns the assignment's pairing index if it has already been built by this process
+        """
+        cached = _pairing_indexes.get(assignment_id)
+        return cached[2] if cached else None
+
+    @classmethod
+    def clear_pairing_index(cls, assignment_id):
+        with _pairing_index_lock:
+            _pairing_indexes.pop(assignment_id, None)
+
+    @classmethod
+    def update_pairing_index_answer(cls, answer):
+        """
+        Adds, updates, or removes an answer from its assignment's pairing index (if loaded)
+        """
+        with _pairing_index_lock:
+            pairing_index = Comparison._get_loaded_pairing_index(answer.assignment_id)
+            if not pairing_index:
+                return
+
+            if answer.active and not answer.practice and not answer.draft and answer.comparable:
+                pairing_index.add_scored_object(ScoredObject(
+                    key=answer.id,
+                    score=answer.score.score if answer.score else None,
+                    rounds=answer.round,
+                    variable1=None, variable2=None,
+                    wins=None, loses=None, opponents=None
+                ))
+            else:
+                pairing_index.remove_scored_object(answer.id)
+
     @classmethod
     def create_new_comparison(cls, assignment_id, user_id, skip_comparison_examples):
         from . import Assignment, ComparisonExample, ComparisonCriterion, \
@@ -302,6 +478,15 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
             db.session.add(comparison)
         db.session.commit()
 
+        if not is_comparison_example_set:
+            with _pairing_index_lock:
+                pairing_index = Comparison._get_loaded_pairing_index(assignment_id)
+                if pairing_index:
+                    pairing_index.add_comparison_pair(user_id, ComparisonPair(
+                        key1=answer1.id, key2=answer2.id, winner=None))
+                    for answer in [answer1, answer2]:
+                        pairing_index.update_rounds(answer.id, answer.round)
+
         return comparison
 
     @classmethod
@@ -350,23 +535,25 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
             )) \
             .all()
 
+        scores_by_answer_id = {score.answer_id: score for score in scores}
+        criteria_scores_by_key = {
+            (criterion_score.answer_id, criterion_score.criterion_id): criterion_score
+            for criterion_score in criteria_scores
+        }
+
         #update answer criterion scores
-        updated_criteria_scores = []
+        criterion_comparison_results = {}
         for comparison_criterion in comparison.comparison_criteria:
             criterion_id = comparison_criterion.criterion_id
 
-            criterion_score1 = next((criterion_score for criterion_score in criteria_scores
-                if criterion_score.answer_id == answer1_id and criterion_score.criterion_id == criterion_id),
+            criterion_score1 = criteria_scores_by_key.get((answer1_id, criterion_id),
                 AnswerCriterionScore(assignment_id=assignment.id, answer_id=answer1_id, criterion_id=criterion_id)
             )
-            updated_criteria_scores.append(criterion_score1)
             key1_scored_object = criterion_score1.convert_to_scored_object()
 
-            criterion_score2 = next((criterion_score for criterion_score in criteria_scores
-                if criterion_score.answer_id == answer2_id and criterion_score.criterion_id == criterion_id),
+            criterion_score2 = criteria_scores_by_key.get((answer2_id, criterion_id),
                 AnswerCriterionScore(assignment_id=assignment.id, answer_id=answer2_id, criterion_id=criterion_id)
             )
-            updated_criteria_scores.append(criterion_score2)
             key2_scored_object = criterion_score2.convert_to_scored_object()
 
             criterion_result_1, criterion_result_2 = calculate_score_1vs1(
@@ -380,25 +567,18 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
                 log=current_app.logger
             )
 
-            for score, result in [(criterion_score1, criterion_result_1), (criterion_score2, criterion_result_2)]:
-                score.score = result.score
-                score.variable1 = result.variable1
-                score.variable2 = result.variable2
-                score.rounds = result.rounds
-                score.wins = result.wins
-                score.loses = result.loses
-                score.opponents = result.opponents
-
-        updated_scores = []
-        score1 = next((score for score in scores if score.answer_id == answer1_id),
+            criterion_comparison_results[criterion_id] = {
+                answer1_id: criterion_result_1,
+                answer2_id: criterion_result_2
+            }
+
+        score1 = scores_by_answer_id.get(answer1_id,
             AnswerScore(assignment_id=assignment.id, answer_id=answer1_id)
         )
-        updated_scores.append(score1)
         key1_scored_object = score1.convert_to_scored_object()
-        score2 = next((score for score in scores if score.answer_id == answer2_id),
+        score2 = scores_by_answer_id.get(answer2_id,
             AnswerScore(assignment_id=assignment.id, answer_id=answer2_id)
         )
-        updated_scores.append(score2)
         key2_scored_object = score2.convert_to_scored_object()
 
         result_1, result_2 = calculate_score_1vs1(
@@ -409,21 +589,72 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
             other_comparison_pairs=[c.convert_to_comparison_pair() for c in other_comparisons],
             log=current_app.logger
         )
-
-        for score, result in [(score1, result_1), (score2, result_2)]:
-            score.score = result.score
-            score.variable1 = result.variable1
-            score.variable2 = result.variable2
-            score.rounds = result.rounds
-            score.wins = result.wins
-            score.loses = result.loses
-            score.opponents = result.opponents
-
-        db.session.add_all(updated_criteria_scores)
-        db.session.add_all(updated_scores)
+        comparison_results = {
+            answer1_id: result_1,
+            answer2_id: result_2
+        }
+
+        upsert_answer_criteria_scores(assignment.id, criterion_comparison_results)
+        upsert_answer_scores(assignment.id, comparison_results)
+        AnswerCriterionScore.update_normalized_scores(assignment.id, [answer1_id, answer2_id])
+        AnswerScore.update_normalized_scores(assignment.id, [answer1_id, answer2_id])
         db.session.commit()
 
-        return updated_scores
+        with _pairing_index_lock:
+            pairing_index = Comparison._get_loaded_pairing_index(assignment.id)
+            if pairing_index:
+                for answer_id, result in comparison_results.items():
+                    pairing_index.update_score(answer_id, float(result.score))
+                for criterion_id, criterion_comparison_result in criterion_comparison_results.items():
+                    for answer_id, result in criterion_comparison_result.items():
+                        pairing_index.update_criterion_score(answer_id, criterion_id, float(result.score))
+
+        return [result_1, result_2]
+
+    @classmethod
+    def update_pending_scores(cls, assignment_id):
+        """
+        Applies score updates for every comparison in the assignment flagged with score_pending.
+        The assignment row is locked before scores are read so that workers apply
+        comparisons one at a time and never calculate ratings from stale scores.
+        :return: set of user ids with updated comparisons
+        """
+        from . import Assignment
+
+        user_ids = set()
+        while True:
+            # end the previous transaction so that reads after the lock see the latest scores
+            db.session.commit()
+
+            Assignment.query \
+                .with_entities(Assignment.id) \
+                .filter(Assignment.id == assignment_id) \
+                .with_for_update() \
+                .first()
+
+            comparison = Comparison.query \
+                .filter(and_(
+                    Comparison.assignment_id == assignment_id,
+                    Comparison.completed == True,
+                    Comparison.score_pending == True
+                )) \
+                .order_by(Comparison.modified, Comparison.id) \
+                .first()
+
+            if not comparison:
+                db.session.commit()
+                break
+
+            user_ids.add(comparison.user_id)
+            comparison.score_pending = False
+
+            # update_scores_1vs1 commits the pending flag with the new scores
+            if comparison.comparison_example_id == None:
+                Comparison.update_scores_1vs1(comparison)
+            else:
+                db.session.commit()
+
+        return user_ids
 
     @classmethod
     def calculate_scores(cls, assignment_id):
@@ -442,14 +673,14 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
             .filter_by(assignment_id=assignment_id, active=True) \
             .all()
 
-        comparison_criteria = []
+        # criterion_comparison_pairs[criterion_id] = array of comparison_pairs
+        criterion_comparison_pairs = {}
 
         comparison_pairs = []
-        answer_ids = set()
         for comparison in comparisons:
-            answer_ids.add(comparison.answer1_id)
-            answer_ids.add(comparison.answer2_id)
-            comparison_criteria.extend(comparison.comparison_criteria)
+            for comparison_criterion in comparison.comparison_criteria:
+                criterion_comparison_pairs.setdefault(comparison_criterion.criterion_id, []) \
+                    .append(comparison_criterion.convert_to_comparison_pair())
             comparison_pairs.append(comparison.convert_to_comparison_pair())
 
         # calculate answer score
@@ -457,80 +688,135 @@ class Comparison(DefaultTableMixin, UUIDMixin, AttemptMixin, WriteTrackingMixin)
         comparison_results = calculate_score(
             package_name=assignment.scoring_algorithm.value,
             comparison_pairs=comparison_pairs,
+            backend=current_app.config.get('SCORING_BACKEND'),
             log=current_app.logger
         )
 
-        scores = AnswerScore.query \
-            .filter(AnswerScore.answer_id.in_(answer_ids)) \
-            .all()
-        updated_answer_scores = update_answer_scores(scores, assignment_id, comparison_results)
-        db.session.add_all(updated_answer_scores)
+        upsert_answer_scores(assignment_id, comparison_results)
 
         # calculate answer criterion scores
         criterion_comparison_results = {}
 
         for assignment_criterion in assignment_criteria:
-            comparison_pairs = []
-            for comparison_criterion in comparison_criteria:
-                if comparison_criterion.criterion_id != assignment_criterion.criterion_id:
-                    continue
-
-                comparison_pairs.append(comparison_criterion.convert_to_comparison_pair())
-
             criterion_comparison_results[assignment_criterion.criterion_id] = calculate_score(
                 package_name=assignment.scoring_algorithm.value,
-                comparison_pairs=comparison_pairs,
+                comparison_pairs=criterion_comparison_pairs.get(assignment_criterion.criterion_id, []),
+                backend=current_app.config.get('SCORING_BACKEND'),
                 log=current_app.logger
             )
 
-        scores = AnswerCriterionScore.query \
-            .filter(AnswerCriterionScore.answer_id.in_(answer_ids)) \
-            .all()
-        updated_answer_criteria_scores = update_answer_criteria_scores(scores, assignment_id, criterion_comparison_results)
-        db.session.add_all(updated_answer_criteria_scores)
+        upsert_answer_criteria_scores(assignment_id, criterion_comparison_results)
+
+        AnswerScore.update_normalized_scores(assignment_id)
+        AnswerCriterionScore.update_normalized_scores(assignment_id)
 
         db.session.commit()
 
-def update_answer_scores(scores, assignment_id, comparison_results):
+        # all scores changed, rebuild the pairing index on next use
+        Comparison.clear_pairing_index(assignment_id)
+
+def upsert_answer_scores(assignment_id, comparison_results):
+    """
+    Bulk inserts/updates answer scores without loading AnswerScore objects into the session
+    """
     from . import AnswerScore
 
-    updated_scores = []
+    rows = []
     for answer_id, comparison_results in comparison_results.items():
-        score = next((score for score in scores
-            if score.answer_id == answer_id),
-            AnswerScore(assignment_id=assignment_id, answer_id=answer_id)
-        )
-        updated_scores.append(score)
+        row = _score_row(comparison_results)
+        row.update(assignment_id=assignment_id, answer_id=answer_id)
+        rows.append(row)
 
-        score.score = comparison_results.score
-        score.variable1 = comparison_results.variable1
-        score.variable2 = comparison_results.variable2
-        score.rounds = comparison_results.rounds
-        score.wins = comparison_results.wins
-        score.loses = comparison_results.loses
-        score.opponents = comparison_results.opponents
+    _bulk_upsert_scores(AnswerScore, assignment_id, ['answer_id'], rows)
 
-    return updated_scores
+    # core statements skip the ORM events that invalidate cached rankings
+    AnswerScore.invalidate_assignment_ranking(assignment_id)
 
 
-def update_answer_criteria_scores(scores, assignment_id, criterion_comparison_results):
+def upsert_answer_criteria_scores(assignment_id, criterion_comparison_results):
+    """
+    Bulk inserts/updates answer criterion scores without loading AnswerCriterionScore objects into the session
+    """
     from . import AnswerCriterionScore
 
-    updated_scores = []
+    rows = []
     for criterion_id, criterion_comparison_result in criterion_comparison_results.items():
         for answer_id, comparison_results in criterion_comparison_result.items():
-            score = next((score for score in scores
-                if score.answer_id == answer_id and score.criterion_id == criterion_id),
-                AnswerCriterionScore(assignment_id=assignment_id, answer_id=answer_id, criterion_id=criterion_id)
-            )
-            updated_scores.append(score)
-
-            score.score = comparison_results.score
-            score.variable1 = comparison_results.variable1
-            score.variable2 = comparison_results.variable2
-            score.rounds = comparison_results.rounds
-            score.wins = comparison_results.wins
-            score.loses = comparison_results.loses
-            score.opponents = comparison_results.opponents
-
-    return updated_scores
\ No newline at end of file
+            row = _score_row(comparison_results)
+            row.update(assignment_id=assignment_id, answer_id=answer_id, criterion_id=criterion_id)
+            rows.append(row)
+
+    _bulk_upsert_scores(AnswerCriterionScore, assignment_id, ['answer_id', 'criterion_id'], rows)
+
+
+def _score_row(scored_object):
+    # Note: elo.Rating objects cannot be compared to None
+    return {
+        'score': float(scored_object.score),
+        'variable1': float(scored_object.variable1) if scored_object.variable1 is not None else None,
+        'variable2': float(scored_object.variable2) if scored_object.variable2 is not None else None,
+        'rounds': scored_object.rounds,
+        'wins': scored_object.wins,
+        'loses': scored_object.loses,
+        'opponents': scored_object.opponents
+    }
+
+
+def _bulk_upsert_scores(model, assignment_id, key_columns, rows):
+    """
+    Inserts or updates score rows matched on key_columns (a unique key of the table).
+    MySQL uses a single INSERT ... ON DUPLICATE KEY UPDATE executemany.
+    Other databases (ex: SQLite for tests) split rows into insert and update executemanys.
+    WriteTrackingMixin fields are set here since ORM events are skipped
+    """
+    if len(rows) == 0:
+        return
+
+    table = model.__table__
+
+    # score objects already loaded in the session are not refreshed by core statements (expire_on_commit is off)
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, model):
+            db.session.expire(instance)
+
+    now = datetime.utcnow()
+    user_id = current_user.id if current_user and current_user.is_authenticated else None
+    update_columns = ['score', 'variable1', 'variable2', 'rounds', 'wins', 'loses', 'opponents',
+        'modified', 'modified_user_id']
+    for row in rows:
+        row.update(modified=now, modified_user_id=user_id)
+
+    if db.session.bind.dialect.name == 'mysql':
+        for row in rows:
+            row.update(created=now, created_user_id=user_id)
+        statement = mysql_insert(table)
+        statement = statement.on_duplicate_key_update(
+            **{column: statement.inserted[column] for column in update_columns}
+        )
+        db.session.execute(statement, rows)
+        return
+
+    existing_ids = {}
+    existing_rows = db.session.execute(
+        select([table.c.id] + [table.c[column] for column in key_columns])
+        .where(table.c.assignment_id == assignment_id)
+    )
+    for existing_row in existing_rows:
+        existing_ids[tuple(existing_row[column] for column in key_columns)] = existing_row['id']
+
+    insert_rows = []
+    update_rows = []
+    for row in rows:
+        score_id = existing_ids.get(tuple(row[column] for column in key_columns))
+        if score_id == None:
+            row.update(created=now, created_user_id=user_id)
+            insert_rows.append(row)
+        else:
+            update_row = {column: row[column] for column in update_columns}
+            update_row['score_id'] = score_id
+            update_rows.append(update_row)
+
+    if len(insert_rows) > 0:
+        db.session.execute(table.insert(), insert_rows)
+    if len(update_rows) > 0:
+        db.session.execute(table.update().where(table.c.id == bindparam('score_id')), update_rows)
@@ -56,7 +56,7 @@ class CourseGrade(DefaultTableMixin, WriteTrackingMixin):
 
     @classmethod
     def calculate_grade(cls, course, user):
-        from . import AssignmentGrade, LTIOutcome, CourseRole
+        from . import LTIOutcome, CourseRole
 
         user_is_student = False
 
@@ -74,46 +74,21 @@ class CourseGrade(DefaultTableMixin, WriteTrackingMixin):
         if len(assignment_ids) == 0:
             CourseGrade.query \
                 .filter_by(course_id=course.id) \
-                .filter(CourseGrade.user_id.in_(student_ids)) \
+                .filter(CourseGrade.user_id == user.id) \
                 .delete()
-            LTIOutcome.update_course_users_grade(course, student_ids)
+            LTIOutcome.update_course_user_grade(course, user.id)
             return
 
         elif not user_is_student:
             return
 
-        # collect all of the students assignment grades
-        student_assignment_grades = {
-            # default grade of 0 in case assignment_grade record is missing
-            assignment_id: 0.0 for assignment_id in assignment_ids
-        }
-
-        assignment_grades = AssignmentGrade.query \
-            .filter_by(user_id=user.id) \
-            .filter(AssignmentGrade.assignment_id.in_(assignment_ids)) \
-            .all()
-        for assignment_grade in assignment_grades:
-            student_assignment_grades[assignment_grade.assignment_id] = assignment_grade.grade
+        _update_course_grades(course, [user.id], assignment_ids)
 
-        grade = _calculate_course_grade(course, student_assignment_grades)
-
-        course_grade = CourseGrade.get_user_course_grade(course, user)
-        if course_grade == None:
-            course_grade = CourseGrade(
-                user_id=user.id,
-                course_id=course.id
-            )
-
-        course_grade.grade = grade
-
-        db.session.add(course_grade)
-        db.session.commit()
-
-        LTIOutcome.update_course_user_grade(course, user.id)
+        LTIOutcome.update_course_users_grade(course, [user.id])
 
     @classmethod
     def calculate_group_grade(cls, course, group):
-        from . import CourseRole, AssignmentGrade, LTIOutcome
+        from . import CourseRole, LTIOutcome
 
         student_ids = [course_user.user_id
             for course_user in course.user_courses
@@ -132,52 +107,17 @@ class CourseGrade(DefaultTableMixin, WriteTrackingMixin):
             CourseGrade.query \
                 .filter_by(course_id=course.id) \
                 .filter(CourseGrade.user_id.in_(student_ids)) \
-                .delete()
+                .delete(synchronize_session='fetch')
             LTIOutcome.update_course_users_grade(course, student_ids)
             return
 
-        # collect all of the students assignment grades
-        student_assignment_grades = {}
-        for student_id in student_ids:
-            student_assignment_grades[student_id] = {}
-            for assignment_id in assignment_ids:
-                student_assignment_grades[student_id][assignment_id] = 0.0
-
-        assignment_grades = AssignmentGrade.query \
-            .filter(AssignmentGrade.assignment_id.in_(assignment_ids)) \
-            .filter(AssignmentGrade.user_id.in_(student_ids)) \
-            .all()
-        for assignment_grade in assignment_grades:
-            student_assignment_grades[assignment_grade.user_id][assignment_grade.assignment_id] = assignment_grade.grade
-
-        course_grades = CourseGrade.query \
-            .filter(CourseGrade.user_id.in_(student_ids)) \
-            .all()
-        new_course_grades = []
-        for student_id in student_ids:
-            grade = _calculate_course_grade(course, student_assignment_grades[student_id])
-
-            course_grade = next((course_grade for course_grade in course_grades
-                if course_grade.user_id == student_id
-            ), None)
-
-            if course_grade == None:
-                course_grade = CourseGrade(
-                    user_id=student_id,
-                    course_id=course.id
-                )
-                new_course_grades.append(course_grade)
-
-            course_grade.grade = grade
-
-        db.session.add_all(course_grades + new_course_grades)
-        db.session.commit()
+        _update_course_grades(course, student_ids, assignment_ids)
 
         LTIOutcome.update_course_users_grade(course, student_ids)
 
     @classmethod
     def calculate_grades(cls, course):
-        from . import CourseRole, AssignmentGrade, LTIOutcome
+        from . import CourseRole, LTIOutcome
 
         student_ids = [course_user.user_id
             for course_user in course.user_courses
@@ -195,42 +135,46 @@ class CourseGrade(DefaultTableMixin, WriteTrackingMixin):
             LTIOutcome.update_course_grades(course)
             return
 
-        # collect all of the students assignment grades
-        student_assignment_grades = {}
-        for student_id in student_ids:
-            student_assignment_grades[student_id] = {}
-            for assignment_id in assignment_ids:
-                student_assignment_grades[student_id][assignment_id] = 0.0
+        _update_course_grades(course, student_ids, assignment_ids)
 
-        assignment_grades = AssignmentGrade.query \
-            .filter(AssignmentGrade.assignment_id.in_(assignment_ids)) \
-            .filter(AssignmentGrade.user_id.in_(student_ids)) \
-            .all()
-        for assignment_grade in assignment_grades:
-            student_assignment_grades[assignment_grade.user_id][assignment_grade.assignment_id] = assignment_grade.grade
-
-        course_grades = CourseGrade.get_course_grades(course)
-        new_course_grades = []
-        for student_id in student_ids:
-            grade = _calculate_course_grade(course, student_assignment_grades[student_id])
-
-            course_grade = next((course_grade for course_grade in course_grades
-                if course_grade.user_id == student_id
-            ), None)
-
-            if course_grade == None:
-                course_grade = CourseGrade(
-                    user_id=student_id,
-                    course_id=course.id
-                )
-                new_course_grades.append(course_grade)
-
-            course_grade.grade = grade
-
-        db.session.add_all(course_grades + new_course_grades)
-        db.session.commit()
+        LTIOutcome.update_course_users_grade(course, student_ids)
 
-        LTIOutcome.update_course_grades(course)
+def _update_course_grades(course, student_ids, assignment_ids):
+    """
+    Calculates and stores the course grades of student_ids from their assignment grades (fetched in one query)
+    :return: list of user ids with a new or changed grade
+    """
+    from . import AssignmentGrade
+    from .assignment_grade import bulk_upsert_grades
+
+    # collect all of the students assignment grades
+    # default grade of 0 in case assignment_grade record is missing
+    student_assignment_grades = {
+        student_id: { assignment_id: 0.0 for assignment_id in assignment_ids }
+        for student_id in student_ids
+    }
+
+    assignment_grades = AssignmentGrade.query \
+        .with_entities(
+            AssignmentGrade.user_id,
+            AssignmentGrade.assignment_id,
+            AssignmentGrade.grade
+        ) \
+        .filter(AssignmentGrade.assignment_id.in_(assignment_ids)) \
+        .filter(AssignmentGrade.user_id.in_(student_ids)) \
+        .all()
+    for (user_id, assignment_id, grade) in assignment_grades:
+        student_assignment_grades[user_id][assignment_id] = grade
+
+    user_grades = {
+        student_id: _calculate_course_grade(course, student_assignment_grades[student_id])
+        for student_id in student_ids
+    }
+
+    changed_user_ids = bulk_upsert_grades(CourseGrade, 'course_id', course.id, user_grades)
+    db.session.commit()
+
+    return changed_user_ids
 
 def _calculate_course_grade(course, assignment_grades):
     grade = 0.0
@@ -12,6 +12,9 @@ class XAPILog(DefaultTableMixin, WriteTrackingMixin):
     # table columns
     statement = db.Column(db.Text)
     transmitted = db.Column(db.Boolean(), default=False, nullable=False, index=True)
+    # set while a task is sending the record to the LRS
+    claim_id = db.Column(db.String(32), nullable=True, index=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
 
     @classmethod
     def __declare_last__(cls):
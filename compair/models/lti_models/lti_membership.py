@@ -1,9 +1,13 @@
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from six import text_type
 
 # sqlalchemy
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy import func, select, and_, or_
+from sqlalchemy import func, select, and_, or_, bindparam
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy_enum34 import EnumType
 from flask_login import current_user
@@ -27,6 +31,9 @@ try:
 except ImportError:
     from urllib import urlencode
 
+# number of streamed members reconciled with each set of lookups and bulk writes
+MEMBERSHIP_SYNC_BATCH_SIZE = 100
+
 class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
     __tablename__ = 'lti_membership'
 
@@ -72,53 +79,115 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
 
     @classmethod
     def _update_membership_for_context(cls, lti_context, members):
-        from compair.models import SystemRole, CourseRole, \
-            LTIUser, LTIUserResourceLink
+        """
+        Syncs lti users, lti memberships, and lti user resource links of the context with members.
+        Members are reconciled in batches of MEMBERSHIP_SYNC_BATCH_SIZE as they are streamed from the
+        membership pages: existing lti users and memberships of each batch are loaded and only new or
+        changed rows are written. Removing memberships not seen and syncing lis_result_sourcedids
+        (only known once every resource link has been requested) wait until the last page.
+        :return: list of (lti_user, course_role) for every member
+        """
+        from compair.models import LTIUserResourceLink
+
+        lti_resource_links = {
+            lti_resource_link.resource_link_id: lti_resource_link
+            for lti_resource_link in lti_context.lti_resource_links
+        }
+        membership_table = LTIMembership.__table__
+
+        # a user listed more than once uses their last entry
+        lti_members = OrderedDict()
+        for batch in _batches(members, MEMBERSHIP_SYNC_BATCH_SIZE):
+            batch_members = LTIMembership._update_lti_users_for_context(lti_context, batch)
+
+            membership_rows = []
+            for (lti_user, course_role, member) in batch_members:
+                lti_members[lti_user.id] = (lti_user, course_role, member)
+                membership_rows.append({
+                    'lti_context_id': lti_context.id,
+                    'lti_user_id': lti_user.id,
+                    'roles': text_type(member.get('roles')),
+                    'lis_result_sourcedid': member.get('lis_result_sourcedid'),
+                    'lis_result_sourcedids': None,
+                    'course_role': course_role
+                })
+            # lis_result_sourcedids are synced after the last page
+            _bulk_sync_rows(LTIMembership,
+                and_(
+                    membership_table.c.lti_context_id == lti_context.id,
+                    membership_table.c.lti_user_id.in_([row['lti_user_id'] for row in membership_rows])
+                ),
+                ['lti_user_id'], membership_rows,
+                update_columns=['roles', 'lis_result_sourcedid', 'course_role'])
+            db.session.commit()
+
+        # sync lis_result_sourcedids and remove memberships of users no longer in the context
+        _bulk_sync_rows(LTIMembership, membership_table.c.lti_context_id == lti_context.id,
+            ['lti_user_id'], [{
+                'lti_user_id': lti_user.id,
+                'lis_result_sourcedids': json.dumps(member.get('lis_result_sourcedids')) if member.get('lis_result_sourcedids') else None
+            } for (lti_user, course_role, member) in lti_members.values()],
+            delete_missing=True)
+
+        # if membership includes lis_result_sourcedids, create/update lti user resource links
+        user_resource_link_rows = []
+        for (lti_user, course_role, member) in lti_members.values():
+            for lis_result_sourcedid_set in member.get('lis_result_sourcedids') or []:
+                lti_resource_link = lti_resource_links.get(lis_result_sourcedid_set['resource_link_id'])
+                if not lti_resource_link:
+                    continue
 
-        lti_resource_links = lti_context.lti_resource_links
+                user_resource_link_rows.append({
+                    'lti_resource_link_id': lti_resource_link.id,
+                    'lti_user_id': lti_user.id,
+                    'roles': text_type(member.get('roles')),
+                    'course_role': course_role,
+                    'lis_result_sourcedid': lis_result_sourcedid_set['lis_result_sourcedid']
+                })
+        if len(user_resource_link_rows) > 0:
+            lti_user_resource_link_table = LTIUserResourceLink.__table__
+            # roles and course_role are only set for new rows.
+            # a new lis_result_sourcedid needs the grade posted again
+            _bulk_sync_rows(LTIUserResourceLink,
+                lti_user_resource_link_table.c.lti_resource_link_id.in_(
+                    [lti_resource_link.id for lti_resource_link in lti_resource_links.values()]),
+                ['lti_user_id', 'lti_resource_link_id'], user_resource_link_rows,
+                update_columns=['lis_result_sourcedid'], reset_on_update={'last_posted_grade': None})
 
-        # remove old membership rows
-        LTIMembership.query \
-            .filter_by(
-                lti_context_id=lti_context.id
-            ) \
-            .delete()
+        db.session.commit()
 
-        # retrieve existing lti_user rows
-        user_ids = []
+        # core statements do not refresh rows already loaded in the session
+        _expire_loaded(LTIMembership)
+        _expire_loaded(LTIUserResourceLink)
+
+        return [(lti_user, course_role) for (lti_user, course_role, member) in lti_members.values()]
+
+    @classmethod
+    def _update_lti_users_for_context(cls, lti_context, members):
+        """
+        Creates or updates the lti users of a batch of members and links or generates their accounts
+        :return: list of (lti_user, course_role, member) for every member of the batch
+        """
+        from compair.models import SystemRole, CourseRole, LTIUser
+
+        # a user listed more than once uses their last entry
+        members_by_user_id = OrderedDict()
         for member in members:
-            user_ids.append(member['user_id'])
+            members_by_user_id[member.get('user_id')] = member
 
-        existing_lti_users = []
-        if len(user_ids) > 0:
-            existing_lti_users = LTIUser.query \
+        # retrieve existing lti_user rows
+        lti_users = {
+            lti_user.user_id: lti_user
+            for lti_user in LTIUser.query \
                 .filter(and_(
                     LTIUser.lti_consumer_id == lti_context.lti_consumer_id,
-                    LTIUser.user_id.in_(user_ids)
-                )) \
-                .all()
-
-        # get existing lti_user_resource_link if there there exists lti users and known resource links for context
-        existing_lti_user_resource_links = []
-        if len(existing_lti_users) > 0 and len(lti_resource_links) > 0:
-            lti_resource_link_ids = [lti_resource_link.id for lti_resource_link in lti_resource_links]
-            existing_lti_user_ids = [existing_lti_user.id for existing_lti_user in existing_lti_users]
-            existing_lti_user_resource_links = LTIUserResourceLink.query \
-                .filter(and_(
-                    LTIUserResourceLink.lti_resource_link_id.in_(lti_resource_link_ids),
-                    LTIUserResourceLink.lti_user_id.in_(existing_lti_user_ids)
+                    LTIUser.user_id.in_(list(members_by_user_id.keys()))
                 )) \
                 .all()
+        }
 
-        new_lti_users = []
-        new_lti_user_resource_links = []
-        lti_memberships = []
-        for member in members:
-            # get lti user if exists
-            lti_user = next(
-                (lti_user for lti_user in existing_lti_users if lti_user.user_id == member.get('user_id')),
-                None
-            )
+        lti_members = []
+        for user_id, member in members_by_user_id.items():
             roles = member.get('roles')
             has_instructor_role = any(
                 role.lower().find("instructor") >= 0 or
@@ -129,14 +198,16 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
             has_ta_role =  any(role.lower().find("teachingassistant") >= 0 for role in roles)
 
             # create lti user if doesn't exist
+            lti_user = lti_users.get(user_id)
             if not lti_user:
                 lti_user = LTIUser(
                     lti_consumer_id=lti_context.lti_consumer_id,
-                    user_id=member.get('user_id')
+                    user_id=user_id
                 )
-                new_lti_users.append(lti_user)
+                db.session.add(lti_user)
+                lti_users[user_id] = lti_user
 
-            # update/set fields if needed
+            # update/set fields if needed (unchanged values are not written)
             lti_user.system_role = SystemRole.instructor if has_instructor_role else SystemRole.student
             lti_user.lis_person_name_given = member.get('person_name_given')
             lti_user.lis_person_name_family = member.get('person_name_family')
@@ -152,119 +223,76 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
             if member.get('student_number'):
                 lti_user.student_number = member.get('student_number')
 
-            if not lti_user.is_linked_to_user() and lti_user.global_unique_identifier:
-                lti_user.generate_or_link_user_account()
-
             course_role = CourseRole.student
             if has_instructor_role:
                 course_role = CourseRole.instructor
             elif has_ta_role:
                 course_role = CourseRole.teaching_assistant
 
-            # create new lti membership row
-            lti_membership = LTIMembership(
-                lti_user=lti_user,
-                lti_context=lti_context,
-                roles=text_type(roles),
-                lis_result_sourcedid=member.get('lis_result_sourcedid'),
-                lis_result_sourcedids=json.dumps(member.get('lis_result_sourcedids')) if member.get('lis_result_sourcedids') else None,
-                course_role=course_role
-            )
-            lti_memberships.append(lti_membership)
-
-            # if membership includes lis_result_sourcedids, create/update lti user resource links
-            if member.get('lis_result_sourcedids'):
-                for lis_result_sourcedid_set in member.get('lis_result_sourcedids'):
-                    lti_resource_link = next(
-                        lti_resource_link for lti_resource_link in lti_resource_links
-                        if lti_resource_link.resource_link_id == lis_result_sourcedid_set['resource_link_id']
-                    )
+            lti_members.append((lti_user, course_role, member))
 
-                    if not lti_resource_link:
-                        continue
-
-                    lti_user_resource_link = None
-                    if len(existing_lti_user_resource_links) > 0 and lti_user.id:
-                        # get lti user resource link if exists
-                        lti_user_resource_link = next(
-                            (lti_user_resource_link for lti_user_resource_link in existing_lti_user_resource_links
-                            if lti_user_resource_link.lti_user_id == lti_user.id and lti_user_resource_link.lti_resource_link_id == lti_resource_link.id),
-                            None
-                        )
-
-                    # create new lti user resource link if needed
-                    if not lti_user_resource_link:
-                        lti_user_resource_link = LTIUserResourceLink(
-                            lti_resource_link=lti_resource_link,
-                            lti_user=lti_user,
-                            roles=text_type(roles),
-                            course_role=course_role
-                        )
-                        new_lti_user_resource_links.append(lti_user_resource_link)
-
-                    # finally update the lis_result_sourcedid value for the user resource link
-                    lti_user_resource_link.lis_result_sourcedid = lis_result_sourcedid_set['lis_result_sourcedid']
-
-        db.session.add_all(new_lti_users)
-        db.session.add_all(existing_lti_users)
-        db.session.add_all(lti_memberships)
-        db.session.add_all(new_lti_user_resource_links)
-        db.session.add_all(existing_lti_user_resource_links)
-
-        # save new lti users
+        # link or generate accounts with one user lookup (also saves new lti users)
+        LTIUser.generate_or_link_user_accounts([lti_user for (lti_user, course_role, member) in lti_members])
         db.session.commit()
 
-        return lti_memberships
+        return lti_members
 
     @classmethod
     def _update_enrollment_for_course(cls, course_id, lti_members):
-        from compair.models import UserCourse
-
-        user_courses = UserCourse.query \
-            .filter_by(course_id=course_id) \
-            .all()
-        new_user_courses = []
-
-        for lti_member in lti_members:
-            if lti_member.compair_user_id != None:
-                user_course = next(
-                    (user_course for user_course in user_courses if user_course.user_id == lti_member.compair_user_id),
-                    None
-                )
-                # add new user_course if doesn't exist
-                if user_course == None:
-                    user_course = UserCourse(
-                        course_id=course_id,
-                        user_id=lti_member.compair_user_id,
-                        course_role=lti_member.course_role
-                    )
-                    new_user_courses.append(user_course)
-
-                # update user_course role
-                else:
-                    user_course.course_role=lti_member.course_role
+        """
+        Enrols members (list of (lti_user, course_role)) in the course and drops missing users
+        """
+        from compair.models import UserCourse, User
+        from compair.authorization import invalidate_permissions
+
+        # preload linked accounts for profile updates (kept referenced so they stay in the identity map)
+        compair_user_ids = [lti_user.compair_user_id
+            for (lti_user, course_role) in lti_members if lti_user.compair_user_id != None]
+        compair_users = []
+        if len(compair_user_ids) > 0:
+            compair_users = User.query.filter(User.id.in_(compair_user_ids)).all()
+
+        user_course_rows = OrderedDict()
+        for (lti_user, course_role) in lti_members:
+            if lti_user.compair_user_id != None:
+                user_course_rows[lti_user.compair_user_id] = {
+                    'course_id': course_id,
+                    'user_id': lti_user.compair_user_id,
+                    'course_role': course_role
+                }
 
                 # update user profile if needed
-                lti_member.lti_user.update_user_profile()
-
-        db.session.add_all(new_user_courses)
-        db.session.commit()
+                lti_user.update_user_profile()
 
         # set user_course to dropped role if missing from membership results and not current user
-        for user_course in user_courses:
+        for (user_id, course_role) in UserCourse.query \
+                .with_entities(UserCourse.user_id, UserCourse.course_role) \
+                .filter(and_(
+                    UserCourse.course_id == course_id,
+                    UserCourse.course_role != CourseRole.dropped
+                )) \
+                .all():
             # never unenrol current_user
-            if current_user and current_user.is_authenticated and user_course.user_id == current_user.id:
+            if current_user and current_user.is_authenticated and user_id == current_user.id:
                 continue
 
-            lti_member = next(
-                (lti_member for lti_member in lti_members if user_course.user_id == lti_member.compair_user_id),
-                None
-            )
-            if lti_member == None:
-                user_course.course_role = CourseRole.dropped
+            if user_id not in user_course_rows:
+                user_course_rows[user_id] = {
+                    'course_id': course_id,
+                    'user_id': user_id,
+                    'course_role': CourseRole.dropped
+                }
 
+        _bulk_sync_rows(UserCourse, UserCourse.__table__.c.course_id == course_id,
+            ['user_id'], list(user_course_rows.values()), update_columns=['course_role'])
         db.session.commit()
 
+        # core statements do not refresh enrolments already loaded in the session
+        _expire_loaded(UserCourse)
+        _expire_loaded(Course, ['user_courses'])
+        _expire_loaded(User, ['user_courses'])
+        invalidate_permissions()
+
     @classmethod
     def _get_membership(cls, lti_context):
         if lti_context.membership_ext_enabled:
@@ -275,6 +303,9 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
 
     @classmethod
     def _get_membership_ext(cls, lti_context):
+        """
+        Yields the members of the memberships extension response
+        """
         lti_consumer = lti_context.lti_consumer
         memberships_id = lti_context.ext_ims_lis_memberships_id
         memberships_url = lti_context.ext_ims_lis_memberships_url
@@ -300,7 +331,6 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
         if root.find('memberships') == None or len(root.findall('memberships/member')) == 0:
             raise MembershipNoResultsException
 
-        members = []
         for record in root.findall('memberships/member'):
             roles_text = record.findtext('roles')
 
@@ -324,167 +354,132 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
             if lti_consumer.student_number_param and record.findtext(lti_consumer.student_number_param):
                 member['student_number'] = record.findtext(lti_consumer.student_number_param)
 
-            members.append(member)
-        return members
+            yield member
 
     @classmethod
     def _get_membership_service(cls, lti_context):
+        """
+        Yields the members of the membership service container as its pages are received.
+        The next page is requested while the current one is parsed. Members that were already
+        yielded receive their lis_result_sourcedids before the generator is exhausted
+        """
         # possible parameters are role, lis_result_sourcedid, limit
         lti_consumer = lti_context.lti_consumer
         memberships_url = lti_context.custom_context_memberships_url
         lti_resource_links = lti_context.lti_resource_links
 
-        members = []
-
-        while True:
-            headers = { 'Accept': 'application/vnd.ims.lis.v2.membershipcontainer+json' }
-            request = requests.Request('GET', memberships_url, headers=headers).prepare()
-            # Note: need to use LTIMemerbshipServiceOauthClient since normal client will
-            #       not include oauth_body_hash if there is not content type or the body is None
-            sign = OAuth1(lti_consumer.oauth_consumer_key, lti_consumer.oauth_consumer_secret,
-                signature_type=SIGNATURE_TYPE_AUTH_HEADER, signature_method=SIGNATURE_HMAC,
-                client_class=LTIMemerbshipServiceOauthClient)
-            # sign = OAuth1(lti_consumer.oauth_consumer_key, lti_consumer.oauth_consumer_secret,
-            #     signature_type=SIGNATURE_TYPE_AUTH_HEADER, signature_method=SIGNATURE_HMAC)
-            signed_request = sign(request)
-            headers = signed_request.headers
-            data = LTIMembership._get_membership_request(memberships_url, headers)
-
-            if data == None:
-                break
-
-            membership = data['pageOf']['membershipSubject']['membership']
-
-            if len(membership) == 0:
-                raise MembershipNoResultsException
-
-            for record in membership:
-                if record.get('status').find("Inactive") >= 0:
-                    continue
-                member = {
-                    'user_id': record['member'].get('userId'),
-                    'roles': record.get('role'),
-                    'lis_person_sourcedid': record['member'].get('sourcedId'),
-                    'global_unique_identifier': None,
-                    'student_number': None,
-                    'person_contact_email_primary': record['member'].get('email'),
-                    'person_name_given': record['member'].get('givenName'),
-                    'person_name_family': record['member'].get('familyName'),
-                    'person_name_full': record['member'].get('name')
-                }
-
-                if (lti_consumer.global_unique_identifier_param or lti_consumer.student_number_param) and 'message' in record:
-                    for message in record['message']:
-                        if not message['message_type'] == 'basic-lti-launch-request':
-                            continue
+        # Note: need to use LTIMemerbshipServiceOauthClient since normal client will
+        #       not include oauth_body_hash if there is not content type or the body is None
+        sign = OAuth1(lti_consumer.oauth_consumer_key, lti_consumer.oauth_consumer_secret,
+            signature_type=SIGNATURE_TYPE_AUTH_HEADER, signature_method=SIGNATURE_HMAC,
+            client_class=LTIMemerbshipServiceOauthClient)
 
-                        # find global unique identifier if present in membership result
-                        if lti_consumer.global_unique_identifier_param:
-                            # check if global_unique_identifier_param is a basic lti parameter
-                            if lti_consumer.global_unique_identifier_param in message:
-                                member['global_unique_identifier'] = message[lti_consumer.global_unique_identifier_param]
-                            # check if global_unique_identifier_param is an extension and present
-                            elif lti_consumer.global_unique_identifier_param.startswith('ext_'):
-                                ext_global_unique_identifier = lti_consumer.global_unique_identifier_param[len('ext_'):]
-                                if ext_global_unique_identifier in message['ext']:
-                                    member['global_unique_identifier'] = message['ext'][ext_global_unique_identifier]
-                            # check if global_unique_identifier_param is an custom attribute and present
-                            elif lti_consumer.global_unique_identifier_param.startswith('custom_'):
-                                custom_global_unique_identifier = lti_consumer.global_unique_identifier_param[len('custom_'):]
-                                if custom_global_unique_identifier in message['custom']:
-                                    member['global_unique_identifier'] = message['custom'][custom_global_unique_identifier]
-
-                        # get student number if present in membership result
-                        if lti_consumer.student_number_param:
-                            # check if student_number_param is a basic lti parameter
-                            if lti_consumer.student_number_param in message:
-                                member['student_number'] = message[lti_consumer.student_number_param]
-                            # check if student_number_param is an extension and present
-                            elif lti_consumer.student_number_param.startswith('ext_'):
-                                ext_student_number = lti_consumer.student_number_param[len('ext_'):]
-                                if ext_student_number in message['ext']:
-                                    member['student_number'] = message['ext'][ext_student_number]
-                            # check if student_number_param is an custom attribute and present
-                            elif lti_consumer.student_number_param.startswith('custom_'):
-                                custom_student_number = lti_consumer.student_number_param[len('custom_'):]
-                                if custom_student_number in message['custom']:
-                                    member['student_number'] = message['custom'][custom_student_number]
-
-                members.append(member)
-            # check if another page or else finish
-            memberships_url = data.get('nextPage')
-            if not memberships_url:
-                break
-
-        # get lis_result_sourcedid for all resource links known to the system
-        for lti_resource_link in lti_resource_links:
-            memberships_url = lti_context.custom_context_memberships_url
-            # add role t0 membership url query string
-            memberships_url += "?" if memberships_url.find("?") == -1 else "&"
-            memberships_url += "role=Learner"
-            # add rlid to membership url query string
-            memberships_url += "&rlid={}".format(lti_resource_link.resource_link_id)
-
-            while True:
-                headers = { 'Accept': 'application/vnd.ims.lis.v2.membershipcontainer+json' }
-                request = requests.Request('GET', memberships_url, headers=headers).prepare()
-                # Note: need to use LTIMemerbshipServiceOauthClient since normal client will
-                #       not include oauth_body_hash if there is not content type or the body is None
-                sign = OAuth1(lti_consumer.oauth_consumer_key, lti_consumer.oauth_consumer_secret,
-                    signature_type=SIGNATURE_TYPE_AUTH_HEADER, signature_method=SIGNATURE_HMAC,
-                    client_class=LTIMemerbshipServiceOauthClient)
-                # sign = OAuth1(lti_consumer.oauth_consumer_key, lti_consumer.oauth_consumer_secret,
-                #     signature_type=SIGNATURE_TYPE_AUTH_HEADER, signature_method=SIGNATURE_HMAC)
-                signed_request = sign(request)
-                headers = signed_request.headers
-                data = LTIMembership._get_membership_request(memberships_url, headers)
-
-                if data == None:
-                    break
+        members = {}
 
+        # a single worker keeps one page request in flight ahead of parsing
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for data in _get_membership_service_pages(executor, sign, memberships_url):
                 membership = data['pageOf']['membershipSubject']['membership']
 
                 if len(membership) == 0:
-                    continue
+                    raise MembershipNoResultsException
 
                 for record in membership:
                     if record.get('status').find("Inactive") >= 0:
                         continue
+                    member = {
+                        'user_id': record['member'].get('userId'),
+                        'roles': record.get('role'),
+                        'lis_person_sourcedid': record['member'].get('sourcedId'),
+                        'global_unique_identifier': None,
+                        'student_number': None,
+                        'person_contact_email_primary': record['member'].get('email'),
+                        'person_name_given': record['member'].get('givenName'),
+                        'person_name_family': record['member'].get('familyName'),
+                        'person_name_full': record['member'].get('name')
+                    }
+
+                    if (lti_consumer.global_unique_identifier_param or lti_consumer.student_number_param) and 'message' in record:
+                        for message in record['message']:
+                            if not message['message_type'] == 'basic-lti-launch-request':
+                                continue
+
+                            # find global unique identifier if present in membership result
+                            if lti_consumer.global_unique_identifier_param:
+                                # check if global_unique_identifier_param is a basic lti parameter
+                                if lti_consumer.global_unique_identifier_param in message:
+                                    member['global_unique_identifier'] = message[lti_consumer.global_unique_identifier_param]
+                                # check if global_unique_identifier_param is an extension and present
+                                elif lti_consumer.global_unique_identifier_param.startswith('ext_'):
+                                    ext_global_unique_identifier = lti_consumer.global_unique_identifier_param[len('ext_'):]
+                                    if ext_global_unique_identifier in message['ext']:
+                                        member['global_unique_identifier'] = message['ext'][ext_global_unique_identifier]
+                                # check if global_unique_identifier_param is an custom attribute and present
+                                elif lti_consumer.global_unique_identifier_param.startswith('custom_'):
+                                    custom_global_unique_identifier = lti_consumer.global_unique_identifier_param[len('custom_'):]
+                                    if custom_global_unique_identifier in message['custom']:
+                                        member['global_unique_identifier'] = message['custom'][custom_global_unique_identifier]
+
+                            # get student number if present in membership result
+                            if lti_consumer.student_number_param:
+                                # check if student_number_param is a basic lti parameter
+                                if lti_consumer.student_number_param in message:
+                                    member['student_number'] = message[lti_consumer.student_number_param]
+                                # check if student_number_param is an extension and present
+                                elif lti_consumer.student_number_param.startswith('ext_'):
+                                    ext_student_number = lti_consumer.student_number_param[len('ext_'):]
+                                    if ext_student_number in message['ext']:
+                                        member['student_number'] = message['ext'][ext_student_number]
+                                # check if student_number_param is an custom attribute and present
+                                elif lti_consumer.student_number_param.startswith('custom_'):
+                                    custom_student_number = lti_consumer.student_number_param[len('custom_'):]
+                                    if custom_student_number in message['custom']:
+                                        member['student_number'] = message['custom'][custom_student_number]
+
+                    # a user listed more than once uses their last entry
+                    members[member['user_id']] = member
+                    yield member
+
+            # get lis_result_sourcedid for all resource links known to the system
+            for lti_resource_link in lti_resource_links:
+                memberships_url = lti_context.custom_context_memberships_url
+                # add role t0 membership url query string
+                memberships_url += "?" if memberships_url.find("?") == -1 else "&"
+                memberships_url += "role=Learner"
+                # add rlid to membership url query string
+                memberships_url += "&rlid={}".format(lti_resource_link.resource_link_id)
+
+                for data in _get_membership_service_pages(executor, sign, memberships_url):
+                    membership = data['pageOf']['membershipSubject']['membership']
+
+                    for record in membership:
+                        if record.get('status').find("Inactive") >= 0:
+                            continue
 
-                    member = next(
-                        (member for member in members if member['user_id'] == record['member'].get('userId')),
-                        None
-                    )
+                        member = members.get(record['member'].get('userId'))
 
-                    if not member or not 'message' in record:
-                        continue
-
-                    for message in record['message']:
-                        if not message['message_type'] == 'basic-lti-launch-request' or not 'lis_result_sourcedid' in message:
+                        if not member or not 'message' in record:
                             continue
 
-                        lis_result_sourcedid_array = member.setdefault('lis_result_sourcedids', [])
-                        lis_result_sourcedid_array.append({
-                            'resource_link_id': lti_resource_link.resource_link_id,
-                            'lis_result_sourcedid': message['lis_result_sourcedid']
-                        })
-
-                # check if another page or else finish
-                memberships_url = data.get('nextPage')
-                if not memberships_url:
-                    break
+                        for message in record['message']:
+                            if not message['message_type'] == 'basic-lti-launch-request' or not 'lis_result_sourcedid' in message:
+                                continue
 
-        return members
+                            lis_result_sourcedid_array = member.setdefault('lis_result_sourcedids', [])
+                            lis_result_sourcedid_array.append({
+                                'resource_link_id': lti_resource_link.resource_link_id,
+                                'lis_result_sourcedid': message['lis_result_sourcedid']
+                            })
 
     @classmethod
     def _post_membership_request(cls, memberships_url, params):
         verify = current_app.config.get('ENFORCE_SSL', True)
-        return requests.post(memberships_url, data=params, verify=verify).text
+        return _get_membership_session().post(memberships_url, data=params, verify=verify).text
 
     @classmethod
     def _get_membership_request(cls, memberships_url, headers=None):
         verify = current_app.config.get('ENFORCE_SSL', True)
-        rv = requests.get(memberships_url, headers=headers, verify=verify)
+        rv = _get_membership_session().get(memberships_url, headers=headers, verify=verify)
         if rv.content:
             return rv.json()
         return None
@@ -497,4 +492,109 @@ class LTIMembership(DefaultTableMixin, WriteTrackingMixin):
         # prevent duplicate resource link in consumer
         db.UniqueConstraint('lti_context_id', 'lti_user_id', name='_unique_lti_context_and_lti_user'),
         DefaultTableMixin.default_table_args
-    )
\ No newline at end of file
+    )
+
+_membership_session = None
+_membership_session_lock = threading.Lock()
+
+def _get_membership_session():
+    """
+    Returns the requests session shared by membership requests so pages and
+    repeated syncs reuse pooled connections instead of opening one per request
+    """
+    global _membership_session
+    with _membership_session_lock:
+        if _membership_session == None:
+            _membership_session = requests.Session()
+    return _membership_session
+
+def _get_membership_service_pages(executor, sign, memberships_url):
+    """
+    Yields the json pages of a membership container starting at memberships_url.
+    Requests run on executor and the next page is requested as soon as its url is
+    known, so it is received while the caller parses the current page
+    """
+    app = current_app._get_current_object()
+
+    def submit(url):
+        headers = { 'Accept': 'application/vnd.ims.lis.v2.membershipcontainer+json' }
+        # requests are signed here since the signer is not shared between threads
+        signed_request = sign(requests.Request('GET', url, headers=headers).prepare())
+        return executor.submit(_get_membership_service_page, app, url, signed_request.headers)
+
+    future = submit(memberships_url)
+    while future != None:
+        data = future.result()
+        if data == None:
+            break
+
+        # check if another page or else finish
+        next_memberships_url = data.get('nextPage')
+        future = submit(next_memberships_url) if next_memberships_url else None
+        yield data
+
+def _get_membership_service_page(app, memberships_url, headers):
+    with app.app_context():
+        return LTIMembership._get_membership_request(memberships_url, headers)
+
+def _batches(items, batch_size):
+    """
+    Yields lists of up to batch_size items as they are received from items
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def _bulk_sync_rows(model, existing_filter, key_columns, rows, update_columns=None, delete_missing=False, reset_on_update=None):
+    """
+    Diffs rows against existing rows of model (matching existing_filter) indexed by key_columns.
+    New rows are inserted and rows with changed update_columns (default: all non key columns) are updated
+    with one executemany each. Unchanged rows are not written.
+    delete_missing: delete existing rows not in rows
+    reset_on_update: extra values written to updated rows
+    """
+    table = model.__table__
+    if update_columns == None:
+        update_columns = [column for column in rows[0].keys() if column not in key_columns] if len(rows) > 0 else []
+
+    existing_rows = {}
+    for existing_row in db.session.execute(
+            select([table.c.id] + [table.c[column] for column in key_columns + update_columns])
+            .where(existing_filter)):
+        existing_rows[tuple(existing_row[column] for column in key_columns)] = existing_row
+
+    now = datetime.utcnow()
+    modified_user_id = current_user.id if current_user and current_user.is_authenticated else None
+
+    insert_rows = []
+    update_rows = []
+    for row in rows:
+        existing_row = existing_rows.pop(tuple(row[column] for column in key_columns), None)
+        if existing_row == None:
+            insert_row = dict(row)
+            insert_row.update(created=now, created_user_id=modified_user_id,
+                modified=now, modified_user_id=modified_user_id)
+            insert_rows.append(insert_row)
+        elif any(existing_row[column] != row[column] for column in update_columns):
+            update_row = { column: row[column] for column in update_columns }
+            update_row.update(reset_on_update or {})
+            update_row.update(row_id=existing_row['id'], modified=now, modified_user_id=modified_user_id)
+            update_rows.append(update_row)
+
+    if len(insert_rows) > 0:
+        db.session.execute(table.insert(), insert_rows)
+    if len(update_rows) > 0:
+        db.session.execute(table.update().where(table.c.id == bindparam('row_id')), update_rows)
+    if delete_missing and len(existing_rows) > 0:
+        db.session.execute(table.delete().where(
+            table.c.id.in_([existing_row['id'] for existing_row in existing_rows.values()])))
+
+def _expire_loaded(model, attribute_names=None):
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, model):
+            db.session.expire(instance, attribute_names)
@@ -1,9 +1,16 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
 # sqlalchemy
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy import func, select, and_, or_
+from sqlalchemy import func, select, and_, or_, bindparam
 from sqlalchemy.ext.hybrid import hybrid_property
 from flask import current_app
 from lti.outcome_request import OutcomeRequest, REPLACE_REQUEST
+from lti.outcome_response import OutcomeResponse
+from requests_oauthlib import OAuth1
+from requests_oauthlib.oauth1_auth import SIGNATURE_TYPE_AUTH_HEADER
 
 from . import *
 
@@ -89,7 +96,7 @@ class LTIOutcome(object):
             return
 
         user_grades = {
-            assignment_grade.user_id: assignment_grade.id \
+            assignment_grade.user_id: assignment_grade \
                 for assignment_grade in assignment_grades
         }
 
@@ -111,9 +118,11 @@ class LTIOutcome(object):
                     continue
 
                 lis_result_sourcedid = lti_user_resource_link.lis_result_sourcedid
-                assignment_grade_id = user_grades.get(lti_user_resource_link.compair_user_id)
+                assignment_grade = user_grades.get(lti_user_resource_link.compair_user_id)
+                if not assignment_grade or _is_grade_posted(lti_user_resource_link.last_posted_grade, assignment_grade.grade):
+                    continue
 
-                resource_link_grades.append((lis_result_sourcedid, assignment_grade_id))
+                resource_link_grades.append((lis_result_sourcedid, assignment_grade.id))
 
             if len(resource_link_grades) == 0:
                 continue
@@ -204,7 +213,7 @@ class LTIOutcome(object):
             return
 
         user_grades = {
-            course_grade.user_id: course_grade.id for course_grade in course_grades
+            course_grade.user_id: course_grade for course_grade in course_grades
         }
 
         # generate requests
@@ -230,9 +239,11 @@ class LTIOutcome(object):
                     continue
 
                 lis_result_sourcedid = lti_user_resource_link.lis_result_sourcedid
-                course_grade_id = user_grades.get(lti_user_resource_link.compair_user_id)
+                course_grade = user_grades.get(lti_user_resource_link.compair_user_id)
+                if not course_grade or _is_grade_posted(lti_user_resource_link.last_posted_grade, course_grade.grade):
+                    continue
 
-                lti_context_grades.append((lis_result_sourcedid, course_grade_id))
+                lti_context_grades.append((lis_result_sourcedid, course_grade.id))
 
             if len(lti_context_grades) == 0:
                 continue
@@ -269,4 +280,166 @@ class LTIOutcome(object):
         else:
             current_app.logger.error("Failed grade update for lis_result_sourcedid: {} with grade: {}".format(lis_result_sourcedid, grade))
 
-        return request.was_outcome_post_successful()
\ No newline at end of file
+        return request.was_outcome_post_successful()
+
+    @classmethod
+    def post_grades(cls, lti_consumer, grade_model, sourcedid_and_grades):
+        """
+        Posts AssignmentGrade or CourseGrade (grade_model) records to the lti consumer.
+        sourcedid_and_grades: list of (lis_result_sourcedid, grade_model id)
+        grades are fetched in one query and grades unchanged since the last successful post are skipped
+        :return: tuple (posted count, failed count, unchanged count)
+        """
+        from compair.models import LTIResourceLink, LTIUserResourceLink
+
+        grade_ids = [grade_id for (lis_result_sourcedid, grade_id) in sourcedid_and_grades if grade_id]
+        grades = {}
+        if len(grade_ids) > 0:
+            grades = dict(grade_model.query \
+                .with_entities(grade_model.id, grade_model.grade) \
+                .filter(grade_model.id.in_(grade_ids)) \
+                .all())
+
+        lis_result_sourcedids = [lis_result_sourcedid
+            for (lis_result_sourcedid, grade_id) in sourcedid_and_grades if grade_id]
+        user_resource_links = {}
+        if len(lis_result_sourcedids) > 0:
+            for (lti_user_resource_link_id, lis_result_sourcedid, last_posted_grade) in LTIUserResourceLink.query \
+                    .with_entities(LTIUserResourceLink.id, LTIUserResourceLink.lis_result_sourcedid,
+                        LTIUserResourceLink.last_posted_grade) \
+                    .join("lti_resource_link") \
+                    .filter(and_(
+                        LTIResourceLink.lti_consumer_id == lti_consumer.id,
+                        LTIUserResourceLink.lis_result_sourcedid.in_(lis_result_sourcedids)
+                    )) \
+                    .all():
+                user_resource_links.setdefault(lis_result_sourcedid, []).append(
+                    (lti_user_resource_link_id, last_posted_grade))
+
+        unchanged_count = 0
+        sourcedid_grades = []
+        for (lis_result_sourcedid, grade_id) in sourcedid_and_grades:
+            if not grade_id:
+                continue
+            grade = grades.get(grade_id, 0.0)
+
+            links = user_resource_links.get(lis_result_sourcedid, [])
+            if len(links) > 0 and all(_is_grade_posted(last_posted_grade, grade)
+                    for (lti_user_resource_link_id, last_posted_grade) in links):
+                unchanged_count += 1
+                continue
+
+            sourcedid_grades.append((lis_result_sourcedid, grade))
+
+        posted_sourcedids = cls.post_replace_results(lti_consumer, sourcedid_grades)
+
+        # remember successfully posted grades
+        posted_grades = []
+        for (lis_result_sourcedid, grade) in sourcedid_grades:
+            if lis_result_sourcedid not in posted_sourcedids:
+                continue
+            for (lti_user_resource_link_id, last_posted_grade) in user_resource_links.get(lis_result_sourcedid, []):
+                posted_grades.append({
+                    'lti_user_resource_link_id': lti_user_resource_link_id,
+                    'last_posted_grade': grade
+                })
+        if len(posted_grades) > 0:
+            table = LTIUserResourceLink.__table__
+            db.session.execute(table.update()
+                .where(table.c.id == bindparam('lti_user_resource_link_id'))
+                .values(last_posted_grade=bindparam('last_posted_grade'), modified=table.c.modified),
+                posted_grades
+            )
+            db.session.commit()
+            for instance in list(db.session.identity_map.values()):
+                if isinstance(instance, LTIUserResourceLink):
+                    db.session.expire(instance, ['last_posted_grade'])
+
+        return (len(posted_sourcedids), len(sourcedid_grades) - len(posted_sourcedids), unchanged_count)
+
+    @classmethod
+    def post_replace_results(cls, lti_consumer, sourcedid_grades):
+        """
+        Posts many grades through one HTTP session with up to LTI_OUTCOME_POST_CONCURRENCY requests at a time
+        sourcedid_grades: list of (lis_result_sourcedid, grade). grade must be in range: [0.0, 1.0]
+        :return: set of lis_result_sourcedids posted successfully
+        """
+        posted_sourcedids = set()
+
+        if len(sourcedid_grades) == 0:
+            return posted_sourcedids
+        elif not lti_consumer.lis_outcome_service_url:
+            current_app.logger.error("Failed {} grade updates ... no lis_outcome_service_url".format(len(sourcedid_grades)))
+            return posted_sourcedids
+
+        valid_sourcedid_grades = []
+        for (lis_result_sourcedid, grade) in sourcedid_grades:
+            if not lis_result_sourcedid:
+                current_app.logger.error("Failed grade update ... no lis_result_sourcedid")
+            elif grade < 0.0 or grade > 1.0:
+                current_app.logger.error("Failed grade update for lis_result_sourcedid: {} grade not in [0.0, 1.0]: {}".format(lis_result_sourcedid, grade))
+            else:
+                valid_sourcedid_grades.append((lis_result_sourcedid, grade))
+
+        if len(valid_sourcedid_grades) == 0:
+            return posted_sourcedids
+
+        concurrency = current_app.config.get('LTI_OUTCOME_POST_CONCURRENCY', 1)
+        max_workers = max(1, min(concurrency, len(valid_sourcedid_grades)))
+
+        with requests.Session() as session:
+            # allow one pooled (keep-alive) connection per worker
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    (lis_result_sourcedid, grade, executor.submit(_post_replace_result_request,
+                        session, lti_consumer.oauth_consumer_key, lti_consumer.oauth_consumer_secret,
+                        lti_consumer.lis_outcome_service_url, lis_result_sourcedid, grade))
+                    for (lis_result_sourcedid, grade) in valid_sourcedid_grades
+                ]
+
+                for (lis_result_sourcedid, grade, future) in futures:
+                    try:
+                        successful = future.result()
+                    except Exception as error:
+                        current_app.logger.error("Failed grade update for lis_result_sourcedid: {} with grade: {} error: {}".format(lis_result_sourcedid, grade, error))
+                        continue
+
+                    if successful:
+                        current_app.logger.debug("Successfully grade update for lis_result_sourcedid: {} with grade: {}".format(lis_result_sourcedid, grade))
+                        posted_sourcedids.add(lis_result_sourcedid)
+                    else:
+                        current_app.logger.error("Failed grade update for lis_result_sourcedid: {} with grade: {}".format(lis_result_sourcedid, grade))
+
+        return posted_sourcedids
+
+def _is_grade_posted(last_posted_grade, grade):
+    """
+    Returns True if grade was already successfully posted (grades may be stored with single precision floats)
+    """
+    return last_posted_grade != None and abs(last_posted_grade - grade) <= 0.000001
+
+def _post_replace_result_request(session, consumer_key, consumer_secret, lis_outcome_service_url, lis_result_sourcedid, grade):
+    """
+    Same as OutcomeRequest.post_replace_result but sent through a shared requests session.
+    Runs in worker threads so it must not use the database or flask app context
+    """
+    request = OutcomeRequest({
+        "consumer_key": consumer_key,
+        "consumer_secret": consumer_secret,
+        "lis_outcome_service_url": lis_outcome_service_url,
+        "lis_result_sourcedid": lis_result_sourcedid,
+        "operation": REPLACE_REQUEST,
+        "score": grade
+    })
+
+    header_oauth = OAuth1(consumer_key, consumer_secret,
+        signature_type=SIGNATURE_TYPE_AUTH_HEADER, force_include_body=True)
+    response = session.post(lis_outcome_service_url, auth=header_oauth,
+        data=request.generate_request_xml(), headers={'Content-type': 'application/xml'})
+    request.outcome_response = OutcomeResponse.from_post_response(response, response.content)
+
+    return request.was_outcome_post_successful()
@@ -42,33 +42,54 @@ class LTIUser(DefaultTableMixin, UUIDMixin, WriteTrackingMixin):
         return self.compair_user_id != None
 
     def generate_or_link_user_account(self):
+        LTIUser.generate_or_link_user_accounts([self])
+
+    @classmethod
+    def generate_or_link_user_accounts(cls, lti_users):
+        """
+        Links lti users without a ComPAIR account to the account with the same global_unique_identifier
+        (looked up in one query) or generates a new account
+        """
         from . import SystemRole, User
 
-        if self.compair_user_id == None and self.global_unique_identifier:
-            self.compair_user = User.query \
-                .filter_by(global_unique_identifier=self.global_unique_identifier) \
-                .one_or_none()
+        lti_users = [lti_user for lti_user in lti_users
+            if lti_user.compair_user_id == None and lti_user.global_unique_identifier]
+        if len(lti_users) == 0:
+            return
+
+        global_unique_identifiers = list(set([lti_user.global_unique_identifier for lti_user in lti_users]))
+        users = {
+            user.global_unique_identifier: user
+            for user in User.query \
+                .filter(User.global_unique_identifier.in_(global_unique_identifiers)) \
+                .all()
+        }
+
+        for lti_user in lti_users:
+            lti_user.compair_user = users.get(lti_user.global_unique_identifier)
 
-            if not self.compair_user:
-                self.compair_user = User(
+            if not lti_user.compair_user:
+                lti_user.compair_user = User(
                     username=None,
                     password=None,
-                    system_role=self.system_role,
-                    firstname=self.lis_person_name_given,
-                    lastname=self.lis_person_name_family,
-                    email=self.lis_person_contact_email_primary,
-                    global_unique_identifier=self.global_unique_identifier
+                    system_role=lti_user.system_role,
+                    firstname=lti_user.lis_person_name_given,
+                    lastname=lti_user.lis_person_name_family,
+                    email=lti_user.lis_person_contact_email_primary,
+                    global_unique_identifier=lti_user.global_unique_identifier
                 )
-                if self.compair_user.system_role == SystemRole.student:
-                    self.compair_user.student_number = self.student_number
+                if lti_user.compair_user.system_role == SystemRole.student:
+                    lti_user.compair_user.student_number = lti_user.student_number
 
                 # instructors can have their display names set to their full name by default
-                if self.compair_user.system_role != SystemRole.student and self.compair_user.fullname != None:
-                    self.compair_user.displayname = self.compair_user.fullname
+                if lti_user.compair_user.system_role != SystemRole.student and lti_user.compair_user.fullname != None:
+                    lti_user.compair_user.displayname = lti_user.compair_user.fullname
                 else:
-                    self.compair_user.displayname = display_name_generator(self.compair_user.system_role.value)
+                    lti_user.compair_user.displayname = display_name_generator(lti_user.compair_user.system_role.value)
 
-            db.session.commit()
+                users[lti_user.global_unique_identifier] = lti_user.compair_user
+
+        db.session.commit()
 
     @classmethod
     def get_by_lti_consumer_id_and_user_id(cls, lti_consumer_id, user_id):
@@ -2,7 +2,7 @@ from six import text_type
 
 # sqlalchemy
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy import func, select, and_, or_
+from sqlalchemy import func, select, and_, or_, event
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy_enum34 import EnumType
 
@@ -20,6 +20,8 @@ class LTIUserResourceLink(DefaultTableMixin, WriteTrackingMixin):
         nullable=False)
     roles = db.Column(db.String(255), nullable=True)
     lis_result_sourcedid = db.Column(db.String(255), nullable=True)
+    # grade last successfully posted to lis_result_sourcedid via LTI Outcomes
+    last_posted_grade = db.Column(db.Float, nullable=True)
     course_role = db.Column(EnumType(CourseRole),
         nullable=False)
 
@@ -80,6 +82,12 @@ class LTIUserResourceLink(DefaultTableMixin, WriteTrackingMixin):
     def __declare_last__(cls):
         super(cls, cls).__declare_last__()
 
+        # grades must be posted again to a new lis_result_sourcedid
+        @event.listens_for(cls.lis_result_sourcedid, 'set')
+        def receive_lis_result_sourcedid_set(target, value, oldvalue, initiator):
+            if value != oldvalue:
+                target.last_posted_grade = None
+
     __table_args__ = (
         # prevent duplicate resource link in consumer
         db.UniqueConstraint('lti_resource_link_id', 'lti_user_id', name='_unique_lti_resource_link_and_lti_user'),
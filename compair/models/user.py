@@ -1,4 +1,7 @@
 import hashlib
+import os
+from billiard import Pool
+from functools import partial
 from flask import current_app
 from datetime import datetime
 import time
@@ -24,6 +27,27 @@ def hash_password(password, is_admin=False):
     pwd_context = getattr(security, current_app.config['PASSLIB_CONTEXT'])
     return pwd_context.encrypt(password, category=category)
 
+def _hash_password_with_context(context_name, password):
+    return getattr(security, context_name).encrypt(password)
+
+def hash_passwords(passwords):
+    """
+    Hashes a list of (non admin) passwords. Hashing is CPU bound so the work is spread across
+    PASSWORD_HASH_PROCESSES processes (default: one per CPU). A billiard pool is used since
+    the celery prefork pool workers are daemonic and multiprocessing does not allow them children
+    :return: list of hashes in the same order as passwords
+    """
+    context_name = current_app.config['PASSLIB_CONTEXT']
+    processes = current_app.config.get('PASSWORD_HASH_PROCESSES') or os.cpu_count() or 1
+    processes = min(processes, len(passwords))
+
+    if processes <= 1:
+        return [_hash_password_with_context(context_name, password) for password in passwords]
+
+    with Pool(processes=processes) as pool:
+        return pool.map(partial(_hash_password_with_context, context_name), passwords,
+            chunksize=max(1, len(passwords) // (processes * 4)))
+
 # Flask-Login requires the user class to have some methods, the easiest way
 # to get those methods is to inherit from the UserMixin class.
 class User(DefaultTableMixin, UUIDMixin, WriteTrackingMixin, UserMixin):
@@ -57,6 +57,33 @@ BROKER_TRANSPORT_OPTIONS = {
     'fanout_patterns': True
 }
 
+# pairing
+# keep an in memory pairing index per assignment instead of reloading all answers for every new comparison.
+# indexes are per process and are rebuilt after PAIRING_INDEX_TTL seconds to pick up changes from other processes
+PAIRING_INDEX_ENABLED = False
+PAIRING_INDEX_TTL = 60
+
+# scoring
+# backend used when recalculating all scores of an assignment. set to 'array' to use the NumPy array backed score algorithms
+SCORING_BACKEND = None
+# update scores & grades for completed comparisons in a celery task instead of during the request.
+# requires a celery worker (CELERY_ALWAYS_EAGER = False) to return before the updates are done
+ASYNC_SCORE_UPDATES_ENABLED = False
+# seconds answer score rankings (used for rank & rank display limit) are cached per process. 0 disables caching.
+# cached rankings are only reused while the assignment's ranking_version matches, so changes from other processes apply immediately
+RANK_CACHE_TTL = 60
+# seconds the assignment statuses of a user in a course are cached per process. 0 disables caching
+ASSIGNMENT_STATUS_CACHE_TTL = 10
+# number of processes hashing the passwords of imported users. 0 uses one process per CPU
+PASSWORD_HASH_PROCESSES = 0
+
+# duplicate courses with at least this many active assignments in a celery task. 0 always duplicates during the request
+COURSE_DUPLICATE_BACKGROUND_THRESHOLD = 20
+
+# lti
+# number of concurrent LTI Outcomes grade posts per celery task
+LTI_OUTCOME_POST_CONCURRENCY = 4
+
 # xAPI & Learning Record Stores (LRS)
 XAPI_ENABLED = False
 CALIPER_ENABLED = False
@@ -70,6 +97,15 @@ LRS_XAPI_PASSWORD = None
 LRS_CALIPER_HOST = 'local' #url for LRS Caliper statements
 LRS_CALIPER_API_KEY = None
 
+# build learning records in a celery task from the facts captured during the request
+ASYNC_LEARNING_RECORDS_ENABLED = False
+# number of learning records sent to the LRS per request (xAPI multi-statement post or Caliper envelope)
+LRS_TRANSMIT_BATCH_SIZE = 100
+# seconds to wait for the LRS to respond to a batch
+LRS_TRANSMIT_TIMEOUT = 30
+# seconds emitted learning records wait before they are sent, so records emitted meanwhile share one task
+LRS_TRANSMIT_DELAY = 5
+
 # limit user generated content field text size limit
 LRS_USER_INPUT_FIELD_SIZE_LIMIT = 10000 #10,000 characters
 LRS_SIS_COURSE_ID_URI_TEMPLATE = '{base_url}/course/{sis_course_id}'
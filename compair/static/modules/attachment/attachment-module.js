@@ -103,8 +103,8 @@ module.factory('KalturaResource',
 
 /***** Services *****/
 module.service('importService',
-        ['FileUploader', '$location', "$cacheFactory", "CourseResource", "Toaster", "UploadValidator",
-        function(FileUploader, $location, $cacheFactory, CourseResource, Toaster, UploadValidator) {
+        ['FileUploader', '$location', "$cacheFactory", "$http", "$timeout", "$q", "CourseResource", "Toaster", "UploadValidator",
+        function(FileUploader, $location, $cacheFactory, $http, $timeout, $q, CourseResource, Toaster, UploadValidator) {
     var results = {};
     var uploader = null;
     var model = '';
@@ -174,9 +174,31 @@ module.service('importService',
 
     var onComplete = function(courseId, response) {
         results = response;
-        if (!('error' in results)) {
+        if ('error' in results) {
+            return $q.when();
+        }
+        // class lists are imported in the background, poll until the import is done
+        if (model == 'users' && results.status != 'complete') {
+            return waitForImport(courseId, results);
+        }
+        onSuccess(courseId);
+        return $q.when();
+    };
+
+    var waitForImport = function(courseId, job) {
+        if (job.status == 'complete') {
+            results = job;
             onSuccess(courseId);
+            return $q.when();
+        } else if (job.status == 'failed') {
+            Toaster.error("Class List Not Imported", "Sorry, this class list couldn't be imported. Please try again.");
+            return $q.when();
         }
+        return $timeout(function() {
+            return $http.get('/api/courses/' + courseId + '/users/import/' + job.id);
+        }, 2000).then(function(ret) {
+            return waitForImport(courseId, ret.data);
+        });
     };
 
 
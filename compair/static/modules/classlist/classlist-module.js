@@ -365,8 +365,9 @@ module.controller(
 
         $scope.uploader = importService.getUploader($scope.courseId, 'users');
         $scope.uploader.onCompleteItem = function(fileItem, response, status, headers) {
-            $scope.submitted = false;
-            importService.onComplete($scope.courseId, response);
+            importService.onComplete($scope.courseId, response).finally(function() {
+                $scope.submitted = false;
+            });
         };
         $scope.uploader.onBeforeUploadItem = function(fileItem) {
             if ($scope.importType == ThirdPartyAuthType.cas || $scope.importType == ThirdPartyAuthType.saml) {
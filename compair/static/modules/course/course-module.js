@@ -627,9 +627,9 @@ module.controller(
 module.controller(
     'CourseDuplicateController',
     ["$rootScope", "$scope", "AssignmentResource", "moment", '$routeParams', '$location',
-     "Session", "CourseResource", "Toaster", "UserResource",
+     "Session", "CourseResource", "Toaster", "UserResource", "$http", "$timeout", "$q",
     function ($rootScope, $scope, AssignmentResource, moment, $routeParams, $location,
-              Session, CourseResource, Toaster, UserResource) {
+              Session, CourseResource, Toaster, UserResource, $http, $timeout, $q) {
 
         $scope.showAssignments = false;
         $scope.submitted = false;
@@ -1079,7 +1079,12 @@ module.controller(
                 $scope.duplicateCourse.assignments.push(assignment_submit);
             }
 
-            CourseResource.createDuplicate({id: $scope.originalCourse.id}, $scope.duplicateCourse, function (ret) {
+            CourseResource.createDuplicate({id: $scope.originalCourse.id}, $scope.duplicateCourse).$promise.then(function (ret) {
+                // assignments of large courses are copied in the background, wait until they are done
+                return waitForDuplicate(ret.id, ret.duplicate_job).then(function() {
+                    return ret;
+                });
+            }).then(function (ret) {
                 Toaster.success("Course Duplicated");
                 // refresh permissions
                 Session.expirePermissions();
@@ -1093,12 +1098,26 @@ module.controller(
                     $location.path('/course/' + ret.id);
                 }
 
-            }).$promise.finally(function() {
+            }).finally(function() {
                 $scope.submitted = false;
                 $scope.saveAttempted = false;
             });
         };
 
+        var waitForDuplicate = function(courseId, job) {
+            if (!job || job.status == 'complete') {
+                return $q.when();
+            } else if (job.status == 'failed') {
+                Toaster.error("Course Not Duplicated", "Sorry, the course was created but its assignments couldn't be copied. Please try again.");
+                return $q.reject();
+            }
+            return $timeout(function() {
+                return $http.get('/api/courses/' + courseId + '/duplicate/' + job.id);
+            }, 2000).then(function(ret) {
+                return waitForDuplicate(courseId, ret.data);
+            });
+        };
+
         var originalCourseWatcher = function(newValue, oldValue) {
             if (angular.equals(newValue, oldValue)) return;
             $scope.setupDuplicateCourse();
@@ -17,7 +17,7 @@ module.factory('ReportResource',
     [ "$q", "$routeParams", "$resource",
     function($q, $routeParams, $resource)
 {
-    var ret = $resource('/api/courses/:id/report', {id: '@id'});
+    var ret = $resource('/api/courses/:id/report/:jobId', {id: '@id'});
     ret.MODEL = "Course"; // add constant to identify the model
         // being used, this is for permissions checking
         // and should match the server side model name
@@ -27,9 +27,9 @@ module.factory('ReportResource',
 /***** Controllers *****/
 module.controller(
     'ReportCreateController',
-    [ "$scope", "$log", "CourseResource", "ReportResource", "UserResource",
+    [ "$scope", "$log", "$timeout", "CourseResource", "ReportResource", "UserResource",
              "GroupResource", "AssignmentResource", "Toaster", "resolvedData",
-    function($scope, $log, CourseResource, ReportResource, UserResource,
+    function($scope, $log, $timeout, CourseResource, ReportResource, UserResource,
              GroupResource, AssignmentResource, Toaster, resolvedData)
     {
         $scope.courses = resolvedData.coursesAsInstructor.courses;
@@ -113,13 +113,37 @@ module.controller(
 
             ReportResource.save({'id': report.course_id}, report).$promise.then(
                 function (ret) {
-                    $scope.reportFile = ret.file;
+                    waitForReport(report.course_id, ret);
+                },
+                function () {
+                    $scope.submitted = false;
                 }
             ).finally(function() {
-                $scope.submitted = false;
                 $scope.saveAttempted = false;
             });
         };
+
+        // reports are generated in the background, poll until the file is ready
+        var waitForReport = function(courseId, job) {
+            if (job.status == 'complete') {
+                $scope.reportFile = job.file;
+                $scope.submitted = false;
+            } else if (job.status == 'failed') {
+                $scope.submitted = false;
+                Toaster.error("Report Not Run", "Sorry, this report couldn't be generated. Please try again.");
+            } else {
+                $timeout(function() {
+                    ReportResource.get({'id': courseId, 'jobId': job.id}).$promise.then(
+                        function (ret) {
+                            waitForReport(courseId, ret);
+                        },
+                        function () {
+                            $scope.submitted = false;
+                        }
+                    );
+                }, 2000);
+            }
+        };
     }
 ]);
 
@@ -1,6 +1,11 @@
+from .classlist import import_classlist
+from .comparison_scores import update_assignment_scores
+from .course_duplicate import duplicate_course_assignments
 from .demo import reset_demo
-from .emit_learning_record import emit_lrs_xapi_statement, emit_lrs_caliper_event
+from .emit_learning_record import emit_lrs_xapi_statement, emit_lrs_caliper_event, \
+    emit_lrs_xapi_statements, emit_lrs_caliper_events, build_learning_records
 from .lti_membership import update_lti_course_membership
 from .lti_outcomes import update_lti_course_grades, update_lti_assignment_grades
+from .report import generate_report
 from .send_mail import send_message, send_messages
 from .user_password import set_passwords
\ No newline at end of file
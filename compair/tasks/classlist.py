@@ -0,0 +1,42 @@
+import os
+import time
+import unicodecsv as csv
+
+from compair.core import celery, db
+from compair.models import Course
+from flask import current_app
+
+@celery.task(bind=True, ignore_result=True, store_errors_even_if_ignored=True)
+def import_classlist(self, job_id, course_id, import_type, file_path, user_id):
+    from compair.api.classlist import import_users, load_import_job, save_import_job
+
+    job = load_import_job(job_id)
+    course = Course.query.get(course_id)
+    if not job or not course:
+        current_app.logger.info("Failed class list import for job with id: "+str(job_id)+". record not found.")
+        return
+
+    current_app.logger.info("Begin class list import for course with id: "+str(course_id)+" named: "+course.name)
+    start = time.time()
+
+    try:
+        with open(file_path, 'rb') as csvfile:
+            total = sum(1 for row in csv.reader(csvfile) if row)
+            save_import_job(job_id, status='running', total=total)
+
+            csvfile.seek(0)
+            results = import_users(import_type, course, csv.reader(csvfile), user_id,
+                on_progress=lambda processed: save_import_job(job_id, processed=processed))
+    except Exception:
+        db.session.rollback()
+        save_import_job(job_id, status='failed')
+        current_app.logger.exception("Failed class list import for course with id: "+str(course_id))
+        raise
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    save_import_job(job_id, status='complete', processed=total,
+        success=results['success'], invalids=results['invalids'])
+    current_app.logger.info("Completed class list import for course with id: "+str(course_id)+
+        " in {:.2f}s".format(time.time() - start))
@@ -0,0 +1,22 @@
+from compair.core import celery, db
+from compair.models import Assignment, Comparison, User
+from flask import current_app
+
+@celery.task(bind=True, autoretry_for=(Exception,),
+    ignore_result=True, store_errors_even_if_ignored=True)
+def update_assignment_scores(self, assignment_id):
+    assignment = Assignment.query.get(assignment_id)
+    if assignment:
+        # every pending comparison in the assignment is handled here, so tasks queued
+        # during a burst of submissions find nothing left to do
+        user_ids = Comparison.update_pending_scores(assignment.id)
+        if len(user_ids) == 0:
+            return
+
+        current_app.logger.debug("Updated scores for assignment: {} comparisons by {} users".format(assignment.id, len(user_ids)))
+
+        for user in User.query.filter(User.id.in_(user_ids)).all():
+            assignment.calculate_grade(user)
+            assignment.course.calculate_grade(user)
+    else:
+        current_app.logger.info("Failed score update for assignment with id: {}. record not found.".format(assignment_id))
@@ -0,0 +1,35 @@
+import time
+
+from compair.core import celery, db
+from compair.models import Course
+from flask import current_app
+
+@celery.task(bind=True, ignore_result=True, store_errors_even_if_ignored=True)
+def duplicate_course_assignments(self, job_id, course_id, duplicate_course_id, assignments_copy_data, user_id):
+    from compair.api.course import duplicate_assignments, load_duplicate_job, save_duplicate_job
+
+    job = load_duplicate_job(job_id)
+    course = Course.query.get(course_id)
+    duplicate_course = Course.query.get(duplicate_course_id)
+    if not job or not course or not duplicate_course:
+        current_app.logger.info("Failed course duplication for job with id: "+str(job_id)+". record not found.")
+        return
+
+    current_app.logger.info("Begin duplicating assignments of course with id: "+str(course_id)+
+        " into course with id: "+str(duplicate_course_id))
+    save_duplicate_job(job_id, status='running')
+    start = time.time()
+
+    try:
+        duplicate_assignments(course, duplicate_course, assignments_copy_data, user_id,
+            on_progress=lambda processed: save_duplicate_job(job_id, processed=processed))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        save_duplicate_job(job_id, status='failed')
+        current_app.logger.exception("Failed duplicating assignments of course with id: "+str(course_id))
+        raise
+
+    save_duplicate_job(job_id, status='complete', processed=len(assignments_copy_data))
+    current_app.logger.info("Completed duplicating assignments of course with id: "+str(course_id)+
+        " in {:.2f}s".format(time.time() - start))
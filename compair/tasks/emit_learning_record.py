@@ -1,13 +1,16 @@
 import json
 import socket
 import datetime
-from sqlalchemy import and_, or_
+import uuid
+import requests
+from sqlalchemy import and_, or_, select
 
 from compair.core import celery
 from flask import current_app
 from compair.models import CaliperLog, XAPILog
 from compair.core import db
 
+# single record tasks are kept for tasks queued before records were sent in batches
 @celery.task(bind=True, autoretry_for=(Exception,),
     ignore_result=True, store_errors_even_if_ignored=True)
 def emit_lrs_xapi_statement(self, xapi_log_id):
@@ -61,33 +64,149 @@ def emit_lrs_caliper_event(self, caliper_log_id):
         db.session.commit()
 
 
+@celery.task(bind=True, autoretry_for=(Exception,),
+    ignore_result=True, store_errors_even_if_ignored=True)
+def emit_lrs_xapi_statements(self):
+    from compair.learning_records import XAPI
+
+    _emit_pending_logs(XAPILog, 'statement', XAPI)
+
+@celery.task(bind=True, autoretry_for=(Exception,),
+    ignore_result=True, store_errors_even_if_ignored=True)
+def emit_lrs_caliper_events(self):
+    from compair.learning_records import CaliperSensor
+
+    _emit_pending_logs(CaliperLog, 'event', CaliperSensor)
+
+@celery.task(bind=True, autoretry_for=(Exception,),
+    ignore_result=True, store_errors_even_if_ignored=True)
+def build_learning_records(self, handler_name, user_id, model_ids, facts, request_facts):
+    from compair.learning_records.capture_events import build_captured_learning_records
+
+    build_captured_learning_records(handler_name, user_id, model_ids, facts, request_facts)
+
+# claims of tasks that stopped while sending (ex: killed workers) are released after an hour
+LOG_CLAIM_TIMEOUT = datetime.timedelta(hours=1)
+
+def _emit_pending_logs(log_model, record_column, learning_record):
+    """
+    Sends untransmitted log rows to the LRS in batches of LRS_TRANSMIT_BATCH_SIZE
+    and deletes each transmitted batch with one statement. Rows stay in the log if the LRS
+    cannot be reached or fails (5xx) and are sent by the next task (or resend_learning_records).
+    Records rejected by the LRS (4xx) are logged and deleted like accepted ones.
+    :return: number of records transmitted
+    """
+    table = log_model.__table__
+    batch_size = current_app.config.get('LRS_TRANSMIT_BATCH_SIZE', 100)
+
+    sent_count = 0
+    while True:
+        now = datetime.datetime.utcnow()
+        claimable = and_(
+            table.c.transmitted == False,
+            or_(
+                table.c.claimed_at == None,
+                table.c.claimed_at < now - LOG_CLAIM_TIMEOUT
+            )
+        )
+        log_ids = [log_id for (log_id,) in db.session.execute(
+            select([table.c.id])
+            .where(claimable)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        )]
+        if len(log_ids) == 0:
+            break
+
+        # claim the rows (committed before sending) so other tasks skip them instead of
+        # waiting on row locks while the LRS responds (rows claimed by another task first are skipped)
+        claim_id = uuid.uuid4().hex
+        db.session.execute(table.update()
+            .where(and_(table.c.id.in_(log_ids), claimable))
+            .values(claim_id=claim_id, claimed_at=now))
+        db.session.commit()
+
+        rows = db.session.execute(
+            select([table.c.id, table.c[record_column]])
+            .where(table.c.claim_id == claim_id)
+            .order_by(table.c.id)
+        ).fetchall()
+        if len(rows) == 0:
+            continue
+
+        transmitted_ids, retry = _emit_rows(learning_record, record_column, rows)
+
+        if len(transmitted_ids) > 0:
+            db.session.execute(table.delete().where(table.c.id.in_(transmitted_ids)))
+        db.session.execute(table.update()
+            .where(table.c.claim_id == claim_id)
+            .values(claim_id=None, claimed_at=None))
+        db.session.commit()
+        sent_count += len(transmitted_ids)
+
+        if retry:
+            break
+
+    return sent_count
+
+def _emit_rows(learning_record, record_column, rows):
+    """
+    Sends log rows to the LRS as one batch. If the LRS rejects the batch (4xx), the rows are
+    sent one at a time so only the rejected records are dropped.
+    :return: ids of the transmitted rows and True if the remaining rows should be sent later
+    """
+    try:
+        status_code = learning_record._emit_batch_to_lrs([row[record_column] for row in rows])
+    except requests.exceptions.RequestException as error:
+        current_app.logger.error("Failed to send learning records: " + str(error))
+        return [], True
+
+    if 200 <= status_code < 300:
+        return [row['id'] for row in rows], False
+
+    if not (400 <= status_code < 500):
+        return [], True
+
+    if len(rows) == 1:
+        current_app.logger.error("Learning record rejected by the LRS: " + rows[0][record_column])
+        return [rows[0]['id']], False
+
+    transmitted_ids = []
+    for row in rows:
+        row_ids, retry = _emit_rows(learning_record, record_column, [row])
+        transmitted_ids.extend(row_ids)
+        if retry:
+            return transmitted_ids, True
+
+    return transmitted_ids, False
+
 @celery.task(bind=True, autoretry_for=(Exception,),
     ignore_result=True, store_errors_even_if_ignored=True)
 def resend_learning_records(self):
     from compair.learning_records import XAPI, CaliperSensor
 
-    # only re-send learning records that have last started over an hour ago
-    # (this is to try and prevent sending duplicates if possible)
+    # only re-send learning records that have been waiting for over an hour
+    # (records are normally sent by the task queued when they are emitted)
     one_hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
 
     if XAPI.enabled() and not XAPI.storing_locally():
-        xapi_logs = XAPILog.query \
+        xapi_log_exists = XAPILog.query \
             .filter(and_(
                 XAPILog.transmitted == False,
                 XAPILog.modified <= one_hour_ago
             )) \
-            .all()
+            .first() != None
 
-        for xapi_log in xapi_logs:
-            emit_lrs_xapi_statement.delay(xapi_log.id)
+        if xapi_log_exists:
+            emit_lrs_xapi_statements.delay()
 
     if CaliperSensor.enabled() and not CaliperSensor.storing_locally():
-        caliper_logs = CaliperLog.query \
+        caliper_log_exists = CaliperLog.query \
             .filter(and_(
                 CaliperLog.transmitted == False,
                 CaliperLog.modified <= one_hour_ago
             )) \
-            .all()
+            .first() != None
 
-        for caliper_log in caliper_logs:
-            emit_lrs_caliper_event.delay(caliper_log.id)
+        if caliper_log_exists:
+            emit_lrs_caliper_events.delay()
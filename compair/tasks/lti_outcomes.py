@@ -1,4 +1,4 @@
-import requests
+import time
 
 from compair.core import celery, db
 from compair.models import LTIConsumer, LTIOutcome, CourseGrade, AssignmentGrade
@@ -9,16 +9,7 @@ from flask import current_app
 def update_lti_course_grades(self, lti_consumer_id, sourcedid_and_grades):
     lti_consumer = LTIConsumer.query.get(lti_consumer_id)
     if lti_consumer:
-        current_app.logger.info("Begin LTI Outcomes grade update for lti_consumer: {} named: {}".format(lti_consumer.id, lti_consumer.tool_consumer_instance_name))
-        for (lis_result_sourcedid, course_grade_id) in sourcedid_and_grades:
-            if course_grade_id:
-                course_grade = CourseGrade.query.get(course_grade_id)
-                grade = course_grade.grade if course_grade else 0.0
-
-                current_app.logger.debug("Posting grade for lis_result_sourcedid: {}".format(lis_result_sourcedid))
-
-                LTIOutcome.post_replace_result(lti_consumer, lis_result_sourcedid, grade)
-
+        _post_grades(lti_consumer, CourseGrade, sourcedid_and_grades)
     else:
         current_app.logger.info("Failed LTI Outcomes grade update for lti_consumer with id: {}. record not found.".format(lti_consumer_id))
 
@@ -27,14 +18,17 @@ def update_lti_course_grades(self, lti_consumer_id, sourcedid_and_grades):
 def update_lti_assignment_grades(self, lti_consumer_id, sourcedid_and_grades):
     lti_consumer = LTIConsumer.query.get(lti_consumer_id)
     if lti_consumer:
-        current_app.logger.info("Begin LTI Outcomes grade update for lti_consumer: {} named: {}".format(lti_consumer.id, lti_consumer.tool_consumer_instance_name))
-        for (lis_result_sourcedid, assignment_grade_id) in sourcedid_and_grades:
-            if assignment_grade_id:
-                assignment_grade = AssignmentGrade.query.get(assignment_grade_id)
-                grade = assignment_grade.grade if assignment_grade else 0.0
+        _post_grades(lti_consumer, AssignmentGrade, sourcedid_and_grades)
+    else:
+        current_app.logger.info("Failed LTI Outcomes grade update for lti_consumer with id: {}. record not found.".format(lti_consumer_id))
 
-                current_app.logger.debug("Posting grade for lis_result_sourcedid: {}".format(lis_result_sourcedid))
+def _post_grades(lti_consumer, grade_model, sourcedid_and_grades):
+    current_app.logger.info("Begin LTI Outcomes grade update for lti_consumer: {} named: {}".format(lti_consumer.id, lti_consumer.tool_consumer_instance_name))
 
-                LTIOutcome.post_replace_result(lti_consumer, lis_result_sourcedid, grade)
-    else:
-        current_app.logger.info("Failed LTI Outcomes grade update for lti_consumer with id: {}. record not found.".format(lti_consumer_id))
\ No newline at end of file
+    start = time.time()
+    (posted, failed, unchanged) = LTIOutcome.post_grades(lti_consumer, grade_model, sourcedid_and_grades)
+    duration = time.time() - start
+
+    current_app.logger.info("Finished LTI Outcomes grade update for lti_consumer: {} named: {}. {} posted, {} failed, {} unchanged in {:.2f}s ({:.1f} grades/s)".format(
+        lti_consumer.id, lti_consumer.tool_consumer_instance_name, posted, failed, unchanged,
+        duration, posted / duration if duration > 0 else 0.0))
@@ -0,0 +1,43 @@
+import time
+
+from sqlalchemy.orm import undefer
+
+from compair.core import celery
+from compair.models import Course, Assignment, Group
+from flask import current_app
+
+@celery.task(bind=True, ignore_result=True, store_errors_even_if_ignored=True)
+def generate_report(self, job_id, course_id, report_type, assignment_ids, group_id, overall, base_url):
+    from compair.api.report import write_report, load_report_job, save_report_job
+
+    job = load_report_job(job_id)
+    course = Course.query.get(course_id)
+    if not job or not course:
+        current_app.logger.info("Failed report generation for job with id: "+str(job_id)+". record not found.")
+        return
+
+    # keep the assignment order of the request
+    assignments = {
+        assignment.id: assignment
+        for assignment in Assignment.query \
+            .options(undefer('comparison_example_count')) \
+            .filter(Assignment.id.in_(assignment_ids)) \
+            .all()
+    } if len(assignment_ids) > 0 else {}
+    assignments = [assignments[assignment_id] for assignment_id in assignment_ids if assignment_id in assignments]
+    group = Group.query.get(group_id) if group_id else None
+
+    current_app.logger.info("Begin "+report_type+" report for course with id: "+str(course_id)+" named: "+course.name)
+    save_report_job(job_id, status='running')
+    start = time.time()
+
+    try:
+        write_report(job['file'], report_type, course, assignments, group, overall, base_url)
+    except Exception:
+        save_report_job(job_id, status='failed')
+        current_app.logger.exception("Failed "+report_type+" report for course with id: "+str(course_id))
+        raise
+
+    save_report_job(job_id, status='complete')
+    current_app.logger.info("Completed "+report_type+" report for course with id: "+str(course_id)+
+        " in {:.2f}s".format(time.time() - start))
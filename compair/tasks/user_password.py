@@ -1,17 +1,41 @@
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam
+
 from compair.core import celery, db
 from compair.models import User
+from compair.models.user import hash_passwords
 
 @celery.task(bind=True, autoretry_for=(Exception,),
     ignore_result=True, store_errors_even_if_ignored=True)
 def set_passwords(self, user_passwords):
-    user_ids = user_passwords.keys()
+    # json serialized task arguments have string keys
+    user_passwords = [(int(user_id), password) for (user_id, password) in user_passwords.items()]
+    if len(user_passwords) == 0:
+        return
+
+    start = time.time()
+    password_hashes = hash_passwords([password for (user_id, password) in user_passwords])
+    elapsed = time.time() - start
 
-    users = User.query \
-        .filter(User.id.in_(user_ids)) \
-        .all()
+    now = datetime.utcnow()
+    table = User.__table__
+    db.session.execute(table.update()
+        .where(table.c.id == bindparam('user_id'))
+        .values(_password=bindparam('password_hash'), modified=bindparam('modified_at')),
+        [{
+            'user_id': user_id,
+            'password_hash': password_hash,
+            'modified_at': now
+        } for ((user_id, password), password_hash) in zip(user_passwords, password_hashes)])
+    db.session.commit()
 
-    for user in users:
-        user.password = user_passwords.get(user.id, None)
+    # core statements do not refresh users already loaded in the session
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, User):
+            db.session.expire(instance, ['_password', 'modified'])
 
-    db.session.add_all(users)
-    db.session.commit()
\ No newline at end of file
+    current_app.logger.info("Set {} passwords in {:.2f}s ({:.1f} hashes/s)".format(
+        len(user_passwords), elapsed, len(user_passwords) / elapsed if elapsed > 0 else 0))
@@ -33,5 +33,10 @@ test_app_settings = {
     'ALLOW_STUDENT_CHANGE_STUDENT_NUMBER': False,
     'ALLOW_STUDENT_CHANGE_EMAIL': False,
     'MAIL_NOTIFICATION_ENABLED': True,
-    'MAIL_DEFAULT_SENDER': 'compair@example.com'
+    'MAIL_DEFAULT_SENDER': 'compair@example.com',
+    # status tests change data through fixtures without sending events
+    'ASSIGNMENT_STATUS_CACHE_TTL': 0,
+    'PASSWORD_HASH_PROCESSES': 1,
+    # send learning records as soon as they are emitted
+    'LRS_TRANSMIT_DELAY': 0
 }
\ No newline at end of file
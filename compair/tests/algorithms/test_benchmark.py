@@ -0,0 +1,67 @@
+import unittest
+
+from compair.algorithms.benchmark import BenchmarkSettings, run_benchmark, simulate, \
+    spearman_correlation, latency_percentiles, LATENCY_PERCENTILES
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = BenchmarkSettings(
+            number_of_answers=20, number_of_students=10, comparisons_per_student=3,
+            correct_rate=1.0, sigma=0.0
+        )
+
+    def test_spearman_correlation(self):
+        self.assertAlmostEqual(spearman_correlation([1, 2, 3, 4], [10, 20, 30, 40]), 1.0)
+        self.assertAlmostEqual(spearman_correlation([1, 2, 3, 4], [4, 3, 2, 1]), -1.0)
+        # only the order matters
+        self.assertAlmostEqual(spearman_correlation([1, 2, 3, 4], [1, 100, 101, 1000]), 1.0)
+        # ties get their average rank
+        self.assertAlmostEqual(spearman_correlation([1, 2, 3, 4], [1, 2, 2, 3]), 0.9486832980505138)
+        # constant values
+        self.assertIsNone(spearman_correlation([1, 2, 3, 4], [0, 0, 0, 0]))
+
+    def test_latency_percentiles(self):
+        self.assertEqual(latency_percentiles([]), {})
+
+        percentiles = latency_percentiles([float(value) for value in range(1, 101)])
+        self.assertEqual(set(percentiles.keys()), set(LATENCY_PERCENTILES + ['max']))
+        self.assertAlmostEqual(percentiles[50], 50.5)
+        self.assertEqual(percentiles['max'], 100.0)
+
+    def test_simulate(self):
+        for pairing_package_name in ['random', 'adaptive', 'adaptive_min_delta']:
+            for scoring_package_name in ['comparative_judgement', 'elo_rating', 'true_skill_rating']:
+                result = simulate(pairing_package_name, scoring_package_name, self.settings, seed=1)
+
+                self.assertEqual(result.comparisons, 30)
+                self.assertEqual(len(result.pair_timings), 30)
+                self.assertEqual(len(result.score_1vs1_timings), 30)
+                self.assertGreater(result.spearman_1vs1, 0)
+                self.assertGreater(result.spearman, 0)
+
+        # same seed simulates the same cohort
+        result1 = simulate('adaptive_min_delta', 'elo_rating', self.settings, seed=2)
+        result2 = simulate('adaptive_min_delta', 'elo_rating', self.settings, seed=2)
+        self.assertEqual(result1.spearman, result2.spearman)
+        self.assertEqual(result1.spearman_1vs1, result2.spearman_1vs1)
+
+    def test_run_benchmark(self):
+        reports, wall_time = run_benchmark(['random', 'adaptive_min_delta'], ['elo_rating'],
+            self.settings, repetitions=3, processes=1, seed=1)
+
+        self.assertGreater(wall_time, 0)
+        self.assertEqual([(report.pairing_package_name, report.scoring_package_name) for report in reports],
+            [('random', 'elo_rating'), ('adaptive_min_delta', 'elo_rating')])
+        for report in reports:
+            self.assertEqual(report.repetitions, 3)
+            self.assertEqual(report.comparisons, 90)
+            self.assertEqual(set(report.pair_latency.keys()), set(LATENCY_PERCENTILES + ['max']))
+            self.assertEqual(set(report.score_1vs1_latency.keys()), set(LATENCY_PERCENTILES + ['max']))
+            self.assertEqual(set(report.score_latency.keys()), set(LATENCY_PERCENTILES + ['max']))
+            self.assertGreater(report.spearman, 0)
+
+        # the process pool gives the same results
+        pool_reports, _ = run_benchmark(['random', 'adaptive_min_delta'], ['elo_rating'],
+            self.settings, repetitions=3, processes=2, seed=1)
+        self.assertEqual([report.spearman for report in pool_reports], [report.spearman for report in reports])
@@ -0,0 +1,176 @@
+import unittest
+
+from compair.algorithms.pair import PairingIndex
+from compair.algorithms import ComparisonPair, ScoredObject, InsufficientObjectsForPairException, \
+    UserComparedAllObjectsException, UnknownPairGeneratorException
+
+class TestPairingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.comparer = 1
+
+    def _build_index(self, scored_objects, comparisons=[]):
+        index = PairingIndex()
+        for scored_object in scored_objects:
+            index.add_scored_object(scored_object)
+        index.set_comparison_pairs(self.comparer, comparisons)
+        return index
+
+    def _scored_object(self, key, score=None, rounds=0):
+        return ScoredObject(
+            key=key, score=score, variable1=None, variable2=None,
+            rounds=rounds, wins=None, loses=None, opponents=None
+        )
+
+    def test_generate_pair_errors(self):
+        for package_name in ['random', 'adaptive', 'adaptive_min_delta']:
+            # empty index
+            index = self._build_index([])
+            with self.assertRaises(InsufficientObjectsForPairException):
+                index.generate_pair(package_name, self.comparer)
+
+            # not enough scored objects for comparison (only 1 scored object)
+            index = self._build_index([self._scored_object(1)])
+            with self.assertRaises(InsufficientObjectsForPairException):
+                index.generate_pair(package_name, self.comparer)
+
+            # not enough scored objects after excluded keys
+            index = self._build_index([self._scored_object(1), self._scored_object(2)])
+            with self.assertRaises(InsufficientObjectsForPairException):
+                index.generate_pair(package_name, self.comparer, excluded_keys={2})
+
+            # user compared all objects
+            index = self._build_index(
+                [self._scored_object(1, 0.7, 1), self._scored_object(2, 0.2, 1)],
+                [ComparisonPair(1, 2, None)]
+            )
+            with self.assertRaises(UserComparedAllObjectsException):
+                index.generate_pair(package_name, self.comparer)
+
+        index = self._build_index([self._scored_object(1), self._scored_object(2)])
+        with self.assertRaises(UnknownPairGeneratorException):
+            index.generate_pair('unknown', self.comparer)
+
+    def test_generate_pair_rounds(self):
+        for package_name in ['random', 'adaptive', 'adaptive_min_delta']:
+            # Selects lowest round objects first
+            index = self._build_index(
+                [self._scored_object(key, 0.5, 2) for key in range(1, 5)] +
+                [self._scored_object(key, 0.5, 1) for key in range(5, 7)]
+            )
+            results = index.generate_pair(package_name, self.comparer)
+            self.assertEqual(sorted([results.key1, results.key2]), [5, 6])
+
+            # round updates move objects between rounds
+            index.update_rounds(5, 2)
+            index.update_rounds(1, 0)
+            index.update_rounds(2, 0)
+            self.assertEqual(index.rounds, [0, 1, 2])
+            results = index.generate_pair(package_name, self.comparer)
+            self.assertEqual(sorted([results.key1, results.key2]), [1, 2])
+
+            # removed objects are no longer selected
+            index.remove_scored_object(1)
+            self.assertNotIn(1, index)
+            results = index.generate_pair(package_name, self.comparer)
+            self.assertEqual(results.key1, 2)
+            self.assertEqual(results.key2, 6)
+
+            # excluded keys are not selected
+            results = index.generate_pair(package_name, self.comparer, excluded_keys={6})
+            self.assertEqual(results.key1, 2)
+            self.assertIn(results.key2, [3, 4, 5])
+
+            # Can select previously compared object but not with same opponent
+            index = self._build_index(
+                [self._scored_object(1, 0.5, 2), self._scored_object(2, 0.5, 2), self._scored_object(3, 0.5, 3)],
+                [ComparisonPair(1, 2, None)]
+            )
+            results = index.generate_pair(package_name, self.comparer)
+            self.assertIn(results.key1, [1, 2])
+            self.assertEqual(results.key2, 3)
+
+    def test_generate_pair_closest_score(self):
+        index = self._build_index(
+            [self._scored_object(1, 0.5, 3), self._scored_object(2, 0.7, 3),
+             self._scored_object(3, 0.2, 3), self._scored_object(4, 0.4, 3)],
+            [ComparisonPair(1, 3, None)]
+        )
+        # only 2 & 4 are unused so they must be paired
+        results = index.generate_pair('adaptive', self.comparer)
+        self.assertEqual(sorted([results.key1, results.key2]), [2, 4])
+
+        # once all objects are used, the closest score is selected
+        index.add_comparison_pair(self.comparer, ComparisonPair(2, 4, None))
+        for _ in range(20):
+            results = index.generate_pair('adaptive', self.comparer)
+            if results.key1 == 1:
+                self.assertEqual(results.key2, 4)
+            elif results.key1 == 2:
+                self.assertEqual(results.key2, 1)
+            elif results.key1 == 3:
+                self.assertEqual(results.key2, 4)
+            elif results.key1 == 4:
+                self.assertEqual(results.key2, 1)
+
+        # score updates re-sort the round
+        index.update_score(3, 0.45)
+        for _ in range(20):
+            results = index.generate_pair('adaptive', self.comparer)
+            if results.key1 == 1:
+                self.assertEqual(results.key2, 4)
+            elif results.key1 == 4:
+                self.assertEqual(results.key2, 3)
+
+    def test_generate_pair_min_delta(self):
+        index = self._build_index(
+            [self._scored_object(1, 0.5, 3), self._scored_object(2, 0.5, 3),
+             self._scored_object(3, 0.5, 3)],
+            [ComparisonPair(1, 2, None), ComparisonPair(1, 3, None)]
+        )
+        index.criterion_weights = {'c1': 1, 'c2': 2}
+        index.update_criterion_score(1, 'c1', 1)
+        index.update_criterion_score(2, 'c1', 2)
+        index.update_criterion_score(2, 'c2', 2)
+        index.update_criterion_score(3, 'c1', 2)
+        index.update_criterion_score(3, 'c2', None)
+
+        results = index.generate_pair('adaptive_min_delta', self.comparer)
+        self.assertEqual(sorted([results.key1, results.key2]), [2, 3])
+
+    def test_generate_all_pairs(self):
+        for package_name in ['random', 'adaptive', 'adaptive_min_delta']:
+            for count in [30, 31]:
+                index = self._build_index([self._scored_object(key) for key in range(count)])
+                comparisons = []
+                used_keys = set()
+
+                # floor(n/2) comparisons use only unseen objects
+                for _ in range(count // 2):
+                    results = index.generate_pair(package_name, self.comparer)
+                    self.assertNotIn(results.key1, used_keys)
+                    self.assertNotIn(results.key2, used_keys)
+                    used_keys.add(results.key1)
+                    used_keys.add(results.key2)
+                    index.add_comparison_pair(self.comparer, results)
+                    comparisons.append(results)
+
+                self.assertEqual(len(set(range(count)) - used_keys), count % 2)
+
+                # remaining comparisons for n(n-1)/2
+                for _ in range(count * (count - 1) // 2 - count // 2):
+                    results = index.generate_pair(package_name, self.comparer)
+                    index.add_comparison_pair(self.comparer, results)
+                    comparisons.append(results)
+
+                with self.assertRaises(UserComparedAllObjectsException):
+                    index.generate_pair(package_name, self.comparer)
+
+                # make sure all pairs are distinct
+                self.assertEqual(
+                    len(comparisons),
+                    len(set([tuple(sorted([c.key1, c.key2])) for c in comparisons])))
+
+                # other comparers are unaffected
+                results = index.generate_pair(package_name, self.comparer + 1)
+                self.assertIsInstance(results, ComparisonPair)
@@ -0,0 +1,73 @@
+import random
+import unittest
+
+from compair.algorithms import ComparisonPair, ComparisonWinner, ScoredObject
+from compair.algorithms.replay import ComparisonReplay
+from compair.algorithms.score import calculate_score_1vs1
+
+class TestComparisonReplay(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.comparison_pairs = []
+        for _ in range(60):
+            key1, key2 = rng.sample(range(1, 11), 2)
+            winner = rng.choice([ComparisonWinner.key1, ComparisonWinner.key2, ComparisonWinner.draw])
+            self.comparison_pairs.append(ComparisonPair(key1=key1, key2=key2, winner=winner))
+
+    def test_replay(self):
+        for package_name in ['comparative_judgement', 'elo_rating', 'true_skill_rating']:
+            replay = ComparisonReplay(package_name)
+
+            # scores from the full comparison history at every step
+            scored_objects = {}
+            past_comparison_pairs = []
+            for comparison_pair, step in zip(self.comparison_pairs, replay.replay(self.comparison_pairs)):
+                key1_scored_object = scored_objects.get(comparison_pair.key1, ScoredObject(
+                    key=comparison_pair.key1, score=0, variable1=None, variable2=None,
+                    rounds=0, opponents=0, wins=0, loses=0
+                ))
+                key2_scored_object = scored_objects.get(comparison_pair.key2, ScoredObject(
+                    key=comparison_pair.key2, score=0, variable1=None, variable2=None,
+                    rounds=0, opponents=0, wins=0, loses=0
+                ))
+                self.assertAlmostEqual(step.key1_before.score, key1_scored_object.score)
+                self.assertAlmostEqual(step.key2_before.score, key2_scored_object.score)
+
+                result1, result2 = calculate_score_1vs1(
+                    package_name=package_name,
+                    key1_scored_object=key1_scored_object,
+                    key2_scored_object=key2_scored_object,
+                    winner=comparison_pair.winner,
+                    other_comparison_pairs=list(past_comparison_pairs)
+                )
+                scored_objects[result1.key] = result1
+                scored_objects[result2.key] = result2
+                past_comparison_pairs.append(comparison_pair)
+
+                for result, replay_result in [(result1, step.key1_after), (result2, step.key2_after)]:
+                    self.assertAlmostEqual(result.score, replay_result.score)
+                    self.assertEqual(
+                        (result.rounds, result.opponents, result.wins, result.loses),
+                        (replay_result.rounds, replay_result.opponents, replay_result.wins, replay_result.loses))
+
+            for key, scored_object in scored_objects.items():
+                self.assertAlmostEqual(replay.score(key).score, scored_object.score)
+
+    def test_score(self):
+        replay = ComparisonReplay('elo_rating', keys=[1, 2], initial_score=1200)
+        self.assertEqual(sorted(replay.scored_objects.keys()), [1, 2])
+
+        # answers not compared yet have the initial score
+        scored_object = replay.score(3)
+        self.assertEqual(scored_object.key, 3)
+        self.assertEqual(scored_object.score, 1200)
+        self.assertEqual(scored_object.rounds, 0)
+
+        step = replay.add(ComparisonPair(key1=1, key2=3, winner=ComparisonWinner.key1))
+        self.assertEqual(step.key1_before.score, 1200)
+        self.assertGreater(step.key1_after.score, 1200)
+        self.assertLess(step.key2_after.score, 1200)
+        self.assertEqual((step.key1_after.wins, step.key1_after.loses), (1, 0))
+        self.assertEqual((step.key2_after.wins, step.key2_after.loses), (0, 1))
+        self.assertEqual(replay.score(3), step.key2_after)
@@ -0,0 +1,122 @@
+import unittest
+import random
+
+from compair.algorithms import ComparisonPair, ScoredObject, ComparisonWinner, InvalidWinnerException
+from compair.algorithms.score import calculate_score, calculate_score_1vs1
+from importlib import import_module
+
+class TestScoreArray(unittest.TestCase):
+    tolerances = {
+        "comparative_judgement": 1e-9,
+        "elo_rating": 1e-9,
+        "true_skill_rating": 1e-6
+    }
+
+    def setUp(self):
+        random.seed(1234)
+
+    def _generate_comparison_pairs(self, key_count, comparison_count):
+        winners = [ComparisonWinner.key1, ComparisonWinner.key2, ComparisonWinner.draw, None]
+        comparison_pairs = []
+        for _ in range(comparison_count):
+            key1, key2 = random.sample(range(key_count), 2)
+            comparison_pairs.append(ComparisonPair(
+                key1=key1, key2=key2, winner=random.choice(winners)
+            ))
+        return comparison_pairs
+
+    def _assert_results_match(self, package_name, comparison_pairs):
+        expected_results = calculate_score(
+            package_name=package_name,
+            comparison_pairs=comparison_pairs
+        )
+        results = calculate_score(
+            package_name=package_name,
+            comparison_pairs=comparison_pairs,
+            backend="array"
+        )
+        tolerance = self.tolerances[package_name]
+
+        self.assertEqual(set(results.keys()), set(expected_results.keys()))
+        for key, expected in expected_results.items():
+            result = results.get(key)
+            self.assertIsInstance(result, ScoredObject)
+            self.assertIsInstance(result.score, float)
+            self.assertEqual(result.key, expected.key)
+            self.assertAlmostEqual(result.score, float(expected.score), delta=tolerance)
+            if expected.variable1 is None:
+                self.assertIsNone(result.variable1)
+            else:
+                self.assertAlmostEqual(result.variable1, float(expected.variable1), delta=tolerance)
+            if expected.variable2 is None:
+                self.assertIsNone(result.variable2)
+            else:
+                self.assertAlmostEqual(result.variable2, float(expected.variable2), delta=tolerance)
+            self.assertEqual(result.rounds, expected.rounds)
+            self.assertEqual(result.opponents, expected.opponents)
+            self.assertEqual(result.wins, expected.wins)
+            self.assertEqual(result.loses, expected.loses)
+
+    def test_calculate_score_array(self):
+        for package_name in ["comparative_judgement", "elo_rating", "true_skill_rating"]:
+            # no comparisons
+            self._assert_results_match(package_name, [])
+
+            # simple comparisons
+            self._assert_results_match(package_name, [
+                ComparisonPair(key1=1, key2=2, winner=ComparisonWinner.key1),
+                ComparisonPair(key1=1, key2=3, winner=ComparisonWinner.key1),
+                ComparisonPair(key1=2, key2=3, winner=ComparisonWinner.key1)
+            ])
+
+            # draws, incomplete comparisons, and repeated opponents
+            self._assert_results_match(package_name, [
+                ComparisonPair(key1=1, key2=2, winner=ComparisonWinner.draw),
+                ComparisonPair(key1=2, key2=1, winner=ComparisonWinner.key2),
+                ComparisonPair(key1=3, key2=1, winner=None),
+                ComparisonPair(key1=4, key2=5, winner=None),
+                ComparisonPair(key1=2, key2=4, winner=ComparisonWinner.key2)
+            ])
+
+            # larger random set of comparisons
+            self._assert_results_match(package_name, self._generate_comparison_pairs(40, 400))
+
+    def test_calculate_score_array_invalid_winner(self):
+        for package_name in ["comparative_judgement", "elo_rating", "true_skill_rating"]:
+            with self.assertRaises(InvalidWinnerException):
+                calculate_score(
+                    package_name=package_name,
+                    comparison_pairs=[ComparisonPair(key1=1, key2=2, winner="invalid")],
+                    backend="array"
+                )
+
+    def test_calculate_score_1vs1_array(self):
+        array_algorithm_classes = {
+            "comparative_judgement": "ComparativeJudgementArrayScoreAlgorithm",
+            "elo_rating": "EloArrayScoreAlgorithm",
+            "true_skill_rating": "TrueSkillArrayScoreAlgorithm"
+        }
+        key1_scored_object = ScoredObject(key=1, score=None, variable1=None, variable2=None,
+            rounds=0, opponents=0, wins=0, loses=0)
+        key2_scored_object = ScoredObject(key=2, score=None, variable1=None, variable2=None,
+            rounds=0, opponents=0, wins=0, loses=0)
+        other_comparison_pairs = [
+            ComparisonPair(key1=1, key2=3, winner=ComparisonWinner.key1),
+            ComparisonPair(key1=3, key2=2, winner=ComparisonWinner.draw)
+        ]
+
+        for package_name, class_name in array_algorithm_classes.items():
+            package = import_module("compair.algorithms.score."+package_name+".array_score_algorithm")
+            score_algorithm = getattr(package, class_name)()
+
+            # 1vs1 updates are the same as the default score algorithm
+            results = score_algorithm.calculate_score_1vs1(key1_scored_object, key2_scored_object,
+                ComparisonWinner.key1, other_comparison_pairs)
+            expected_results = calculate_score_1vs1(
+                package_name=package_name,
+                key1_scored_object=key1_scored_object,
+                key2_scored_object=key2_scored_object,
+                winner=ComparisonWinner.key1,
+                other_comparison_pairs=other_comparison_pairs
+            )
+            self.assertEqual(results, expected_results)
@@ -194,6 +194,31 @@ class AnswerCommentListAPITests(ComPAIRAPITestCase):
                 self.assertEqual(3, len(rv.json))
                 self.assertEqual(draft_comment.uuid, rv.json[0]['id'])
 
+    def test_get_list_query_count(self):
+        url = self.get_url(course_uuid=self.course.uuid, assignment_uuid=self.assignment.uuid,
+            assignment_id=self.assignment.uuid)
+        answers = self.answers[self.assignment.id]
+
+        with self.login(self.data.get_authorized_instructor().username):
+            db.session.expire_all()
+            with self.count_queries() as statements:
+                rv = self.client.get(url)
+                self.assert200(rv)
+            self.assertEqual(2, len(rv.json))
+            query_count = len(statements)
+
+            # feedback from every student on every answer
+            for answer in answers:
+                for index in range(3):
+                    AnswerCommentsTestData.create_answer_comment(self.data.get_extra_student(index), answer)
+
+            db.session.expire_all()
+            with self.count_queries() as statements:
+                rv = self.client.get(url)
+                self.assert200(rv)
+            self.assertEqual(2 + 3 * len(answers), len(rv.json))
+            self.assertEqual(query_count, len(statements))
+
     @mock.patch('compair.tasks.lti_outcomes.update_lti_course_grades.run')
     @mock.patch('compair.tasks.lti_outcomes.update_lti_assignment_grades.run')
     def test_create_answer_comment(self, mocked_update_assignment_grades_run, mocked_update_course_grades_run):
@@ -991,6 +991,52 @@ class AssignmentStatusComparisonsAPITests(ComPAIRAPITestCase):
                     self.assertEqual(status['answers']['count'], 0)
                     self.assertEqual(status['answers']['feedback'], 0)
 
+    def test_get_all_status_cache(self):
+        self.app.config['ASSIGNMENT_STATUS_CACHE_TTL'] = 60
+        url = self.url + '/status'
+        comparison_url = self.url + '/' + self.assignment.uuid + '/comparisons'
+
+        student = self.data.create_normal_user()
+        self.data.enrol_student(student, self.data.get_course())
+        with self.login(student.username):
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertFalse(rv.json['statuses'][self.assignment.uuid]['comparisons']['has_draft'])
+
+            # changes made without events are not seen until the statuses expire
+            comparison = Comparison.create_new_comparison(self.assignment.id, student.id, False)
+            comparison.created = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+            comparison.modified = comparison.created + datetime.timedelta(minutes=5)
+            comparison.completed = False
+            db.session.commit()
+
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertFalse(rv.json['statuses'][self.assignment.uuid]['comparisons']['has_draft'])
+
+            # saving a comparison refreshes the user's statuses
+            comparison_submit = {
+                'comparison_criteria': [{
+                    'criterion_id': criterion.uuid,
+                    'winner': WinningAnswer.answer1.value,
+                    'content': None
+                } for criterion in self.assignment.criteria],
+                'draft': True
+            }
+            rv = self.client.post(comparison_url, data=json.dumps(comparison_submit), content_type='application/json')
+            self.assert200(rv)
+
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertTrue(rv.json['statuses'][self.assignment.uuid]['comparisons']['has_draft'])
+            self.assertEqual(rv.json['statuses'][self.assignment.uuid]['comparisons']['count'], 0)
+
+        # statuses are cached per user
+        with self.login(self.data.get_authorized_instructor().username):
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertTrue(rv.json['statuses'][self.assignment.uuid]['answers']['answered'])
+
     def test_get_all_status_with_student_login(self):
         student = self.data.get_authorized_student()
         self._test_get_all_status_with_student(self.login(student.username))
@@ -2243,6 +2289,40 @@ class AssignmentUserComparisonsAPITests(ComPAIRAPITestCase):
                     for self_evaluation in rv.json['self_evaluations']:
                         self.assertIn(self_evaluation['id'], self_evaluation_uuids)
 
+    def test_get_comparisons_query_count(self):
+        users_url = '/api/courses/'+self.fixtures.course.uuid+'/assignments/'+self.fixtures.assignment.uuid+'/users/comparisons'
+        user_url = '/api/courses/'+self.fixtures.course.uuid+'/assignments/'+self.fixtures.assignment.uuid+'/user/comparisons'
+
+        with self.login(self.fixtures.instructor.username):
+            # the number of queries doesn't depend on the number of users on the page
+            query_counts = []
+            for per_page in [2, len(self.fixtures.students)]:
+                db.session.expire_all()
+                with self.count_queries() as statements:
+                    rv = self.client.get(users_url, data=json.dumps({'perPage': per_page}), content_type='application/json')
+                    self.assert200(rv)
+                self.assertEqual(len(rv.json['objects']), per_page)
+                query_counts.append(len(statements))
+            self.assertEqual(query_counts[0], query_counts[1])
+
+            # or on the number of comparisons of the user
+            db.session.expire_all()
+            with self.count_queries() as statements:
+                rv = self.client.get(user_url, data=json.dumps({}), content_type='application/json')
+                self.assert200(rv)
+            self.assertEqual(len(rv.json['comparisons']), 0)
+            query_count = len(statements)
+
+            self.fixtures.add_comparisons_for_user(self.fixtures.assignment, self.fixtures.instructor,
+                with_comments=True, with_self_eval=False)
+
+            db.session.expire_all()
+            with self.count_queries() as statements:
+                rv = self.client.get(user_url, data=json.dumps({}), content_type='application/json')
+                self.assert200(rv)
+            self.assertEqual(len(rv.json['comparisons']), self.fixtures.assignment.total_comparisons_required)
+            self.assertEqual(query_count, len(statements))
+
 class AssignmentLTIAPITests(ComPAIRAPITestCase):
     def setUp(self):
         super(AssignmentLTIAPITests, self).setUp()
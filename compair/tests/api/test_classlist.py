@@ -2,9 +2,13 @@
 from __future__ import unicode_literals
 import json
 import io
+import os
+import time
 import unicodecsv as csv
 import six
 
+from flask import current_app
+
 from compair.core import db
 from data.fixtures.test_data import BasicTestData, ThirdPartyAuthTestData
 from compair.tests.test_compair import ComPAIRAPITestCase, ComPAIRAPIDemoTestCase
@@ -20,6 +24,14 @@ class ClassListAPITest(ComPAIRAPITestCase):
 
         self.delimiter = ",".encode('utf-8') if six.PY2 else ","
 
+    def tearDown(self):
+        # class list import job statuses
+        folder = current_app.config['UPLOAD_FOLDER']
+        for file_name in os.listdir(folder):
+            if file_name.startswith('import_') and file_name.endswith('.json'):
+                os.remove(os.path.join(folder, file_name))
+        super(ClassListAPITest, self).tearDown()
+
     def test_get_classlist(self):
         # test login required
         rv = self.client.get(self.url)
@@ -840,6 +852,69 @@ class ClassListAPITest(ComPAIRAPITestCase):
                     self.assertEqual(len(group.user_courses.all()), 1)
 
 
+    def test_get_import_job(self):
+        filename = "classlist.csv"
+        content = "newuser1,password\nnewuser2,password\n,password"
+
+        with self.login(self.data.get_authorized_instructor().username):
+            uploaded_file = io.BytesIO(content.encode('utf-8'))
+            rv = self.client.post(self.url, data=dict(file=(uploaded_file, filename)))
+            self.assert200(rv)
+            uploaded_file.close()
+            job_id = rv.json['id']
+            self.assertEqual('complete', rv.json['status'])
+            self.assertEqual(3, rv.json['processed'])
+            self.assertEqual(3, rv.json['total'])
+
+            rv = self.client.get(self.url + '/import/' + job_id)
+            self.assert200(rv)
+            self.assertEqual('complete', rv.json['status'])
+            self.assertEqual(2, rv.json['success'])
+            self.assertEqual(1, len(rv.json['invalids']))
+            self.assertEqual('The username is required.', rv.json['invalids'][0]['message'])
+
+            # test invalid job id
+            rv = self.client.get(self.url + '/import/invalid')
+            self.assert404(rv)
+            rv = self.client.get(self.url + '/import/' + 'a' * 22)
+            self.assert404(rv)
+
+        # test unauthorized users
+        for username in [self.data.get_unauthorized_instructor().username, self.data.get_authorized_student().username]:
+            with self.login(username):
+                rv = self.client.get(self.url + '/import/' + job_id)
+                self.assert403(rv)
+
+        # test job of another course
+        with self.login(self.data.get_unauthorized_instructor().username):
+            rv = self.client.get('/api/courses/' + self.data.get_secondary_course().uuid + '/users/import/' + job_id)
+            self.assert404(rv)
+
+    def test_import_large_classlist(self):
+        filename = "classlist.csv"
+        rows = ["user{0},password,sn{0},First,Last,user{0}@example.com,,group{1}".format(index, index % 50)
+            for index in range(10000)]
+
+        with self.login(self.data.get_authorized_instructor().username):
+            uploaded_file = io.BytesIO("\n".join(rows).encode('utf-8'))
+            start = time.time()
+            rv = self.client.post(self.url, data=dict(file=(uploaded_file, filename)))
+            elapsed = time.time() - start
+            self.assert200(rv)
+            uploaded_file.close()
+            self.assertEqual(10000, rv.json['success'])
+            self.assertEqual(0, len(rv.json['invalids']))
+            self.assertLess(elapsed, 30)
+
+            students = UserCourse.query \
+                .filter_by(
+                    course_id=self.data.get_course().id,
+                    course_role=CourseRole.student
+                ) \
+                .count()
+            self.assertEqual(10000, students)
+            self.assertEqual(50, Group.query.filter_by(course_id=self.data.get_course().id).count())
+
     def test_import_cas_classlist(self):
         url = '/api/courses/' + self.data.get_course().uuid + '/users'
         student = self.data.get_authorized_student()
@@ -641,6 +641,58 @@ class ComparisonAPITests(ComPAIRAPITestCase):
             }
         }
 
+    @mock.patch('compair.tasks.comparison_scores.update_assignment_scores.delay')
+    def test_submit_comparison_async_score_updates(self, mocked_update_assignment_scores_delay):
+        self.app.config['ASYNC_SCORE_UPDATES_ENABLED'] = True
+        user = self.data.get_authorized_student()
+        submitted_comparisons = []
+
+        with self.login(user.username):
+            for _ in range(2):
+                rv = self.client.get(self.base_url)
+                self.assert200(rv)
+                answer1 = Answer.query.filter_by(uuid=rv.json['comparison']['answer1_id']).first()
+                answer2 = Answer.query.filter_by(uuid=rv.json['comparison']['answer2_id']).first()
+
+                comparison_submit = self._build_comparison_submit(self.assignment, WinningAnswer.answer1.value)
+                rv = self.client.post(self.base_url, data=json.dumps(comparison_submit), content_type='application/json')
+                self.assert200(rv)
+
+                # scores and grades are left to the task
+                comparison = Comparison.query.filter_by(uuid=rv.json['comparison']['id']).first()
+                self.assertTrue(comparison.score_pending)
+                mocked_update_assignment_scores_delay.assert_called_once_with(self.assignment.id)
+                mocked_update_assignment_scores_delay.reset_mock()
+                submitted_comparisons.append((comparison, answer1, answer2))
+
+        self.assertIsNone(AssignmentGrade.get_user_assignment_grade(self.assignment, user))
+        for (comparison, answer1, answer2) in submitted_comparisons:
+            if comparison.comparison_example_id == None:
+                self.assertIsNone(AnswerScore.query.filter_by(answer_id=answer1.id).first())
+                self.assertIsNone(AnswerScore.query.filter_by(answer_id=answer2.id).first())
+
+        # a single task run applies every pending comparison of the assignment
+        from compair.tasks import update_assignment_scores
+        update_assignment_scores(self.assignment.id)
+
+        for (comparison, answer1, answer2) in submitted_comparisons:
+            comparison = Comparison.query.get(comparison.id)
+            self.assertFalse(comparison.score_pending)
+            if comparison.comparison_example_id == None:
+                for answer in [answer1, answer2]:
+                    score = AnswerScore.query.filter_by(answer_id=answer.id).first()
+                    self.assertIsNotNone(score)
+                    self.assertEqual(score.rounds, 1)
+                    self.assertEqual(AnswerCriterionScore.query.filter_by(answer_id=answer.id).count(),
+                        len(self.assignment.criteria))
+
+        self.assertGreater(AssignmentGrade.get_user_assignment_grade(self.assignment, user).grade, 0)
+        self.assertGreater(CourseGrade.get_user_course_grade(self.course, user).grade, 0)
+
+        # nothing left for later tasks
+        self.assertEqual(Comparison.update_pending_scores(self.assignment.id), set())
+        self.app.config['ASYNC_SCORE_UPDATES_ENABLED'] = False
+
     @mock.patch('random.shuffle')
     def test_score_calculation(self, mock_shuffle):
         """
@@ -789,6 +789,53 @@ class CoursesDuplicateComplexAPITests(ComPAIRAPITestCase):
                     self.assertEqual(original_answer2.draft, original_answer2.draft)
 
 
+    def test_duplicate_course_background(self):
+        original_course = self.data.get_course()
+        self.app.config['COURSE_DUPLICATE_BACKGROUND_THRESHOLD'] = 1
+
+        with self.login(self.data.get_authorized_instructor().username):
+            rv = self.client.post(self.url, data=json.dumps(self.expected), content_type='application/json')
+            self.assert200(rv)
+
+            duplicate_course_uuid = rv.json['id']
+
+            # the job completes before the response with CELERY_ALWAYS_EAGER
+            job = rv.json['duplicate_job']
+            self.assertEqual(job['status'], 'complete')
+            self.assertEqual(job['processed'], 5)
+            self.assertEqual(job['total'], 5)
+
+            job_url = '/api/courses/' + duplicate_course_uuid + '/duplicate/' + job['id']
+            rv = self.client.get(job_url)
+            self.assert200(rv)
+            self.assertEqual(rv.json['status'], 'complete')
+
+            # invalid job id
+            rv = self.client.get('/api/courses/' + duplicate_course_uuid + '/duplicate/invalid')
+            self.assert404(rv)
+
+            # jobs are only found through the duplicate course
+            rv = self.client.get('/api/courses/' + original_course.uuid + '/duplicate/' + job['id'])
+            self.assert404(rv)
+
+            duplicate_course = Course.query.filter_by(uuid=duplicate_course_uuid).one()
+            original_assignments = original_course.assignments.all()
+            duplicate_assignments = duplicate_course.assignments.all()
+            self.assertEqual(len(original_assignments), len(duplicate_assignments))
+
+            for original_assignment, duplicate_assignment in zip(original_assignments, duplicate_assignments):
+                self.assertEqual(original_assignment.name, duplicate_assignment.name)
+                self.assertEqual(self.data.get_authorized_instructor().id, duplicate_assignment.user_id)
+                self.assertEqual([criterion.id for criterion in original_assignment.criteria],
+                    [criterion.id for criterion in duplicate_assignment.criteria])
+                self.assertEqual(original_assignment.comparison_examples.count(),
+                    duplicate_assignment.comparison_examples.count())
+
+        # other instructors cannot see the progress
+        with self.login(self.data.get_unauthorized_instructor().username):
+            rv = self.client.get(job_url)
+            self.assert403(rv)
+
 class CourseDemoAPITests(ComPAIRAPIDemoTestCase):
     def setUp(self):
         super(CourseDemoAPITests, self).setUp()
@@ -6,13 +6,16 @@ import os
 import unicodecsv as csv
 import re
 import six
+import time
+import unittest
 
 from sqlalchemy import or_
-from data.fixtures import DefaultFixture
-from data.fixtures.test_data import TestFixture
+from data.fixtures import DefaultFixture, CourseFactory
+from data.fixtures.test_data import TestFixture, PeerFeedbackBenchmarkTestData
 from compair.tests.test_compair import ComPAIRAPITestCase
 from compair.models import CourseRole, Answer, Comparison, AnswerComment, AnswerCommentType, AssignmentGrade
 from compair.core import db
+from compair.api.report import peer_feedback_report
 from flask import current_app
 
 class ReportAPITest(ComPAIRAPITestCase):
@@ -30,6 +33,11 @@ class ReportAPITest(ComPAIRAPITestCase):
     def tearDown(self):
         folder = current_app.config['REPORT_FOLDER']
 
+        # report job statuses
+        for file_name in os.listdir(folder):
+            if file_name.endswith('.json'):
+                self.files_to_cleanup.append(file_name)
+
         for file_name in self.files_to_cleanup:
             file_path = os.path.join(folder, file_name)
             try:
@@ -923,6 +931,63 @@ class ReportAPITest(ComPAIRAPITestCase):
 
             self.assertEqual(row, excepted_row)
 
+    def test_report_job_status(self):
+        params = {
+            'group_id': None,
+            'type': "participation_stat",
+            'assignment': None
+        }
+
+        with self.login(self.fixtures.instructor.username):
+            rv = self.client.post(self.url, data=json.dumps(params), content_type='application/json')
+            self.assert200(rv)
+            job_id = rv.json['id']
+            self.assertEqual(rv.json['status'], 'complete')
+            file_name = rv.json['file'].split("/")[-1]
+            self.files_to_cleanup.append(file_name)
+
+        job_url = self.url + "/" + job_id
+
+        # test login required
+        rv = self.client.get(job_url)
+        self.assert401(rv)
+
+        # test unauthorized user
+        with self.login(self.fixtures.unauthorized_instructor.username):
+            rv = self.client.get(job_url)
+            self.assert403(rv)
+
+        with self.login(self.fixtures.students[0].username):
+            rv = self.client.get(job_url)
+            self.assert403(rv)
+
+        with self.login(self.fixtures.instructor.username):
+            # test invalid job id
+            rv = self.client.get(self.url + "/999")
+            self.assert404(rv)
+
+            rv = self.client.get(self.url + "/..%2F..%2Fsettings")
+            self.assert404(rv)
+
+        # test job of another course
+        other_course = CourseFactory()
+        self.fixtures.enrol_user(self.fixtures.unauthorized_instructor, other_course, CourseRole.instructor)
+        with self.login(self.fixtures.unauthorized_instructor.username):
+            rv = self.client.get("/api/courses/" + other_course.uuid + "/report/" + job_id)
+            self.assert404(rv)
+
+        with self.login(self.fixtures.instructor.username):
+            # test authorized user
+            rv = self.client.get(job_url)
+            self.assert200(rv)
+            self.assertEqual(rv.json['id'], job_id)
+            self.assertEqual(rv.json['status'], 'complete')
+            self.assertEqual(rv.json['file'], 'report/' + file_name)
+
+            tmp_name = os.path.join(current_app.config['REPORT_FOLDER'], file_name)
+            self.assertTrue(os.path.isfile(tmp_name))
+            self.assertFalse(os.path.isfile(tmp_name + '.part'))
+
     def _strip_html(self, text):
         text = re.sub('<[^>]+>', '', text)
         text = text.replace('&nbsp;', ' ')
@@ -941,4 +1006,26 @@ class ReportAPITest(ComPAIRAPITestCase):
         if len(content) <= length:
             return content
         else:
-            return ' '.join(content[:length+1].split(' ')[:-1]) + suffix
\ No newline at end of file
+            return ' '.join(content[:length+1].split(' ')[:-1]) + suffix
+
+
+@unittest.skipUnless(os.environ.get('COMPAIR_RUN_BENCHMARKS'), "set COMPAIR_RUN_BENCHMARKS to run benchmarks")
+class ReportBenchmarkTest(ComPAIRAPITestCase):
+    def test_peer_feedback_report_benchmark(self):
+        data = PeerFeedbackBenchmarkTestData()
+        benchmark_students = set(student.lastname for student in data.get_students())
+
+        start = time.time()
+        feedback_counts = {}
+        for row in peer_feedback_report(data.get_course(), data.get_assignments(), None):
+            # skip blank rows of other students in the course
+            if row[1] not in benchmark_students:
+                continue
+            key = (row[0], row[1])
+            feedback_counts[key] = feedback_counts.get(key, 0) + 1
+        elapsed = time.time() - start
+
+        self.assertEqual(sum(feedback_counts.values()), 100000)
+        self.assertEqual(set(feedback_counts.values()), {50})
+        # filtering every comment for every assignment and sender took minutes
+        self.assertLess(elapsed, 30)
@@ -12,7 +12,7 @@ from data.fixtures import DefaultFixture, UserFactory, AssignmentFactory
 from data.fixtures.test_data import BasicTestData, LTITestData, ThirdPartyAuthTestData, ComparisonTestData
 from compair.tests.test_compair import ComPAIRAPITestCase
 from compair.models import User, SystemRole, CourseRole, AnswerComment, AnswerCommentType, Comparison, \
-    LTIContext, LTIUser, ThirdPartyUser, ThirdPartyType, WinningAnswer, EmailNotificationMethod
+    Answer, UserCourse, LTIContext, LTIUser, ThirdPartyUser, ThirdPartyType, WinningAnswer, EmailNotificationMethod
 from compair.core import db
 
 
@@ -1647,6 +1647,38 @@ class UsersAPITests(ComPAIRAPITestCase):
                 self.assert200(rv)
                 self.assertTrue(rv.json['available'])
 
+    def test_permissions_follow_enrolment_changes(self):
+        student = self.data.get_unauthorized_student()
+        instructor = self.data.get_unauthorized_instructor()
+        course = self.data.get_course()
+
+        with self.app.app_context():
+            login_user(student, force=True)
+            self.assertFalse(allow(READ, course))
+            self.assertFalse(allow(CREATE, Answer(course_id=course.id)))
+
+            # enrolling in the same request is picked up by the next check
+            self.data.enrol_student(student, course)
+            self.assertTrue(allow(READ, course))
+            self.assertTrue(allow(CREATE, Answer(course_id=course.id)))
+            self.assertFalse(allow(EDIT, course))
+
+            user_course = UserCourse.query \
+                .filter_by(user_id=student.id, course_id=course.id) \
+                .one()
+            user_course.course_role = CourseRole.dropped
+            db.session.commit()
+            self.assertFalse(allow(READ, course))
+            logout_user()
+
+        student = self.data.create_normal_user()
+        with self.app.app_context():
+            login_user(instructor, force=True)
+            self.assertFalse(allow(EDIT, student))
+            self.data.enrol_student(student, self.data.get_secondary_course())
+            self.assertTrue(allow(EDIT, student))
+            logout_user()
+
     def _verify_permissions(self, user_id, permissions):
         operations = [MANAGE, CREATE, EDIT, DELETE, READ]
 
@@ -1843,4 +1875,45 @@ class UsersCourseStatusAPITests(ComPAIRAPITestCase):
             rv = self.client.get(url)
             self.assert200(rv)
             self.assertEqual(1, len(rv.json['statuses']))
-            self.assertEqual(0, rv.json['statuses'][course.uuid]['incomplete_assignments'])
\ No newline at end of file
+            self.assertEqual(0, rv.json['statuses'][course.uuid]['incomplete_assignments'])
+
+    def test_get_course_list_cache(self):
+        self.app.config['ASSIGNMENT_STATUS_CACHE_TTL'] = 60
+        student = self.data.get_authorized_student()
+        instructor = self.data.get_authorized_instructor()
+
+        courses = []
+        assignments = []
+        for _ in range(3):
+            course = self.data.create_course()
+            self.data.enrol_student(student, course)
+            self.data.enrol_instructor(instructor, course)
+            courses.append(course)
+            assignments.append(self.data.create_assignment_in_answer_period(course, instructor))
+        url = '/api/users/courses/status?ids='+','.join([course.uuid for course in courses])
+
+        with self.login(student.username):
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertEqual(3, len(rv.json['statuses']))
+            for course in courses:
+                self.assertEqual(1, rv.json['statuses'][course.uuid]['incomplete_assignments'])
+
+            # changes made without events are not seen until the statuses expire
+            self.data.create_answer(assignments[0], student)
+
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertEqual(1, rv.json['statuses'][courses[0].uuid]['incomplete_assignments'])
+
+            # submitting an answer refreshes the statuses of its course only
+            answer_url = '/api/courses/' + courses[1].uuid + '/assignments/' + assignments[1].uuid + '/answers'
+            rv = self.client.post(answer_url, data=json.dumps({'content': 'this is some answer content'}),
+                content_type='application/json')
+            self.assert200(rv)
+
+            rv = self.client.get(url)
+            self.assert200(rv)
+            self.assertEqual(1, rv.json['statuses'][courses[0].uuid]['incomplete_assignments'])
+            self.assertEqual(0, rv.json['statuses'][courses[1].uuid]['incomplete_assignments'])
+            self.assertEqual(1, rv.json['statuses'][courses[2].uuid]['incomplete_assignments'])
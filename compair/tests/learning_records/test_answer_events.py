@@ -1,16 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import json
+import mock
 import pytz
 
 from data.fixtures.test_data import SimpleAnswersTestData, LTITestData
 from compair.tests.test_compair import ComPAIRLearningRecordTestCase
 
 from compair.core import db
+from compair.models import XAPILog, CaliperLog
+from flask import session as sess
 from flask_login import current_app
 
 from compair.learning_records.capture_events import on_answer_modified, \
-    on_answer_delete, on_answer_create
+    on_answer_delete, on_answer_create, build_captured_learning_records
 
 class AnswerLearningRecordTests(ComPAIRLearningRecordTestCase):
     def setUp(self):
@@ -489,4 +492,60 @@ class AnswerLearningRecordTests(ComPAIRLearningRecordTestCase):
         }
 
         self.assertEqual(len(statements), 1)
-        self.assertEqual(statements[0], expected_xapi_statement)
\ No newline at end of file
+        self.assertEqual(statements[0], expected_xapi_statement)
+
+    @mock.patch('compair.tasks.build_learning_records.delay')
+    def test_on_answer_create_async(self, mocked_build_learning_records):
+        self.app.config['ASYNC_LEARNING_RECORDS_ENABLED'] = True
+
+        on_answer_create.send(
+            current_app._get_current_object(),
+            event_name=on_answer_create.name,
+            user=self.user,
+            answer=self.answer
+        )
+
+        # only the facts of the event are captured in the request
+        self.assertEqual(XAPILog.query.count(), 0)
+        self.assertEqual(CaliperLog.query.count(), 0)
+        self.assertEqual(mocked_build_learning_records.call_count, 1)
+        handler_name, user_id, model_ids, facts, request_facts = mocked_build_learning_records.call_args[0]
+        self.assertEqual(handler_name, 'learning_record_on_answer_create')
+        self.assertEqual(user_id, self.user.id)
+        self.assertEqual(model_ids, {'answer': ['Answer', self.answer.id]})
+        self.assertEqual(facts, {'event_name': on_answer_create.name, 'draft': self.answer.draft})
+        self.assertEqual(request_facts['session']['session_id'], sess['session_id'])
+
+        # records built by the task match the ones built in the request
+        build_captured_learning_records(handler_name, user_id, model_ids, facts, request_facts)
+        statements = self.get_and_clear_xapi_statement_log()
+        events = self.get_and_clear_caliper_event_log()
+
+        self.app.config['ASYNC_LEARNING_RECORDS_ENABLED'] = False
+        on_answer_create.send(
+            current_app._get_current_object(),
+            event_name=on_answer_create.name,
+            user=self.user,
+            answer=self.answer
+        )
+        self.assertEqual(statements, self.get_and_clear_xapi_statement_log())
+        self.assertEqual(events, self.get_and_clear_caliper_event_log())
+
+        # an answer submitted before the records are built keeps the draft state of the event
+        self.app.config['ASYNC_LEARNING_RECORDS_ENABLED'] = True
+        self.answer.draft = True
+        db.session.commit()
+        on_answer_create.send(
+            current_app._get_current_object(),
+            event_name=on_answer_create.name,
+            user=self.user,
+            answer=self.answer
+        )
+        self.answer.draft = False
+        db.session.commit()
+
+        build_captured_learning_records(*mocked_build_learning_records.call_args[0])
+        statements = self.get_and_clear_xapi_statement_log()
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            self.assertFalse(statement['result']['completion'])
@@ -18,11 +18,13 @@ from flask_testing import TestCase
 from os.path import dirname
 from flask.testing import FlaskClient
 from six import wraps
+from sqlalchemy import event
 
 from compair import create_app
 from compair.manage.database import populate
+from compair.api.assignment import clear_assignment_statuses
 from compair.core import db
-from compair.models import User, XAPILog, CaliperLog
+from compair.models import User, XAPILog, CaliperLog, AnswerScore
 from compair.tests import test_app_settings
 from lti import ToolConsumer
 from lti.utils import parse_qs
@@ -89,6 +91,9 @@ class ComPAIRTestCase(TestCase):
         return app
 
     def setUp(self):
+        # cached rankings and statuses from previous tests reference reused ids
+        AnswerScore.clear_assignment_ranking()
+        clear_assignment_statuses()
         db.create_all()
         with suppress_stdout():
             populate(default_data=True)
@@ -102,6 +107,19 @@ class ComPAIRTestCase(TestCase):
         db.session.remove()
         db.drop_all()
 
+    @contextmanager
+    def count_queries(self):
+        """ records the sql statements executed in the block """
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
 class ComPAIRAPITestCase(ComPAIRTestCase):
     api = None
     resource = None
@@ -218,6 +236,9 @@ class ComPAIRAPITestCase(ComPAIRTestCase):
 
 class ComPAIRAPIDemoTestCase(ComPAIRAPITestCase):
     def setUp(self):
+        # cached rankings and statuses from previous tests reference reused ids
+        AnswerScore.clear_assignment_ranking()
+        clear_assignment_statuses()
         db.create_all()
         with suppress_stdout():
             populate(default_data=True, sample_data=True)
@@ -3,17 +3,25 @@ from __future__ import unicode_literals
 import unittest
 import mock
 import base64
+import multiprocessing
 import uuid
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from compair import db
 from compair.models import User, Comparison, AnswerScore, \
-    AnswerCriterionScore, LTIOutcome, SystemRole
-from compair.models.comparison import update_answer_scores, \
-    update_answer_criteria_scores
+    AnswerCriterionScore, LTIOutcome, SystemRole, AssignmentGrade, CourseRole, \
+    UserCourse, LTIMembership, LTIUser, LTIUserResourceLink, Assignment
+from compair.models.user import hash_passwords
+from compair.models.answer_score import _score_rankings
+from compair.tasks import set_passwords
+from compair.models.lti_models.lti_membership import _get_membership_service_pages
+from compair.models.comparison import upsert_answer_scores, upsert_answer_criteria_scores
 from compair.tests.test_compair import ComPAIRTestCase
 from compair.algorithms import ComparisonPair, ComparisonWinner
 from compair.algorithms.score import calculate_score
-from data.fixtures.test_data import TestFixture, LTITestData
+from data.fixtures.test_data import TestFixture, LTITestData, SimpleAnswersTestData
 
 class TestUsersModel(ComPAIRTestCase):
     user = User()
@@ -57,63 +65,464 @@ class TestUsersModel(ComPAIRTestCase):
         self.user.password = '123456'
         self.assertTrue(self.user.verify_password('123456'))
 
+    def test_hash_passwords(self):
+        passwords = ['password' + str(index) for index in range(20)]
+
+        for processes in [1, 2]:
+            self.app.config['PASSWORD_HASH_PROCESSES'] = processes
+            password_hashes = hash_passwords(passwords)
+            self.assertEqual(len(password_hashes), len(passwords))
+            for password, password_hash in zip(passwords, password_hashes):
+                self.user._password = password_hash
+                self.assertTrue(self.user.verify_password(password))
+
+    def test_set_passwords_task(self):
+        fixtures = TestFixture().add_course(num_students=3)
+        user_passwords = { str(student.id): 'password' + str(student.id) for student in fixtures.students }
+
+        # default config (one process per CPU)
+        self.app.config['PASSWORD_HASH_PROCESSES'] = 0
+        set_passwords.delay(user_passwords)
+        for student in fixtures.students:
+            self.assertTrue(User.query.get(student.id).verify_password('password' + str(student.id)))
+
+    def test_hash_passwords_daemonic_process(self):
+        # celery prefork pool workers are daemonic processes
+        passwords = ['password' + str(index) for index in range(8)]
+        self.app.config['PASSWORD_HASH_PROCESSES'] = 2
+
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_hash_passwords_in_process, args=(self.app, passwords, queue))
+        process.daemon = True
+        process.start()
+        daemon, password_hashes = queue.get(timeout=60)
+        process.join()
+
+        self.assertTrue(daemon)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(password_hashes), len(passwords))
+        for password, password_hash in zip(passwords, password_hashes):
+            self.user._password = password_hash
+            self.assertTrue(self.user.verify_password(password))
+
+
+def _hash_passwords_in_process(app, passwords, queue):
+    with app.app_context():
+        queue.put((multiprocessing.current_process().daemon, hash_passwords(passwords)))
+
 
 class TestUtils(ComPAIRTestCase):
-    def test_update_answer_scores(self):
+    def test_upsert_answer_scores(self):
+        data = SimpleAnswersTestData(num_answer=3)
+        assignment = data.get_assignments()[0]
+        answer1, answer2, answer3 = data.answers_by_assignment[assignment.id]
+        criterion = assignment.criteria[0]
+
+        # keep the fixture scores of answer1 only
+        existing_score = answer1.score
+        existing_criterion_score = AnswerCriterionScore.query \
+            .filter_by(answer_id=answer1.id, criterion_id=criterion.id) \
+            .one()
+        AnswerScore.query \
+            .filter(AnswerScore.answer_id.in_([answer2.id, answer3.id])) \
+            .delete(synchronize_session='fetch')
+        AnswerCriterionScore.query \
+            .filter(AnswerCriterionScore.answer_id.in_([answer2.id, answer3.id])) \
+            .delete(synchronize_session='fetch')
+        db.session.commit()
 
         comparison_results = calculate_score(comparison_pairs=[
-            ComparisonPair(key1=1,key2=2, winner=ComparisonWinner.key1)
+            ComparisonPair(key1=answer1.id, key2=answer2.id, winner=ComparisonWinner.key1),
+            ComparisonPair(key1=answer2.id, key2=answer3.id, winner=ComparisonWinner.key1)
         ])
-        scores = update_answer_scores([], 1, comparison_results)
-        self.assertEqual(len(scores), 2)
-        for score in scores:
-            self.assertIsNone(score.id)
 
-        score = AnswerScore(answer_id=1, id=2)
-        scores = update_answer_scores([score], 1, comparison_results)
-        self.assertEqual(len(scores), 2)
-        self.assertEqual(scores[0].id, 2)
-        self.assertIsNone(scores[1].id)
+        # inserts new scores and updates existing ones
+        for _ in range(2):
+            upsert_answer_scores(assignment.id, comparison_results)
+            upsert_answer_criteria_scores(assignment.id, {criterion.id: comparison_results})
+            db.session.commit()
+
+            scores = AnswerScore.query \
+                .filter_by(assignment_id=assignment.id) \
+                .all()
+            self.assertEqual(len(scores), 3)
+            for score in scores:
+                result = comparison_results[score.answer_id]
+                self.assertAlmostEqual(score.score, result.score)
+                self.assertEqual(score.rounds, result.rounds)
+                self.assertEqual(score.wins, result.wins)
+                self.assertEqual(score.loses, result.loses)
+                self.assertEqual(score.opponents, result.opponents)
+                self.assertIsNotNone(score.created)
+                self.assertIsNotNone(score.modified)
+
+            criterion_scores = AnswerCriterionScore.query \
+                .filter_by(assignment_id=assignment.id, criterion_id=criterion.id) \
+                .all()
+            self.assertEqual(len(criterion_scores), 3)
+            for criterion_score in criterion_scores:
+                result = comparison_results[criterion_score.answer_id]
+                self.assertEqual(criterion_score.criterion_id, criterion.id)
+                self.assertAlmostEqual(criterion_score.score, result.score)
+                self.assertEqual(criterion_score.rounds, result.rounds)
+
+            # objects already in the session are refreshed
+            self.assertEqual(existing_score.id, AnswerScore.query.filter_by(answer_id=answer1.id).one().id)
+            self.assertAlmostEqual(existing_score.score, comparison_results[answer1.id].score)
+            self.assertAlmostEqual(existing_criterion_score.score, comparison_results[answer1.id].score)
+
+    def test_answer_score_rank(self):
+        self.app.config['RANK_CACHE_TTL'] = 60
+        data = SimpleAnswersTestData(num_answer=4)
+        assignment = data.get_assignments()[0]
+        answers = data.answers_by_assignment[assignment.id]
+
+        scores = [answer.score for answer in answers]
+        for answer_score, score in zip(scores, [5, 3, 3, 9]):
+            answer_score.score = score
+        db.session.commit()
+
+        # tied scores share the highest rank
+        self.assertEqual([score.rank for score in scores], [2, 3, 3, 1])
+        self.assertEqual(AnswerScore.get_score_for_rank(assignment.id, 1), 9)
+        self.assertEqual(AnswerScore.get_score_for_rank(assignment.id, 3), 3)
+        self.assertIsNone(AnswerScore.get_score_for_rank(assignment.id, 5))
+        self.assertEqual(AnswerScore.get_assignment_rankings([assignment.id]), {assignment.id: [3, 3, 5, 9]})
+        self.assertEqual(AnswerScore.get_rank_for_score([3, 3, 5, 9], 3), 3)
+        self.assertIsNone(AnswerScore.get_rank_for_score([3, 3, 5, 9], 4))
+
+        # cached rankings are refreshed when scores change
+        scores[1].score = 10
+        db.session.commit()
+        self.assertEqual([score.rank for score in scores], [3, 1, 4, 2])
 
+        upsert_answer_scores(assignment.id, calculate_score(comparison_pairs=[
+            ComparisonPair(key1=answers[2].id, key2=answers[0].id, winner=ComparisonWinner.key1)
+        ]))
+        db.session.commit()
+        self.assertGreater(AnswerScore.query.filter_by(answer_id=answers[2].id).one().score, 10)
+        self.assertEqual(AnswerScore.query.filter_by(answer_id=answers[2].id).one().rank, 1)
+
+        # rankings cached before another process changed the scores are not reused
+        get_ranking_version = lambda: Assignment.query \
+            .with_entities(Assignment.ranking_version) \
+            .filter_by(id=assignment.id) \
+            .scalar()
+        ranking_version = get_ranking_version()
+        stale_ranking = _score_rankings[assignment.id]
+        scores[0].score = 20
+        db.session.commit()
+        self.assertEqual(get_ranking_version(), ranking_version + 1)
+        _score_rankings[assignment.id] = stale_ranking
+        self.assertEqual(scores[0].rank, 1)
 
-        comparison_results = calculate_score(comparison_pairs=[
-            ComparisonPair(key1=1,key2=2, winner=ComparisonWinner.key1),
-            ComparisonPair(key1=3,key2=4, winner=ComparisonWinner.key1)
-        ])
-        score = AnswerScore(answer_id=1, id=2)
-        scores = update_answer_scores([score], 1, comparison_results)
-        self.assertEqual(len(scores), 4)
+        # rankings only include active answers
+        answers[2].active = False
+        db.session.commit()
+        self.assertIsNone(AnswerScore.query.filter_by(answer_id=answers[2].id).one().rank)
+        self.assertEqual(AnswerScore.get_score_for_rank(assignment.id, 1),
+            AnswerScore.query.filter_by(answer_id=answers[0].id).one().score)
+
+    def test_update_normalized_scores(self):
+        data = SimpleAnswersTestData(num_answer=4)
+        assignment = data.get_assignments()[0]
+        answers = data.answers_by_assignment[assignment.id]
+        criterion = assignment.criteria[0]
+
+        for answer, score in zip(answers, [5, 3, 1, 9]):
+            answer.score.score = score
+            for criterion_score in answer.criteria_scores:
+                criterion_score.score = score
+        db.session.commit()
 
-    def test_update_answer_criteria_scores(self):
+        AnswerScore.update_normalized_scores(assignment.id)
+        AnswerCriterionScore.update_normalized_scores(assignment.id)
+        db.session.commit()
 
-        criterion_comparison_results = {
-            1: calculate_score(comparison_pairs=[
-               ComparisonPair(key1=1,key2=2, winner=ComparisonWinner.key1)
-            ])
+        self.assertEqual(assignment.answer_score_min, 1)
+        self.assertEqual(assignment.answer_score_max, 9)
+        self.assertEqual([answer.score.normalized_score for answer in answers], [50, 25, 0, 100])
+        for answer in answers:
+            self.assertAlmostEqual(answer.score.normalized_score, answer.score.calculated_normalized_score)
+            for criterion_score in answer.criteria_scores:
+                self.assertAlmostEqual(criterion_score.normalized_score, criterion_score.calculated_normalized_score)
+
+        # only the given answers are updated while min/max are unchanged
+        answers[0].score.score = 7
+        db.session.commit()
+        AnswerScore.update_normalized_scores(assignment.id, [answers[0].id])
+        db.session.commit()
+        self.assertEqual([answer.score.normalized_score for answer in answers], [75, 25, 0, 100])
+
+        # deactivating the max answer renormalizes all active answers
+        answers[3].active = False
+        db.session.commit()
+        AnswerScore.update_normalized_scores(assignment.id, [answers[0].id])
+        db.session.commit()
+        self.assertEqual(assignment.answer_score_max, 7)
+        for answer, normalized_score in zip(answers[:3], [100, 100.0 / 3, 0]):
+            self.assertAlmostEqual(answer.score.normalized_score, normalized_score)
+
+    @mock.patch('compair.models.LTIOutcome.update_course_users_grade')
+    @mock.patch('compair.models.LTIOutcome.update_assignment_users_grades')
+    def test_calculate_grades(self, mocked_update_assignment_users_grades, mocked_update_course_users_grade):
+        data = SimpleAnswersTestData(num_answer=3)
+        assignment = data.get_assignments()[0]
+        course = data.get_course()
+        answers = data.answers_by_assignment[assignment.id]
+        mocked_update_assignment_users_grades.reset_mock()
+        mocked_update_course_users_grade.reset_mock()
+
+        assignment_grades = {
+            assignment_grade.user_id: assignment_grade.grade
+            for assignment_grade in AssignmentGrade.get_assignment_grades(assignment)
         }
-        scores = update_answer_criteria_scores([], 1, criterion_comparison_results)
-        self.assertEqual(len(scores), 2)
-        for score in scores:
-            self.assertIsNone(score.id)
-
-        score = AnswerCriterionScore(answer_id=1, criterion_id=1, id=2)
-        scores = update_answer_criteria_scores([score], 1, criterion_comparison_results)
-        self.assertEqual(len(scores), 2)
-        self.assertEqual(scores[0].id, 2)
-        self.assertIsNone(scores[1].id)
-
-
-        criterion_comparison_results = {
-            1: calculate_score(comparison_pairs=[
-                   ComparisonPair(key1=1,key2=2, winner=ComparisonWinner.key1)
-            ]),
-            2: calculate_score(comparison_pairs=[
-               ComparisonPair(key1=1,key2=2, winner=ComparisonWinner.key1)
-            ])
+        self.assertGreater(assignment_grades[answers[0].user_id], 0.0)
+        student_ids = sorted(course_user.user_id
+            for course_user in course.user_courses
+            if course_user.course_role == CourseRole.student)
+
+        # unchanged grades are not written
+        modified = {
+            assignment_grade.user_id: assignment_grade.modified
+            for assignment_grade in AssignmentGrade.get_assignment_grades(assignment)
         }
-        score = AnswerCriterionScore(answer_id=1, criterion_id=1, id=2)
-        scores = update_answer_criteria_scores([score], 1, criterion_comparison_results)
-        self.assertEqual(len(scores), 4)
+        assignment.calculate_grades()
+        course.calculate_grades()
+        for assignment_grade in AssignmentGrade.get_assignment_grades(assignment):
+            self.assertEqual(assignment_grade.modified, modified[assignment_grade.user_id])
+
+        # every student is sent (grades already posted are skipped by LTIOutcome)
+        for mocked_update in [mocked_update_assignment_users_grades, mocked_update_course_users_grade]:
+            mocked_update.assert_called_once_with(mock.ANY, mock.ANY)
+            self.assertEqual(sorted(mocked_update.call_args[0][1]), student_ids)
+        mocked_update_assignment_users_grades.reset_mock()
+        mocked_update_course_users_grade.reset_mock()
+
+        answers[0].active = False
+        db.session.commit()
+        assignment.calculate_grades()
+        course.calculate_grades()
+        self.assertEqual(sorted(mocked_update_assignment_users_grades.call_args[0][1]), student_ids)
+        self.assertEqual(sorted(mocked_update_course_users_grade.call_args[0][1]), student_ids)
+
+        assignment_grade = AssignmentGrade.get_user_assignment_grade(assignment, answers[0].user)
+        self.assertLess(assignment_grade.grade, assignment_grades[answers[0].user_id])
+        for answer in answers[1:]:
+            assignment_grade = AssignmentGrade.get_user_assignment_grade(assignment, answer.user)
+            self.assertAlmostEqual(assignment_grade.grade, assignment_grades[answer.user_id])
+
+        # single user calculation matches the batch calculation
+        AssignmentGrade.query.filter_by(user_id=answers[1].user_id).delete()
+        db.session.commit()
+        assignment.calculate_grade(answers[1].user)
+        assignment_grade = AssignmentGrade.get_user_assignment_grade(assignment, answers[1].user)
+        self.assertAlmostEqual(assignment_grade.grade, assignment_grades[answers[1].user_id])
+
+class TestLTIMembership(ComPAIRTestCase):
+
+    def setUp(self):
+        super(TestLTIMembership, self).setUp()
+        self.fixtures = TestFixture().add_course(num_students=5)
+        self.lti_data = LTITestData()
+        self.lti_context = self.lti_data.create_context(self.lti_data.lti_consumer,
+            compair_course_id=self.fixtures.course.id)
+        self.lti_resource_link = self.lti_data.create_resource_link(self.lti_data.lti_consumer,
+            lti_context=self.lti_context)
+
+    def _members(self, count):
+        return [{
+            'user_id': "lti_member_{}".format(index),
+            'roles': ["Learner"],
+            'person_name_given': "First{}".format(index),
+            'person_name_family': "Last",
+            'global_unique_identifier': "guid_{}".format(index),
+            'lis_result_sourcedids': [
+                { 'resource_link_id': self.lti_resource_link.resource_link_id, 'lis_result_sourcedid': "sourcedid_{}".format(index) },
+                { 'resource_link_id': "unknown_resource_link", 'lis_result_sourcedid': "unknown_{}".format(index) }
+            ]
+        } for index in range(count)]
+
+    def _sync(self, members):
+        lti_members = LTIMembership._update_membership_for_context(self.lti_context, members)
+        LTIMembership._update_enrollment_for_course(self.fixtures.course.id, lti_members)
+
+    def test_update_membership_for_context(self):
+        course = self.fixtures.course
+        members = self._members(4)
+        # duplicate entries use the last one
+        members.append(dict(members[0], person_name_given="Changed"))
+        self._sync(members)
+
+        lti_memberships = LTIMembership.query.filter_by(lti_context_id=self.lti_context.id).all()
+        self.assertEqual(len(lti_memberships), 4)
+        self.assertEqual(LTIUser.query.filter_by(user_id="lti_member_0").one().lis_person_name_given, "Changed")
+        self.assertEqual(LTIUserResourceLink.query \
+            .filter_by(lti_resource_link_id=self.lti_resource_link.id) \
+            .count(), 4)
+
+        # previous students are dropped
+        for student in self.fixtures.students:
+            user_course = UserCourse.query.filter_by(course_id=course.id, user_id=student.id).one()
+            self.assertEqual(user_course.course_role, CourseRole.dropped)
+        member_user_courses = UserCourse.query \
+            .join(LTIUser, LTIUser.compair_user_id == UserCourse.user_id) \
+            .filter(UserCourse.course_id == course.id) \
+            .all()
+        self.assertEqual(len(member_user_courses), 4)
+        for user_course in member_user_courses:
+            self.assertEqual(user_course.course_role, CourseRole.student)
+
+        # unchanged rows are not rewritten
+        modified = { lti_membership.id: lti_membership.modified for lti_membership in lti_memberships }
+        lti_user_resource_link = LTIUserResourceLink.query \
+            .join("lti_user") \
+            .filter(LTIUser.user_id == "lti_member_1") \
+            .one()
+        lti_user_resource_link.last_posted_grade = 0.5
+        db.session.commit()
+
+        members = self._members(3)
+        members[1]['lis_result_sourcedids'][0]['lis_result_sourcedid'] = "new_sourcedid"
+        self._sync(members)
+
+        lti_memberships = LTIMembership.query.filter_by(lti_context_id=self.lti_context.id).all()
+        self.assertEqual(len(lti_memberships), 3)
+        for lti_membership in lti_memberships:
+            self.assertEqual(lti_membership.modified, modified[lti_membership.id])
+
+        # changed lis_result_sourcedid needs the grade posted again
+        self.assertEqual(lti_user_resource_link.lis_result_sourcedid, "new_sourcedid")
+        self.assertIsNone(lti_user_resource_link.last_posted_grade)
+
+        # removed members are dropped
+        dropped_user = LTIUser.query.filter_by(user_id="lti_member_3").one().compair_user
+        user_course = UserCourse.query.filter_by(course_id=course.id, user_id=dropped_user.id).one()
+        self.assertEqual(user_course.course_role, CourseRole.dropped)
+
+    @mock.patch('compair.models.lti_models.lti_membership.MEMBERSHIP_SYNC_BATCH_SIZE', 2)
+    def test_update_membership_for_context_batches(self):
+        self._sync(self._members(3))
+        original_membership_ids = [lti_membership.id for lti_membership in
+            LTIMembership.query.filter_by(lti_context_id=self.lti_context.id).all()]
+
+        members = self._members(5)[1:]
+        def stream_members():
+            for index, member in enumerate(members):
+                if index == 2:
+                    # the first batch is reconciled before the rest of the members arrive
+                    lti_user_ids = [lti_user.id for lti_user in LTIUser.query
+                        .filter(LTIUser.user_id.in_(["lti_member_1", "lti_member_2"])).all()]
+                    self.assertEqual(LTIMembership.query
+                        .filter_by(lti_context_id=self.lti_context.id)
+                        .filter(LTIMembership.lti_user_id.in_(lti_user_ids))
+                        .count(), 2)
+                    self.assertEqual(LTIUser.query.filter_by(user_id="lti_member_3").count(), 0)
+                    # unseen memberships are only removed after the last member
+                    self.assertEqual(LTIMembership.query.filter_by(lti_context_id=self.lti_context.id).count(), 3)
+                yield member
+        self._sync(stream_members())
+
+        lti_memberships = LTIMembership.query.filter_by(lti_context_id=self.lti_context.id).all()
+        self.assertEqual(len(lti_memberships), 4)
+        self.assertEqual(len(set(original_membership_ids) & set(m.id for m in lti_memberships)), 2)
+        self.assertEqual(LTIUserResourceLink.query \
+            .filter_by(lti_resource_link_id=self.lti_resource_link.id) \
+            .join("lti_user") \
+            .filter(LTIUser.user_id == "lti_member_4") \
+            .one().lis_result_sourcedid, "sourcedid_4")
+
+        dropped_user = LTIUser.query.filter_by(user_id="lti_member_0").one().compair_user
+        user_course = UserCourse.query.filter_by(course_id=self.fixtures.course.id, user_id=dropped_user.id).one()
+        self.assertEqual(user_course.course_role, CourseRole.dropped)
+
+    def _membership_page(self, user_ids, next_page=None, lis_result_sourcedid=False):
+        membership = []
+        for user_id in user_ids:
+            record = {
+                'status': 'Active',
+                'role': ['Learner'],
+                'member': { 'userId': user_id, 'name': user_id }
+            }
+            if lis_result_sourcedid:
+                record['message'] = [{
+                    'message_type': 'basic-lti-launch-request',
+                    'lis_result_sourcedid': "sourcedid_" + user_id
+                }]
+            membership.append(record)
+
+        data = { 'pageOf': { 'membershipSubject': { 'membership': membership } } }
+        if next_page:
+            data['nextPage'] = next_page
+        return data
+
+    @mock.patch('compair.models.lti_models.lti_membership.LTIMembership._get_membership_request')
+    def test_get_membership_service_pages(self, mocked_get_membership_request):
+        pages = OrderedDict([
+            ("https://example.com/memberships?page=1", self._membership_page(["user1"], "https://example.com/memberships?page=2")),
+            ("https://example.com/memberships?page=2", self._membership_page(["user2"], "https://example.com/memberships?page=3")),
+            ("https://example.com/memberships?page=3", self._membership_page(["user3"]))
+        ])
+        sign = lambda request: request
+
+        # pages are yielded in order and the last page (no nextPage) stops the requests
+        mocked_get_membership_request.side_effect = lambda url, headers: pages[url]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = list(_get_membership_service_pages(executor, sign, "https://example.com/memberships?page=1"))
+        self.assertEqual(results, list(pages.values()))
+        self.assertEqual([call[0][0] for call in mocked_get_membership_request.call_args_list], list(pages.keys()))
+
+        # an empty response stops the requests
+        mocked_get_membership_request.reset_mock()
+        mocked_get_membership_request.side_effect = lambda url, headers: \
+            None if url.endswith("page=2") else pages[url]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = list(_get_membership_service_pages(executor, sign, "https://example.com/memberships?page=1"))
+        self.assertEqual(results, [pages["https://example.com/memberships?page=1"]])
+        self.assertEqual(mocked_get_membership_request.call_count, 2)
+
+        # an error on a middle page is raised after the previous pages and no later page is requested
+        def error_on_page_2(url, headers):
+            if url.endswith("page=2"):
+                raise requests.exceptions.ConnectionError()
+            return pages[url]
+
+        mocked_get_membership_request.reset_mock()
+        mocked_get_membership_request.side_effect = error_on_page_2
+        results = []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                for data in _get_membership_service_pages(executor, sign, "https://example.com/memberships?page=1"):
+                    results.append(data)
+        self.assertEqual(results, [pages["https://example.com/memberships?page=1"]])
+        self.assertEqual([call[0][0] for call in mocked_get_membership_request.call_args_list],
+            ["https://example.com/memberships?page=1", "https://example.com/memberships?page=2"])
+
+    @mock.patch('compair.models.lti_models.lti_membership.LTIMembership._get_membership_request')
+    def test_get_membership_service(self, mocked_get_membership_request):
+        memberships_url = "https://example.com/memberships"
+        self.lti_context.custom_context_memberships_url = memberships_url
+        db.session.commit()
+        resource_link_url = memberships_url + "?role=Learner&rlid=" + self.lti_resource_link.resource_link_id
+
+        pages = {
+            memberships_url: self._membership_page(["user1", "user2"], memberships_url + "?page=2"),
+            memberships_url + "?page=2": self._membership_page(["user3"]),
+            resource_link_url: self._membership_page(["user1", "user3"], resource_link_url + "&page=2", lis_result_sourcedid=True),
+            resource_link_url + "&page=2": self._membership_page(["user2"], lis_result_sourcedid=True)
+        }
+        mocked_get_membership_request.side_effect = lambda url, headers: pages[url]
+
+        members = list(LTIMembership._get_membership_service(self.lti_context))
+
+        # members of every page in order with the lis_result_sourcedids of every resource link page
+        self.assertEqual([member['user_id'] for member in members], ["user1", "user2", "user3"])
+        for member in members:
+            self.assertEqual(member['lis_result_sourcedids'], [{
+                'resource_link_id': self.lti_resource_link.resource_link_id,
+                'lis_result_sourcedid': "sourcedid_" + member['user_id']
+            }])
+        self.assertEqual(mocked_get_membership_request.call_count, 4)
 
 class TestLTIOutcome(ComPAIRTestCase):
 
@@ -179,4 +588,76 @@ class TestLTIOutcome(ComPAIRTestCase):
 
         # success
         result = LTIOutcome.post_replace_result(self.lti_consumer, self.lis_result_sourcedid, self.grade)
-        self.assertTrue(result)
\ No newline at end of file
+        self.assertTrue(result)
+
+    def test_post_grades(self):
+        student = self.fixtures.students[0]
+        assignment = self.fixtures.assignment
+        (lti_user_resource_link1, lti_user_resource_link2) = self.lti_data.setup_student_user_resource_links(
+            student, self.fixtures.course, assignment)
+        assignment_grade = AssignmentGrade.get_user_assignment_grade(assignment, student)
+        self.assertIsNotNone(assignment_grade)
+        sourcedid_and_grades = [(lti_user_resource_link2.lis_result_sourcedid, assignment_grade.id)]
+
+        with mock.patch('requests.Session.post', mock.Mock(side_effect=self.mocked_requests_post)) as mocked_post:
+            # grades are posted the first time
+            result = LTIOutcome.post_grades(self.lti_consumer, AssignmentGrade, sourcedid_and_grades)
+            self.assertEqual(result, (1, 0, 0))
+            self.assertEqual(mocked_post.call_count, 1)
+            self.assertAlmostEqual(lti_user_resource_link2.last_posted_grade, assignment_grade.grade)
+
+            # unchanged grades are skipped
+            result = LTIOutcome.post_grades(self.lti_consumer, AssignmentGrade, sourcedid_and_grades)
+            self.assertEqual(result, (0, 0, 1))
+            self.assertEqual(mocked_post.call_count, 1)
+
+            # changed grades are posted again
+            assignment_grade.grade = 0.25 if assignment_grade.grade != 0.25 else 0.5
+            db.session.commit()
+            result = LTIOutcome.post_grades(self.lti_consumer, AssignmentGrade, sourcedid_and_grades)
+            self.assertEqual(result, (1, 0, 0))
+            self.assertEqual(mocked_post.call_count, 2)
+            self.assertAlmostEqual(lti_user_resource_link2.last_posted_grade, assignment_grade.grade)
+
+            # grades are posted to new lis_result_sourcedids
+            lti_user_resource_link2.lis_result_sourcedid = "SomeNewSourcedId"
+            db.session.commit()
+            self.assertIsNone(lti_user_resource_link2.last_posted_grade)
+            sourcedid_and_grades = [(lti_user_resource_link2.lis_result_sourcedid, assignment_grade.id)]
+            result = LTIOutcome.post_grades(self.lti_consumer, AssignmentGrade, sourcedid_and_grades)
+            self.assertEqual(result, (1, 0, 0))
+            self.assertEqual(mocked_post.call_count, 3)
+
+            # failed posts are not remembered
+            mocked_post.side_effect = Exception("connection error")
+            assignment_grade.grade = 0.75
+            db.session.commit()
+            result = LTIOutcome.post_grades(self.lti_consumer, AssignmentGrade, sourcedid_and_grades)
+            self.assertEqual(result, (0, 1, 0))
+            self.assertNotAlmostEqual(lti_user_resource_link2.last_posted_grade, 0.75)
+
+    @mock.patch('compair.tasks.lti_outcomes.update_lti_assignment_grades.delay')
+    def test_update_assignment_users_grades(self, mocked_update_lti_assignment_grades):
+        student = self.fixtures.students[0]
+        assignment = self.fixtures.assignment
+        (lti_user_resource_link1, lti_user_resource_link2) = self.lti_data.setup_student_user_resource_links(
+            student, self.fixtures.course, assignment)
+        assignment_grade = AssignmentGrade.get_user_assignment_grade(assignment, student)
+        expected = [(lti_user_resource_link2.lis_result_sourcedid, assignment_grade.id)]
+
+        # grades not posted yet (new links or failed posts) are sent
+        LTIOutcome.update_assignment_users_grades(assignment, [student.id])
+        mocked_update_lti_assignment_grades.assert_called_once_with(self.lti_consumer.id, expected)
+        mocked_update_lti_assignment_grades.reset_mock()
+
+        # grades already posted are skipped
+        lti_user_resource_link2.last_posted_grade = assignment_grade.grade
+        db.session.commit()
+        LTIOutcome.update_assignment_users_grades(assignment, [student.id])
+        mocked_update_lti_assignment_grades.assert_not_called()
+
+        # changed grades are sent
+        assignment_grade.grade = 0.25 if assignment_grade.grade != 0.25 else 0.5
+        db.session.commit()
+        LTIOutcome.update_assignment_users_grades(assignment, [student.id])
+        mocked_update_lti_assignment_grades.assert_called_once_with(self.lti_consumer.id, expected)
@@ -8,7 +8,7 @@ from compair import db
 from six.moves import range
 from compair.models import SystemRole, CourseRole, Course, \
     Comparison, ThirdPartyType, AnswerCommentType, WinningAnswer, \
-    UserCourse
+    UserCourse, AnswerScore, AnswerCriterionScore, User, Answer, AnswerComment
 from data.factories import CourseFactory, UserFactory, UserCourseFactory, AssignmentFactory, \
     AnswerFactory, CriterionFactory, ComparisonFactory, ComparisonCriterionFactory, \
     AnswerCommentFactory, AnswerScoreFactory, AnswerCriterionScoreFactory, \
@@ -406,6 +406,8 @@ class SimpleAnswersTestData(SimpleAssignmentTestData):
                     criterion=criterion
                 )
         db.session.commit()
+        if with_score:
+            self.update_normalized_scores(assignment)
         return answer
 
     def get_groups(self):
@@ -430,8 +432,15 @@ class SimpleAnswersTestData(SimpleAssignmentTestData):
                     criterion=criterion
                 )
         db.session.commit()
+        if with_score:
+            self.update_normalized_scores(assignment)
         return answer
 
+    def update_normalized_scores(self, assignment):
+        AnswerScore.update_normalized_scores(assignment.id)
+        AnswerCriterionScore.update_normalized_scores(assignment.id)
+        db.session.commit()
+
     def create_answer_comment(self, answer, author, comment_type, draft=False):
         answer_comment = AnswerCommentFactory(
             answer=answer,
@@ -880,6 +889,12 @@ class TestFixture:
 
         db.session.commit()
 
+        if with_scores:
+            for assignment in self.assignments:
+                AnswerScore.update_normalized_scores(assignment.id)
+                AnswerCriterionScore.update_normalized_scores(assignment.id)
+            db.session.commit()
+
         return self
 
     def add_non_comparable_answers(self, num_non_comparable_ans):
@@ -1081,3 +1096,69 @@ class TestFixture:
         return self._get_assignment_group_answers(assignment, group) + \
             self._get_assignment_group_member_answers(assignment, group)
 
+
+
+class PeerFeedbackBenchmarkTestData(BasicTestData):
+    """
+    Course with num_students * num_assignments * num_feedback_per_assignment peer feedback comments
+    (100k by default) to catch performance regressions in reports.
+    Students, answers, and comments are bulk inserted since factories would take minutes at this size
+    """
+    def __init__(self, num_students=200, num_assignments=10, num_feedback_per_assignment=50):
+        BasicTestData.__init__(self)
+        course = self.get_course()
+        self.assignments = []
+        for _ in range(num_assignments):
+            self.assignments.append(AssignmentFactory(course=course, user=self.get_authorized_instructor()))
+        db.session.commit()
+
+        db.session.execute(User.__table__.insert(), [{
+            'username': 'benchmark_student_%d' % index,
+            'firstname': 'first_%d' % index,
+            'lastname': 'last_%d' % index,
+            'displayname': 'display_%d' % index,
+            'student_number': 'number_%d' % index,
+            'system_role': SystemRole.student
+        } for index in range(num_students)])
+        self.students = User.query \
+            .filter(User.username.like('benchmark_student_%')) \
+            .order_by(User.id) \
+            .all()
+
+        db.session.execute(UserCourse.__table__.insert(), [{
+            'user_id': student.id,
+            'course_id': course.id,
+            'course_role': CourseRole.student
+        } for student in self.students])
+
+        db.session.execute(Answer.__table__.insert(), [{
+            'assignment_id': assignment.id,
+            'user_id': student.id,
+            'content': '<p>answer by %s</p>' % student.username,
+            'submission_date': datetime.datetime.utcnow()
+        } for assignment in self.assignments for student in self.students])
+
+        comment_types = [AnswerCommentType.evaluation, AnswerCommentType.private, AnswerCommentType.public]
+        for assignment in self.assignments:
+            answer_ids = [answer_id for (answer_id, ) in Answer.query \
+                .with_entities(Answer.id) \
+                .filter_by(assignment_id=assignment.id) \
+                .order_by(Answer.id) \
+                .all()]
+
+            # every student gives feedback on the answers that follow their own
+            db.session.execute(AnswerComment.__table__.insert(), [{
+                'answer_id': answer_ids[(student_index + offset) % len(answer_ids)],
+                'user_id': student.id,
+                'content': '<p>feedback %d from %s</p>' % (offset, student.username),
+                'comment_type': comment_types[offset % len(comment_types)],
+                'draft': False
+            } for student_index, student in enumerate(self.students)
+                for offset in range(1, num_feedback_per_assignment + 1)])
+        db.session.commit()
+
+    def get_assignments(self):
+        return self.assignments
+
+    def get_students(self):
+        return self.students
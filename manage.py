@@ -3,9 +3,12 @@ from requests.utils import unquote
 
 from flask_script import Manager, Server
 
+from compair.manage.algorithms import manager as algorithms_manager
 from compair.manage.database import manager as database_manager
 from compair.manage.report import manager as report_generator
 from compair.manage.grades import manager as grades_generator
+from compair.manage.lti import manager as lti_manager
+from compair.manage.lrs import manager as lrs_manager
 from compair.manage.score import manager as score_generator
 from compair.manage.user import manager as user_manager
 from compair.manage.utils import manager as util_manager
@@ -13,9 +16,12 @@ from compair import create_app
 
 manager = Manager(create_app(skip_assets=True))
 # register sub-managers
+manager.add_command("algorithms", algorithms_manager)
 manager.add_command("database", database_manager)
 manager.add_command("report", report_generator)
 manager.add_command("grades", grades_generator)
+manager.add_command("lti", lti_manager)
+manager.add_command("lrs", lrs_manager)
 manager.add_command("score", score_generator)
 manager.add_command("runserver", Server(port=8080))
 manager.add_command("user", user_manager)
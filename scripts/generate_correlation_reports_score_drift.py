@@ -17,8 +17,8 @@ import multiprocessing
 from enum import Enum
 
 from compair.algorithms import ComparisonPair, ScoredObject, ComparisonWinner
-from compair.algorithms.score import calculate_score_1vs1
 from compair.algorithms.pair import generate_pair
+from compair.algorithms.replay import ComparisonReplay
 from compair.models import PairingAlgorithm, ScoringAlgorithm
 
 CURRENT_FOLDER = os.getcwd() + '/scripts'
@@ -112,14 +112,11 @@ def _run(file_path, pairing_package_name, scoring_package_name, winner_selector,
 
     while repetition_count < REPETITIONS:
         grade_by_answer_key = {}
-        answers = []
         results = []
         for key, grade in enumerate(actual_grades):
             grade_by_answer_key[key+1] = grade
-            answers.append(ScoredObject(
-                key=key+1, score=0, variable1=None, variable2=None,
-                rounds=0, opponents=0, wins=0, loses=0
-            ))
+        answer_keys = sorted(grade_by_answer_key.keys())
+        replay = ComparisonReplay(scoring_package_name, keys=answer_keys)
 
         students = []
         for key in range(NUMBER_OF_STUDENTS):
@@ -144,7 +141,7 @@ def _run(file_path, pairing_package_name, scoring_package_name, winner_selector,
 
                 comparison_pair = generate_pair(
                     package_name=pairing_package_name,
-                    scored_objects=answers,
+                    scored_objects=[replay.score(key) for key in answer_keys],
                     comparison_pairs=student_comparisons
                 )
                 key1 = comparison_pair.key1
@@ -165,20 +162,9 @@ def _run(file_path, pairing_package_name, scoring_package_name, winner_selector,
                     indexes = [i for i, s in enumerate(students) if student['key'] == s['key']]
                     del students[indexes[0]]
 
-                index1 = next(index for index, answer in enumerate(answers) if answer.key == key1)
-                index2 = next(index for index, answer in enumerate(answers) if answer.key == key2)
+                replay.add(comparison_pair)
 
-                result1, results2 = calculate_score_1vs1(
-                    package_name=scoring_package_name,
-                    key1_scored_object=answers[index1],
-                    key2_scored_object=answers[index2],
-                    winner=winner,
-                    other_comparison_pairs=comparisons
-                )
-                answers[index1] = result1
-                answers[index2] = results2
-
-            current_scores = [answer.score for answer in answers]
+            current_scores = [replay.score(key).score for key in answer_keys]
 
             r_value, pearsonr_p_value = pearsonr(ACTUAL_GRADES, current_scores)
             results.append(str(r_value))
@@ -192,7 +178,7 @@ def _run(file_path, pairing_package_name, scoring_package_name, winner_selector,
 
         # prepare for next run
         repetition_count += 1
-        actual_grades = [answer.score for answer in answers]
+        actual_grades = [replay.score(key).score for key in answer_keys]
 
 
 repetition_count = 0